@@ -1,3 +1,6 @@
 from .header import show_header
 from .footer import show_footer
-__all__ = ['show_header', 'show_footer']
+from .capacite_heatmap import show_capacite_heatmap
+from .grille_paginee import show_grille_paginee, deltas_editeur, reset_grille
+__all__ = ['show_header', 'show_footer', 'show_capacite_heatmap',
+           'show_grille_paginee', 'deltas_editeur', 'reset_grille']
@@ -0,0 +1,81 @@
+import streamlit as st
+import pandas as pd
+import plotly.graph_objects as go
+from datetime import date
+
+from utils.capacite import (
+    get_capacite_horizon, get_alertes_surcharge, pivot_heatmap, SEUIL_SURCHARGE_PCT, NIVEAU_CAPACITE_INCONNUE
+)
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _load_capacite(atelier, date_debut, nb_semaines):
+    return get_capacite_horizon(atelier, date_debut, nb_semaines)
+
+
+def show_capacite_heatmap(atelier, date_debut=None, key_prefix="capa"):
+    """Heatmap de charge ligne × jour (ou semaine) + alertes de surcharge sur l'horizon"""
+    date_debut = date_debut or date.today()
+
+    col_h, col_g, col_s = st.columns([2, 1, 1])
+    with col_h:
+        nb_semaines = st.slider("Horizon (semaines)", 8, 26, 12, key=f"{key_prefix}_horizon")
+    with col_g:
+        granularite = st.radio("Granularité", ["Semaine", "Jour"], horizontal=True, key=f"{key_prefix}_gran")
+    with col_s:
+        seuil = st.number_input("Seuil alerte (%)", 50, 200, SEUIL_SURCHARGE_PCT, step=5, key=f"{key_prefix}_seuil")
+
+    try:
+        df_capa = _load_capacite(atelier, date_debut, nb_semaines)
+    except Exception as e:
+        st.error(f"❌ Erreur capacité : {str(e)}")
+        return
+
+    if df_capa.empty:
+        st.info("Aucune ligne active")
+        return
+
+    matrice = pivot_heatmap(df_capa, 'charge_pct', par='semaine' if granularite == "Semaine" else 'jour')
+    colonnes = [c.strftime('%d/%m') if isinstance(c, pd.Timestamp) else c for c in matrice.columns]
+    fig = go.Figure(go.Heatmap(
+        z=matrice.values.clip(max=150),
+        x=colonnes,
+        y=matrice.index.tolist(),
+        text=matrice.values.round(0),
+        texttemplate="%{text}%",
+        colorscale=[[0, '#4caf50'], [0.33, '#ffc107'], [0.53, '#ff9800'], [0.67, '#f44336'], [1, '#b71c1c']],
+        zmin=0, zmax=150,
+        colorbar=dict(title="Charge %"),
+        hovertemplate="%{y} — %{x}<br>Charge : %{text}%<extra></extra>",
+    ))
+    fig.update_layout(height=120 + 40 * len(matrice.index), margin=dict(l=10, r=10, t=10, b=10))
+    st.plotly_chart(fig, use_container_width=True)
+
+    inconnues = sorted(df_capa.loc[~df_capa['capacite_connue'], 'ligne'].unique())
+    if inconnues:
+        st.warning(f"{NIVEAU_CAPACITE_INCONNUE} Temps planifié sans capacité connue (ligne inconnue, inactive "
+                   f"ou non affectée) : {', '.join(inconnues)}")
+
+    jours, semaines = get_alertes_surcharge(atelier, date_debut, nb_semaines, seuil, df_capacite=df_capa)
+    if semaines.empty and jours.empty:
+        st.success(f"✅ Aucune surcharge ≥ {seuil}% sur {nb_semaines} semaines")
+        return
+
+    st.markdown(f"**⚠️ {len(jours)} jour(s) / {len(semaines)} semaine(s) en surcharge ≥ {seuil}%**")
+    if not semaines.empty:
+        df_sem = semaines.assign(Semaine='S' + semaines['semaine'].astype(str).str.zfill(2)
+                                 + ' (' + semaines['debut_semaine'].dt.strftime('%d/%m') + ')')
+        st.dataframe(
+            df_sem[['ligne', 'Semaine', 'capacite_h', 'planifie_h', 'charge_pct']].rename(columns={
+                'ligne': 'Ligne', 'capacite_h': 'Capacité (h)', 'planifie_h': 'Planifié (h)', 'charge_pct': 'Charge (%)'}),
+            use_container_width=True, hide_index=True
+        )
+    if not jours.empty:
+        with st.expander(f"📅 Détail des {len(jours)} jour(s)"):
+            df_j = jours.assign(Jour=jours['jour'].dt.strftime('%d/%m/%Y'))
+            st.dataframe(
+                df_j[['ligne', 'Jour', 'capacite_h', 'planifie_h', 'depassement_h', 'charge_pct']].rename(columns={
+                    'ligne': 'Ligne', 'capacite_h': 'Capacité (h)', 'planifie_h': 'Planifié (h)',
+                    'depassement_h': 'Dépassement (h)', 'charge_pct': 'Charge (%)'}),
+                use_container_width=True, hide_index=True
+            )
@@ -0,0 +1,86 @@
+import math
+
+import streamlit as st
+
+from utils.grille import charger_page, compter
+
+
+def _etat(key, signature):
+    """Pile des curseurs de début de page ; remise à zéro si filtres/tri changent."""
+    etat_key = f"_grille_{key}"
+    etat = st.session_state.get(etat_key)
+    if etat is None or etat['signature'] != signature:
+        etat = {'signature': signature, 'pile': [None], 'suivant': None}
+        st.session_state[etat_key] = etat
+    return etat
+
+
+def _page_suivante(etat):
+    if etat['suivant'] is not None:
+        etat['pile'].append(etat['suivant'])
+
+
+def _page_precedente(etat):
+    if len(etat['pile']) > 1:
+        etat['pile'].pop()
+
+
+def reset_grille(key):
+    """Revient à la première page (après enregistrement, actualisation...)."""
+    st.session_state.pop(f"_grille_{key}", None)
+
+
+def show_grille_paginee(key, spec, filtres=None, tri=None, taille=50):
+    """
+    Charge UNE page de la grille (filtres, tri, pagination par clé en SQL)
+    et affiche la barre de navigation.
+
+    Seuls les curseurs de pagination sont gardés en session : la mémoire par
+    session ne dépend pas de la taille de la table.
+
+    Returns:
+        (DataFrame de la page, nombre total de lignes filtrées, jeton de page)
+        — le jeton change avec la page/les filtres : à utiliser dans la clé du
+        data_editor pour ne pas rattacher des modifications à une autre page.
+    """
+    signature = repr((filtres, tri, taille))
+    etat = _etat(key, signature)
+    df_page, etat['suivant'] = charger_page(spec, filtres, tri, taille, etat['pile'][-1])
+    total = compter(spec, filtres)
+
+    num_page = len(etat['pile'])
+    nb_pages = max(1, math.ceil(total / taille))
+    col_prec, col_info, col_suiv = st.columns([1, 3, 1])
+    with col_prec:
+        st.button("⬅️ Précédent", key=f"{key}_prec", use_container_width=True,
+                  disabled=num_page == 1, on_click=_page_precedente, args=(etat,))
+    with col_info:
+        debut = (num_page - 1) * taille + 1 if total else 0
+        fin = min(debut + len(df_page) - 1, total) if total else 0
+        st.markdown(
+            f"<div style='text-align:center; padding-top:0.4rem'>Page <b>{num_page}</b> / {nb_pages} "
+            f"— lignes {debut}–{fin} sur <b>{total:,}</b></div>".replace(',', ' '),
+            unsafe_allow_html=True
+        )
+    with col_suiv:
+        st.button("Suivant ➡️", key=f"{key}_suiv", use_container_width=True,
+                  disabled=etat['suivant'] is None, on_click=_page_suivante, args=(etat,))
+    jeton = f"{abs(hash(signature)) % 10**8}_{num_page}"
+    return df_page, total, jeton
+
+
+def deltas_editeur(editor_key, df_affiche, cle='id'):
+    """
+    Modifications d'un st.data_editor sous forme {id: {colonne: nouvelle valeur}}.
+
+    Streamlit renvoie déjà les modifications par position de ligne
+    (session_state[editor_key]['edited_rows']) : on les rattache à l'id de la
+    ligne affichée, sans comparer la page entière.
+    """
+    etat = st.session_state.get(editor_key) or {}
+    deltas = {}
+    for position, changements in (etat.get('edited_rows') or {}).items():
+        position = int(position)
+        if position < len(df_affiche) and changements:
+            deltas[int(df_affiche.iloc[position][cle])] = dict(changements)
+    return deltas
@@ -1,2 +1,5 @@
 from .connection import get_connection
-__all__ = ['get_connection']
+from .transactions import executer_transaction, verrouiller
+from .schema import a_table, a_colonne, colonnes, premiere_colonne, expr_tare_lots, rafraichir_schema
+__all__ = ['get_connection', 'executer_transaction', 'verrouiller',
+           'a_table', 'a_colonne', 'colonnes', 'premiere_colonne', 'expr_tare_lots', 'rafraichir_schema']
@@ -0,0 +1,88 @@
+"""
+Capacités du schéma, lues une fois par process.
+
+Une seule requête sur information_schema.columns charge les colonnes de
+toutes les tables du schéma courant. Les chargeurs testent ensuite tables et
+colonnes en mémoire et construisent leur SQL sans aller-retour de plus :
+
+    if a_colonne('lots_bruts', 'tare_theorique_pct'):
+        ...
+
+Après une migration faite par l'application (CREATE/ALTER), appeler
+rafraichir_schema() : la lecture suivante recharge le catalogue. Si le
+catalogue ne peut pas être lu (connexion), rien n'est mémorisé et la
+lecture suivante réessaie.
+"""
+import threading
+
+from .connection import get_connection
+
+TARE_DEFAUT_PCT = 22
+
+_colonnes = None  # {table: (colonne, ...)} dans l'ordre de la table
+_verrou = threading.Lock()
+
+
+def _charger():
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT table_name, column_name
+            FROM information_schema.columns
+            WHERE table_schema = current_schema()
+            ORDER BY table_name, ordinal_position
+        """)
+        rows = cur.fetchall()
+        cur.close()
+    finally:
+        conn.close()
+    catalogue = {}
+    for r in rows:
+        catalogue.setdefault(r['table_name'], []).append(r['column_name'])
+    return {t: tuple(cols) for t, cols in catalogue.items()}
+
+
+def _catalogue():
+    global _colonnes
+    if _colonnes is None:
+        with _verrou:
+            if _colonnes is None:
+                try:
+                    _colonnes = _charger()
+                except Exception:
+                    return {}
+    return _colonnes
+
+
+def rafraichir_schema():
+    """À appeler après une migration : le catalogue sera relu au prochain accès"""
+    global _colonnes
+    with _verrou:
+        _colonnes = None
+
+
+def colonnes(table):
+    """Colonnes de la table (tuple vide si elle n'existe pas)"""
+    return _catalogue().get(table, ())
+
+
+def a_table(table):
+    return table in _catalogue()
+
+
+def a_colonne(table, colonne):
+    return colonne in colonnes(table)
+
+
+def premiere_colonne(table, candidats):
+    """Premier des candidats présent dans la table, ou None"""
+    cols = colonnes(table)
+    return next((c for c in candidats if c in cols), None)
+
+
+def expr_tare_lots(alias='l'):
+    """Tare utilisée pour un lot : lavage réelle, sinon théorique (si la colonne existe), sinon défaut"""
+    if a_colonne('lots_bruts', 'tare_theorique_pct'):
+        return f"COALESCE({alias}.tare_lavage_totale_pct, {alias}.tare_theorique_pct, {TARE_DEFAUT_PCT})"
+    return f"COALESCE({alias}.tare_lavage_totale_pct, {TARE_DEFAUT_PCT})"
@@ -0,0 +1,165 @@
+"""
+Transactions courtes avec verrous de ligne, délai de verrou borné et reprise.
+
+Usage :
+    def _operation(cursor, ...):
+        row = verrouiller(cursor, "SELECT ... FROM t WHERE id = %s FOR UPDATE", (id,))
+        ...
+        return True, "✅ ..."
+
+    ok, msg = executer_transaction('TRANSFERT', _operation, ...)
+
+- lock_timeout (SET LOCAL) : un verrou non obtenu en LOCK_TIMEOUT_MS lève
+  lock_not_available au lieu de bloquer l'écran ;
+- lock_not_available, deadlock_detected et serialization_failure sont rejoués
+  jusqu'à MAX_TENTATIVES fois (attente croissante) ;
+- une fonction qui retourne (False, msg) est annulée (ROLLBACK) ;
+- attente de verrou, tentatives et durée sont gardées en mémoire (METRIQUES)
+  et enregistrées dans transactions_metriques.
+"""
+import random
+import threading
+import time
+from collections import deque
+
+from .connection import get_connection
+
+LOCK_TIMEOUT_MS = 3000
+MAX_TENTATIVES = 4
+
+# Codes SQLSTATE rejouables
+PGCODES_REPRISE = {
+    '55P03': 'lock_not_available',
+    '40P01': 'deadlock_detected',
+    '40001': 'serialization_failure',
+}
+
+METRIQUES = deque(maxlen=500)
+
+_table_metriques_prete = False
+
+# Transaction en cours (par thread) : cumul des attentes mesurées par verrouiller()
+_courante = threading.local()
+
+
+def verrouiller(cursor, query, params=None, tous=False):
+    """
+    Exécute un SELECT ... FOR UPDATE en mesurant le temps d'attente du verrou.
+
+    Returns:
+        la ligne (ou toutes les lignes si tous=True)
+    """
+    t0 = time.perf_counter()
+    cursor.execute(query, params)
+    rows = cursor.fetchall() if tous else cursor.fetchone()
+    if getattr(_courante, 'attente_verrou_s', None) is not None:
+        _courante.attente_verrou_s += time.perf_counter() - t0
+    return rows
+
+
+def _init_table_metriques(conn):
+    global _table_metriques_prete
+    if _table_metriques_prete:
+        return
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS transactions_metriques (
+            id SERIAL PRIMARY KEY,
+            operation VARCHAR(50) NOT NULL,
+            statut VARCHAR(20) NOT NULL,
+            tentatives INTEGER NOT NULL,
+            attente_verrou_ms NUMERIC(10,1),
+            duree_ms NUMERIC(10,1),
+            erreur TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.commit()
+    cursor.close()
+    _table_metriques_prete = True
+
+
+def _enregistrer(conn, metrique):
+    METRIQUES.append(metrique)
+    if conn is None:
+        return
+    try:
+        _init_table_metriques(conn)
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO transactions_metriques
+                (operation, statut, tentatives, attente_verrou_ms, duree_ms, erreur)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """, (metrique['operation'], metrique['statut'], metrique['tentatives'],
+              metrique['attente_verrou_ms'], metrique['duree_ms'], metrique['erreur']))
+        conn.commit()
+        cursor.close()
+    except Exception:
+        conn.rollback()
+
+
+def executer_transaction(operation, fonction, *args, connexion=None, lock_timeout_ms=LOCK_TIMEOUT_MS,
+                         max_tentatives=MAX_TENTATIVES, enregistrer=True, **kwargs):
+    """
+    Exécute fonction(cursor, *args, **kwargs) dans une transaction avec reprise.
+
+    Args:
+        operation: libellé pour les métriques ('TRANSFERT', 'MODIFICATION'...)
+        connexion: fabrique de connexion (défaut : get_connection)
+        enregistrer: écrire la métrique dans transactions_metriques
+
+    Returns:
+        Le résultat de fonction ; (False, msg) si toutes les tentatives échouent.
+    """
+    connexion = connexion or get_connection
+    debut = time.perf_counter()
+    _courante.attente_verrou_s = 0.0
+    tentative, resultat, erreur = 0, None, None
+    conn = None
+
+    while tentative < max_tentatives:
+        tentative += 1
+        erreur = None
+        try:
+            conn = conn or connexion()
+            cursor = conn.cursor()
+            cursor.execute(f"SET LOCAL lock_timeout = '{int(lock_timeout_ms)}ms'")
+            resultat = fonction(cursor, *args, **kwargs)
+            if isinstance(resultat, tuple) and resultat and resultat[0] is False:
+                conn.rollback()
+            else:
+                conn.commit()
+            cursor.close()
+            break
+        except Exception as e:
+            if conn is not None:
+                conn.rollback()
+            code = getattr(e, 'pgcode', None)
+            erreur = PGCODES_REPRISE.get(code) or str(e)
+            if code not in PGCODES_REPRISE or tentative >= max_tentatives:
+                break
+            # Attente croissante avec gigue avant de rejouer
+            time.sleep(min(0.05 * 2 ** tentative, 1.0) * (0.5 + random.random()))
+
+    if erreur is not None:
+        if erreur in PGCODES_REPRISE.values():
+            resultat = (False, "❌ Emplacement en cours de modification par un autre utilisateur, réessayez")
+        else:
+            resultat = (False, f"❌ Erreur : {erreur}")
+        statut = 'ECHEC'
+    else:
+        statut = 'REFUS' if isinstance(resultat, tuple) and resultat and resultat[0] is False else 'OK'
+
+    metrique = {
+        'operation': operation,
+        'statut': statut,
+        'tentatives': tentative,
+        'attente_verrou_ms': round(_courante.attente_verrou_s * 1000, 1),
+        'duree_ms': round((time.perf_counter() - debut) * 1000, 1),
+        'erreur': erreur,
+    }
+    _courante.attente_verrou_s = None
+    _enregistrer(conn if enregistrer else None, metrique)
+    if conn is not None:
+        conn.close()
+    return resultat
@@ -5,6 +5,9 @@ from datetime import datetime
 import time
 from database import get_connection
 from components import show_footer
+from utils.edition import diff_modifications, appliquer_modifications
+from utils.cache_tables import invalider_tables
+from utils.synthese_previsions import marquer_synthese_a_recalculer
 from auth import require_access  # ✅ MODIFIÉ
 import io
 import streamlit.components.v1 as components
@@ -486,52 +489,29 @@ def save_changes(table_name, original_df, edited_df):
     """Sauvegarde les modifications"""
     try:
         config = TABLES_CONFIG[table_name]
-        conn = get_connection()
-        cursor = conn.cursor()
-        updates = 0
-        
-        # ⭐ Récupérer le df complet avec colonnes cachées
-        full_df = st.session_state.get(f'full_df_{table_name}')
         
-        for idx in edited_df.index:
-            if idx not in original_df.index:
-                continue
-            
-            row_id = convert_to_native_types(edited_df.loc[idx, config['primary_key']])
-            changes = {}
-            
-            # Colonnes visibles éditées
-            for col in config['editable']:
-                if col not in edited_df.columns or col not in original_df.columns:
-                    continue
-                
-                # ⭐ Ignorer colonnes calculées
-                if col in config.get("calculated_columns", {}):
-                    continue
-                
-                old_val = original_df.loc[idx, col]
-                new_val = edited_df.loc[idx, col]
-                
-                if pd.isna(old_val) and pd.isna(new_val):
-                    continue
-                elif pd.isna(old_val) or pd.isna(new_val) or old_val != new_val:
-                    changes[col] = convert_to_native_types(new_val)
-            
-            if changes:
-                set_clause = ", ".join([f"{col} = %s" for col in changes.keys()])
-                values = list(changes.values()) + [row_id]
-                
-                if config.get('has_updated_at', True):
-                    update_query = f"UPDATE {config['table']} SET {set_clause}, updated_at = CURRENT_TIMESTAMP WHERE {config['primary_key']} = %s"
-                else:
-                    update_query = f"UPDATE {config['table']} SET {set_clause} WHERE {config['primary_key']} = %s"
-                
-                cursor.execute(update_query, values)
-                updates += 1
+        # ⭐ Ignorer colonnes calculées
+        editables = [col for col in config['editable'] if col not in config.get("calculated_columns", {})]
+        modifications = diff_modifications(original_df, edited_df, editables, cle=config['primary_key'])
+        if not modifications:
+            return True, "✅ 0 enregistrement(s) mis à jour"
         
+        conn = get_connection()
+        cursor = conn.cursor()
+        resultats = appliquer_modifications(
+            cursor, config['table'], modifications, cle=config['primary_key'],
+            set_fixe="updated_at = CURRENT_TIMESTAMP" if config.get('has_updated_at', True) else None
+        )
         conn.commit()
         cursor.close()
         conn.close()
+        invalider_tables(config['table'])
+        marquer_synthese_a_recalculer(config['table'])
+        updates = sum(resultats.values())
+        
+        introuvables = len(resultats) - updates
+        if introuvables:
+            return True, f"✅ {updates} enregistrement(s) mis à jour — ⚠️ {introuvables} introuvable(s)"
         return True, f"✅ {updates} enregistrement(s) mis à jour"
         
     except Exception as e:
@@ -584,6 +564,8 @@ def delete_record(table_name, record_id):
         conn.commit()
         cursor.close()
         conn.close()
+        invalider_tables(config['table'])
+        marquer_synthese_a_recalculer(config['table'])
         return True, "✅ Désactivé"
         
     except Exception as e:
@@ -607,6 +589,8 @@ def reactivate_record(table_name, record_id):
         conn.commit()
         cursor.close()
         conn.close()
+        invalider_tables(config['table'])
+        marquer_synthese_a_recalculer(config['table'])
         return True, "✅ Réactivé"
         
     except Exception as e:
@@ -655,6 +639,8 @@ def add_record(table_name, data):
         conn.commit()
         cursor.close()
         conn.close()
+        invalider_tables(config['table'])
+        marquer_synthese_a_recalculer(config['table'])
         return True, "✅ Ajouté avec succès"
         
     except Exception as e:
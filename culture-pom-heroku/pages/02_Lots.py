@@ -4,11 +4,15 @@ import numpy as np
 from datetime import datetime, date
 import time
 from database import get_connection
-from components import show_footer
+from components import show_footer, show_grille_paginee, deltas_editeur, reset_grille
+from utils import grille
+from utils.edition import diff_modifications, appliquer_modifications
+from utils.cache_tables import invalider_tables
+from utils.synthese_previsions import marquer_synthese_a_recalculer
+from utils.correspondance import construire_index, correspondre
 from auth import require_access, is_admin
 import io
 import streamlit.components.v1 as components
-from difflib import get_close_matches
 
 st.set_page_config(page_title="Lots - Culture Pom", page_icon="📦", layout="wide")
 
@@ -143,60 +147,94 @@ def get_all_producteurs_for_dropdown():
 # FONCTIONS CHARGEMENT / SAUVEGARDE
 # ============================================================================
 
-def load_stock_data():
-    """Charge les données du stock AVEC jointures"""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        query = """
-            SELECT 
-                l.id,
-                l.code_lot_interne,
-                l.nom_usage,
-                l.code_variete,
-                COALESCE(v.nom_variete, l.code_variete) as nom_variete,
-                l.code_producteur,
-                COALESCE(p.nom, l.code_producteur) as nom_producteur,
-                l.date_entree_stock,
-                l.calibre_min,
-                l.calibre_max,
-                l.poids_total_brut_kg,
-                l.prix_achat_euro_tonne,
-                l.tare_achat_pct,
-                l.valeur_lot_euro,
-                l.statut,
-                COALESCE((CURRENT_DATE - l.date_entree_stock::DATE), 0) as age_jours,
-                l.is_active
-            FROM lots_bruts l
+# Grille des lots : filtres, tri et pagination exécutés par Postgres (utils/grille.py)
+LOTS_GRILLE = {
+    'from': """lots_bruts l
             LEFT JOIN ref_varietes v ON l.code_variete = v.code_variete
-            LEFT JOIN ref_producteurs p ON l.code_producteur = p.code_producteur
-            WHERE l.is_active = TRUE
-            ORDER BY l.date_entree_stock DESC
-        """
-        
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        
-        if rows:
-            df = pd.DataFrame(rows)
-            # Convertir colonnes numériques
-            numeric_cols = ['poids_total_brut_kg', 'prix_achat_euro_tonne', 'tare_achat_pct', 'valeur_lot_euro', 'age_jours', 'calibre_min', 'calibre_max']
-            for col in numeric_cols:
-                if col in df.columns:
-                    df[col] = pd.to_numeric(df[col], errors='coerce')
-            return df
-        return pd.DataFrame()
-        
+            LEFT JOIN ref_producteurs p ON l.code_producteur = p.code_producteur""",
+    'where': "l.is_active = TRUE",
+    'cle': 'id',
+    'colonnes': {
+        'id': 'l.id',
+        'code_lot_interne': 'l.code_lot_interne',
+        'nom_usage': 'l.nom_usage',
+        'code_variete': 'l.code_variete',
+        'nom_variete': 'COALESCE(v.nom_variete, l.code_variete)',
+        'code_producteur': 'l.code_producteur',
+        'nom_producteur': 'COALESCE(p.nom, l.code_producteur)',
+        'date_entree_stock': 'l.date_entree_stock',
+        'calibre_min': 'l.calibre_min',
+        'calibre_max': 'l.calibre_max',
+        'poids_total_brut_kg': 'l.poids_total_brut_kg',
+        'prix_achat_euro_tonne': 'l.prix_achat_euro_tonne',
+        'tare_achat_pct': 'l.tare_achat_pct',
+        'valeur_lot_euro': 'l.valeur_lot_euro',
+        'statut': 'l.statut',
+        'age_jours': 'COALESCE((CURRENT_DATE - l.date_entree_stock::DATE), 0)',
+        'is_active': 'l.is_active',
+    },
+    'types': {
+        'date_entree_stock': 'date',
+        'valeur_lot_euro': 'nombre',
+        'prix_achat_euro_tonne': 'nombre',
+        'age_jours': 'nombre',
+    },
+}
+
+LOTS_TRIS = {
+    "Date d'entrée": 'date_entree_stock',
+    "Code lot": 'code_lot_interne',
+    "Nom usage": 'nom_usage',
+    "Variété": 'nom_variete',
+    "Producteur": 'nom_producteur',
+    "Valeur lot": 'valeur_lot_euro',
+}
+
+def _typer_lots(df):
+    """Convertit les colonnes numériques d'une page de lots"""
+    numeric_cols = ['poids_total_brut_kg', 'prix_achat_euro_tonne', 'tare_achat_pct', 'valeur_lot_euro', 'age_jours', 'calibre_min', 'calibre_max']
+    for col in numeric_cols:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+    return df
+
+def load_stock_page(filtres, tri, taille=50):
+    """Charge UNE page de lots (avec jointures) + barre de navigation"""
+    try:
+        df_page, total, jeton = show_grille_paginee("lots", LOTS_GRILLE, filtres, tri, taille)
+        return _typer_lots(df_page), total, jeton
     except Exception as e:
         st.error(f"❌ Erreur chargement : {str(e)}")
+        return pd.DataFrame(), 0, "erreur"
+
+def load_stock_export(filtres, tri):
+    """Charge tous les lots filtrés (export à la demande)"""
+    try:
+        return _typer_lots(grille.charger_tout(LOTS_GRILLE, filtres, tri))
+    except Exception as e:
+        st.error(f"❌ Erreur export : {str(e)}")
         return pd.DataFrame()
 
-def calculate_metrics(df):
-    """Calcule les métriques KPI"""
-    if df.empty:
+@st.cache_data(ttl=300)
+def get_lots_filter_options(alias):
+    """Valeurs des listes de filtre (variétés, producteurs des lots actifs)"""
+    try:
+        return [str(v) for v in grille.valeurs_distinctes(LOTS_GRILLE, alias)]
+    except Exception:
+        return []
+
+def calculate_metrics():
+    """Calcule les métriques KPI (agrégats SQL, sans charger les lots)"""
+    try:
+        agg = grille.agreger(LOTS_GRILLE, agregats={
+            'total_lots': 'COUNT(*)',
+            'nb_varietes': 'COUNT(DISTINCT {code_variete})',
+            'nb_producteurs': 'COUNT(DISTINCT {code_producteur})',
+        })
+    except Exception as e:
+        st.error(f"❌ Erreur chargement : {str(e)}")
+        return {'total_lots': 0, 'tonnage_total': 0.0, 'nb_varietes': 0, 'nb_producteurs': 0}
+    if not agg.get('total_lots'):
         return {'total_lots': 0, 'tonnage_total': 0.0, 'nb_varietes': 0, 'nb_producteurs': 0}
     
     # ⭐ Récupérer le tonnage réel depuis stock_emplacements (pas lots_bruts.poids_total_brut_kg qui est NULL)
@@ -218,10 +256,10 @@ def calculate_metrics(df):
         st.error(f"Erreur calcul tonnage : {e}")
     
     return {
-        'total_lots': len(df),
+        'total_lots': int(agg['total_lots']),
         'tonnage_total': tonnage_total,
-        'nb_varietes': df['code_variete'].nunique(),
-        'nb_producteurs': df['code_producteur'].nunique()
+        'nb_varietes': int(agg['nb_varietes']),
+        'nb_producteurs': int(agg['nb_producteurs'])
     }
 
 def convert_to_native_types(value):
@@ -241,74 +279,55 @@ def convert_to_native_types(value):
 def save_stock_changes(original_df, edited_df, varietes_dict, producteurs_dict):
     """Sauvegarde les modifications avec conversion NOM → CODE pour variétés/producteurs"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        updates = 0
-        
-        varietes_reverse = {v: k for k, v in varietes_dict.items()}
-        producteurs_reverse = {v: k for k, v in producteurs_dict.items()}
-        
-        for idx in edited_df.index:
-            if idx not in original_df.index:
-                continue
-            
-            if 'id' not in edited_df.columns:
+        editable_columns = ['nom_usage', 'nom_variete', 'nom_producteur', 'calibre_min', 'calibre_max',
+                            'prix_achat_euro_tonne', 'tare_achat_pct', 'statut']
+        diffs = diff_modifications(original_df, edited_df, editable_columns)
+        
+        # ⭐ Valeur lot recalculée (vectorisé) pour les lignes dont tare ou prix change
+        poids = pd.to_numeric(edited_df['poids_total_brut_kg'], errors='coerce').fillna(0.0)
+        tare = pd.to_numeric(edited_df['tare_achat_pct'], errors='coerce').fillna(0.0)
+        prix = pd.to_numeric(edited_df['prix_achat_euro_tonne'], errors='coerce').fillna(0.0)
+        valeurs_lot = pd.Series(((poids / 1000.0) * (1.0 - tare / 100.0) * prix).to_numpy(),
+                                index=edited_df['id'].to_numpy())
+        
+        modifications = {}
+        for row_id, changes in diffs.items():
+            if row_id == 0:
                 continue
-            
-            row_id = edited_df.loc[idx, 'id']
-            
-            if pd.isna(row_id) or row_id == 0:
-                continue
-            
-            row_id = convert_to_native_types(row_id)
-            
-            changes = {}
-            
-            editable_columns = ['nom_usage', 'nom_variete', 'nom_producteur', 'calibre_min', 'calibre_max', 
-                               'prix_achat_euro_tonne', 'tare_achat_pct', 'statut']
-            
-            for col in editable_columns:
-                if col not in edited_df.columns or col not in original_df.columns:
-                    continue
-                
-                old_val = original_df.loc[idx, col]
-                new_val = edited_df.loc[idx, col]
-                
-                if pd.isna(old_val) and pd.isna(new_val):
-                    continue
-                elif pd.isna(old_val) or pd.isna(new_val) or old_val != new_val:
-                    if col == 'nom_variete' and new_val in varietes_dict:
-                        changes['code_variete'] = varietes_dict[new_val]
-                    elif col == 'nom_producteur' and new_val in producteurs_dict:
-                        changes['code_producteur'] = producteurs_dict[new_val]
-                    elif col not in ['nom_variete', 'nom_producteur']:
-                        changes[col] = convert_to_native_types(new_val)
-            
-            # ⭐ Recalcul valeur_lot si tare ou prix change
-            if 'tare_achat_pct' in changes or 'prix_achat_euro_tonne' in changes:
-                poids_brut = float(edited_df.loc[idx, 'poids_total_brut_kg']) if pd.notna(edited_df.loc[idx, 'poids_total_brut_kg']) else 0.0
-                tare = float(changes.get('tare_achat_pct', edited_df.loc[idx, 'tare_achat_pct'])) if 'tare_achat_pct' in changes or pd.notna(edited_df.loc[idx, 'tare_achat_pct']) else 0.0
-                prix = float(changes.get('prix_achat_euro_tonne', edited_df.loc[idx, 'prix_achat_euro_tonne'])) if 'prix_achat_euro_tonne' in changes or pd.notna(edited_df.loc[idx, 'prix_achat_euro_tonne']) else 0.0
-                
-                poids_tonnes = poids_brut / 1000.0
-                valeur_lot = poids_tonnes * (1.0 - tare / 100.0) * prix
-                changes['valeur_lot_euro'] = valeur_lot
-            
-            if changes:
-                set_clause = ", ".join([f"{col} = %s" for col in changes.keys()])
-                values = list(changes.values()) + [row_id]
-                
-                update_query = f"UPDATE lots_bruts SET {set_clause}, updated_at = CURRENT_TIMESTAMP WHERE id = %s"
-                cursor.execute(update_query, values)
-                updates += 1
+            sets = {}
+            for col, new_val in changes.items():
+                if col == 'nom_variete':
+                    if new_val in varietes_dict:
+                        sets['code_variete'] = varietes_dict[new_val]
+                elif col == 'nom_producteur':
+                    if new_val in producteurs_dict:
+                        sets['code_producteur'] = producteurs_dict[new_val]
+                else:
+                    sets[col] = new_val
+            if 'tare_achat_pct' in sets or 'prix_achat_euro_tonne' in sets:
+                sets['valeur_lot_euro'] = float(valeurs_lot.get(row_id, 0.0))
+            if sets:
+                modifications[row_id] = sets
+        
+        if not modifications:
+            return True, "ℹ️ Aucune modification détectée"
         
+        conn = get_connection()
+        cursor = conn.cursor()
+        resultats = appliquer_modifications(cursor, 'lots_bruts', modifications,
+                                            set_fixe="updated_at = CURRENT_TIMESTAMP")
         conn.commit()
         cursor.close()
         conn.close()
+        invalider_tables('lots_bruts')
+        marquer_synthese_a_recalculer('lots_bruts')
         
-        if updates == 0:
-            return True, "ℹ️ Aucune modification détectée"
-        return True, f"✅ {updates} lot(s) mis à jour"
+        updates = sum(resultats.values())
+        introuvables = [row_id for row_id, ok in resultats.items() if not ok]
+        message = f"✅ {updates} lot(s) mis à jour"
+        if introuvables:
+            message += f" — ⚠️ lot(s) introuvable(s) : {', '.join(str(i) for i in introuvables)}"
+        return True, message
         
     except Exception as e:
         if 'conn' in locals():
@@ -365,6 +384,8 @@ def add_lot(data, varietes_dict, producteurs_dict):
         conn.commit()
         cursor.close()
         conn.close()
+        invalider_tables('lots_bruts')
+        marquer_synthese_a_recalculer('lots_bruts')
         
         return True, "✅ Lot ajouté avec succès"
         
@@ -398,6 +419,8 @@ def delete_lot(lot_id):
         conn.commit()
         cursor.close()
         conn.close()
+        invalider_tables('lots_bruts')
+        marquer_synthese_a_recalculer('lots_bruts')
         
         return True, "✅ Lot désactivé avec succès"
         
@@ -415,29 +438,6 @@ def delete_lot(lot_id):
 # FONCTIONS IMPORT EXCEL - AJOUT ONGLET
 # ============================================================================
 
-def fuzzy_match_value(value, valid_values, threshold=0.8):
-    """Match fuzzy avec difflib (intégré Python)"""
-    if pd.isna(value) or str(value).strip() == '':
-        return (True, None, "empty")
-    
-    value_clean = str(value).strip().upper()
-    
-    # 1. Match exact
-    for valid in valid_values:
-        if valid.upper() == value_clean:
-            return (True, valid, "exact")
-    
-    # 2. Match fuzzy
-    matches = get_close_matches(value_clean, [v.upper() for v in valid_values], n=1, cutoff=threshold)
-    
-    if matches:
-        matched_upper = matches[0]
-        for valid in valid_values:
-            if valid.upper() == matched_upper:
-                return (True, valid, "fuzzy")
-    
-    return (False, None, "error")
-
 def get_valid_references_import():
     """Récupère toutes les valeurs valides depuis DB pour import"""
     try:
@@ -521,6 +521,10 @@ def validate_import_data_excel(df, valid_refs):
     errors_count = 0
     warnings_count = 0
     
+    # Index construits une fois par import (exact + trigrammes, mémo par valeur distincte)
+    index_varietes = construire_index(valid_refs['varietes'])
+    index_producteurs = construire_index(valid_refs['producteurs'])
+    
     for idx, row in df_validated.iterrows():
         errors = []
         warnings = []
@@ -535,7 +539,7 @@ def validate_import_data_excel(df, valid_refs):
         
         # Validation variété
         if not pd.isna(row['code_variete']) and str(row['code_variete']).strip() != '':
-            is_valid, matched, match_type = fuzzy_match_value(row['code_variete'], valid_refs['varietes'])
+            is_valid, matched, match_type = correspondre(index_varietes, row['code_variete'])
             if is_valid and match_type == "fuzzy":
                 warnings.append(f"Variété '{row['code_variete']}' → '{matched}'")
                 df_validated.at[idx, '_variete_corrected'] = matched
@@ -547,7 +551,7 @@ def validate_import_data_excel(df, valid_refs):
         
         # Validation producteur
         if not pd.isna(row['code_producteur']) and str(row['code_producteur']).strip() != '':
-            is_valid, matched, match_type = fuzzy_match_value(row['code_producteur'], valid_refs['producteurs'])
+            is_valid, matched, match_type = correspondre(index_producteurs, row['code_producteur'])
             if is_valid and match_type == "fuzzy":
                 warnings.append(f"Producteur '{row['code_producteur']}' → '{matched}'")
                 df_validated.at[idx, '_producteur_corrected'] = matched
@@ -628,6 +632,8 @@ def import_validated_lots_excel(df_validated):
         conn.commit()
         cursor.close()
         conn.close()
+        invalider_tables('lots_bruts')
+        marquer_synthese_a_recalculer('lots_bruts')
         
         if failed_lots:
             return True, f"✅ {imported_count} lots importés | ⚠️ {len(failed_lots)} échecs"
@@ -648,7 +654,7 @@ tab1, tab2 = st.tabs(["📋 Liste Lots", "📥 Import Excel"])
 
 # ===== ONGLET 1 : CODE ORIGINAL (100% INCHANGÉ) =====
 with tab1:
-    df = load_stock_data()
+    metrics = calculate_metrics()
     
     # ============================================================================
     # FORMULAIRE D'AJOUT (AU CLIC SUR BOUTON)
@@ -820,12 +826,10 @@ with tab1:
     # AFFICHAGE TABLEAU ET FILTRES
     # ============================================================================
     
-    if not df.empty:
+    if metrics['total_lots'] > 0:
         varietes_dict = get_all_varietes_for_dropdown()
         producteurs_dict = get_all_producteurs_for_dropdown()
         
-        metrics = calculate_metrics(df)
-        
         # KPIs
         st.subheader("📊 Indicateurs Clés")
         col1, col2, col3, col4 = st.columns(4)
@@ -843,36 +847,39 @@ with tab1:
         
         # Filtres
         st.subheader("🔍 Filtres")
-        col1, col2, col3 = st.columns(3)
+        col1, col2, col3, col4, col5 = st.columns([2, 2, 2, 2, 1])
         
         with col1:
             search_nom = st.text_input("Nom usage", key="filter_nom_usage", placeholder="Rechercher...")
         
         with col2:
-            varietes = ['Toutes'] + sorted(df['nom_variete'].dropna().unique().tolist())
+            varietes = ['Toutes'] + get_lots_filter_options('nom_variete')
             selected_variete = st.selectbox("Variété", varietes, key="filter_variete")
         
         with col3:
-            producteurs = ['Tous'] + sorted(df['nom_producteur'].dropna().unique().tolist())
+            producteurs = ['Tous'] + get_lots_filter_options('nom_producteur')
             selected_producteur = st.selectbox("Producteur", producteurs, key="filter_producteur")
         
-        # Appliquer filtres
-        filtered_df = df.copy()
-        
-        if search_nom:
-            filtered_df = filtered_df[filtered_df['nom_usage'].str.contains(search_nom, case=False, na=False)]
+        with col4:
+            tri_label = st.selectbox("Trier par", list(LOTS_TRIS.keys()), key="tri_lots")
         
-        if selected_variete != 'Toutes':
-            filtered_df = filtered_df[filtered_df['nom_variete'] == selected_variete]
+        with col5:
+            tri_sens = st.selectbox("Ordre", ["DESC", "ASC"], key="tri_lots_sens",
+                                    format_func=lambda x: "⬇️ Décr." if x == "DESC" else "⬆️ Croiss.")
         
-        if selected_producteur != 'Tous':
-            filtered_df = filtered_df[filtered_df['nom_producteur'] == selected_producteur]
+        # Filtres et tri exécutés en SQL (page par page)
+        filtres = [
+            ('nom_usage', 'contient', search_nom.strip() if search_nom else None),
+            ('nom_variete', '=', selected_variete if selected_variete != 'Toutes' else None),
+            ('nom_producteur', '=', selected_producteur if selected_producteur != 'Tous' else None),
+        ]
+        tri = (LOTS_TRIS[tri_label], tri_sens)
         
         st.markdown("---")
-        st.info(f"📊 {len(filtered_df)} lot(s) affiché(s) sur {len(df)} total")
-        
-        if 'original_stock_df' not in st.session_state:
-            st.session_state.original_stock_df = filtered_df.copy()
+        filtered_df, nb_filtres, jeton_page = load_stock_page(filtres, tri)
+        editor_key = f"stock_editor_{jeton_page}"
+        st.caption(f"📊 {nb_filtres} lot(s) filtré(s) sur {metrics['total_lots']} total — "
+                   "enregistrez vos modifications avant de changer de page")
         
         # ⭐ EN-TÊTE avec BOUTONS
         col_title, col_save, col_refresh, col_add, col_details = st.columns([2, 1, 1, 1, 1.5])
@@ -882,12 +889,22 @@ with tab1:
         
         with col_save:
             if st.button("💾 Enregistrer", use_container_width=True, type="primary", key="btn_save_top"):
-                if 'edited_stock_df' in st.session_state:
-                    success, message = save_stock_changes(st.session_state.original_stock_df, st.session_state.edited_stock_df, varietes_dict, producteurs_dict)
+                # Modifications envoyées par l'éditeur, ligne par ligne (id -> colonnes modifiées)
+                deltas = deltas_editeur(editor_key, filtered_df)
+                for changes in deltas.values():
+                    changes.pop('Select', None)
+                deltas = {lot_id: changes for lot_id, changes in deltas.items() if changes}
+                if deltas:
+                    original_rows = filtered_df[filtered_df['id'].isin(deltas.keys())]
+                    edited_rows = original_rows.copy()
+                    for idx in edited_rows.index:
+                        for col, val in deltas[int(edited_rows.at[idx, 'id'])].items():
+                            if col in edited_rows.columns:
+                                edited_rows.at[idx, col] = val
+                    success, message = save_stock_changes(original_rows, edited_rows, varietes_dict, producteurs_dict)
                     if success:
                         st.success(message)
-                        st.session_state.pop('original_stock_df', None)
-                        st.session_state.pop('edited_stock_df', None)
+                        st.session_state.pop(editor_key, None)
                         st.rerun()
                     else:
                         if "Aucune modification" in message:
@@ -899,7 +916,9 @@ with tab1:
         
         with col_refresh:
             if st.button("🔄 Actualiser", use_container_width=True, key="btn_refresh_top"):
-                st.session_state.pop('original_stock_df', None)
+                st.session_state.pop(editor_key, None)
+                reset_grille("lots")
+                get_lots_filter_options.clear()
                 st.rerun()
         
         with col_add:
@@ -974,13 +993,9 @@ with tab1:
             num_rows="fixed",
             disabled=['id', 'code_lot_interne', 'poids_total_brut_kg', 'valeur_lot_euro', 'age_jours'],
             column_config=column_config,
-            key="stock_editor"
+            key=editor_key
         )
         
-        # Stocker edited_df
-        edited_df_for_save = edited_df.drop('Select', axis=1) if 'Select' in edited_df.columns else edited_df
-        st.session_state.edited_stock_df = edited_df_for_save
-        
         # ⭐ RÉCUPÉRER LES LOTS SÉLECTIONNÉS
         selected_lot_ids = []
         
@@ -1025,23 +1040,28 @@ with tab1:
         st.subheader("📤 Exports")
         col1, col2 = st.columns(2)
         
-        with col1:
-            csv = filtered_df.to_csv(index=False).encode('utf-8')
-            st.download_button("📥 CSV", csv, f"lots_{datetime.now().strftime('%Y%m%d')}.csv", "text/csv", use_container_width=True)
-        
-        with col2:
-            buffer = io.BytesIO()
-            with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-                filtered_df.to_excel(writer, index=False, sheet_name='Lots')
-            st.download_button("📥 Excel", buffer.getvalue(), f"lots_{datetime.now().strftime('%Y%m%d')}.xlsx", 
-                              "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", use_container_width=True)
+        # Export complet chargé uniquement à la demande (la grille n'a qu'une page en mémoire)
+        if st.button(f"📦 Préparer l'export ({nb_filtres} lots filtrés)", key="btn_prepare_export_lots"):
+            export_df = load_stock_export(filtres, tri)
+            
+            with col1:
+                csv = export_df.to_csv(index=False).encode('utf-8')
+                st.download_button("📥 CSV", csv, f"lots_{datetime.now().strftime('%Y%m%d')}.csv", "text/csv", use_container_width=True)
+            
+            with col2:
+                buffer = io.BytesIO()
+                with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+                    export_df.to_excel(writer, index=False, sheet_name='Lots')
+                st.download_button("📥 Excel", buffer.getvalue(), f"lots_{datetime.now().strftime('%Y%m%d')}.xlsx", 
+                                  "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", use_container_width=True)
         
         # ⭐ SUPPRESSION LOTS (ADMIN UNIQUEMENT)
         if is_admin():
             st.markdown("---")
             st.subheader("🗑️ Suppression de Lots (Admin)")
             
-            lot_options = [f"{row['id']} - {row['code_lot_interne']} - {row['nom_usage']}" for _, row in df.iterrows()]
+            # Lots de la page affichée (filtrer/paginer pour atteindre un autre lot)
+            lot_options = [f"{row['id']} - {row['code_lot_interne']} - {row['nom_usage']}" for _, row in filtered_df.iterrows()]
             
             if lot_options:
                 selected_lot = st.selectbox(
@@ -1073,7 +1093,7 @@ with tab1:
                                 st.success(message)
                                 st.session_state.pop('confirm_delete_lot_id', None)
                                 st.session_state.pop('confirm_delete_lot_name', None)
-                                st.session_state.pop('original_stock_df', None)
+                                reset_grille("lots")
                                 time.sleep(1)
                                 st.rerun()
                             else:
@@ -2,9 +2,13 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 from datetime import datetime
-from database import get_connection
+from database import get_connection, executer_transaction
 from components import show_footer
 from auth import require_access
+from utils.stock_historique import init_schema_historique
+from utils.stock_operations import transferer_emplacement, modifier_emplacement, supprimer_emplacement
+from utils.cache_tables import invalider_tables
+from utils.synthese_previsions import marquer_synthese_a_recalculer
 import io
 
 st.set_page_config(page_title="Détails Stock - Culture Pom", page_icon="📍", layout="wide")
@@ -333,6 +337,8 @@ def add_emplacement(lot_id, site, emplacement, nombre_unites, type_cond, statut_
         conn.commit()
         cursor.close()
         conn.close()
+        invalider_tables('stock_emplacements')
+        marquer_synthese_a_recalculer('stock_emplacements')
         
         return True, "✅ Emplacement ajouté"
         
@@ -342,117 +348,16 @@ def add_emplacement(lot_id, site, emplacement, nombre_unites, type_cond, statut_
         return False, f"❌ Erreur : {str(e)}"
 
 def transfer_emplacement(lot_id, empl_source_id, quantite_transfert, site_dest, empl_dest):
-    """Transfère du stock d'un emplacement vers un autre"""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        # Récupérer infos source
-        cursor.execute("""
-            SELECT site_stockage, emplacement_stockage, nombre_unites, 
-                   type_conditionnement, poids_total_kg, statut_lavage
-            FROM stock_emplacements
-            WHERE id = %s AND is_active = TRUE
-        """, (empl_source_id,))
-        
-        source = cursor.fetchone()
-        
-        if not source:
-            return False, "❌ Emplacement source introuvable"
-        
-        if int(quantite_transfert) > int(source['nombre_unites']):
-            return False, f"❌ Quantité insuffisante (disponible: {source['nombre_unites']})"
-        
-        # Calcul poids
-        if source['type_conditionnement'] == 'Pallox':
-            poids_unitaire = 1900.0
-        elif source['type_conditionnement'] == 'Petit Pallox':
-            poids_unitaire = 1200.0
-        elif source['type_conditionnement'] == 'Big Bag':
-            poids_unitaire = 1600.0
-        else:
-            poids_unitaire = 1900.0
-        
-        poids_transfere = quantite_transfert * poids_unitaire
-        
-        # Déduire de la source
-        nouvelle_quantite_source = int(source['nombre_unites']) - int(quantite_transfert)
-        nouveau_poids_source = nouvelle_quantite_source * poids_unitaire
-        
-        if nouvelle_quantite_source == 0:
-            # Supprimer source
-            cursor.execute("""
-                UPDATE stock_emplacements 
-                SET is_active = FALSE 
-                WHERE id = %s
-            """, (empl_source_id,))
-        else:
-            # Mettre à jour source
-            cursor.execute("""
-                UPDATE stock_emplacements 
-                SET nombre_unites = %s, poids_total_kg = %s 
-                WHERE id = %s
-            """, (nouvelle_quantite_source, nouveau_poids_source, empl_source_id))
-        
-        # Vérifier si destination existe déjà
-        cursor.execute("""
-            SELECT id, nombre_unites, poids_total_kg
-            FROM stock_emplacements
-            WHERE lot_id = %s 
-              AND site_stockage = %s 
-              AND emplacement_stockage = %s 
-              AND type_conditionnement = %s
-              AND statut_lavage = %s
-              AND is_active = TRUE
-        """, (int(lot_id), site_dest, empl_dest, source['type_conditionnement'], source['statut_lavage']))
-        
-        dest_existant = cursor.fetchone()
-        
-        if dest_existant:
-            # Ajouter à l'existant
-            nouvelle_quantite_dest = int(dest_existant['nombre_unites']) + int(quantite_transfert)
-            nouveau_poids_dest = float(dest_existant['poids_total_kg']) + poids_transfere
-            
-            cursor.execute("""
-                UPDATE stock_emplacements 
-                SET nombre_unites = %s, poids_total_kg = %s 
-                WHERE id = %s
-            """, (nouvelle_quantite_dest, nouveau_poids_dest, dest_existant['id']))
-        else:
-            # Créer nouveau
-            cursor.execute("""
-                INSERT INTO stock_emplacements (
-                    lot_id, site_stockage, emplacement_stockage,
-                    nombre_unites, type_conditionnement, poids_total_kg,
-                    statut_lavage, is_active
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, TRUE)
-            """, (int(lot_id), site_dest, empl_dest, int(quantite_transfert), 
-                  source['type_conditionnement'], poids_transfere, source['statut_lavage']))
-        
-        # Enregistrer mouvement
-        user = st.session_state.get('username', 'system')
-        
-        cursor.execute("""
-            INSERT INTO stock_mouvements (
-                lot_id, type_mouvement, 
-                site_origine, emplacement_origine,
-                site_destination, emplacement_destination,
-                quantite, type_conditionnement, poids_kg, user_action, created_by
-            ) VALUES (%s, 'TRANSFERT', %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """, (int(lot_id), source['site_stockage'], source['emplacement_stockage'],
-              site_dest, empl_dest, int(quantite_transfert), 
-              source['type_conditionnement'], poids_transfere, user, user))
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
-        
-        return True, "✅ Transfert effectué"
-        
-    except Exception as e:
-        if 'conn' in locals():
-            conn.rollback()
-        return False, f"❌ Erreur : {str(e)}"
+    """Transfère du stock d'un emplacement vers un autre (lignes verrouillées, reprise sur conflit)"""
+    user = st.session_state.get('username', 'system')
+    ok, msg = executer_transaction(
+        'TRANSFERT', transferer_emplacement,
+        lot_id, empl_source_id, quantite_transfert, site_dest, empl_dest, user
+    )
+    if ok:
+        invalider_tables('stock_emplacements')
+        marquer_synthese_a_recalculer('stock_emplacements')
+    return ok, msg
 
 def modify_emplacement(empl_id, nouvelle_quantite):
     """Modifie la quantité d'un emplacement (OBSOLÈTE - utiliser modify_emplacement_complet)"""
@@ -461,161 +366,31 @@ def modify_emplacement(empl_id, nouvelle_quantite):
 
 def modify_emplacement_complet(empl_id, nouvelle_quantite=None, nouveau_type=None, nouveau_statut=None, 
                                nouveau_poids=None, nouveau_calibre_min=None, nouveau_calibre_max=None):
-    """Modifie complètement un emplacement avec traçabilité"""
+    """Modifie complètement un emplacement avec traçabilité (ligne verrouillée, reprise sur conflit)"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        # Validation calibre
-        if nouveau_calibre_min is not None and nouveau_calibre_max is not None:
-            if nouveau_calibre_min >= nouveau_calibre_max:
-                return False, "❌ Calibre min doit être inférieur à calibre max"
-        
-        # Récupérer infos actuelles
-        cursor.execute("""
-            SELECT lot_id, site_stockage, emplacement_stockage, 
-                   nombre_unites, type_conditionnement, poids_total_kg,
-                   statut_lavage, calibre_min, calibre_max
-            FROM stock_emplacements
-            WHERE id = %s AND is_active = TRUE
-        """, (empl_id,))
-        
-        empl = cursor.fetchone()
-        
-        if not empl:
-            return False, "❌ Emplacement introuvable"
-        
-        # Préparer les nouvelles valeurs (garder anciennes si non spécifiées)
-        final_quantite = int(nouvelle_quantite) if nouvelle_quantite is not None else int(empl['nombre_unites'])
-        final_type = nouveau_type if nouveau_type is not None else empl['type_conditionnement']
-        final_statut = nouveau_statut if nouveau_statut is not None else empl['statut_lavage']
-        
-        # Calcul poids
-        if nouveau_poids is not None:
-            final_poids = float(nouveau_poids)
-        else:
-            # Recalculer selon type
-            if final_type == 'Pallox':
-                poids_unitaire = 1900.0
-            elif final_type == 'Petit Pallox':
-                poids_unitaire = 1200.0
-            elif final_type == 'Big Bag':
-                poids_unitaire = 1600.0
-            else:
-                poids_unitaire = 1900.0
-            final_poids = final_quantite * poids_unitaire
-        
-        # Calibre - garder ancien si non spécifié
-        final_calibre_min = int(nouveau_calibre_min) if nouveau_calibre_min is not None else empl['calibre_min']
-        final_calibre_max = int(nouveau_calibre_max) if nouveau_calibre_max is not None else empl['calibre_max']
-        
-        # Construire notes de modification pour traçabilité
-        modifications = []
-        if nouvelle_quantite is not None and int(nouvelle_quantite) != int(empl['nombre_unites']):
-            modifications.append(f"Quantité: {empl['nombre_unites']}→{final_quantite}")
-        if nouveau_type is not None and nouveau_type != empl['type_conditionnement']:
-            modifications.append(f"Type: {empl['type_conditionnement']}→{final_type}")
-        if nouveau_statut is not None and nouveau_statut != empl['statut_lavage']:
-            modifications.append(f"Statut: {empl['statut_lavage']}→{final_statut}")
-        if nouveau_poids is not None and abs(float(nouveau_poids) - float(empl['poids_total_kg'])) > 1:
-            modifications.append(f"Poids: {empl['poids_total_kg']:.0f}→{final_poids:.0f}kg")
-        if nouveau_calibre_min is not None or nouveau_calibre_max is not None:
-            old_cal = f"{empl['calibre_min'] or '?'}-{empl['calibre_max'] or '?'}"
-            new_cal = f"{final_calibre_min or '?'}-{final_calibre_max or '?'}"
-            if old_cal != new_cal:
-                modifications.append(f"Calibre: {old_cal}→{new_cal}")
-        
-        if not modifications:
-            return True, "ℹ️ Aucune modification détectée"
-        
-        # Mettre à jour
-        cursor.execute("""
-            UPDATE stock_emplacements 
-            SET nombre_unites = %s, 
-                type_conditionnement = %s,
-                poids_total_kg = %s,
-                statut_lavage = %s,
-                calibre_min = %s,
-                calibre_max = %s,
-                updated_at = CURRENT_TIMESTAMP
-            WHERE id = %s
-        """, (final_quantite, final_type, final_poids, final_statut, 
-              final_calibre_min, final_calibre_max, empl_id))
-        
-        # Enregistrer mouvement de traçabilité
-        user = st.session_state.get('username', 'system')
-        notes_modif = " | ".join(modifications)
-        
-        cursor.execute("""
-            INSERT INTO stock_mouvements (
-                lot_id, type_mouvement, 
-                site_destination, emplacement_destination,
-                quantite, type_conditionnement, poids_kg, user_action, created_by,
-                notes
-            ) VALUES (%s, 'MODIFICATION', %s, %s, %s, %s, %s, %s, %s, %s)
-        """, (int(empl['lot_id']), empl['site_stockage'], empl['emplacement_stockage'],
-              final_quantite, final_type, final_poids, user, user, notes_modif))
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
-        
-        return True, f"✅ Emplacement modifié ({len(modifications)} changement(s))"
-        
+        init_schema_historique()  # colonnes delta_* (hors transaction verrouillée)
     except Exception as e:
-        if 'conn' in locals():
-            conn.rollback()
         return False, f"❌ Erreur : {str(e)}"
+    user = st.session_state.get('username', 'system')
+    ok, msg = executer_transaction(
+        'MODIFICATION', modifier_emplacement, empl_id, user,
+        nouvelle_quantite=nouvelle_quantite, nouveau_type=nouveau_type, nouveau_statut=nouveau_statut,
+        nouveau_poids=nouveau_poids, nouveau_calibre_min=nouveau_calibre_min,
+        nouveau_calibre_max=nouveau_calibre_max
+    )
+    if ok:
+        invalider_tables('stock_emplacements')
+        marquer_synthese_a_recalculer('stock_emplacements')
+    return ok, msg
 
 def delete_emplacement(empl_id):
-    """Supprime (soft delete) un emplacement"""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        # Récupérer infos pour mouvement
-        cursor.execute("""
-            SELECT lot_id, site_stockage, emplacement_stockage, 
-                   nombre_unites, type_conditionnement, poids_total_kg
-            FROM stock_emplacements
-            WHERE id = %s AND is_active = TRUE
-        """, (empl_id,))
-        
-        empl = cursor.fetchone()
-        
-        if not empl:
-            return False, "❌ Emplacement introuvable"
-        
-        # Soft delete
-        cursor.execute("""
-            UPDATE stock_emplacements 
-            SET is_active = FALSE 
-            WHERE id = %s
-        """, (empl_id,))
-        
-        # Enregistrer mouvement
-        user = st.session_state.get('username', 'system')
-        
-        cursor.execute("""
-            INSERT INTO stock_mouvements (
-                lot_id, type_mouvement, 
-                site_origine, emplacement_origine,
-                quantite, type_conditionnement, poids_kg, user_action, created_by
-            ) VALUES (%s, 'SUPPRESSION', %s, %s, %s, %s, %s, %s, %s)
-        """, (int(empl['lot_id']), empl['site_stockage'], empl['emplacement_stockage'],
-              int(empl['nombre_unites']), empl['type_conditionnement'], 
-              float(empl['poids_total_kg']), user, user))
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
-        
-        return True, "✅ Emplacement supprimé"
-        
-    except Exception as e:
-        if 'conn' in locals():
-            conn.rollback()
-        return False, f"❌ Erreur : {str(e)}"
+    """Supprime (soft delete) un emplacement (ligne verrouillée, reprise sur conflit)"""
+    user = st.session_state.get('username', 'system')
+    ok, msg = executer_transaction('SUPPRESSION', supprimer_emplacement, empl_id, user)
+    if ok:
+        invalider_tables('stock_emplacements')
+        marquer_synthese_a_recalculer('stock_emplacements')
+    return ok, msg
 
 def get_all_lots():
     """Récupère tous les lots actifs"""
@@ -1,12 +1,15 @@
 import streamlit as st
 import pandas as pd
+import plotly.express as px
 from datetime import datetime, timedelta
 from database import get_connection
-from components import show_footer
+from components import show_footer, show_grille_paginee
 from auth import require_access, is_admin
 import io
 import time
-import re
+from utils import grille, stock_historique
+from utils.cache_tables import invalider_tables
+from utils.synthese_previsions import marquer_synthese_a_recalculer
 
 st.set_page_config(page_title="Stock Global - Culture Pom", page_icon="📊", layout="wide")
 
@@ -364,40 +367,80 @@ def get_capacites_sites():
 # 📦 FONCTIONS DE DONNÉES - STOCK COMPLET
 # ============================================================
 
-def get_stock_complet():
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT l.id as lot_id, l.code_lot_interne, l.nom_usage,
-                   COALESCE(v.nom_variete, l.code_variete) as variete,
-                   COALESCE(p.nom, l.code_producteur) as producteur,
-                   se.site_stockage, se.emplacement_stockage,
-                   se.nombre_unites, se.poids_total_kg,
-                   COALESCE(se.statut_lavage, 'BRUT') as statut_lavage,
-                   se.type_conditionnement, se.calibre_min, se.calibre_max,
-                   l.age_jours, l.date_entree_stock
-            FROM stock_emplacements se
+# Vue stock complète : filtres, tri et pagination exécutés par Postgres (utils/grille.py)
+_SQL_STATUT_BUCKET = """
+    CASE
+        WHEN COALESCE(NULLIF(UPPER(TRIM(se.statut_lavage)), ''), 'BRUT') LIKE 'GRENAILLES%%'
+            THEN CASE WHEN UPPER(se.statut_lavage) LIKE '%%LAV%%' THEN 'GREN_LAVEES' ELSE 'GREN_BRUTES' END
+        WHEN COALESCE(NULLIF(UPPER(TRIM(se.statut_lavage)), ''), 'BRUT') LIKE 'LAV%%' THEN 'LAVE'
+        ELSE 'BRUT'
+    END"""
+
+STOCK_GRILLE = {
+    'from': """stock_emplacements se
             JOIN lots_bruts l ON se.lot_id = l.id
             LEFT JOIN ref_varietes v ON l.code_variete = v.code_variete
-            LEFT JOIN ref_producteurs p ON l.code_producteur = p.code_producteur
-            WHERE se.is_active = TRUE AND l.is_active = TRUE AND se.nombre_unites > 0
-            ORDER BY l.code_lot_interne, se.site_stockage
-        """)
-        rows = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        if rows:
-            df = pd.DataFrame(rows)
-            for col in ['nombre_unites', 'poids_total_kg', 'age_jours']:
-                if col in df.columns:
-                    df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
-            # Calibre emplacement : NaN conservé (calibre non renseigné -> affiché vide, ignoré par le filtre)
-            for col in ['calibre_min', 'calibre_max']:
-                if col in df.columns:
-                    df[col] = pd.to_numeric(df[col], errors='coerce')
-            return df
-        return pd.DataFrame()
+            LEFT JOIN ref_producteurs p ON l.code_producteur = p.code_producteur""",
+    'where': "se.is_active = TRUE AND l.is_active = TRUE AND se.nombre_unites > 0",
+    'cle': 'id',
+    'colonnes': {
+        'id': 'se.id',
+        'lot_id': 'l.id',
+        'code_lot_interne': 'l.code_lot_interne',
+        'nom_usage': 'l.nom_usage',
+        'variete': 'COALESCE(v.nom_variete, l.code_variete)',
+        'producteur': 'COALESCE(p.nom, l.code_producteur)',
+        'site_stockage': 'se.site_stockage',
+        'emplacement_stockage': 'se.emplacement_stockage',
+        'nombre_unites': 'se.nombre_unites',
+        'poids_total_kg': 'se.poids_total_kg',
+        'statut_lavage': "COALESCE(se.statut_lavage, 'BRUT')",
+        'statut_bucket': _SQL_STATUT_BUCKET,
+        'type_conditionnement': 'se.type_conditionnement',
+        'calibre_min': 'se.calibre_min',
+        'calibre_max': 'se.calibre_max',
+        'age_jours': 'l.age_jours',
+        'date_entree_stock': 'l.date_entree_stock',
+    },
+    'types': {'nombre_unites': 'nombre', 'poids_total_kg': 'nombre', 'age_jours': 'nombre',
+              'date_entree_stock': 'date'},
+}
+
+def _typer_stock(df):
+    for col in ['nombre_unites', 'poids_total_kg', 'age_jours']:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+    # Calibre emplacement : NaN conservé (calibre non renseigné -> affiché vide, ignoré par le filtre)
+    for col in ['calibre_min', 'calibre_max']:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+    return df
+
+@st.cache_data(ttl=300)
+def get_stock_filter_options(alias):
+    try:
+        return [str(v) for v in grille.valeurs_distinctes(STOCK_GRILLE, alias)]
+    except Exception:
+        return []
+
+def get_stock_totaux(filtres):
+    """Totaux de la vue stock filtrée (agrégat SQL, indépendant de la page affichée)"""
+    try:
+        agg = grille.agreger(STOCK_GRILLE, filtres, {
+            'nb_emplacements': 'COUNT(*)',
+            'total_pallox': 'COALESCE(SUM({nombre_unites}), 0)',
+            'total_kg': 'COALESCE(SUM({poids_total_kg}), 0)',
+            'nb_lots': 'COUNT(DISTINCT {lot_id})',
+        })
+        return {k: float(v or 0) for k, v in agg.items()}
+    except Exception as e:
+        st.error(f"❌ Erreur stock complet : {str(e)}")
+        return {'nb_emplacements': 0, 'total_pallox': 0, 'total_kg': 0, 'nb_lots': 0}
+
+def get_stock_complet(filtres=None):
+    """Vue stock complète filtrée (exports à la demande)"""
+    try:
+        return _typer_stock(grille.charger_tout(STOCK_GRILLE, filtres, ('code_lot_interne', 'ASC')))
     except Exception as e:
         st.error(f"❌ Erreur stock complet : {str(e)}")
         return pd.DataFrame()
@@ -574,163 +617,22 @@ def get_stats_mouvements(jours=30):
 # 📅 FONCTIONS STOCK À DATE
 # ============================================================
 
-def _parser_notes_modification(notes):
-    """
-    Parse le champ notes d'un mouvement MODIFICATION.
-    Format : "Quantité: avant+après | Poids: avant+aprèskg"
-    Ex : "Quantité: 10+11 | Poids: 19000+20900kg"
-    Retourne (qty_apres, pds_apres_kg) — la valeur APRÈS qui est dans le champ
-    et (qty_avant, pds_avant_kg) — la valeur AVANT pour annuler.
-    """
-    if not notes:
-        return None, None, None, None
-    try:
-        m_qty = re.search(r'Quantit[eé]\s*:\s*(\d+)\s*\+\s*(\d+)', notes, re.IGNORECASE)
-        m_pds = re.search(r'Poids\s*:\s*([\d.]+)\s*\+\s*([\d.]+)', notes, re.IGNORECASE)
-        qty_avant  = int(m_qty.group(1))   if m_qty else None
-        qty_apres  = int(m_qty.group(2))   if m_qty else None
-        pds_avant  = float(m_pds.group(1)) if m_pds else None
-        pds_apres  = float(m_pds.group(2)) if m_pds else None
-        return qty_avant, qty_apres, pds_avant, pds_apres
-    except Exception:
-        return None, None, None, None
-
-
 def get_stock_a_date(date_cible_ts):
     """
     Reconstruit le stock à une date donnée.
 
-    Stratégie : partir de l'état ACTUEL de stock_emplacements (source de vérité),
-    puis annuler tous les mouvements postérieurs à date_cible_ts.
-
-    Annulation par type :
-      AJOUT        → soustraire qty/pds de site_destination/emplacement_destination
-      SUPPRESSION  → ajouter qty/pds sur site_origine/emplacement_origine
-      TRANSFERT    → ajouter sur origine, soustraire sur destination
-      MODIFICATION → lire notes "avant+après", recalculer le delta et l'annuler
-                     (si notes non parsable : mouvement ignoré avec avertissement comptabilisé)
+    Stratégie : partir de l'instantané (stock_snapshots) le plus proche de la
+    date cible — ou de l'état actuel de stock_emplacements — puis rejouer en
+    avant ou en arrière uniquement les mouvements intermédiaires.
+    Voir utils/stock_historique.py.
     """
-    conn = None
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-
-        # 1. État actuel de tous les emplacements (actifs ou non, pour remonter l'historique)
-        cursor.execute("""
-            SELECT se.lot_id,
-                   lb.code_lot_interne, lb.nom_usage, lb.code_variete,
-                   se.site_stockage, se.emplacement_stockage,
-                   se.nombre_unites, se.poids_total_kg,
-                   se.type_conditionnement
-            FROM stock_emplacements se
-            JOIN lots_bruts lb ON lb.id = se.lot_id
-        """)
-        empl_rows = cursor.fetchall()
-
-        stock = {}   # (lot_id, site, empl) → {nombre_unites, poids_total_kg}
-        meta  = {}   # (lot_id, site, empl) → infos affichage
-
-        for r in empl_rows:
-            k = (r['lot_id'], str(r['site_stockage'] or ''), str(r['emplacement_stockage'] or ''))
-            stock[k] = {
-                'nombre_unites':  float(r['nombre_unites'] or 0),
-                'poids_total_kg': float(r['poids_total_kg'] or 0),
-            }
-            meta[k] = {
-                'code_lot_interne':    r['code_lot_interne'],
-                'nom_usage':           r['nom_usage'],
-                'code_variete':        r['code_variete'],
-                'type_conditionnement': r['type_conditionnement'],
-            }
-
-        # 2. Mouvements POSTÉRIEURS à la date cible (à annuler, du plus récent au plus ancien)
-        cursor.execute("""
-            SELECT lot_id, type_mouvement,
-                   site_origine, emplacement_origine,
-                   site_destination, emplacement_destination,
-                   COALESCE(quantite, 0)   AS quantite,
-                   COALESCE(poids_kg, 0.0) AS poids_kg,
-                   notes, created_at
-            FROM stock_mouvements
-            WHERE created_at > %s
-            ORDER BY created_at DESC
-        """, (date_cible_ts,))
-        mvt_rows = cursor.fetchall()
-        cursor.close()
-        conn.close()
-
-        nb_modif_non_parsees = 0
-
-        def _ensure(k):
-            if k not in stock:
-                stock[k] = {'nombre_unites': 0.0, 'poids_total_kg': 0.0}
-
-        for r in mvt_rows:
-            t   = r['type_mouvement']
-            lid = r['lot_id']
-            qty = float(r['quantite'])
-            pds = float(r['poids_kg'])
-            ori = (lid, str(r['site_origine']    or ''), str(r['emplacement_origine']    or ''))
-            dst = (lid, str(r['site_destination'] or ''), str(r['emplacement_destination'] or ''))
-
-            if t == 'AJOUT':
-                _ensure(dst)
-                stock[dst]['nombre_unites']  -= qty
-                stock[dst]['poids_total_kg'] -= pds
-
-            elif t == 'SUPPRESSION':
-                _ensure(ori)
-                stock[ori]['nombre_unites']  += qty
-                stock[ori]['poids_total_kg'] += pds
-
-            elif t == 'TRANSFERT':
-                _ensure(ori); _ensure(dst)
-                stock[ori]['nombre_unites']  += qty
-                stock[ori]['poids_total_kg'] += pds
-                stock[dst]['nombre_unites']  -= qty
-                stock[dst]['poids_total_kg'] -= pds
-
-            elif t == 'MODIFICATION':
-                # qty/pds dans le champ = valeur APRÈS la modif
-                # On lit notes pour obtenir la valeur AVANT
-                qty_avant, qty_apres, pds_avant, pds_apres = _parser_notes_modification(r['notes'])
-                if qty_avant is not None and pds_avant is not None:
-                    # delta appliqué par la modif = apres - avant
-                    # Pour annuler, on soustrait ce delta
-                    _ensure(dst)
-                    stock[dst]['nombre_unites']  -= (qty_apres - qty_avant)
-                    stock[dst]['poids_total_kg'] -= (pds_apres - pds_avant)
-                else:
-                    nb_modif_non_parsees += 1
-
-        # 3. Construire le DataFrame résultat (seulement emplacements > 0)
-        records = []
-        for (lot_id, site, empl), v in stock.items():
-            nb = round(v['nombre_unites'])
-            if nb <= 0 or not site:
-                continue
-            m = meta.get((lot_id, site, empl), {})
-            records.append({
-                'lot_id':               lot_id,
-                'code_lot_interne':     m.get('code_lot_interne', ''),
-                'nom_usage':            m.get('nom_usage', ''),
-                'code_variete':         m.get('code_variete', ''),
-                'site_stockage':        site,
-                'emplacement_stockage': empl,
-                'nombre_unites':        nb,
-                'poids_total_kg':       round(v['poids_total_kg'], 1),
-                'type_conditionnement': m.get('type_conditionnement', ''),
-            })
-
-        df = pd.DataFrame(records)
-        return df, nb_modif_non_parsees
-
+        return stock_historique.get_stock_a_date(date_cible_ts)
     except Exception as e:
-        if conn:
-            conn.close()
         st.error(f"❌ Erreur stock à date : {e}")
         return pd.DataFrame(), 0
 
+
 # ============================================================
 # ✏️ FONCTIONS MAJ EN MASSE
 # ============================================================
@@ -779,59 +681,111 @@ def get_emplacements_pour_maj(site_filtre, emplacement_filtre=None):
         st.error(f"❌ Erreur chargement emplacements : {e}")
         return pd.DataFrame()
 
+def _valider_maj_masse(modifications):
+    """
+    Pré-validation ligne à ligne (types, valeurs) avant l'écriture groupée.
+    Retourne (lignes_valides, erreurs).
+    """
+    valides, erreurs = [], []
+    for modif in modifications:
+        try:
+            ligne = {
+                'id':         int(modif['id']),
+                'nb_new':     int(modif['nombre_unites_new']),
+                'pds_new':    float(modif['poids_total_kg_new']),
+                'pu_new':     float(modif['poids_unitaire_reel_new']) if modif.get('poids_unitaire_reel_new') else None,
+                'statut_new': str(modif['statut_lavage_new']) if modif.get('statut_lavage_new') else None,
+                'nb_old':     int(modif['nombre_unites_old']),
+                'pds_old':    float(modif['poids_total_kg_old']),
+            }
+        except (KeyError, TypeError, ValueError) as e_ligne:
+            erreurs.append(f"ID {modif.get('id','?')} : valeur invalide ({e_ligne})")
+            continue
+        if ligne['nb_new'] < 0 or ligne['pds_new'] < 0:
+            erreurs.append(f"ID {ligne['id']} : quantité ou poids négatif")
+            continue
+        valides.append(ligne)
+    return valides, erreurs
+
+
 def appliquer_maj_masse(modifications, username):
     """
     Applique les modifications en masse.
-    Notes au format "Quantité: avant+après | Poids: avant+aprèskg"
-    pour permettre la reconstruction stock à date.
+
+    1. Pré-validation Python ligne à ligne (erreurs remontées par ID) ;
+    2. contrôle en une requête que les emplacements existent et sont actifs ;
+    3. une seule instruction : UPDATE ... FROM unnest(...) sur stock_emplacements
+       puis INSERT ... SELECT de tous les mouvements MODIFICATION.
+
+    Le mouvement MODIFICATION porte delta_unites / delta_poids_kg (rejeu du
+    stock à date) ; les notes "Quantité: avant+après | Poids: avant+aprèskg"
+    restent pour la lecture humaine.
     """
+    lignes, erreurs = _valider_maj_masse(modifications)
+    if not lignes:
+        return 0, len(erreurs), erreurs
+
     conn = None
-    nb_ok, nb_err = 0, 0
-    erreurs = []
     try:
         conn = get_connection()
+        stock_historique.init_schema_historique(conn)
         cursor = conn.cursor()
-        for modif in modifications:
-            try:
-                eid        = int(modif['id'])
-                nb_new     = int(modif['nombre_unites_new'])
-                pds_new    = float(modif['poids_total_kg_new'])
-                pu_new     = float(modif['poids_unitaire_reel_new']) if modif.get('poids_unitaire_reel_new') else None
-                statut_new = str(modif['statut_lavage_new']) if modif.get('statut_lavage_new') else None
-                nb_old     = int(modif['nombre_unites_old'])
-                pds_old    = float(modif['poids_total_kg_old'])
-
-                cursor.execute("""
-                    UPDATE stock_emplacements
-                    SET nombre_unites = %s, poids_total_kg = %s,
-                        poids_unitaire_reel = %s, statut_lavage = %s,
-                        updated_at = CURRENT_TIMESTAMP
-                    WHERE id = %s AND is_active = true
-                """, (nb_new, pds_new, pu_new, statut_new, eid))
-
-                # Notes parsables pour reconstruction stock à date
-                notes_trace = f"Quantité: {nb_old}+{nb_new} | Poids: {pds_old}+{pds_new}kg"
-
-                cursor.execute("""
-                    INSERT INTO stock_mouvements (
-                        lot_id, type_mouvement, quantite, poids_kg,
-                        site_destination, emplacement_destination,
-                        description, notes, created_by, user_action
-                    )
-                    SELECT se.lot_id, 'MODIFICATION', %s, %s,
-                           se.site_stockage, se.emplacement_stockage,
-                           'MAJ en masse via Stock Global', %s, %s, %s
-                    FROM stock_emplacements se WHERE se.id = %s
-                """, (nb_new, pds_new, notes_trace, username, username, eid))
-
-                nb_ok += 1
-            except Exception as e_ligne:
-                nb_err += 1
-                erreurs.append(f"ID {modif.get('id','?')} : {e_ligne}")
+
+        ids = [l['id'] for l in lignes]
+        cursor.execute("""
+            SELECT id FROM stock_emplacements
+            WHERE id = ANY(%s) AND is_active = true
+        """, (ids,))
+        actifs = {r['id'] for r in cursor.fetchall()}
+        for l in lignes:
+            if l['id'] not in actifs:
+                erreurs.append(f"ID {l['id']} : emplacement introuvable ou inactif")
+        lignes = [l for l in lignes if l['id'] in actifs]
+        if not lignes:
+            cursor.close()
+            conn.close()
+            return 0, len(erreurs), erreurs
+
+        cols = {k: [l[k] for l in lignes] for k in lignes[0]}
+        notes = [f"Quantité: {l['nb_old']}+{l['nb_new']} | Poids: {l['pds_old']}+{l['pds_new']}kg" for l in lignes]
+
+        cursor.execute("""
+            WITH v AS (
+                SELECT * FROM unnest(
+                    %s::int[], %s::int[], %s::numeric[], %s::numeric[], %s::text[],
+                    %s::int[], %s::numeric[], %s::text[]
+                ) AS t(id, nb_new, pds_new, pu_new, statut_new, nb_old, pds_old, notes)
+            ),
+            maj AS (
+                UPDATE stock_emplacements se
+                SET nombre_unites = v.nb_new, poids_total_kg = v.pds_new,
+                    poids_unitaire_reel = v.pu_new, statut_lavage = v.statut_new,
+                    updated_at = CURRENT_TIMESTAMP
+                FROM v
+                WHERE se.id = v.id AND se.is_active = true
+                RETURNING se.id, se.lot_id, se.site_stockage, se.emplacement_stockage
+            )
+            INSERT INTO stock_mouvements (
+                lot_id, type_mouvement, quantite, poids_kg,
+                site_destination, emplacement_destination,
+                description, notes, created_by, user_action,
+                delta_unites, delta_poids_kg
+            )
+            SELECT maj.lot_id, 'MODIFICATION', v.nb_new, v.pds_new,
+                   maj.site_stockage, maj.emplacement_stockage,
+                   'MAJ en masse via Stock Global', v.notes, %s, %s,
+                   v.nb_new - v.nb_old, ROUND(v.pds_new - v.pds_old, 2)
+            FROM maj JOIN v ON v.id = maj.id
+        """, (cols['id'], cols['nb_new'], cols['pds_new'], cols['pu_new'], cols['statut_new'],
+              cols['nb_old'], cols['pds_old'], notes, username, username))
+        nb_ok = cursor.rowcount
+
         conn.commit()
         cursor.close()
         conn.close()
-        return nb_ok, nb_err, erreurs
+        invalider_tables('stock_emplacements')
+        marquer_synthese_a_recalculer('stock_emplacements')
+        return nb_ok, len(erreurs), erreurs
     except Exception as e:
         if conn:
             conn.rollback()
@@ -978,68 +932,80 @@ with tab2:
 
 with tab3:
     st.subheader("📦 Vue Stock Complète")
-    df_stock = get_stock_complet()
-    if not df_stock.empty:
-        col1, col2, col3, col4 = st.columns(4)
-        with col1: filtre_statut     = st.selectbox("Statut",  ["Tous","BRUT","LAVÉ","GRENAILLES_BRUTES","GRENAILLES_LAVÉES"], key="filtre_statut_stock")
-        with col2: filtre_site_stock = st.selectbox("Site",    ["Tous"] + sorted(df_stock['site_stockage'].unique().tolist()), key="filtre_site_stock")
-        with col3: filtre_variete    = st.selectbox("Variété", ["Toutes"] + sorted(df_stock['variete'].dropna().unique().tolist()), key="filtre_variete_stock")
-        with col4: filtre_age        = st.selectbox("Âge",     ["Tous","< 30 jours","30-60 jours","> 60 jours"], key="filtre_age_stock")
-
-        # Filtre calibre par bornes (0–100 = pas de filtre ; conserve les lots dont la plage [min,max] est dans les bornes)
-        colc1, colc2, _colc3, _colc4 = st.columns(4)
-        with colc1: filtre_cal_min = st.number_input("Calibre min ≥", min_value=0, max_value=100, value=0,   key="filtre_cal_min_stock")
-        with colc2: filtre_cal_max = st.number_input("Calibre max ≤", min_value=0, max_value=100, value=100, key="filtre_cal_max_stock")
-        if filtre_cal_min > filtre_cal_max:
-            st.caption("⚠️ Calibre min > max : aucun résultat possible.")
-
-        df_filtered = df_stock.copy()
-        if filtre_statut     != "Tous":    df_filtered = df_filtered[df_filtered['statut_lavage'].map(_statut_bucket) == _statut_bucket(filtre_statut)]
-        if filtre_site_stock != "Tous":    df_filtered = df_filtered[df_filtered['site_stockage'] == filtre_site_stock]
-        if filtre_variete    != "Toutes":  df_filtered = df_filtered[df_filtered['variete'] == filtre_variete]
-        if filtre_age == "< 30 jours":    df_filtered = df_filtered[df_filtered['age_jours'] < 30]
-        elif filtre_age == "30-60 jours": df_filtered = df_filtered[(df_filtered['age_jours'] >= 30) & (df_filtered['age_jours'] <= 60)]
-        elif filtre_age == "> 60 jours":  df_filtered = df_filtered[df_filtered['age_jours'] > 60]
-        # Calibre : appliqué seulement si les bornes sont resserrées (préserve les lots sans calibre par défaut)
-        if filtre_cal_min > 0 or filtre_cal_max < 100:
-            df_filtered = df_filtered[(df_filtered['calibre_min'] >= filtre_cal_min) & (df_filtered['calibre_max'] <= filtre_cal_max)]
-
+    col1, col2, col3, col4 = st.columns(4)
+    with col1: filtre_statut     = st.selectbox("Statut",  ["Tous","BRUT","LAVÉ","GRENAILLES_BRUTES","GRENAILLES_LAVÉES"], key="filtre_statut_stock")
+    with col2: filtre_site_stock = st.selectbox("Site",    ["Tous"] + get_stock_filter_options('site_stockage'), key="filtre_site_stock")
+    with col3: filtre_variete    = st.selectbox("Variété", ["Toutes"] + get_stock_filter_options('variete'), key="filtre_variete_stock")
+    with col4: filtre_age        = st.selectbox("Âge",     ["Tous","< 30 jours","30-60 jours","> 60 jours"], key="filtre_age_stock")
+
+    # Filtre calibre par bornes (0–100 = pas de filtre ; conserve les lots dont la plage [min,max] est dans les bornes)
+    colc1, colc2, _colc3, _colc4 = st.columns(4)
+    with colc1: filtre_cal_min = st.number_input("Calibre min ≥", min_value=0, max_value=100, value=0,   key="filtre_cal_min_stock")
+    with colc2: filtre_cal_max = st.number_input("Calibre max ≤", min_value=0, max_value=100, value=100, key="filtre_cal_max_stock")
+    if filtre_cal_min > filtre_cal_max:
+        st.caption("⚠️ Calibre min > max : aucun résultat possible.")
+
+    # Filtres traduits en SQL (utils/grille.py) : seule la page affichée est chargée
+    filtres_stock = []
+    if filtre_statut     != "Tous":    filtres_stock.append(('statut_bucket', '=', _statut_bucket(filtre_statut)))
+    if filtre_site_stock != "Tous":    filtres_stock.append(('site_stockage', '=', filtre_site_stock))
+    if filtre_variete    != "Toutes":  filtres_stock.append(('variete', '=', filtre_variete))
+    if filtre_age == "< 30 jours":    filtres_stock.append(('age_jours', '<', 30))
+    elif filtre_age == "30-60 jours": filtres_stock += [('age_jours', '>=', 30), ('age_jours', '<=', 60)]
+    elif filtre_age == "> 60 jours":  filtres_stock.append(('age_jours', '>', 60))
+    # Calibre : appliqué seulement si les bornes sont resserrées (préserve les lots sans calibre par défaut)
+    if filtre_cal_min > 0 or filtre_cal_max < 100:
+        filtres_stock += [('calibre_min', '>=', filtre_cal_min), ('calibre_max', '<=', filtre_cal_max)]
+
+    totaux_stock = get_stock_totaux(filtres_stock)
+    if totaux_stock['nb_emplacements'] > 0:
         st.markdown("---")
         col1, col2, col3 = st.columns(3)
-        with col1: st.info(f"**{len(df_filtered)}** emplacements")
-        with col2: st.info(f"**{df_filtered['nombre_unites'].sum():,.0f}** pallox | **{df_filtered['poids_total_kg'].sum()/1000:,.1f}** T")
-        with col3: st.info(f"**{df_filtered['lot_id'].nunique()}** lots distincts")
-
-        df_display = df_filtered.copy()
-        df_display['Tonnes']  = df_display['poids_total_kg'] / 1000
-        df_display['Calibre'] = df_display.apply(
-            lambda r: f"{int(r['calibre_min'])}-{int(r['calibre_max'])}"
-            if pd.notna(r['calibre_min']) and pd.notna(r['calibre_max']) else "", axis=1)
-        _LBL_STATUT = {"BRUT": "🟢 BRUT", "LAVE": "🧼 LAVÉ",
-                       "GREN_BRUTES": "🌾 Gren. brutes", "GREN_LAVEES": "✨ Gren. lavées"}
-        df_display['Statut']  = df_display['statut_lavage'].apply(
-            lambda s: _LBL_STATUT.get(_statut_bucket(s), s or ""))
-
-        st.dataframe(
-            df_display[['code_lot_interne','variete','producteur','site_stockage',
-                        'emplacement_stockage','nombre_unites','Tonnes','Statut','Calibre','age_jours']].rename(columns={
-                'code_lot_interne':'Lot','variete':'Variété','producteur':'Producteur',
-                'site_stockage':'Site','emplacement_stockage':'Emplacement',
-                'nombre_unites':'Pallox','age_jours':'Âge (j)'}),
-            use_container_width=True, hide_index=True,
-            column_config={"Tonnes": st.column_config.NumberColumn(format="%.1f")}
-        )
+        with col1: st.info(f"**{totaux_stock['nb_emplacements']:,.0f}** emplacements")
+        with col2: st.info(f"**{totaux_stock['total_pallox']:,.0f}** pallox | **{totaux_stock['total_kg']/1000:,.1f}** T")
+        with col3: st.info(f"**{totaux_stock['nb_lots']:,.0f}** lots distincts")
+
+        try:
+            df_page, _, _ = show_grille_paginee("stock_complet", STOCK_GRILLE, filtres_stock,
+                                                ('code_lot_interne', 'ASC'), taille=100)
+        except Exception as e:
+            st.error(f"❌ Erreur stock complet : {str(e)}")
+            df_page = pd.DataFrame()
+
+        if not df_page.empty:
+            df_display = _typer_stock(df_page)
+            df_display['Tonnes']  = df_display['poids_total_kg'] / 1000
+            df_display['Calibre'] = df_display.apply(
+                lambda r: f"{int(r['calibre_min'])}-{int(r['calibre_max'])}"
+                if pd.notna(r['calibre_min']) and pd.notna(r['calibre_max']) else "", axis=1)
+            _LBL_STATUT = {"BRUT": "🟢 BRUT", "LAVE": "🧼 LAVÉ",
+                           "GREN_BRUTES": "🌾 Gren. brutes", "GREN_LAVEES": "✨ Gren. lavées"}
+            df_display['Statut']  = df_display['statut_lavage'].apply(
+                lambda s: _LBL_STATUT.get(_statut_bucket(s), s or ""))
+
+            st.dataframe(
+                df_display[['code_lot_interne','variete','producteur','site_stockage',
+                            'emplacement_stockage','nombre_unites','Tonnes','Statut','Calibre','age_jours']].rename(columns={
+                    'code_lot_interne':'Lot','variete':'Variété','producteur':'Producteur',
+                    'site_stockage':'Site','emplacement_stockage':'Emplacement',
+                    'nombre_unites':'Pallox','age_jours':'Âge (j)'}),
+                use_container_width=True, hide_index=True,
+                column_config={"Tonnes": st.column_config.NumberColumn(format="%.1f")}
+            )
         st.markdown("---")
-        col1, col2 = st.columns(2)
-        with col1:
-            st.download_button("📥 Exporter CSV", df_filtered.to_csv(index=False).encode('utf-8'),
-                f"stock_complet_{datetime.now().strftime('%Y%m%d')}.csv", "text/csv", use_container_width=True)
-        with col2:
-            buf = io.BytesIO()
-            with pd.ExcelWriter(buf, engine='openpyxl') as w: df_filtered.to_excel(w, index=False, sheet_name='Stock')
-            st.download_button("📥 Exporter Excel", buf.getvalue(),
-                f"stock_complet_{datetime.now().strftime('%Y%m%d')}.xlsx",
-                "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", use_container_width=True)
+        # Export complet chargé uniquement à la demande
+        if st.button("📦 Préparer l'export", key="btn_prepare_export_stock"):
+            df_filtered = get_stock_complet(filtres_stock).drop(columns=['statut_bucket'], errors='ignore')
+            col1, col2 = st.columns(2)
+            with col1:
+                st.download_button("📥 Exporter CSV", df_filtered.to_csv(index=False).encode('utf-8'),
+                    f"stock_complet_{datetime.now().strftime('%Y%m%d')}.csv", "text/csv", use_container_width=True)
+            with col2:
+                buf = io.BytesIO()
+                with pd.ExcelWriter(buf, engine='openpyxl') as w: df_filtered.to_excel(w, index=False, sheet_name='Stock')
+                st.download_button("📥 Exporter Excel", buf.getvalue(),
+                    f"stock_complet_{datetime.now().strftime('%Y%m%d')}.xlsx",
+                    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", use_container_width=True)
     else:
         st.warning("⚠️ Aucun stock trouvé")
 
@@ -1135,10 +1101,57 @@ with tab5:
 with tab_date:
     st.subheader("📅 Stock à une date donnée")
     st.caption(
-        "Reconstruction du stock à partir de l'état actuel, en annulant tous les mouvements "
-        "postérieurs à la date choisie. Les MODIFICATION sont reconstituées grâce au champ notes."
+        "Reconstruction du stock à partir de l'instantané le plus proche de la date choisie "
+        "(ou de l'état actuel), en rejouant uniquement les mouvements intermédiaires. "
+        "Les MODIFICATION sont rejouées via leurs deltas (delta_unites / delta_poids_kg)."
     )
 
+    # Instantané hebdomadaire automatique (au plus un par semaine)
+    try:
+        stock_historique.assurer_snapshot_recent(freq_jours=7)
+    except Exception as e:
+        st.warning(f"⚠️ Instantané de stock non créé : {e}")
+
+    if is_admin():
+        with st.expander("🗂️ Instantanés de stock (admin)"):
+            col_s1, col_s2, col_s3 = st.columns(3)
+            with col_s1:
+                if st.button("📸 Créer un instantané maintenant", key="btn_snapshot_stock"):
+                    try:
+                        snapshot_at, nb = stock_historique.creer_snapshot()
+                        st.success(f"✅ Instantané du {snapshot_at:%d/%m/%Y %H:%M} : {nb} emplacements")
+                    except Exception as e:
+                        st.error(f"❌ Erreur instantané : {str(e)}")
+            with col_s2:
+                if st.button("🔎 Vérifier la cohérence", key="btn_coherence_stock",
+                             help="Compare la reconstruction par instantané à l'annulation complète des mouvements"):
+                    try:
+                        date_verif = datetime.combine(
+                            st.session_state.get("stock_date_cible", datetime.today().date()),
+                            datetime.max.time()
+                        )
+                        res = stock_historique.verifier_coherence(date_verif)
+                        if res['nb_ecarts'] == 0:
+                            st.success(
+                                f"✅ {res['nb_emplacements']} emplacements identiques "
+                                f"({res['duree_snapshot_s']}s vs {res['duree_annulation_s']}s)"
+                            )
+                        else:
+                            st.warning(f"⚠️ {res['nb_ecarts']} écart(s) entre les deux méthodes")
+                            st.dataframe(res['ecarts'], use_container_width=True, hide_index=True)
+                    except Exception as e:
+                        st.error(f"❌ Erreur vérification : {str(e)}")
+            with col_s3:
+                if st.button("🧮 Reprendre les deltas MODIFICATION", key="btn_backfill_deltas",
+                             help="Remplit delta_unites / delta_poids_kg des anciennes MODIFICATION à partir des notes"):
+                    try:
+                        res = stock_historique.backfill_deltas_modification()
+                        st.success(f"✅ {res['remplies']} mouvement(s) repris sur {res['a_traiter']}")
+                        if res['non_resolues']:
+                            st.warning(f"⚠️ {res['non_resolues']} mouvement(s) non résolus (changement de type sans poids tracé)")
+                    except Exception as e:
+                        st.error(f"❌ Erreur reprise : {str(e)}")
+
     col_d1, col_d2 = st.columns([2, 3])
     with col_d1:
         date_cible = st.date_input("Date de référence", value=datetime.today().date(), key="stock_date_cible")
@@ -1156,8 +1169,8 @@ with tab_date:
         else:
             if nb_non_parsees > 0:
                 st.warning(
-                    f"⚠️ {nb_non_parsees} mouvement(s) MODIFICATION avec notes non parsables ont été ignorés. "
-                    "Ces mouvements correspondent à d'anciennes modifications dont le format notes diffère. "
+                    f"⚠️ {nb_non_parsees} mouvement(s) MODIFICATION sans delta ni notes parsables ont été ignorés. "
+                    "Ces mouvements correspondent à d'anciennes modifications (voir la reprise des deltas, admin). "
                     "Le stock affiché peut présenter de légères imprécisions sur les périodes concernées."
                 )
 
@@ -1215,6 +1228,48 @@ with tab_date:
                 f"stock_au_{date_cible.strftime('%Y%m%d')}.xlsx",
                 "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
 
+    # ----- Évolution sur une période (tous les points en une passe) -----
+    st.markdown("---")
+    st.subheader("📈 Évolution du stock")
+    col_e1, col_e2, col_e3, col_e4 = st.columns([2, 2, 1, 2])
+    with col_e1:
+        serie_debut = st.date_input("Du", value=datetime.today().date() - timedelta(days=365), key="serie_debut")
+    with col_e2:
+        serie_fin = st.date_input("Au", value=datetime.today().date(), key="serie_fin")
+    with col_e3:
+        serie_freq = st.selectbox("Pas", options=['W', 'D', 'M'], key="serie_freq",
+                                  format_func=lambda f: {'D': 'Jour', 'W': 'Semaine', 'M': 'Mois'}[f])
+    with col_e4:
+        serie_groupe = st.selectbox("Par", options=['site_stockage', 'code_variete', ''], key="serie_groupe",
+                                    format_func=lambda g: {'site_stockage': 'Site', 'code_variete': 'Variété', '': 'Total'}[g])
+
+    if st.button("📈 Tracer l'évolution", key="btn_stock_serie"):
+        if serie_debut >= serie_fin:
+            st.warning("⚠️ La date de début doit précéder la date de fin")
+        else:
+            with st.spinner("Calcul de la série..."):
+                try:
+                    df_serie, nb_non_parsees_serie = stock_historique.get_stock_series(
+                        serie_debut, serie_fin, freq=serie_freq,
+                        group_by=[serie_groupe] if serie_groupe else []
+                    )
+                except Exception as e:
+                    st.error(f"❌ Erreur évolution stock : {str(e)}")
+                    df_serie, nb_non_parsees_serie = pd.DataFrame(), 0
+
+            if df_serie.empty:
+                st.info("Aucun stock sur la période")
+            else:
+                if nb_non_parsees_serie > 0:
+                    st.warning(f"⚠️ {nb_non_parsees_serie} mouvement(s) MODIFICATION sans delta ignorés")
+                fig = px.area(
+                    df_serie, x='date', y='tonnage', color=serie_groupe or None,
+                    labels={'date': 'Date', 'tonnage': 'Stock (t)',
+                            'site_stockage': 'Site', 'code_variete': 'Variété'}
+                )
+                fig.update_layout(height=420, margin=dict(l=10, r=10, t=30, b=10))
+                st.plotly_chart(fig, use_container_width=True)
+
 # ============================================================
 # ONGLET 7 : MAJ EN MASSE
 # ============================================================
@@ -4,6 +4,8 @@ import numpy as np
 from datetime import datetime, date, timedelta
 from database import get_connection
 from components import show_footer
+from utils.stock_pf import (init_grand_livre, maj_semaine, maj_stock_lot,
+                             reconstruire_grand_livre, get_disponibilites)
 from auth import require_access
 import plotly.express as px
 import plotly.graph_objects as go
@@ -287,9 +289,9 @@ def get_evolution_stock(nb_semaines=12):
             WITH cumul AS (
                 SELECT 
                     annee, semaine,
-                    SUM(quantite_tonnes) as mvt_semaine,
-                    SUM(SUM(quantite_tonnes)) OVER (ORDER BY annee, semaine) as stock_cumule
-                FROM mouvements_produits_finis
+                    SUM(entrees_t - sorties_t) as mvt_semaine,
+                    SUM(SUM(entrees_t - sorties_t)) OVER (ORDER BY annee, semaine) as stock_cumule
+                FROM pf_stock_hebdo
                 GROUP BY annee, semaine
             )
             SELECT * FROM cumul ORDER BY annee DESC, semaine DESC LIMIT %s
@@ -494,6 +496,8 @@ def convertir_reservation_en_sortie(reservation_id, username):
               -abs(float(r['quantite_tonnes'])) * 1000,
               r['date_production'], r['reference_commande'],
               r['client'], f"Depuis réservation #{reservation_id}", username))
+        maj_semaine(cur, r['code_produit_commercial'], r['sur_emballage_id'], iso[0], iso[1])
+        maj_stock_lot(cur, r['code_produit_commercial'], r['date_production'], r['sur_emballage_id'])
         # Marquer convertie
         cur.execute("""
             UPDATE pf_reservations
@@ -513,18 +517,18 @@ def get_stats_rotation(nb_semaines=8):
         conn = get_connection(); cur = conn.cursor()
         cur.execute("""
             SELECT
-                m.code_produit_commercial,
+                h.code_produit_commercial,
                 COALESCE(pc.marque,'') as marque,
-                COALESCE(pc.libelle, m.code_produit_commercial) as libelle,
-                SUM(m.quantite_tonnes) FILTER (WHERE m.quantite_tonnes > 0) as entrees_t,
-                ABS(SUM(m.quantite_tonnes) FILTER (WHERE m.quantite_tonnes < 0)) as sorties_t,
-                COUNT(DISTINCT CASE WHEN m.quantite_tonnes < 0 THEN m.date_mouvement END) as nb_jours_sortie,
-                MIN(m.date_mouvement) FILTER (WHERE m.quantite_tonnes > 0) as premiere_entree,
-                MAX(m.date_mouvement) FILTER (WHERE m.quantite_tonnes < 0) as derniere_sortie
-            FROM mouvements_produits_finis m
-            LEFT JOIN ref_produits_commerciaux pc ON pc.code_produit = m.code_produit_commercial
-            WHERE m.date_mouvement >= CURRENT_DATE - (%s * 7)
-            GROUP BY m.code_produit_commercial, pc.marque, pc.libelle
+                COALESCE(pc.libelle, h.code_produit_commercial) as libelle,
+                NULLIF(SUM(h.entrees_t), 0) as entrees_t,
+                NULLIF(SUM(h.sorties_t), 0) as sorties_t,
+                SUM(h.nb_jours_sortie) as nb_jours_sortie,
+                MIN(h.premiere_entree) as premiere_entree,
+                MAX(h.derniere_sortie) as derniere_sortie
+            FROM pf_stock_hebdo h
+            LEFT JOIN ref_produits_commerciaux pc ON pc.code_produit = h.code_produit_commercial
+            WHERE h.semaine_debut > CURRENT_DATE - (%s * 7)
+            GROUP BY h.code_produit_commercial, pc.marque, pc.libelle
             ORDER BY sorties_t DESC NULLS LAST
         """, (nb_semaines,))
         rows = cur.fetchall(); cur.close(); conn.close()
@@ -546,17 +550,30 @@ def get_alertes_stock_faible(seuil_t=1.0):
     try:
         conn = get_connection(); cur = conn.cursor()
         cur.execute("""
+            WITH dernieres AS (
+                -- Clôture de la dernière semaine connue = stock actuel du produit / sur-emballage
+                SELECT DISTINCT ON (code_produit_commercial, sur_emballage_id)
+                    code_produit_commercial, cloture_t
+                FROM pf_stock_hebdo
+                ORDER BY code_produit_commercial, sur_emballage_id, annee DESC, semaine DESC
+            ),
+            sorties AS (
+                SELECT code_produit_commercial, MAX(derniere_sortie) as derniere_sortie
+                FROM pf_stock_hebdo
+                GROUP BY code_produit_commercial
+            )
             SELECT
-                m.code_produit_commercial,
+                d.code_produit_commercial,
                 COALESCE(pc.marque,'') as marque,
-                COALESCE(pc.libelle, m.code_produit_commercial) as libelle,
-                ROUND(SUM(m.quantite_tonnes)::numeric, 4) as stock_t,
-                MAX(m.date_mouvement) FILTER (WHERE m.quantite_tonnes < 0) as derniere_sortie
-            FROM mouvements_produits_finis m
-            LEFT JOIN ref_produits_commerciaux pc ON pc.code_produit = m.code_produit_commercial
-            GROUP BY m.code_produit_commercial, pc.marque, pc.libelle
-            HAVING ROUND(SUM(m.quantite_tonnes)::numeric, 4) > 0
-               AND ROUND(SUM(m.quantite_tonnes)::numeric, 4) < %s
+                COALESCE(pc.libelle, d.code_produit_commercial) as libelle,
+                ROUND(SUM(d.cloture_t)::numeric, 4) as stock_t,
+                MAX(s.derniere_sortie) as derniere_sortie
+            FROM dernieres d
+            LEFT JOIN sorties s ON s.code_produit_commercial = d.code_produit_commercial
+            LEFT JOIN ref_produits_commerciaux pc ON pc.code_produit = d.code_produit_commercial
+            GROUP BY d.code_produit_commercial, pc.marque, pc.libelle
+            HAVING ROUND(SUM(d.cloture_t)::numeric, 4) > 0
+               AND ROUND(SUM(d.cloture_t)::numeric, 4) < %s
             ORDER BY stock_t ASC
         """, (seuil_t,))
         rows = cur.fetchall(); cur.close(); conn.close()
@@ -574,11 +591,11 @@ def get_evolution_par_produit(nb_semaines=12):
                 code_produit_commercial,
                 annee, semaine,
                 CONCAT(annee, '-S', LPAD(semaine::text, 2, '0')) as semaine_label,
-                SUM(quantite_tonnes) FILTER (WHERE quantite_tonnes > 0) as entrees,
-                ABS(SUM(quantite_tonnes) FILTER (WHERE quantite_tonnes < 0)) as sorties,
-                SUM(quantite_tonnes) as mvt_net
-            FROM mouvements_produits_finis
-            WHERE date_mouvement >= CURRENT_DATE - (%s * 7)
+                NULLIF(SUM(entrees_t), 0) as entrees,
+                NULLIF(SUM(sorties_t), 0) as sorties,
+                SUM(entrees_t - sorties_t) as mvt_net
+            FROM pf_stock_hebdo
+            WHERE semaine_debut > CURRENT_DATE - (%s * 7)
             GROUP BY code_produit_commercial, annee, semaine
             ORDER BY code_produit_commercial, annee, semaine
         """, (nb_semaines,))
@@ -588,42 +605,25 @@ def get_evolution_par_produit(nb_semaines=12):
         return pd.DataFrame()
 
 
-
-def get_stock_disponible(code_produit, date_production=None, sur_emballage_id=None):
-    """Retourne le stock disponible (réel - réservations actives) pour un produit/lot."""
+def ajouter_disponibilite(df_stock):
+    """Ajoute stock_reserve_t / stock_disponible au stock par lot (une requête pour toute la liste)."""
+    df_stock = df_stock.copy()
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        # Stock réel
-        if date_production:
-            cursor.execute("""
-                SELECT COALESCE(ROUND(SUM(quantite_tonnes)::numeric, 6), 0) as stock
-                FROM mouvements_produits_finis
-                WHERE code_produit_commercial = %s
-                  AND date_production = %s
-                  AND (%s IS NULL OR sur_emballage_id = %s)
-            """, (code_produit, date_production, sur_emballage_id, sur_emballage_id))
-        else:
-            cursor.execute("""
-                SELECT COALESCE(ROUND(SUM(quantite_tonnes)::numeric, 6), 0) as stock
-                FROM mouvements_produits_finis
-                WHERE code_produit_commercial = %s
-            """, (code_produit,))
-        stock_reel = float(cursor.fetchone()['stock'])
-        # Réservations actives (non expirées, non converties)
-        cursor.execute("""
-            SELECT COALESCE(SUM(quantite_tonnes), 0) as reserv
-            FROM pf_reservations
-            WHERE code_produit_commercial = %s
-              AND statut = 'ACTIVE'
-              AND expire_at > NOW()
-              AND (%s IS NULL OR date_production = %s)
-        """, (code_produit, date_production, date_production))
-        stock_reserve = float(cursor.fetchone()['reserv'])
-        cursor.close(); conn.close()
-        return round(stock_reel - stock_reserve, 6)
+        dispo = get_disponibilites(df_stock['code_produit_commercial'].dropna().unique().tolist())
     except Exception:
-        return None
+        dispo = pd.DataFrame()
+    if dispo.empty:
+        df_stock['stock_reserve_t'] = 0.0
+    else:
+        dispo['_se'] = pd.to_numeric(dispo['sur_emballage_id'], errors='coerce').fillna(0).astype(int)
+        df_stock['_se'] = pd.to_numeric(df_stock['sur_emballage_id'], errors='coerce').fillna(0).astype(int)
+        df_stock = df_stock.merge(
+            dispo[['code_produit_commercial', 'date_production', '_se', 'reserve_t']],
+            on=['code_produit_commercial', 'date_production', '_se'], how='left'
+        ).drop(columns=['_se'])
+        df_stock['stock_reserve_t'] = df_stock.pop('reserve_t').fillna(0.0)
+    df_stock['stock_disponible'] = (df_stock['stock_tonnes'] - df_stock['stock_reserve_t']).round(6)
+    return df_stock
 
 
 def ajouter_mouvement(code_produit, type_mouvement, date_mouvement,
@@ -671,6 +671,9 @@ def ajouter_mouvement(code_produit, type_mouvement, date_mouvement,
         ))
         
         new_id = cursor.fetchone()['id']
+        # Grand livre hebdo tenu dans la même transaction
+        maj_semaine(cursor, code_produit, sur_emballage_id, iso[0], iso[1])
+        maj_stock_lot(cursor, code_produit, date_production, sur_emballage_id)
         conn.commit()
         cursor.close()
         conn.close()
@@ -687,13 +690,21 @@ def supprimer_mouvement(mouvement_id):
     try:
         conn = get_connection()
         cursor = conn.cursor()
-        cursor.execute("SELECT id FROM mouvements_produits_finis WHERE id = %s", (mouvement_id,))
-        if not cursor.fetchone():
+        cursor.execute("""
+            SELECT id, code_produit_commercial, sur_emballage_id, annee, semaine, date_production
+            FROM mouvements_produits_finis WHERE id = %s
+        """, (mouvement_id,))
+        mvt = cursor.fetchone()
+        if not mvt:
             cursor.close()
             conn.close()
             return False, "Mouvement introuvable"
         
         cursor.execute("DELETE FROM mouvements_produits_finis WHERE id = %s", (mouvement_id,))
+        maj_semaine(cursor, mvt['code_produit_commercial'], mvt['sur_emballage_id'],
+                    mvt['annee'], mvt['semaine'])
+        maj_stock_lot(cursor, mvt['code_produit_commercial'], mvt['date_production'],
+                      mvt['sur_emballage_id'])
         conn.commit()
         cursor.close()
         conn.close()
@@ -744,6 +755,10 @@ st.markdown("---")
 
 # Initialiser la table réservations si besoin
 init_reservations_table()
+try:
+    init_grand_livre()
+except Exception as e:
+    st.error(f"❌ Erreur grand livre produits finis : {str(e)}")
 
 tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs([
     "📊 Stock Actuel", "📋 Historique", "📥 Entrée en Stock",
@@ -760,6 +775,9 @@ with tab1:
     df_stock = get_stock_actuel()
     
     if not df_stock.empty:
+        # Réservé / disponible de toute la liste en une requête
+        df_stock = ajouter_disponibilite(df_stock)
+        
         # Compteurs fraîcheur (neutre, juste les chiffres)
         if 'age_jours' in df_stock.columns:
             sp = df_stock[df_stock['stock_tonnes'] > 0]
@@ -892,8 +910,8 @@ with tab1:
                        f"Stock actuel : **{stock_se} {se_lib_sel}(s)** / {stock_uvc} UVC / {stock_t:.3f} T")
             
             # Stock disponible réel (stock - réservations actives)
-            stock_dispo_t = get_stock_disponible(code_sel, date_prod_sel, int(se_id_sel) if se_id_sel else None)
-            stock_reserve_t = round(stock_t - (stock_dispo_t or stock_t), 6)
+            stock_dispo_t = float(sel_row.get('stock_disponible', stock_t))
+            stock_reserve_t = round(float(sel_row.get('stock_reserve_t', 0)), 6)
             if stock_reserve_t > 0:
                 st.info(f"⚠️ Stock réservé : **{stock_reserve_t:.3f} T** — Stock disponible réel : **{stock_dispo_t:.3f} T**")
 
@@ -1370,6 +1388,15 @@ with tab6:
                 use_container_width=True, hide_index=True)
     else:
         st.info("📭 Pas assez de données pour le graphique")
+    
+    st.caption("Graphiques calculés sur le grand livre hebdomadaire (pf_stock_hebdo), tenu à jour à chaque mouvement.")
+    if st.button("🔄 Reconstruire le grand livre", key="btn_rebuild_grand_livre"):
+        try:
+            nb = reconstruire_grand_livre()
+            st.success(f"✅ Grand livre reconstruit ({nb} semaine(s) produit)")
+            st.rerun()
+        except Exception as e:
+            st.error(f"❌ Erreur reconstruction : {str(e)}")
 
 
 # ============================================================================
@@ -1437,7 +1464,7 @@ with tab4:
         if df_stock_r.empty:
             st.warning("Aucun stock disponible.")
         else:
-            df_stock_r = df_stock_r[df_stock_r['stock_tonnes'] > 0]
+            df_stock_r = ajouter_disponibilite(df_stock_r[df_stock_r['stock_tonnes'] > 0])
 
             ra1, ra2 = st.columns(2)
             with ra1:
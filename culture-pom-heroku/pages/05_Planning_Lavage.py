@@ -3,7 +3,10 @@ import streamlit.components.v1 as stc
 import pandas as pd
 from datetime import datetime, timedelta, time
 from database import get_connection
-from components import show_footer
+from components import show_footer, show_capacite_heatmap
+from utils.capacite import get_capacite_horizon, index_capacite, capacites_inconnues, NIVEAU_CAPACITE_INCONNUE
+from utils.cache_tables import invalider_tables
+from utils.synthese_previsions import marquer_synthese_a_recalculer
 from auth import require_access
 from auth.roles import is_admin
 import io
@@ -419,27 +422,6 @@ def get_horaire_fin_jour(jour_semaine, horaires_config):
             return h_fin
     return time(23, 59)
 
-def get_capacite_jour(ligne_code, capacite_th, jour_semaine, horaires_config):
-    """Calcule la capacité totale en heures pour un jour donné.
-    
-    Plage par défaut 00:00 → 23:59 = ~24h (cohérent avec 3 équipes).
-    """
-    if jour_semaine not in horaires_config:
-        return 24.0
-    h_debut = horaires_config[jour_semaine]['debut']
-    h_fin = horaires_config[jour_semaine]['fin']
-    debut_h = h_debut.hour + h_debut.minute / 60 if isinstance(h_debut, time) else 0.0
-    fin_h = h_fin.hour + h_fin.minute / 60 if isinstance(h_fin, time) else 23.983
-    return fin_h - debut_h
-
-def calculer_temps_utilise(planning_df, date_str, ligne):
-    """Calcule le temps utilisé pour un jour/ligne"""
-    if planning_df.empty:
-        return 0.0
-    mask = (planning_df['date_prevue'].astype(str) == date_str) & (planning_df['ligne_lavage'] == ligne)
-    filtered = planning_df[mask]
-    return filtered['duree_minutes'].sum() / 60 if not filtered.empty else 0.0
-
 def trouver_prochain_creneau_libre(planning_df, date_cible, ligne, heure_souhaitee, duree_min):
     """
     Trouve le prochain créneau disponible pour placer un élément.
@@ -1839,6 +1821,8 @@ def terminer_job(job_id,
         conn.commit()
         cursor.close()
         conn.close()
+        invalider_tables('stock_emplacements')
+        marquer_synthese_a_recalculer('stock_emplacements')
         
         temps_str = f"{temps_reel_minutes // 60}h{temps_reel_minutes % 60:02d}" if temps_reel_minutes else "N/A"
         nb_lots_str = f" ({len(lots_fille)} lots)" if is_multi_lot else ""
@@ -3194,6 +3178,8 @@ def annuler_job_termine(job_id):
         conn.commit()
         cursor.close()
         conn.close()
+        invalider_tables('stock_emplacements')
+        marquer_synthese_a_recalculer('stock_emplacements')
         return True, f"✅ Job annulé - Stock {statut_source} restauré (+{quantite_pallox} pallox)"
     except Exception as e:
         if 'conn' in locals():
@@ -3529,6 +3515,8 @@ def corriger_job_termine(job_id):
         conn.commit()
         cursor.close()
         conn.close()
+        invalider_tables('stock_emplacements')
+        marquer_synthese_a_recalculer('stock_emplacements')
         return True, (f"✅ Job #{job_id} rouvert pour correction — stock source restauré. "
                       f"Il est repassé EN_COURS : re-saisis les résultats puis valide la terminaison.")
     except Exception as e:
@@ -3676,6 +3664,11 @@ with tab1:
     horaires_config = get_config_horaires()
     planning_df = get_planning_semaine(annee, semaine)
     lignes_dict = {l['code']: float(l['capacite_th']) for l in lignes} if lignes else {'LIGNE_1': 13.0, 'LIGNE_2': 6.0}
+    try:
+        capacite_semaine = index_capacite(get_capacite_horizon('LAVAGE', week_start, nb_semaines=1))
+    except Exception as e:
+        st.error(f"❌ Erreur capacité : {str(e)}")
+        capacite_semaine = {}
     
     # ============================================================
     # ⭐ BLOC VISUALISATION JOB TERMINÉ PLEINE LARGEUR (lecture seule)
@@ -5266,12 +5259,18 @@ with tab1:
                 # Capacités
                 cap_html = ""
                 for lc in sorted(lignes_dict.keys()):
-                    cap_tot = get_capacite_jour(lc, lignes_dict[lc], i, horaires_config)
-                    temps_ut = calculer_temps_utilise(planning_df, jour_str, lc)
-                    temps_di = max(0, cap_tot - temps_ut)
-                    charge = (temps_ut / cap_tot * 100) if cap_tot > 0 else 0
+                    capa = capacite_semaine.get((lc, jour_str))
+                    if not capa or not capa['capacite_connue']:
+                        cap_html += f"<div><strong>{lc.replace('LIGNE_','L')}</strong>: {NIVEAU_CAPACITE_INCONNUE} capacité inconnue</div>"
+                        continue
+                    temps_di = capa['disponible_h']
+                    charge = capa['charge_pct']
                     emoji = "🟢" if charge < 50 else "🟡" if charge < 80 else "🔴"
                     cap_html += f"<div><strong>{lc.replace('LIGNE_','L')}</strong>: {temps_di:.1f}h {emoji}</div>"
+                for lc, planifie_h in capacites_inconnues(capacite_semaine, jour_str):
+                    if lc in lignes_dict:
+                        continue
+                    cap_html += f"<div><strong>{lc.replace('LIGNE_','L')}</strong>: {planifie_h:.1f}h planifiées {NIVEAU_CAPACITE_INCONNUE}</div>"
                 st.markdown(f"""<div class="capacity-box">{cap_html}</div>""", unsafe_allow_html=True)
                 
                 # Éléments planifiés
@@ -5627,6 +5626,9 @@ with tab1:
             total_l2 = planning_df[planning_df['ligne_lavage'] == 'LIGNE_2']['duree_minutes'].sum() / 60
             st.markdown(f"**📊** L1={total_l1:.1f}h | L2={total_l2:.1f}h")
 
+    with st.expander("🔥 Charge multi-semaines (heatmap)"):
+        show_capacite_heatmap('LAVAGE', week_start, key_prefix="capa_lavage")
+
 # ============================================================
 # ONGLET 2 : LISTE JOBS
 # ============================================================
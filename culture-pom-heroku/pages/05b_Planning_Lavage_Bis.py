@@ -5,7 +5,7 @@ from datetime import datetime, date, timedelta
 
 from auth import require_access
 from database import get_connection
-from streamlit_calendar import fullcalendar_component
+from streamlit_fullcalendar import fullcalendar, get_visible_range, consume_event, invalidate_events
 
 
 st.set_page_config(
@@ -75,9 +75,9 @@ def get_jobs_non_planifies(ligne_code):
         return pd.DataFrame()
 
 
-def get_planning_elements(ligne_code, week_start):
+def get_planning_elements(ligne_code, date_debut, date_fin):
+    """Éléments planifiés sur [date_debut, date_fin[ (plage visible du calendrier)."""
     try:
-        week_end = week_start + timedelta(days=6)
         conn = get_connection()
         cursor = conn.cursor()
         cursor.execute("""
@@ -90,10 +90,10 @@ def get_planning_elements(ligne_code, week_start):
             FROM lavages_planning_elements pe
             LEFT JOIN lavages_jobs j ON pe.job_id = j.id
             LEFT JOIN lavages_temps_customs tc ON pe.temps_custom_id = tc.id
-            WHERE pe.date_prevue BETWEEN %s AND %s
+            WHERE pe.date_prevue >= %s AND pe.date_prevue < %s
               AND pe.ligne_lavage = %s
             ORDER BY pe.date_prevue, pe.heure_debut
-        """, (week_start, week_end, ligne_code))
+        """, (date_debut, date_fin, ligne_code))
         rows = cursor.fetchall()
         cursor.close()
         conn.close()
@@ -272,11 +272,12 @@ def has_conflict(cursor, ligne_lavage, date_prevue, heure_debut, heure_fin, excl
 
 
 def build_calendar_events(planning_df):
+    """Événements FullCalendar de la fenêtre chargée (le composant n'envoie que le delta)."""
     events = []
     if planning_df.empty:
         return events
 
-    for _, row in planning_df.iterrows():
+    for row in planning_df.to_dict('records'):
         date_prevue = row['date_prevue']
         heure_debut = row['heure_debut']
         heure_fin = row['heure_fin']
@@ -340,7 +341,47 @@ with col_info:
     week_start_default = today - timedelta(days=today.weekday())
     week_start = st.date_input("Semaine du", value=week_start_default)
 
-planning_df = get_planning_elements(selected_line, week_start)
+# ------------------------------------------------------------
+# Événement calendrier traité AVANT le chargement : l'écriture en base est
+# incluse dans le delta envoyé au navigateur lors de ce même rerun.
+# ------------------------------------------------------------
+calendar_key = f"calendar_lavage_bis_{selected_line}"
+calendar_event = consume_event(calendar_key)
+calendar_message = None
+
+if isinstance(calendar_event, dict):
+    event_type = calendar_event.get("type")
+
+    if event_type == "external_drop":
+        job_id = calendar_event.get("job_id")
+        start_dt = parse_iso_datetime(calendar_event.get("start"))
+        end_dt = parse_iso_datetime(calendar_event.get("end"))
+        duree_minutes = calendar_event.get("duree_minutes")
+
+        if not end_dt and start_dt:
+            end_dt = start_dt + timedelta(minutes=int(duree_minutes or 60))
+
+        if job_id and start_dt and end_dt:
+            calendar_message = insert_planning_element(
+                job_id=job_id,
+                ligne_lavage=selected_line,
+                start_dt=start_dt,
+                end_dt=end_dt,
+                duree_minutes=int(duree_minutes or (end_dt - start_dt).total_seconds() / 60)
+            )
+
+    if event_type in {"drop", "resize"}:
+        planning_element_id = calendar_event.get("planning_id") or calendar_event.get("event_id")
+        start_dt = parse_iso_datetime(calendar_event.get("new_start"))
+        end_dt = parse_iso_datetime(calendar_event.get("new_end"))
+        if planning_element_id and start_dt and end_dt:
+            calendar_message = update_planning_element(int(planning_element_id), start_dt, end_dt)
+            if not calendar_message[0]:
+                # Refusé en base : renvoyer la position enregistrée au navigateur
+                invalidate_events(calendar_key, [calendar_event.get("event_id")])
+
+visible_start, visible_end = get_visible_range(calendar_key, initial_date=week_start)
+planning_df = get_planning_elements(selected_line, visible_start, visible_end)
 jobs_df = get_jobs_non_planifies(selected_line)
 
 col_jobs, col_calendar = st.columns([1, 2])
@@ -424,49 +465,19 @@ with col_jobs:
 
 with col_calendar:
     st.subheader("📅 Calendrier Lavage")
-    calendar_event = fullcalendar_component(
+    if calendar_message:
+        ok, msg = calendar_message
+        if ok:
+            st.success(msg)
+        else:
+            st.error(msg)
+
+    fullcalendar(
         events=build_calendar_events(planning_df),
+        window=(visible_start, visible_end),
+        initial_date=str(week_start),
         editable=True,
         droppable=True,
         height=650,
-        initial_date=str(week_start),
-        key=f"calendar_lavage_bis_{selected_line}"
+        key=calendar_key
     )
-
-    if isinstance(calendar_event, dict):
-        event_type = calendar_event.get("type")
-
-        if event_type == "external_drop":
-            job_id = calendar_event.get("job_id")
-            start_dt = parse_iso_datetime(calendar_event.get("start"))
-            end_dt = parse_iso_datetime(calendar_event.get("end"))
-            duree_minutes = calendar_event.get("duree_minutes")
-
-            if not end_dt and start_dt:
-                end_dt = start_dt + timedelta(minutes=int(duree_minutes or 60))
-
-            if job_id and start_dt and end_dt:
-                ok, msg = insert_planning_element(
-                    job_id=job_id,
-                    ligne_lavage=selected_line,
-                    start_dt=start_dt,
-                    end_dt=end_dt,
-                    duree_minutes=int(duree_minutes or (end_dt - start_dt).total_seconds() / 60)
-                )
-                if ok:
-                    st.success(msg)
-                    st.rerun()
-                else:
-                    st.error(msg)
-
-        if event_type in {"drop", "resize"}:
-            planning_element_id = calendar_event.get("job_id")
-            start_dt = parse_iso_datetime(calendar_event.get("new_start"))
-            end_dt = parse_iso_datetime(calendar_event.get("new_end"))
-            if planning_element_id and start_dt and end_dt:
-                ok, msg = update_planning_element(planning_element_id, start_dt, end_dt)
-                if ok:
-                    st.success(msg)
-                    st.rerun()
-                else:
-                    st.error(msg)
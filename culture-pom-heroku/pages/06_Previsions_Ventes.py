@@ -5,6 +5,13 @@ from datetime import datetime, timedelta
 from database import get_connection
 from components import show_footer
 from auth import require_access
+from utils.previsions import (
+    decaler_semaine, semaine_de_index, matrice_previsions, charger_matrice,
+    moyennes_precedentes, tendances, evolution_marques
+)
+from utils.modeles_prevision import ajuster_modeles, get_suggestions, get_rapport_backtest, MODELES
+from utils.cache_tables import invalider_tables
+from utils.synthese_previsions import marquer_synthese_a_recalculer
 import plotly.express as px
 import plotly.graph_objects as go
 
@@ -72,14 +79,8 @@ def get_semaine_courante_et_editables():
     semaine_actuelle, annee_actuelle = get_semaine_actuelle()
     semaine_courante = (annee_actuelle, semaine_actuelle)
 
-    semaines_editables = []
-    for i in range(1, 6):  # S+1 à S+5
-        sem = semaine_actuelle + i
-        annee = annee_actuelle
-        if sem > 52:
-            sem = sem - 52
-            annee = annee + 1
-        semaines_editables.append((annee, sem))
+    # S+1 à S+5 (années ISO de 52 ou 53 semaines)
+    semaines_editables = [decaler_semaine(annee_actuelle, semaine_actuelle, i) for i in range(1, 6)]
 
     return semaine_courante, semaines_editables
 
@@ -147,77 +148,24 @@ def get_moyenne_3_semaines_precedentes(semaines_cibles):
     Pour chaque semaine cible, calcule la moyenne des quantités réelles
     des 3 semaines précédentes (depuis la base), par produit.
 
+    Une seule requête sur la plage utile, puis fenêtre glissante vectorisée
+    sur la matrice produit × semaine ISO.
+
     Retourne un dict :
       { (annee, sem) : { code_produit : moyenne_float } }
     """
     if not semaines_cibles:
         return {}
 
-    # Collecter toutes les semaines précédentes nécessaires
-    semaines_a_chercher = set()
-    for (annee, sem) in semaines_cibles:
-        for i in range(1, 4):  # 3 semaines précédentes
-            s = sem - i
-            a = annee
-            if s <= 0:
-                s = s + 52
-                a = a - 1
-            semaines_a_chercher.add((a, s))
-
-    if not semaines_a_chercher:
-        return {}
-
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-
-        semaines_list = list(semaines_a_chercher)
-        conditions = " OR ".join(["(annee = %s AND semaine = %s)" for _ in semaines_list])
-        params = [val for a, s in semaines_list for val in (a, s)]
-
-        cursor.execute(f"""
-            SELECT code_produit_commercial, annee, semaine, quantite_prevue_tonnes
-            FROM previsions_ventes
-            WHERE {conditions}
-        """, params)
-        rows = cursor.fetchall()
-        cursor.close()
-        conn.close()
+        premiere = decaler_semaine(*min(semaines_cibles), -3)
+        derniere = decaler_semaine(*max(semaines_cibles), -1)
+        matrice, _ = charger_matrice(premiere, derniere)
     except Exception as e:
         st.error(f"❌ Erreur calcul estimations : {str(e)}")
         return {}
 
-    if not rows:
-        return {}
-
-    df_hist = pd.DataFrame(rows)
-
-    result = {}
-    for (annee, sem) in semaines_cibles:
-        moyennes_produit = {}
-        # Les 3 semaines précédentes de cette semaine cible
-        semaines_prec = []
-        for i in range(1, 4):
-            s = sem - i
-            a = annee
-            if s <= 0:
-                s = s + 52
-                a = a - 1
-            semaines_prec.append((a, s))
-
-        # Filtrer l'historique sur ces 3 semaines
-        mask = pd.Series([False] * len(df_hist))
-        for (a, s) in semaines_prec:
-            mask = mask | ((df_hist['annee'] == a) & (df_hist['semaine'] == s))
-        df_prec = df_hist[mask]
-
-        if not df_prec.empty:
-            for code_produit, grp in df_prec.groupby('code_produit_commercial'):
-                moyennes_produit[code_produit] = float(grp['quantite_prevue_tonnes'].mean())
-
-        result[(annee, sem)] = moyennes_produit
-
-    return result
+    return moyennes_precedentes(matrice, semaines_cibles, fenetre=3)
 
 
 def get_previsions_historique_complet():
@@ -288,6 +236,8 @@ def save_previsions(df_previsions):
         conn.commit()
         cursor.close()
         conn.close()
+        invalider_tables('previsions_ventes')
+        marquer_synthese_a_recalculer('previsions_ventes')
 
         return True, f"✅ Enregistré : {updated} mis à jour, {inserted} créés"
     except Exception as e:
@@ -296,40 +246,28 @@ def save_previsions(df_previsions):
         return False, f"❌ Erreur : {str(e)}"
 
 
-def calculer_tendance_produit(df_hist, code_produit):
-    """Calcule la tendance d'évolution pour un produit (moyenne des variations)"""
-    df_prod = df_hist[df_hist['code_produit_commercial'] == code_produit].copy()
-
-    if len(df_prod) < 2:
-        return None, "Données insuffisantes"
-
-    df_prod = df_prod.sort_values(['annee', 'semaine'])
-    df_prod['variation'] = df_prod['quantite_prevue_tonnes'].diff()
-    variations = df_prod['variation'].dropna()
-
-    if len(variations) == 0:
-        return None, "Pas de variation"
-
-    variation_moyenne = variations.mean()
-    variation_pct = (variation_moyenne / df_prod['quantite_prevue_tonnes'].mean() * 100) if df_prod['quantite_prevue_tonnes'].mean() > 0 else 0
+@st.cache_data(ttl=3600, show_spinner="🤖 Mise à jour des modèles de prévision...")
+def get_suggestions_modele(semaines):
+    """Prévisions statistiques (modèles avancés sur les nouvelles semaines si besoin)"""
+    ajuster_modeles()
+    return get_suggestions(list(semaines))
 
-    return variation_moyenne, variation_pct
 
+def calculer_tendance_produit(df_tendances, code_produit):
+    """Tendance d'évolution d'un produit (moyenne des variations), lue dans tendances() calculées pour tous"""
+    if code_produit not in df_tendances.index:
+        return None, "Données insuffisantes"
 
-def get_evolution_marque(df_hist, marque):
-    """Agrège l'évolution par marque"""
-    df_marque = df_hist[df_hist['marque'] == marque].copy()
-
-    if df_marque.empty:
-        return pd.DataFrame()
+    tendance = df_tendances.loc[code_produit]
+    if pd.isna(tendance['variation_moyenne']):
+        return None, "Données insuffisantes"
 
-    df_agg = df_marque.groupby(['annee', 'semaine']).agg({
-        'quantite_prevue_tonnes': 'sum'
-    }).reset_index()
+    return float(tendance['variation_moyenne']), float(tendance['variation_pct'])
 
-    df_agg['semaine_label'] = df_agg.apply(lambda r: f"S{int(r['semaine']):02d}/{int(r['annee'])}", axis=1)
 
-    return df_agg
+def get_evolution_marque(df_evolution, marque):
+    """Évolution d'une marque, lue dans evolution_marques() calculée pour toutes"""
+    return df_evolution[df_evolution['marque'] == marque].reset_index(drop=True)
 
 
 # ==========================================
@@ -356,6 +294,13 @@ previsions_editables = get_previsions(semaines_editables)
 # Calcul des estimations (moyenne 3 semaines précédentes) pour les semaines éditables sans valeur
 estimations = get_moyenne_3_semaines_precedentes(semaines_editables)
 
+# Suggestions du modèle statistique pour les mêmes semaines
+try:
+    suggestions_modele = get_suggestions_modele(tuple(semaines_editables))
+except Exception as e:
+    st.error(f"❌ Erreur modèle statistique : {str(e)}")
+    suggestions_modele = {}
+
 # ==========================================
 # KPIs
 # ==========================================
@@ -396,11 +341,12 @@ st.markdown("---")
 # ONGLETS
 # ==========================================
 
-tab1, tab2, tab3, tab4 = st.tabs([
+tab1, tab2, tab3, tab4, tab5 = st.tabs([
     "📝 Saisie (S en cours + 5 semaines)",
     "📊 Vue consolidée",
     "📈 Statistiques",
-    "📜 Historique"
+    "📜 Historique",
+    "🤖 Modèle statistique"
 ])
 
 # ==========================================
@@ -435,10 +381,21 @@ with tab1:
 
         st.markdown("---")
 
+        # Source des estimations pré-remplies
+        source_estimation = st.radio(
+            "Estimations pré-remplies",
+            ["🤖 Modèle statistique", "📊 Moyenne 3 semaines"],
+            horizontal=True,
+            key="source_estimation",
+            help="Modèle statistique : meilleur modèle par produit sur les expéditions (voir onglet 🤖)"
+        )
+        if source_estimation == "🤖 Modèle statistique" and any(suggestions_modele.values()):
+            estimations = suggestions_modele
+
         # Légende estimation
         st.markdown("""
         <div class="estimation-legend">
-            <strong>~ Estimation</strong> : valeur pré-remplie automatiquement (moyenne des 3 semaines précédentes en base).
+            <strong>~ Estimation</strong> : valeur pré-remplie automatiquement (modèle statistique ou moyenne des 3 semaines précédentes).
             Modifiez-la puis enregistrez pour qu'elle devienne une prévision confirmée (le ~ disparaîtra).
         </div>
         """, unsafe_allow_html=True)
@@ -545,7 +502,7 @@ with tab1:
             label = labels_colonnes[col_name]
             estimes = cellules_estimation.get(col_name, set())
             help_text = (
-                f"~ Contient des estimations (moyenne 3 sem. précédentes). "
+                f"~ Contient des estimations automatiques. "
                 f"Modifiez et enregistrez pour confirmer."
             ) if estimes else f"Prévision en tonnes — semaine {sem}/{annee}"
             column_config[col_name] = st.column_config.NumberColumn(
@@ -749,6 +706,14 @@ with tab3:
             lambda r: f"S{int(r['semaine']):02d}/{int(r['annee'])}", axis=1
         )
 
+        # Matrice produit × semaine : tendances et évolutions par marque pour tous en une passe
+        matrice_hist = matrice_previsions(hist_complet)
+        tendances_hist = tendances(matrice_hist)
+        evolution_hist = evolution_marques(
+            matrice_hist,
+            hist_complet.drop_duplicates('code_produit_commercial').set_index('code_produit_commercial')['marque']
+        )
+
         st.markdown("### 📊 Vue d'ensemble")
 
         col1, col2, col3, col4 = st.columns(4)
@@ -832,7 +797,7 @@ with tab3:
                         min_produit = df_produit['quantite_prevue_tonnes'].min()
                         st.metric("Minimum", f"{min_produit:.1f} T")
 
-                    variation_moy, variation_pct = calculer_tendance_produit(hist_complet, code_produit)
+                    variation_moy, variation_pct = calculer_tendance_produit(tendances_hist, code_produit)
 
                     if variation_moy is not None:
                         st.markdown("#### 📉 Tendance")
@@ -869,7 +834,7 @@ with tab3:
                         key="marque_stats"
                     )
 
-                    df_marque_agg = get_evolution_marque(hist_complet, marque_selectionnee)
+                    df_marque_agg = get_evolution_marque(evolution_hist, marque_selectionnee)
 
                     if not df_marque_agg.empty:
                         fig_marque = px.line(
@@ -959,6 +924,83 @@ with tab4:
             st.metric("Moyenne/Semaine", f"{moy_semaine:.0f} T")
 
 
+# ==========================================
+# ONGLET 5 : MODÈLE STATISTIQUE
+# ==========================================
+
+with tab5:
+    st.subheader("🤖 Modèle statistique — Backtest")
+    st.caption(
+        "Par produit, trois modèles sont évalués sur les expéditions réelles des 13 dernières semaines "
+        "(prévisions à 1-6 semaines avec les seules données antérieures) ; le plus précis est retenu. "
+        "WAPE = écart absolu cumulé / volume réel (plus bas = meilleur)."
+    )
+
+    col_r1, col_r2 = st.columns([3, 1])
+    with col_r2:
+        if st.button("🔄 Réajuster tous les modèles", use_container_width=True, key="btn_reajuster"):
+            try:
+                with st.spinner("Ajustement de tous les produits..."):
+                    mode, nb = ajuster_modeles(force=True)
+                get_suggestions_modele.clear()
+                st.success(f"✅ {nb} produit(s) réajusté(s)")
+            except Exception as e:
+                st.error(f"❌ Erreur : {str(e)}")
+
+    try:
+        rapport = get_rapport_backtest()
+    except Exception as e:
+        st.error(f"❌ Erreur : {str(e)}")
+        rapport = pd.DataFrame()
+
+    if rapport.empty:
+        st.info("📭 Aucun modèle ajusté (pas d'historique d'expéditions ni de prévisions)")
+    else:
+        with col_r1:
+            derniere = semaine_de_index(int(rapport['semaine_idx'].max()))
+            st.markdown(f"**{len(rapport)} produits** — expéditions intégrées jusqu'à {format_semaine(*derniere)}")
+
+        # WAPE global pondéré par le volume (modèle retenu vs prévisions saisies)
+        df_vol = rapport[rapport['volume_backtest'] > 0]
+        col_k1, col_k2, col_k3 = st.columns(3)
+        with col_k1:
+            if not df_vol.empty:
+                wape_modele = (df_vol['wape_retenu'] * df_vol['volume_backtest']).sum() / df_vol['volume_backtest'].sum()
+                st.metric("🤖 WAPE modèle", f"{wape_modele * 100:.1f} %")
+        with col_k2:
+            df_man = df_vol.dropna(subset=['wape_manuel'])
+            if not df_man.empty:
+                wape_manuel = (df_man['wape_manuel'] * df_man['volume_backtest']).sum() / df_man['volume_backtest'].sum()
+                st.metric("✍️ WAPE prévisions saisies", f"{wape_manuel * 100:.1f} %")
+        with col_k3:
+            repartition = rapport['modele'].map(MODELES).value_counts()
+            st.metric("🏆 Modèle le plus retenu", repartition.index[0] if len(repartition) else "-")
+
+        df_rapport = rapport[['code_produit', 'marque', 'libelle', 'modele', 'wape_retenu', 'wape_manuel',
+                              'wape_naif', 'wape_campagne', 'wape_lissage', 'volume_backtest']].copy()
+        df_rapport['modele'] = df_rapport['modele'].map(MODELES)
+        for col in ['wape_retenu', 'wape_manuel', 'wape_naif', 'wape_campagne', 'wape_lissage']:
+            df_rapport[col] = df_rapport[col] * 100
+
+        st.dataframe(
+            df_rapport,
+            use_container_width=True,
+            hide_index=True,
+            column_config={
+                'code_produit': st.column_config.TextColumn("Code"),
+                'marque': st.column_config.TextColumn("Marque"),
+                'libelle': st.column_config.TextColumn("Libellé"),
+                'modele': st.column_config.TextColumn("Modèle retenu"),
+                'wape_retenu': st.column_config.NumberColumn("WAPE retenu", format="%.1f %%"),
+                'wape_manuel': st.column_config.NumberColumn("WAPE saisi", format="%.1f %%"),
+                'wape_naif': st.column_config.NumberColumn("Naïf", format="%.1f %%"),
+                'wape_campagne': st.column_config.NumberColumn("Campagne", format="%.1f %%"),
+                'wape_lissage': st.column_config.NumberColumn("Lissage", format="%.1f %%"),
+                'volume_backtest': st.column_config.NumberColumn("Volume backtest (T)", format="%.1f"),
+            }
+        )
+
+
 # ==========================================
 # FOOTER
 # ==========================================
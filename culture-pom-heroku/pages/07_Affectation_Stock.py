@@ -1,10 +1,17 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
+import time
 from datetime import datetime, timedelta
 from database import get_connection
 from components import show_footer
 from auth import require_access
+from utils.cache_tables import invalider_tables
+from utils.synthese_previsions import marquer_synthese_a_recalculer
+from utils.previsions import semaine_de_index
+from utils.allocation_fifo import (
+    semaines_campagne, charger_demande, unites_stock, allouer, enregistrer_allocations
+)
 
 # CSS compact
 st.markdown("""
@@ -242,6 +249,8 @@ def get_stock_par_lot():
                 COALESCE(p.nom, l.code_producteur) as producteur_nom,
                 COALESCE(v.nom_variete, l.code_variete) as variete,
                 l.code_variete,
+                l.date_entree_stock,
+                lp.date_passage_prevue,
                 se.site_stockage,
                 COALESCE(se.type_stock, se.statut_lavage, 'BRUT') as type_stock,
                 se.poids_total_kg,
@@ -273,6 +282,12 @@ def get_stock_par_lot():
                 WHERE is_active = TRUE
                 GROUP BY emplacement_id
             ) aff ON se.id = aff.emplacement_id
+            LEFT JOIN (
+                SELECT lot_id, MIN(date_passage_prevue) as date_passage_prevue
+                FROM previsions_affectations
+                WHERE is_active = TRUE
+                GROUP BY lot_id
+            ) lp ON l.id = lp.lot_id
             WHERE se.is_active = TRUE
               AND se.nombre_unites > 0
         )
@@ -285,6 +300,8 @@ def get_stock_par_lot():
             variete,
             code_variete,
             MIN(site_stockage) as site_principal,
+            MIN(date_entree_stock) as date_entree_stock,
+            MIN(date_passage_prevue) as date_passage_prevue,
             
             -- Stock LAVÉ disponible
             COALESCE(SUM(CASE WHEN type_stock = 'LAVÉ' 
@@ -459,6 +476,8 @@ def create_affectation(code_produit, lot_id, emplacement_id,
         conn.commit()
         cursor.close()
         conn.close()
+        invalider_tables('previsions_affectations')
+        marquer_synthese_a_recalculer('previsions_affectations')
         
         return True, f"✅ Affectation #{new_id} créée"
         
@@ -483,6 +502,8 @@ def delete_affectation(affectation_id):
         conn.commit()
         cursor.close()
         conn.close()
+        invalider_tables('previsions_affectations')
+        marquer_synthese_a_recalculer('previsions_affectations')
         
         return True, "✅ Affectation supprimée"
         
@@ -728,7 +749,7 @@ st.markdown("---")
 # ONGLETS
 # ==========================================
 
-tab1, tab2, tab3, tab4 = st.tabs(["📊 Vue Consolidée", "➕ Affecter un Lot", "📋 Affectations", "📦 Récap par Lot"])
+tab1, tab2, tab3, tab4, tab5 = st.tabs(["📊 Vue Consolidée", "➕ Affecter un Lot", "📋 Affectations", "📦 Récap par Lot", "🤖 Allocation FIFO"])
 
 # ==========================================
 # ONGLET 1 : VUE CONSOLIDÉE PAR PRODUIT
@@ -1449,6 +1470,124 @@ with tab4:
                     st.markdown("---")
                     st.caption(f"📦 **Produits** : {lot['produits_liste']}")
 
+# ==========================================
+# ONGLET 5 : ALLOCATION FIFO (CAMPAGNE)
+# ==========================================
+
+with tab5:
+    st.subheader("🤖 Allocation FIFO sur la campagne")
+    st.markdown("*Stock libre affecté aux prévisions semaine par semaine, lots les plus anciens d'abord, variétés compatibles uniquement*")
+    
+    if st.button("⚙️ Calculer l'allocation", type="primary", key="fifo_calculer"):
+        try:
+            debut_calcul = time.perf_counter()
+            premiere, derniere = semaines_campagne()
+            demande, varietes_produits, affecte = charger_demande(premiere, derniere)
+            unites = unites_stock(get_stock_par_lot())
+            st.session_state['allocation_fifo'] = allouer(demande, affecte, varietes_produits, unites)
+            st.session_state['allocation_fifo_duree'] = time.perf_counter() - debut_calcul
+        except Exception as e:
+            st.error(f"❌ Erreur allocation : {str(e)}")
+    
+    resultat = st.session_state.get('allocation_fifo')
+    
+    if resultat is None:
+        st.info("💡 Lancez le calcul pour obtenir la couverture de toute la campagne et les allocations proposées")
+    elif not len(resultat['produits']):
+        st.info("📭 Aucune prévision de vente sur la campagne")
+    else:
+        demande_tot = resultat['demande'].sum()
+        existant_tot = resultat['couvert_existant'].sum()
+        nouveau_tot = resultat['couvert_nouveau'].sum()
+        manque_tot = resultat['manque'].sum()
+        
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("📊 Prévu campagne", f"{demande_tot:.0f} T")
+        with col2:
+            st.metric("📦 Déjà couvert", f"{existant_tot:.0f} T")
+        with col3:
+            st.metric("🤖 Allocation proposée", f"{nouveau_tot:.0f} T")
+        with col4:
+            st.metric("❌ Manque", f"{manque_tot:.0f} T",
+                     delta_color="inverse" if manque_tot > 0 else "off",
+                     delta=f"{manque_tot / demande_tot * 100:.0f}% du prévu" if demande_tot > 0 else None)
+        st.caption(f"⏱️ Calcul : {st.session_state.get('allocation_fifo_duree', 0) * 1000:.0f} ms")
+        
+        # Libellés
+        produits_ref = {p['code_produit']: f"{p['marque']} - {p['libelle']}" for p in get_produits_commerciaux()}
+        libelles_semaines = [format_semaine(*semaine_de_index(s)) for s in resultat['semaines']]
+        noms_produits = [produits_ref.get(c, c) for c in resultat['produits']]
+        
+        st.markdown("---")
+        st.markdown("#### 📅 Couverture par semaine")
+        
+        manque_semaine = pd.DataFrame(
+            {'Manque (T)': resultat['manque'].sum(axis=0)}, index=libelles_semaines
+        )
+        st.bar_chart(manque_semaine)
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            couverture = np.where(
+                resultat['demande'] > 0,
+                (resultat['couvert_existant'] + resultat['couvert_nouveau']) / resultat['demande'] * 100,
+                np.nan
+            )
+        df_couverture = pd.DataFrame(couverture, index=noms_produits, columns=libelles_semaines)
+        st.dataframe(
+            df_couverture.style.format("{:.0f}%", na_rep="-").map(
+                lambda v: '' if pd.isna(v) else ('color: #2ca02c' if v >= 99.5 else ('color: #ff7f0e' if v >= 50 else 'color: #d62728'))
+            ),
+            use_container_width=True
+        )
+        st.caption("% du prévu couvert (déjà affecté + allocation proposée) • - = pas de prévision")
+        
+        st.markdown("---")
+        st.markdown("#### 📋 Allocations proposées")
+        
+        allocations = resultat['allocations']
+        if allocations.empty:
+            st.info("Aucun stock libre compatible avec les besoins restants")
+        else:
+            df_edit = allocations.assign(
+                accepter=True,
+                produit=[produits_ref.get(c, c) for c in allocations['code_produit']]
+            )[['accepter', 'code_lot_interne', 'statut_stock', 'produit', 'brut', 'net', 'tare_pct', 'date_debut', 'date_fin']]
+            
+            df_edite = st.data_editor(
+                df_edit,
+                column_config={
+                    'accepter': st.column_config.CheckboxColumn("✅", width="small"),
+                    'code_lot_interne': "Lot",
+                    'statut_stock': "Type",
+                    'produit': "Produit",
+                    'brut': st.column_config.NumberColumn("Brut (T)", format="%.1f"),
+                    'net': st.column_config.NumberColumn("Net (T)", format="%.1f"),
+                    'tare_pct': st.column_config.NumberColumn("Tare %", format="%.1f"),
+                    'date_debut': st.column_config.DateColumn("Du", format="DD/MM/YY"),
+                    'date_fin': st.column_config.DateColumn("Au", format="DD/MM/YY"),
+                },
+                disabled=['code_lot_interne', 'statut_stock', 'produit', 'brut', 'net', 'tare_pct', 'date_debut', 'date_fin'],
+                use_container_width=True,
+                hide_index=True,
+                key="fifo_allocations"
+            )
+            
+            acceptees = allocations[df_edite['accepter'].to_numpy()]
+            st.caption(f"{len(acceptees)}/{len(allocations)} allocation(s) acceptée(s) • {acceptees['net'].sum():.1f} T net")
+            
+            if st.button(f"💾 Enregistrer {len(acceptees)} allocation(s)", type="primary",
+                        disabled=acceptees.empty, key="fifo_enregistrer"):
+                ok, message = enregistrer_allocations(acceptees, st.session_state.get('username', 'system'))
+                if ok:
+                    invalider_tables('previsions_affectations')
+                    marquer_synthese_a_recalculer('previsions_affectations')
+                    st.session_state.pop('allocation_fifo', None)
+                    st.success(message)
+                    st.rerun()
+                else:
+                    st.error(message)
+
 # ==========================================
 # FOOTER
 # ==========================================
@@ -3,7 +3,8 @@ import streamlit.components.v1 as components
 import pandas as pd
 from datetime import datetime, timedelta, time
 from database import get_connection
-from components import show_footer
+from components import show_footer, show_capacite_heatmap
+from utils.capacite import get_capacite_horizon, index_capacite, capacites_inconnues, NIVEAU_CAPACITE_INCONNUE
 from auth import require_access
 from auth.roles import is_admin
 import io
@@ -265,24 +266,6 @@ def get_planning_semaine(annee, semaine):
     except:
         return pd.DataFrame()
 
-def get_capacite_jour(ligne_code, capacite_th, jour_semaine, horaires_config):
-    """Calcule la capacité totale en heures pour un jour donné"""
-    if jour_semaine not in horaires_config:
-        return 17.0
-    h_debut = horaires_config[jour_semaine]['debut']
-    h_fin = horaires_config[jour_semaine]['fin']
-    debut_h = h_debut.hour + h_debut.minute / 60 if isinstance(h_debut, time) else 5.0
-    fin_h = h_fin.hour + h_fin.minute / 60 if isinstance(h_fin, time) else 22.0
-    return fin_h - debut_h
-
-def calculer_temps_utilise(planning_df, date_str, ligne):
-    """Calcule le temps utilisé pour un jour/ligne"""
-    if planning_df.empty:
-        return 0.0
-    mask = (planning_df['date_prevue'].astype(str) == date_str) & (planning_df['ligne_production'] == ligne)
-    filtered = planning_df[mask]
-    return filtered['duree_minutes'].sum() / 60 if not filtered.empty else 0.0
-
 def verifier_chevauchement(planning_df, date_prevue, ligne_production, heure_debut, duree_minutes):
     """Vérifie si le créneau demandé chevauche un élément existant"""
     jour_str = str(date_prevue)
@@ -764,6 +747,11 @@ with tab1:
     horaires_config = get_config_horaires(st.session_state.prod_selected_ligne)
     planning_df = get_planning_semaine(annee, semaine)
     lignes_dict = {l['code']: float(l['capacite_th']) for l in lignes} if lignes else {}
+    try:
+        capacite_semaine = index_capacite(get_capacite_horizon('PRODUCTION', week_start, nb_semaines=1))
+    except Exception as e:
+        st.error(f"❌ Erreur capacité : {str(e)}")
+        capacite_semaine = {}
     
     # Layout principal
     col_left, col_right = st.columns([1, 4])
@@ -863,14 +851,19 @@ with tab1:
                 # Capacités par ligne
                 cap_html = ""
                 for lc in sorted(lignes_dict.keys()):
-                    ligne_horaires = get_config_horaires(lc)
-                    cap_tot = get_capacite_jour(lc, lignes_dict[lc], i, ligne_horaires)
-                    temps_ut = calculer_temps_utilise(planning_df, jour_str, lc)
-                    temps_di = max(0, cap_tot - temps_ut)
-                    charge = (temps_ut / cap_tot * 100) if cap_tot > 0 else 0
+                    capa = capacite_semaine.get((lc, jour_str))
+                    if not capa or not capa['capacite_connue']:
+                        cap_html += f"<div><strong>{lc.replace('SBU_', 'S').replace('ENSACH_', 'E')[:3]}</strong>: {NIVEAU_CAPACITE_INCONNUE} capacité inconnue</div>"
+                        continue
+                    temps_di = capa['disponible_h']
+                    charge = capa['charge_pct']
                     emoji = "🟢" if charge < 50 else "🟡" if charge < 80 else "🔴"
                     code_court = lc.replace('SBU_', 'S').replace('ENSACH_', 'E')[:3]
                     cap_html += f"<div><strong>{code_court}</strong>: {temps_di:.1f}h {emoji}</div>"
+                for lc, planifie_h in capacites_inconnues(capacite_semaine, jour_str):
+                    if lc in lignes_dict:
+                        continue
+                    cap_html += f"<div><strong>{lc.replace('SBU_', 'S').replace('ENSACH_', 'E')[:3]}</strong>: {planifie_h:.1f}h planifiées {NIVEAU_CAPACITE_INCONNUE}</div>"
                 st.markdown(f"""<div class="capacity-box">{cap_html}</div>""", unsafe_allow_html=True)
                 
                 # Éléments planifiés
@@ -1009,6 +1002,10 @@ with tab1:
                 else:
                     st.caption("_Vide_")
 
+    st.markdown("---")
+    with st.expander("🔥 Charge multi-semaines (heatmap)"):
+        show_capacite_heatmap('PRODUCTION', week_start, key_prefix="capa_prod")
+
 # ============================================================
 # ONGLET 2 : LISTE JOBS
 # ============================================================
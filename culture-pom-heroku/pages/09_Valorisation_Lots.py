@@ -3,6 +3,8 @@ import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 from database import get_connection
+from utils.cache_tables import invalider_tables
+from utils.synthese_previsions import marquer_synthese_a_recalculer
 from components import show_footer
 from auth import require_access
 
@@ -266,6 +268,8 @@ def update_lot_valorisation(lot_id, prix_achat, tare_achat):
         conn.commit()
         cursor.close()
         conn.close()
+        invalider_tables('lots_bruts')
+        marquer_synthese_a_recalculer('lots_bruts')
         
         return True, "✅ Lot mis à jour"
         
@@ -309,6 +313,8 @@ def update_lot_valorisation_complet(lot_id, poids_brut, prix_achat, tare_achat):
         conn.commit()
         cursor.close()
         conn.close()
+        invalider_tables('lots_bruts')
+        marquer_synthese_a_recalculer('lots_bruts')
         
         return True, f"✅ Lot mis à jour (Valeur: {valeur_lot:,.2f} €)"
         
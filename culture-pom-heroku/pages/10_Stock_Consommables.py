@@ -17,6 +17,10 @@ from datetime import datetime
 from database import get_connection
 from components import show_footer
 from auth import require_access
+from utils.stock_consommables import (
+    init_synthese_consommables, reconstruire_synthese, get_synthese,
+    get_sites_ateliers_synthese, entrer_stock, ajuster_stock as ajuster_stock_emplacement
+)
 import io
 
 st.set_page_config(page_title="Stock Consommables - Culture Pom", page_icon="📦", layout="wide")
@@ -40,6 +44,11 @@ require_access("STOCK")
 st.title("📦 Stock Consommables")
 st.markdown("---")
 
+try:
+    init_synthese_consommables()
+except Exception as e:
+    st.error(f"❌ Erreur synthèse : {str(e)}")
+
 # ==========================================
 # FONCTION DE NORMALISATION (IDENTIQUE AU SCRIPT D'IMPORT)
 # ==========================================
@@ -98,70 +107,9 @@ def normaliser_code(libelle):
 # ==========================================
 
 def get_kpis_consommables(site_filter=None, atelier_filter=None):
-    """Récupère les KPIs - DYNAMIQUES selon filtres"""
+    """Récupère les KPIs - DYNAMIQUES selon filtres (une ligne de la synthèse)"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        # Construire WHERE clause
-        where_conditions = ["sc.is_active = TRUE"]
-        params = []
-        
-        if site_filter and site_filter != "Tous":
-            where_conditions.append("sc.site = %s")
-            params.append(site_filter)
-        
-        if atelier_filter and atelier_filter != "Tous":
-            where_conditions.append("sc.atelier = %s")
-            params.append(atelier_filter)
-        
-        where_clause = " AND ".join(where_conditions)
-        
-        # Nombre de références (dans le filtre)
-        cursor.execute(f"""
-            SELECT COUNT(DISTINCT sc.consommable_id) as nb 
-            FROM stock_consommables sc
-            WHERE {where_clause}
-        """, params)
-        nb_refs = cursor.fetchone()['nb']
-        
-        # Valeur totale CORRIGÉE : quantite × coefficient × prix
-        cursor.execute(f"""
-            SELECT COALESCE(SUM(
-                sc.quantite * COALESCE(rc.coefficient_conversion, 1) * COALESCE(rc.prix_unitaire, 0)
-            ), 0) as valeur
-            FROM stock_consommables sc
-            JOIN ref_consommables rc ON sc.consommable_id = rc.id
-            WHERE {where_clause}
-        """, params)
-        valeur_totale = float(cursor.fetchone()['valeur'])
-        
-        # Nombre d'emplacements
-        cursor.execute(f"""
-            SELECT COUNT(*) as nb 
-            FROM stock_consommables sc
-            WHERE {where_clause}
-        """, params)
-        nb_emplacements = cursor.fetchone()['nb']
-        
-        # Alertes stock bas
-        cursor.execute(f"""
-            SELECT COUNT(*) as nb 
-            FROM stock_consommables sc
-            JOIN ref_consommables rc ON sc.consommable_id = rc.id
-            WHERE {where_clause} AND rc.seuil_alerte > 0 AND sc.quantite <= rc.seuil_alerte
-        """, params)
-        nb_alertes = cursor.fetchone()['nb']
-        
-        cursor.close()
-        conn.close()
-        
-        return {
-            'nb_refs': nb_refs,
-            'valeur_totale': valeur_totale,
-            'nb_emplacements': nb_emplacements,
-            'nb_alertes': nb_alertes
-        }
+        return get_synthese(site_filter, atelier_filter)
     except Exception as e:
         st.error(f"❌ Erreur KPIs : {str(e)}")
         return None
@@ -169,19 +117,7 @@ def get_kpis_consommables(site_filter=None, atelier_filter=None):
 def get_sites_ateliers():
     """Récupère la liste des sites et ateliers"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT DISTINCT site FROM stock_consommables WHERE is_active = TRUE ORDER BY site")
-        sites = [row['site'] for row in cursor.fetchall()]
-        
-        cursor.execute("SELECT DISTINCT atelier FROM stock_consommables WHERE atelier IS NOT NULL AND is_active = TRUE ORDER BY atelier")
-        ateliers = [row['atelier'] for row in cursor.fetchall()]
-        
-        cursor.close()
-        conn.close()
-        
-        return sites, ateliers
+        return get_sites_ateliers_synthese()
     except Exception as e:
         return [], []
 
@@ -272,49 +208,25 @@ def get_referentiel_consommables():
 
 def ajouter_entree_stock(consommable_id, site, atelier, emplacement, quantite, fournisseur, reference_bl, notes, user):
     """Ajoute une entrée de stock"""
+    return ajouter_bon_livraison(
+        [(consommable_id, site, atelier, emplacement, quantite)], fournisseur, reference_bl, notes, user,
+        message=f"✅ +{quantite} ajouté(s)"
+    )
+
+def ajouter_bon_livraison(lignes, fournisseur, reference_bl, notes, user, message=None):
+    """Enregistre toutes les lignes d'un bon de livraison en une opération (stock + mouvements + synthèse)"""
     try:
         conn = get_connection()
         cursor = conn.cursor()
         
-        # Vérifier si emplacement existe
-        cursor.execute("""
-            SELECT id, quantite FROM stock_consommables 
-            WHERE consommable_id = %s AND site = %s 
-            AND COALESCE(atelier, '') = COALESCE(%s, '')
-            AND COALESCE(emplacement, '') = COALESCE(%s, '')
-            AND is_active = TRUE
-        """, (consommable_id, site, atelier, emplacement))
-        existing = cursor.fetchone()
-        
-        if existing:
-            # Mise à jour
-            new_qty = existing['quantite'] + quantite
-            cursor.execute("""
-                UPDATE stock_consommables 
-                SET quantite = %s, updated_at = CURRENT_TIMESTAMP
-                WHERE id = %s
-            """, (new_qty, existing['id']))
-        else:
-            # Création
-            cursor.execute("""
-                INSERT INTO stock_consommables 
-                (consommable_id, site, atelier, emplacement, quantite)
-                VALUES (%s, %s, %s, %s, %s)
-            """, (consommable_id, site, atelier, emplacement, quantite))
-        
-        # Log mouvement
-        cursor.execute("""
-            INSERT INTO mouvements_consommables 
-            (consommable_id, type_mouvement, quantite, site, atelier, emplacement, 
-             fournisseur, reference_document, notes, created_by)
-            VALUES (%s, 'ENTREE', %s, %s, %s, %s, %s, %s, %s, %s)
-        """, (consommable_id, quantite, site, atelier, emplacement, fournisseur, reference_bl, notes, user))
+        nb = entrer_stock(cursor, lignes, user, fournisseur=fournisseur,
+                          reference_bl=reference_bl, notes=notes)
         
         conn.commit()
         cursor.close()
         conn.close()
         
-        return True, f"✅ +{quantite} ajouté(s)"
+        return True, message or f"✅ {nb} ligne(s) du BL enregistrée(s)"
     except Exception as e:
         if 'conn' in locals():
             conn.rollback()
@@ -326,39 +238,19 @@ def ajuster_stock(consommable_id, site, atelier, emplacement, nouvelle_qte, moti
         conn = get_connection()
         cursor = conn.cursor()
         
-        # Récupérer stock actuel
-        cursor.execute("""
-            SELECT id, quantite FROM stock_consommables 
-            WHERE consommable_id = %s AND site = %s 
-            AND COALESCE(atelier, '') = COALESCE(%s, '')
-            AND COALESCE(emplacement, '') = COALESCE(%s, '')
-            AND is_active = TRUE
-        """, (consommable_id, site, atelier, emplacement))
-        existing = cursor.fetchone()
-        
-        if not existing:
+        ecart = ajuster_stock_emplacement(cursor, consommable_id, site, atelier, emplacement,
+                                          nouvelle_qte, motif, user)
+        if ecart is None:
+            conn.rollback()
+            cursor.close()
+            conn.close()
             return False, "❌ Emplacement non trouvé"
         
-        ecart = nouvelle_qte - existing['quantite']
-        
-        # Mise à jour
-        cursor.execute("""
-            UPDATE stock_consommables 
-            SET quantite = %s, updated_at = CURRENT_TIMESTAMP
-            WHERE id = %s
-        """, (nouvelle_qte, existing['id']))
-        
-        # Log
-        cursor.execute("""
-            INSERT INTO mouvements_consommables 
-            (consommable_id, type_mouvement, quantite, site, atelier, emplacement, notes, created_by)
-            VALUES (%s, 'AJUSTEMENT', %s, %s, %s, %s, %s, %s)
-        """, (consommable_id, ecart, site, atelier, emplacement, motif, user))
-        
         conn.commit()
         cursor.close()
         conn.close()
         
+        ecart = int(ecart) if float(ecart).is_integer() else ecart
         return True, f"✅ Stock ajusté ({'+' if ecart > 0 else ''}{ecart})"
     except Exception as e:
         if 'conn' in locals():
@@ -393,6 +285,10 @@ def sauvegarder_consommable(consommable_id, data):
                   data['coefficient_conversion'], data['unite_facturation'],
                   data['fournisseur_principal'], data['prix_unitaire'], data['seuil_alerte']))
         
+        # Prix / coefficient / seuil : valeurs et alertes de la synthèse à recalculer
+        if consommable_id:
+            reconstruire_synthese(cursor)
+        
         conn.commit()
         cursor.close()
         conn.close()
@@ -493,34 +389,95 @@ with tab2:
     df_ref = get_referentiel_consommables()
     
     if not df_ref.empty:
-        consommables = df_ref[df_ref['is_active'] == True][['id', 'libelle']].values.tolist()
-        options = [f"{c[1]}" for c in consommables]
-        selected = st.selectbox("Consommable *", options, key="entree_conso")
-        idx = options.index(selected)
-        conso_id = consommables[idx][0]
-        
-        col1, col2 = st.columns(2)
-        with col1:
-            site = st.selectbox("Site *", ["St Flavy", "Corroy", "La Motte-Tilly"], key="entree_site")
-            atelier = st.text_input("Atelier", key="entree_atelier", placeholder="Ex: COMMUN, BANC COUSEUR...")
-            emplacement = st.text_input("Emplacement", key="entree_emplacement")
+        mode_entree = st.radio("Mode", ["Entrée simple", "Bon de livraison complet"],
+                               horizontal=True, key="entree_mode")
+        
+        if mode_entree == "Entrée simple":
+            consommables = df_ref[df_ref['is_active'] == True][['id', 'libelle']].values.tolist()
+            options = [f"{c[1]}" for c in consommables]
+            selected = st.selectbox("Consommable *", options, key="entree_conso")
+            idx = options.index(selected)
+            conso_id = consommables[idx][0]
+        
+            col1, col2 = st.columns(2)
+            with col1:
+                site = st.selectbox("Site *", ["St Flavy", "Corroy", "La Motte-Tilly"], key="entree_site")
+                atelier = st.text_input("Atelier", key="entree_atelier", placeholder="Ex: COMMUN, BANC COUSEUR...")
+                emplacement = st.text_input("Emplacement", key="entree_emplacement")
+        
+            with col2:
+                quantite = st.number_input("Quantité *", min_value=1, value=1, key="entree_qte")
+                fournisseur = st.text_input("Fournisseur", key="entree_fournisseur")
+                reference_bl = st.text_input("N° BL", key="entree_bl")
+                notes = st.text_area("Notes", key="entree_notes", height=68)
+        
+            if st.button("✅ Enregistrer l'entrée", type="primary", use_container_width=True):
+                user = st.session_state.get('username', 'system')
+                success, msg = ajouter_entree_stock(conso_id, site, atelier if atelier else None, 
+                                                    emplacement if emplacement else None,
+                                                    quantite, fournisseur, reference_bl, notes, user)
+                if success:
+                    st.success(msg)
+                    st.balloons()
+                else:
+                    st.error(msg)
         
-        with col2:
-            quantite = st.number_input("Quantité *", min_value=1, value=1, key="entree_qte")
-            fournisseur = st.text_input("Fournisseur", key="entree_fournisseur")
-            reference_bl = st.text_input("N° BL", key="entree_bl")
-            notes = st.text_area("Notes", key="entree_notes", height=68)
-        
-        if st.button("✅ Enregistrer l'entrée", type="primary", use_container_width=True):
-            user = st.session_state.get('username', 'system')
-            success, msg = ajouter_entree_stock(conso_id, site, atelier if atelier else None, 
-                                                emplacement if emplacement else None,
-                                                quantite, fournisseur, reference_bl, notes, user)
-            if success:
-                st.success(msg)
-                st.balloons()
-            else:
-                st.error(msg)
+        else:
+            # Un BL = plusieurs consommables enregistrés en une seule opération
+            consommables_actifs = df_ref[df_ref['is_active'] == True]
+            ids_par_libelle = dict(zip(consommables_actifs['libelle'], consommables_actifs['id']))
+            
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                bl_site = st.selectbox("Site *", ["St Flavy", "Corroy", "La Motte-Tilly"], key="bl_site")
+            with col2:
+                bl_fournisseur = st.text_input("Fournisseur", key="bl_fournisseur")
+            with col3:
+                bl_reference = st.text_input("N° BL *", key="bl_reference")
+            bl_notes = st.text_input("Notes", key="bl_notes")
+            
+            df_bl = st.data_editor(
+                pd.DataFrame({
+                    'Consommable': pd.Series(dtype='object'),
+                    'Atelier': pd.Series(dtype='object'),
+                    'Emplacement': pd.Series(dtype='object'),
+                    'Quantité': pd.Series(dtype='int')
+                }),
+                num_rows="dynamic",
+                use_container_width=True,
+                hide_index=True,
+                column_config={
+                    'Consommable': st.column_config.SelectboxColumn(
+                        options=list(ids_par_libelle.keys()), required=True
+                    ),
+                    'Quantité': st.column_config.NumberColumn(min_value=1, step=1, required=True)
+                },
+                key="bl_lignes"
+            )
+            
+            df_bl = df_bl.dropna(subset=['Consommable', 'Quantité'])
+            st.caption(f"{len(df_bl)} ligne(s) saisie(s)")
+            
+            if st.button("✅ Enregistrer le BL", type="primary", use_container_width=True, key="btn_bl"):
+                if not bl_reference:
+                    st.error("❌ N° BL obligatoire")
+                elif df_bl.empty:
+                    st.warning("Aucune ligne à enregistrer")
+                else:
+                    lignes = [
+                        (ids_par_libelle[row['Consommable']], bl_site,
+                         row['Atelier'] if pd.notna(row['Atelier']) and row['Atelier'] else None,
+                         row['Emplacement'] if pd.notna(row['Emplacement']) and row['Emplacement'] else None,
+                         int(row['Quantité']))
+                        for _, row in df_bl.iterrows()
+                    ]
+                    user = st.session_state.get('username', 'system')
+                    success, msg = ajouter_bon_livraison(lignes, bl_fournisseur, bl_reference, bl_notes, user)
+                    if success:
+                        st.success(msg)
+                        st.balloons()
+                    else:
+                        st.error(msg)
     else:
         st.warning("⚠️ Aucun consommable. Utilisez l'onglet **Import** d'abord.")
 
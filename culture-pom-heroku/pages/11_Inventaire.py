@@ -9,6 +9,8 @@ import pandas as pd
 from datetime import datetime, date
 from database import get_connection
 from components import show_footer
+from utils.inventaire import init_schema_inventaire, creer_inventaire_site
+from utils.stock_consommables import init_synthese_consommables, reconstruire_synthese
 from auth import require_access
 import io
 
@@ -27,6 +29,12 @@ st.title("📋 Gestion des Inventaires")
 st.markdown("*Création, validation et historique*")
 st.markdown("---")
 
+try:
+    init_schema_inventaire()
+    init_synthese_consommables()
+except Exception as e:
+    st.error(f"❌ Erreur schéma inventaire : {str(e)}")
+
 # ============================================================
 # FONCTIONS
 # ============================================================
@@ -126,47 +134,17 @@ def creer_inventaire(date_inv, site, compteur_1, compteur_2, mois, annee):
         
         created_by = st.session_state.get('username', 'system')
         
-        # Créer inventaire
-        cursor.execute("""
-            INSERT INTO inventaires (type_inventaire, date_inventaire, mois, annee, site, 
-                                    statut, compteur_1, compteur_2, created_by)
-            VALUES ('CONSOMMABLES', %s, %s, %s, %s, 'EN_COURS', %s, %s, %s)
-            RETURNING id
-        """, (date_inv, mois, annee, site, compteur_1, compteur_2, created_by))
-        inv_id = cursor.fetchone()['id']
-        
-        # ⭐ Charger TOUTES les refs affectées au site (même stock = 0)
-        cursor.execute("""
-            SELECT 
-                sc.consommable_id, sc.site, sc.atelier, sc.emplacement,
-                sc.quantite as stock_theorique,
-                COALESCE(sc.coefficient_conversion, 1.0) as coefficient_conversion
-            FROM stock_consommables sc
-            WHERE sc.is_active = TRUE AND sc.site = %s
-        """, (site,))
-        rows = cursor.fetchall()
-        
-        if not rows:
+        # ⭐ En-tête + TOUTES les refs affectées au site (même stock = 0) en une requête
+        inv_id, nb_lignes = creer_inventaire_site(cursor, date_inv, site, compteur_1, compteur_2,
+                                                  mois, annee, created_by)
+        if inv_id is None:
             conn.rollback()
             return False, f"❌ Aucune référence affectée à {site}"
         
-        # Insérer lignes avec coefficient
-        for row in rows:
-            cursor.execute("""
-                INSERT INTO inventaires_consommables_lignes 
-                (inventaire_id, consommable_id, site, atelier, emplacement, 
-                 stock_theorique, coefficient_conversion)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-            """, (inv_id, row['consommable_id'], row['site'], row['atelier'],
-                  row['emplacement'], row['stock_theorique'], row['coefficient_conversion']))
-        
-        # Mettre à jour nb_lignes
-        cursor.execute("UPDATE inventaires SET nb_lignes = %s WHERE id = %s", (len(rows), inv_id))
-        
         conn.commit()
         cursor.close()
         conn.close()
-        return True, f"✅ Inventaire #{inv_id} créé avec {len(rows)} références"
+        return True, f"✅ Inventaire #{inv_id} créé avec {nb_lignes} références"
     except Exception as e:
         if 'conn' in locals():
             conn.rollback()
@@ -240,6 +218,9 @@ def valider_inventaire(inventaire_id, validateur):
                 if ligne['ecart_valeur']:
                     valeur_totale += abs(float(ligne['ecart_valeur']))
         
+        # Synthèse des KPIs consommables (même transaction)
+        reconstruire_synthese(cursor)
+        
         # Mettre à jour inventaire
         cursor.execute("""
             UPDATE inventaires 
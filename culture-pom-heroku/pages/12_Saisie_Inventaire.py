@@ -9,6 +9,11 @@ import streamlit as st
 import pandas as pd
 from datetime import datetime
 from database import get_connection
+from utils.inventaire import (
+    init_schema_inventaire, enregistrer_comptages, fusionner_lot_comptages,
+    LOT_DEJA_RECU, INVENTAIRE_CLOTURE
+)
+from streamlit_comptage import file_comptage, traiter_lots, LotRejete
 from auth import is_authenticated, is_admin, is_compteur  # ✅ CORRIGÉ: importer is_compteur
 
 # Configuration page - DOIT être en premier
@@ -136,6 +141,11 @@ if not is_compteur() and not is_admin():
 # FONCTIONS - CORRIGÉES pour table 'inventaires'
 # ============================================
 
+try:
+    init_schema_inventaire()
+except Exception as e:
+    st.error(f"Erreur : {e}")
+
 def get_inventaires_en_cours():
     """Récupère les inventaires EN_COURS depuis la table 'inventaires'"""
     try:
@@ -151,7 +161,8 @@ def get_inventaires_en_cours():
                 i.mois, 
                 i.annee,
                 i.nb_lignes,
-                (SELECT COUNT(*) FROM inventaires_consommables_lignes WHERE inventaire_id = i.id) as nb_refs
+                i.nb_lignes AS nb_refs,
+                COALESCE(i.nb_lignes_comptees, 0) AS nb_comptees
             FROM inventaires i
             WHERE i.statut = 'EN_COURS'
             ORDER BY i.created_at DESC
@@ -197,41 +208,29 @@ def get_lignes_inventaire(inventaire_id):
         return pd.DataFrame()
 
 def sauvegarder_comptages(inventaire_id, comptages):
-    """Sauvegarde tous les comptages en une transaction"""
+    """Sauvegarde tous les comptages en une requête (lignes inchangées ignorées)"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        updated = 0
-        for ligne_id, stock_compte in comptages.items():
-            if stock_compte is not None:
-                cursor.execute("""
-                    UPDATE inventaires_consommables_lignes
-                    SET stock_compte = %s,
-                        ecart = %s - stock_theorique,
-                        updated_at = CURRENT_TIMESTAMP
-                    WHERE id = %s
-                """, (int(stock_compte), int(stock_compte), int(ligne_id)))
-                updated += 1
-        
-        # Mettre à jour le compteur nb_lignes dans inventaires
-        cursor.execute("""
-            UPDATE inventaires
-            SET nb_lignes = (
-                SELECT COUNT(*) FROM inventaires_consommables_lignes 
-                WHERE inventaire_id = %s AND stock_compte IS NOT NULL
-            )
-            WHERE id = %s
-        """, (inventaire_id, inventaire_id))
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
-        
+        updated, nb_comptees, nb_total = enregistrer_comptages(inventaire_id, comptages)
+        if nb_comptees is not None:
+            return True, f"✅ {updated} ligne(s) enregistrée(s) — {nb_comptees}/{nb_total} comptée(s)"
         return True, f"✅ {updated} ligne(s) enregistrée(s)"
     except Exception as e:
         return False, f"❌ Erreur : {e}"
 
+def fusionner_lot(inventaire_id, lot_id, comptages):
+    """Fusionne un lot de la file hors ligne (idempotent sur lot_id)"""
+    try:
+        statut, updated, nb_comptees, nb_total = fusionner_lot_comptages(inventaire_id, lot_id, comptages)
+    except Exception as e:
+        return False, f"❌ Erreur : {e}"
+    if statut == INVENTAIRE_CLOTURE:
+        raise LotRejete("Inventaire clôturé : comptages non enregistrés")
+    if statut == LOT_DEJA_RECU:
+        return True, "✅ Lot déjà enregistré"
+    if nb_comptees is not None:
+        return True, f"✅ {updated} ligne(s) synchronisée(s) — {nb_comptees}/{nb_total} comptée(s)"
+    return True, f"✅ {updated} ligne(s) synchronisée(s)"
+
 # ============================================
 # INTERFACE MOBILE
 # ============================================
@@ -240,17 +239,26 @@ st.title("📱 Saisie Inventaire")
 
 # Sélection inventaire
 inventaires = get_inventaires_en_cours()
+inventaires_ouverts = [inv['id'] for inv in inventaires]
+
+# Lot reçu de la file hors ligne : fusionné avant de recharger les lignes
+# (même si son inventaire vient d'être clôturé : il est alors rejeté)
+resultat_lot = traiter_lots("file_comptage", fusionner_lot)
+if resultat_lot and not resultat_lot[0]:
+    st.error(resultat_lot[1])
 
 if not inventaires:
     st.warning("📋 Aucun inventaire en cours")
     st.info("Demandez à un manager de créer un inventaire")
+    # Purge des comptages restés sur le téléphone pour des inventaires clôturés
+    file_comptage(None, [], fusionner_lot, inventaires_ouverts=[], height=60, key="file_comptage")
     st.stop()
 
 # Dropdown sélection inventaire
 inv_options = {}
 for inv in inventaires:
     nb = inv['nb_refs'] if inv['nb_refs'] else inv['nb_lignes'] if inv['nb_lignes'] else 0
-    label = f"{inv['site']} - {inv['mois']}/{inv['annee']} ({nb} réf.)"
+    label = f"{inv['site']} - {inv['mois']}/{inv['annee']} ({nb} réf., {inv['nb_comptees']} comptée(s))"
     inv_options[label] = inv['id']
 
 selected_inv_label = st.selectbox(
@@ -269,6 +277,31 @@ if df_lignes.empty:
     st.info("L'inventaire a été créé mais aucune référence n'a été chargée.")
     st.stop()
 
+# Info inventaire
+site_name = selected_inv_label.split(" - ")[0]
+st.markdown(f"**{len(df_lignes)} références** à compter sur **{site_name}**")
+
+# ============================================
+# SAISIE HORS LIGNE (par défaut)
+# ============================================
+# Les comptages sont gardés sur le téléphone et envoyés par lots :
+# une coupure réseau ne perd ni ne bloque la saisie.
+
+saisie_classique = st.toggle("Saisie classique (connexion stable)", value=False, key="saisie_classique")
+
+if not saisie_classique:
+    lignes = df_lignes.astype(object).where(df_lignes.notna(), None).to_dict('records')
+    file_comptage(inventaire_id, lignes, fusionner_lot, inventaires_ouverts=inventaires_ouverts, key="file_comptage")
+
+    if is_admin():
+        st.markdown("---")
+        st.info("👤 Mode Admin : vous voyez cette page pour test/debug")
+    st.stop()
+
+# ============================================
+# SAISIE CLASSIQUE
+# ============================================
+
 # Initialiser session state pour les comptages
 if 'comptages' not in st.session_state:
     st.session_state.comptages = {}
@@ -280,10 +313,6 @@ if 'inventaire_id_loaded' not in st.session_state or st.session_state.inventaire
             st.session_state.comptages[row['id']] = int(row['stock_compte'])
     st.session_state.inventaire_id_loaded = inventaire_id
 
-# Info inventaire
-site_name = selected_inv_label.split(" - ")[0]
-st.markdown(f"**{len(df_lignes)} références** à compter sur **{site_name}**")
-
 st.markdown("---")
 
 # Grouper par atelier
@@ -3,8 +3,10 @@ import pandas as pd
 import numpy as np
 from datetime import datetime
 import time
-from database import get_connection
+from database import get_connection, a_colonne, premiere_colonne
 from components import show_footer
+from utils.edition import diff_modifications, appliquer_modifications
+from utils.cache_tables import invalider_tables
 from auth import require_access, can_edit, can_delete, get_current_username
 import io
 
@@ -167,28 +169,15 @@ def get_varietes_referentielles():
     """
     # Candidats de noms de colonne (par ordre de préférence)
     candidats_col = ['nom', 'nom_variete', 'variete', 'libelle', 'name']
+    # 1. Trouver la bonne colonne (catalogue du schéma en mémoire ; None si la table n'existe pas)
+    col_nom = premiere_colonne('ref_varietes', candidats_col)
+    if not col_nom:
+        return ([], None)
     try:
         conn = get_connection()
         cursor = conn.cursor()
-        # 1. Vérifier que la table existe et trouver la bonne colonne
-        cursor.execute("""
-            SELECT column_name FROM information_schema.columns
-            WHERE table_name = 'ref_varietes'
-        """)
-        rows = cursor.fetchall()
-        if not rows:
-            cursor.close()
-            conn.close()
-            return ([], None)
-        # rows peut être tuple ou dict selon le curseur (RealDictCursor)
-        cols = [r['column_name'] if hasattr(r, 'get') else r[0] for r in rows]
-        col_nom = next((c for c in candidats_col if c in cols), None)
-        if not col_nom:
-            cursor.close()
-            conn.close()
-            return ([], None)
         # 2. Charger les variétés (uniquement actives si la colonne is_active existe)
-        if 'is_active' in cols:
+        if a_colonne('ref_varietes', 'is_active'):
             where_clause = f"WHERE is_active = TRUE AND {col_nom} IS NOT NULL AND TRIM({col_nom}::text) <> ''"
         else:
             where_clause = f"WHERE {col_nom} IS NOT NULL AND TRIM({col_nom}::text) <> ''"
@@ -211,83 +200,39 @@ def get_varietes_referentielles():
 def save_changes(original_df, edited_df):
     """Sauvegarde les modifications"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        updates = 0
         username = get_current_username()
         
-        for idx in edited_df.index:
-            if idx not in original_df.index:
-                continue
-            
-            row_id = int(edited_df.loc[idx, 'id'])
-            changes = {}
-            
-            # Colonnes éditables
-            editable_cols = ['mois', 'marque', 'type_produit', 'variete', 
-                           'arrachage_quinzaine', 'volume_net_t', 'dechets_pct',
-                           'rendement_t_ha', 'notes']
-            
-            for col in editable_cols:
-                if col not in edited_df.columns:
-                    continue
-                
-                old_val = original_df.loc[idx, col]
-                new_val = edited_df.loc[idx, col]
-                
-                # Comparer en gérant les NaN
-                if pd.isna(old_val) and pd.isna(new_val):
-                    continue
-                elif pd.isna(old_val) or pd.isna(new_val) or old_val != new_val:
-                    # Conversion type Python natif
-                    if pd.isna(new_val):
-                        changes[col] = None
-                    elif isinstance(new_val, (np.integer, np.int64)):
-                        changes[col] = int(new_val)
-                    elif isinstance(new_val, (np.floating, np.float64)):
-                        changes[col] = float(new_val)
-                    else:
-                        changes[col] = new_val
+        # Colonnes éditables
+        editable_cols = ['mois', 'marque', 'type_produit', 'variete', 
+                       'arrachage_quinzaine', 'volume_net_t', 'dechets_pct',
+                       'rendement_t_ha', 'notes']
+        modifications = diff_modifications(original_df, edited_df, editable_cols)
+        
+        for changes in modifications.values():
+            # ⭐ Mettre à jour mois_numero si le mois a changé
+            if 'mois' in changes:
+                changes['mois_numero'] = get_mois_numero(changes['mois'])
             
-            if changes:
-                # ⭐ Mettre à jour mois_numero si le mois a changé
-                if 'mois' in changes:
-                    changes['mois_numero'] = get_mois_numero(changes['mois'])
-                
-                # ⭐ NE PAS inclure les colonnes GENERATED (calculées par PostgreSQL)
-                # volume_brut_t, hectares_necessaires sont GENERATED ALWAYS AS
-                for gen_col in ['volume_brut_t', 'hectares_necessaires', 'hectares_ajustes']:
-                    changes.pop(gen_col, None)
-                
-                # ⭐ Convertir tous les types numpy en types Python natifs
-                safe_changes = {}
-                for k, v in changes.items():
-                    if pd.isna(v) if not isinstance(v, str) else False:
-                        safe_changes[k] = None
-                    elif isinstance(v, (np.integer, np.int64, np.int32)):
-                        safe_changes[k] = int(v)
-                    elif isinstance(v, (np.floating, np.float64, np.float32)):
-                        safe_changes[k] = float(v)
-                    else:
-                        safe_changes[k] = v
-                changes = safe_changes
-                
-                # Construire UPDATE
-                set_clause = ", ".join([f"{col} = %s" for col in changes.keys()])
-                values = list(changes.values()) + [username, row_id]
-                
-                query = f"""
-                    UPDATE plans_recolte 
-                    SET {set_clause}, updated_by = %s, updated_at = CURRENT_TIMESTAMP 
-                    WHERE id = %s
-                """
-                cursor.execute(query, values)
-                updates += 1
+            # ⭐ NE PAS inclure les colonnes GENERATED (calculées par PostgreSQL)
+            # volume_brut_t, hectares_necessaires sont GENERATED ALWAYS AS
+            for gen_col in ['volume_brut_t', 'hectares_necessaires', 'hectares_ajustes']:
+                changes.pop(gen_col, None)
+        
+        if not modifications:
+            return True, "✅ 0 ligne(s) modifiée(s)"
         
+        conn = get_connection()
+        cursor = conn.cursor()
+        resultats = appliquer_modifications(
+            cursor, 'plans_recolte', modifications,
+            set_fixe="updated_by = %s, updated_at = CURRENT_TIMESTAMP", params_fixe=(username,)
+        )
         conn.commit()
         cursor.close()
         conn.close()
+        invalider_tables('plans_recolte')
         
+        updates = sum(resultats.values())
         return True, f"✅ {updates} ligne(s) modifiée(s)"
         
     except Exception as e:
@@ -339,6 +284,7 @@ def add_record(data):
         conn.commit()
         cursor.close()
         conn.close()
+        invalider_tables('plans_recolte')
         
         return True, f"✅ Ligne #{new_id} ajoutée"
         
@@ -363,6 +309,7 @@ def delete_record(record_id):
         conn.commit()
         cursor.close()
         conn.close()
+        invalider_tables('plans_recolte')
         
         return True, "✅ Ligne désactivée"
         
@@ -387,6 +334,7 @@ def reactivate_record(record_id):
         conn.commit()
         cursor.close()
         conn.close()
+        invalider_tables('plans_recolte')
         
         return True, "✅ Ligne réactivée"
         
@@ -423,6 +371,7 @@ def update_taux_couverture(record_id, nouveau_taux):
         conn.commit()
         cursor.close()
         conn.close()
+        invalider_tables('plans_recolte')
         
         return True, f"✅ Taux mis à jour : {nouveau_taux}% ({hectares_ajustes:.2f} ha)"
         
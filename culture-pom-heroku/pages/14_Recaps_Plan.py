@@ -18,6 +18,12 @@ import numpy as np
 from datetime import datetime
 import time
 from database import get_connection
+from utils.cache_tables import versions_tables, invalider_tables
+from utils.recaps_plan import (
+    COLONNES_PLAN, cle_plan, charger_plan_campagne, kpis_globaux, recap_par_mois, recap_par_variete,
+    recap_par_marque, recap_par_type, besoins_avec_couverture, marques_disponibles,
+    types_pour_marque, varietes_disponibles, recap_marque_type, recap_variete_detail
+)
 from components import show_footer
 from auth import require_access, can_edit, can_delete, get_current_username
 import io
@@ -93,307 +99,54 @@ def convert_to_native(value):
     return value
 
 # ==========================================
-# FONCTIONS DE CHARGEMENT (EXISTANTES)
+# FONCTIONS DE CHARGEMENT
 # ==========================================
+# Le plan de la campagne est lu une fois (utils/recaps_plan) ; toutes les
+# vues sont des agrégats pandas de ce DataFrame, sans autre requête.
 
 @st.cache_data(ttl=60)
-def get_kpis_globaux(campagne):
-    """KPIs globaux du plan"""
+def _get_plan(campagne, versions):
+    """Lignes actives du plan de la campagne (une requête)"""
+    return charger_plan_campagne(campagne)
+
+
+def get_plan(campagne):
+    """Plan de la campagne, invalidé à chaque écriture sur plans_recolte ou sur cette campagne"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT 
-                COUNT(*) as nb_lignes,
-                COUNT(DISTINCT variete) as nb_varietes,
-                COUNT(DISTINCT marque) as nb_marques,
-                COUNT(DISTINCT type_produit) as nb_types,
-                COALESCE(SUM(volume_net_t), 0) as total_volume_net,
-                COALESCE(SUM(volume_brut_t), 0) as total_volume_brut,
-                COALESCE(SUM(hectares_necessaires), 0) as total_hectares,
-                COALESCE(ROUND(SUM(hectares_necessaires)::NUMERIC, 1), 0) as total_hectares_arrondi
-            FROM plans_recolte
-            WHERE campagne = %s AND is_active = TRUE
-        """, (campagne,))
-        
-        row = cursor.fetchone()
-        cursor.close()
-        conn.close()
-        
-        if row:
-            return {
-                'nb_lignes': row['nb_lignes'],
-                'nb_varietes': row['nb_varietes'],
-                'nb_marques': row['nb_marques'],
-                'nb_types': row['nb_types'],
-                'total_volume_net': float(row['total_volume_net']),
-                'total_volume_brut': float(row['total_volume_brut']),
-                'total_hectares': float(row['total_hectares']),
-                'total_hectares_arrondi': float(row['total_hectares_arrondi'])
-            }
-        return None
+        return _get_plan(campagne, versions_tables('plans_recolte', cle_plan(campagne)))
     except Exception as e:
-        st.error(f"Erreur KPIs : {e}")
-        return None
+        st.error(f"❌ Erreur chargement plan : {str(e)}")
+        return pd.DataFrame(columns=COLONNES_PLAN)
+
+
+def get_kpis_globaux(campagne):
+    """KPIs globaux du plan"""
+    return kpis_globaux(get_plan(campagne))
 
 
-@st.cache_data(ttl=60)
 def get_recap_par_mois(campagne):
     """Récap par mois"""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT 
-                mois,
-                mois_numero,
-                COUNT(*) as nb_lignes,
-                COUNT(DISTINCT variete) as nb_varietes,
-                SUM(volume_net_t) as volume_net,
-                SUM(volume_brut_t) as volume_brut,
-                SUM(hectares_necessaires) as hectares,
-                ROUND(SUM(hectares_necessaires)::NUMERIC, 1) as hectares_arrondi
-            FROM plans_recolte
-            WHERE campagne = %s AND is_active = TRUE
-            GROUP BY mois, mois_numero
-            ORDER BY mois_numero
-        """, (campagne,))
-        
-        rows = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        
-        if rows:
-            df = pd.DataFrame(rows)
-            
-            # Convertir colonnes numériques Decimal → float
-            numeric_cols = ['nb_lignes', 'nb_varietes', 'volume_net', 'volume_brut', 'hectares', 'hectares_arrondi']
-            for col in numeric_cols:
-                if col in df.columns:
-                    df[col] = pd.to_numeric(df[col], errors='coerce')
-            
-            df = df.rename(columns={
-                'mois': 'Mois',
-                'nb_lignes': 'Lignes',
-                'nb_varietes': 'Variétés',
-                'volume_net': 'Volume Net (T)',
-                'volume_brut': 'Volume Brut (T)',
-                'hectares': 'Hectares',
-                'hectares_arrondi': 'Ha Arrondi'
-            })
-            return df
-        return pd.DataFrame()
-    except Exception as e:
-        st.error(f"Erreur : {e}")
-        return pd.DataFrame()
+    return recap_par_mois(get_plan(campagne))
 
 
-@st.cache_data(ttl=60)
 def get_recap_par_variete(campagne):
     """Récap par variété"""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT 
-                variete,
-                COUNT(*) as nb_lignes,
-                COUNT(DISTINCT mois) as nb_mois,
-                SUM(volume_net_t) as volume_net,
-                SUM(volume_brut_t) as volume_brut,
-                SUM(hectares_necessaires) as hectares,
-                ROUND(SUM(hectares_necessaires)::NUMERIC, 1) as hectares_arrondi
-            FROM plans_recolte
-            WHERE campagne = %s AND is_active = TRUE
-            GROUP BY variete
-            ORDER BY SUM(volume_net_t) DESC
-        """, (campagne,))
-        
-        rows = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        
-        if rows:
-            df = pd.DataFrame(rows)
-            
-            # Convertir colonnes numériques Decimal → float
-            numeric_cols = ['nb_lignes', 'nb_mois', 'volume_net', 'volume_brut', 'hectares', 'hectares_arrondi']
-            for col in numeric_cols:
-                if col in df.columns:
-                    df[col] = pd.to_numeric(df[col], errors='coerce')
-            
-            df = df.rename(columns={
-                'variete': 'Variété',
-                'nb_lignes': 'Lignes',
-                'nb_mois': 'Mois',
-                'volume_net': 'Volume Net (T)',
-                'volume_brut': 'Volume Brut (T)',
-                'hectares': 'Hectares',
-                'hectares_arrondi': 'Ha Arrondi'
-            })
-            return df
-        return pd.DataFrame()
-    except Exception as e:
-        st.error(f"Erreur : {e}")
-        return pd.DataFrame()
+    return recap_par_variete(get_plan(campagne))
 
 
-@st.cache_data(ttl=60)
 def get_recap_par_marque(campagne):
     """Récap par marque"""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT 
-                marque,
-                COUNT(*) as nb_lignes,
-                COUNT(DISTINCT type_produit) as nb_types,
-                SUM(volume_net_t) as volume_net,
-                SUM(volume_brut_t) as volume_brut,
-                SUM(hectares_necessaires) as hectares,
-                ROUND(SUM(hectares_necessaires)::NUMERIC, 1) as hectares_arrondi
-            FROM plans_recolte
-            WHERE campagne = %s AND is_active = TRUE
-            GROUP BY marque
-            ORDER BY SUM(volume_net_t) DESC
-        """, (campagne,))
-        
-        rows = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        
-        if rows:
-            df = pd.DataFrame(rows)
-            
-            # Convertir colonnes numériques Decimal → float
-            numeric_cols = ['nb_lignes', 'nb_types', 'volume_net', 'volume_brut', 'hectares', 'hectares_arrondi']
-            for col in numeric_cols:
-                if col in df.columns:
-                    df[col] = pd.to_numeric(df[col], errors='coerce')
-            
-            df = df.rename(columns={
-                'marque': 'Marque',
-                'nb_lignes': 'Lignes',
-                'nb_types': 'Types',
-                'volume_net': 'Volume Net (T)',
-                'volume_brut': 'Volume Brut (T)',
-                'hectares': 'Hectares',
-                'hectares_arrondi': 'Ha Arrondi'
-            })
-            return df
-        return pd.DataFrame()
-    except Exception as e:
-        st.error(f"Erreur : {e}")
-        return pd.DataFrame()
+    return recap_par_marque(get_plan(campagne))
 
 
-@st.cache_data(ttl=60)
 def get_recap_par_type(campagne):
     """Récap par type produit"""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT 
-                type_produit,
-                COUNT(*) as nb_lignes,
-                COUNT(DISTINCT marque) as nb_marques,
-                SUM(volume_net_t) as volume_net,
-                SUM(volume_brut_t) as volume_brut,
-                SUM(hectares_necessaires) as hectares,
-                ROUND(SUM(hectares_necessaires)::NUMERIC, 1) as hectares_arrondi
-            FROM plans_recolte
-            WHERE campagne = %s AND is_active = TRUE
-            GROUP BY type_produit
-            ORDER BY SUM(volume_net_t) DESC
-        """, (campagne,))
-        
-        rows = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        
-        if rows:
-            df = pd.DataFrame(rows)
-            
-            # Convertir colonnes numériques Decimal → float
-            numeric_cols = ['nb_lignes', 'nb_marques', 'volume_net', 'volume_brut', 'hectares', 'hectares_arrondi']
-            for col in numeric_cols:
-                if col in df.columns:
-                    df[col] = pd.to_numeric(df[col], errors='coerce')
-            
-            df = df.rename(columns={
-                'type_produit': 'Type Produit',
-                'nb_lignes': 'Lignes',
-                'nb_marques': 'Marques',
-                'volume_net': 'Volume Net (T)',
-                'volume_brut': 'Volume Brut (T)',
-                'hectares': 'Hectares',
-                'hectares_arrondi': 'Ha Arrondi'
-            })
-            return df
-        return pd.DataFrame()
-    except Exception as e:
-        st.error(f"Erreur : {e}")
-        return pd.DataFrame()
+    return recap_par_type(get_plan(campagne))
 
 
-@st.cache_data(ttl=60)
 def get_besoins_avec_couverture(campagne):
-    """Besoins mensuels avec couverture"""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT 
-                mois,
-                variete,
-                SUM(volume_net_t) as volume_net,
-                SUM(volume_brut_t) as volume_brut,
-                SUM(hectares_necessaires) as hectares_necessaires,
-                ROUND(SUM(hectares_necessaires)::NUMERIC, 1) as hectares_arrondi,
-                AVG(taux_couverture_cible) as taux_couverture_moyen,
-                SUM(COALESCE(hectares_ajustes, hectares_necessaires)) as hectares_avec_couverture
-            FROM plans_recolte
-            WHERE campagne = %s AND is_active = TRUE
-            GROUP BY mois, variete
-            ORDER BY mois, variete
-        """, (campagne,))
-        
-        rows = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        
-        if rows:
-            df = pd.DataFrame(rows)
-            
-            # Convertir colonnes numériques Decimal → float
-            numeric_cols = ['volume_net', 'volume_brut', 'hectares_necessaires', 'hectares_arrondi', 'taux_couverture_moyen', 'hectares_avec_couverture']
-            for col in numeric_cols:
-                if col in df.columns:
-                    df[col] = pd.to_numeric(df[col], errors='coerce')
-            
-            df = df.rename(columns={
-                'mois': 'Mois',
-                'variete': 'Variété',
-                'volume_net': 'Volume Net (T)',
-                'volume_brut': 'Volume Brut (T)',
-                'hectares_necessaires': 'Ha Nécessaires',
-                'hectares_arrondi': 'Ha Arrondi',
-                'taux_couverture_moyen': 'Taux Couverture (%)',
-                'hectares_avec_couverture': 'Ha Avec Couverture'
-            })
-            return df
-        return pd.DataFrame()
-    except Exception as e:
-        st.error(f"Erreur : {e}")
-        return pd.DataFrame()
+    """Besoins par mois/variété avec couverture"""
+    return besoins_avec_couverture(get_plan(campagne))
 
 
 # ==========================================
@@ -402,112 +155,19 @@ def get_besoins_avec_couverture(campagne):
 
 # ========== MARQUE + TYPE ==========
 
-@st.cache_data(ttl=60)
 def get_marques_disponibles(campagne):
     """Liste des marques disponibles"""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT DISTINCT marque
-            FROM plans_recolte
-            WHERE campagne = %s AND is_active = TRUE AND marque IS NOT NULL
-            ORDER BY marque
-        """, (campagne,))
-        
-        rows = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        
-        return [row['marque'] for row in rows] if rows else []
-    except Exception as e:
-        st.error(f"Erreur : {e}")
-        return []
+    return marques_disponibles(get_plan(campagne))
 
 
-@st.cache_data(ttl=60)
 def get_types_pour_marque(campagne, marque):
     """Types produits disponibles pour une marque"""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT DISTINCT type_produit
-            FROM plans_recolte
-            WHERE campagne = %s AND marque = %s AND is_active = TRUE AND type_produit IS NOT NULL
-            ORDER BY type_produit
-        """, (campagne, marque))
-        
-        rows = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        
-        return [row['type_produit'] for row in rows] if rows else []
-    except Exception as e:
-        st.error(f"Erreur : {e}")
-        return []
+    return types_pour_marque(get_plan(campagne), marque)
 
 
-@st.cache_data(ttl=60)
 def get_recap_marque_type(campagne, marque, type_produit):
     """Récap pour une combinaison Marque + Type"""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        # Total annuel
-        cursor.execute("""
-            SELECT 
-                COUNT(*) as nb_lignes,
-                COUNT(DISTINCT mois) as nb_mois,
-                SUM(volume_net_t) as total_volume_net,
-                SUM(volume_brut_t) as total_volume_brut
-            FROM plans_recolte
-            WHERE campagne = %s AND marque = %s AND type_produit = %s AND is_active = TRUE
-        """, (campagne, marque, type_produit))
-        
-        total = cursor.fetchone()
-        
-        # Détail par mois
-        cursor.execute("""
-            SELECT 
-                mois,
-                COUNT(*) as nb_lignes,
-                SUM(volume_net_t) as volume_net
-            FROM plans_recolte
-            WHERE campagne = %s AND marque = %s AND type_produit = %s AND is_active = TRUE
-            GROUP BY mois
-            ORDER BY mois
-        """, (campagne, marque, type_produit))
-        
-        detail = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        
-        df_detail = pd.DataFrame(detail) if detail else pd.DataFrame()
-        
-        # Convertir colonnes numériques Decimal → float
-        if not df_detail.empty:
-            numeric_cols = ['nb_lignes', 'volume_net']
-            for col in numeric_cols:
-                if col in df_detail.columns:
-                    df_detail[col] = pd.to_numeric(df_detail[col], errors='coerce')
-        
-        result = {
-            'total': {
-                'nb_lignes': total['nb_lignes'],
-                'nb_mois': total['nb_mois'],
-                'volume_net': float(total['total_volume_net'] or 0)
-            },
-            'detail': df_detail
-        }
-        
-        return result
-    except Exception as e:
-        st.error(f"Erreur : {e}")
-        return None
+    return recap_marque_type(get_plan(campagne), marque, type_produit)
 
 
 def ajuster_volume_proportionnel(marque, type_produit, nouveau_total, campagne):
@@ -515,6 +175,10 @@ def ajuster_volume_proportionnel(marque, type_produit, nouveau_total, campagne):
     Ajuste le volume total d'une combinaison Marque+Type
     en répartissant proportionnellement sur tous les mois
     
+    Une seule requête : verrou des lignes, ratio, arrondi à 0.01 T, l'écart
+    d'arrondi reporté sur la plus grosse ligne (le total saisi est exact).
+    Les lignes sans volume (NULL) ne sont pas modifiées.
+    
     ⚠️ IMPORTANT : Ne modifie que volume_net_t
     Les colonnes GENERATED (volume_brut_t, hectares_necessaires) se recalculent auto
     """
@@ -522,45 +186,72 @@ def ajuster_volume_proportionnel(marque, type_produit, nouveau_total, campagne):
         conn = get_connection()
         cursor = conn.cursor()
         
-        # Récupérer total actuel
         cursor.execute("""
-            SELECT SUM(volume_net_t) as total_actuel
-            FROM plans_recolte
-            WHERE campagne = %s AND marque = %s AND type_produit = %s AND is_active = TRUE
-        """, (campagne, marque, type_produit))
+            WITH verrou AS (
+                SELECT id, volume_net_t
+                FROM plans_recolte
+                WHERE campagne = %(campagne)s
+                  AND marque = %(marque)s
+                  AND type_produit = %(type_produit)s
+                  AND is_active = TRUE
+                  AND volume_net_t IS NOT NULL
+                FOR UPDATE
+            ),
+            lignes AS (
+                SELECT
+                    id,
+                    SUM(volume_net_t) OVER () as total_actuel,
+                    ROUND((volume_net_t * %(nouveau_total)s / NULLIF(SUM(volume_net_t) OVER (), 0))::NUMERIC, 2) as volume_arrondi,
+                    ROW_NUMBER() OVER (ORDER BY volume_net_t DESC NULLS LAST, id) as rang
+                FROM verrou
+            ),
+            cible AS (
+                SELECT
+                    id,
+                    total_actuel,
+                    volume_arrondi + CASE
+                        WHEN rang = 1 THEN ROUND(%(nouveau_total)s::NUMERIC, 2) - SUM(volume_arrondi) OVER ()
+                        ELSE 0
+                    END as volume
+                FROM lignes
+            ),
+            maj AS (
+                UPDATE plans_recolte p
+                SET volume_net_t = c.volume,
+                    updated_by = %(updated_by)s,
+                    updated_at = CURRENT_TIMESTAMP
+                FROM cible c
+                WHERE p.id = c.id AND c.total_actuel > 0
+                RETURNING p.volume_net_t, p.volume_brut_t, p.hectares_necessaires
+            )
+            SELECT
+                (SELECT COALESCE(MAX(total_actuel), 0) FROM lignes) as total_actuel,
+                COUNT(*) as nb_lignes,
+                COALESCE(SUM(volume_brut_t), 0) as volume_brut,
+                COALESCE(SUM(hectares_necessaires), 0) as hectares
+            FROM maj
+        """, {
+            'campagne': campagne, 'marque': marque, 'type_produit': type_produit,
+            'nouveau_total': float(nouveau_total), 'updated_by': get_current_username(),
+        })
         
-        total_actuel = float(cursor.fetchone()['total_actuel'] or 0)
+        resultat = cursor.fetchone()
+        total_actuel = float(resultat['total_actuel'])
         
         if total_actuel == 0:
+            conn.rollback()
             cursor.close()
             conn.close()
             return False, "❌ Total actuel = 0, impossible d'ajuster"
         
-        # Calculer ratio
-        nouveau_total_float = float(nouveau_total)
-        ratio = nouveau_total_float / total_actuel
-        
-        # Mettre à jour UNIQUEMENT volume_net_t (les colonnes GENERATED se recalculent auto)
-        updated_by = get_current_username()
-        
-        cursor.execute("""
-            UPDATE plans_recolte
-            SET volume_net_t = volume_net_t * %s,
-                updated_by = %s,
-                updated_at = CURRENT_TIMESTAMP
-            WHERE campagne = %s 
-              AND marque = %s 
-              AND type_produit = %s 
-              AND is_active = TRUE
-        """, (ratio, updated_by, campagne, marque, type_produit))
-        
-        nb_updated = cursor.rowcount
-        
         conn.commit()
         cursor.close()
         conn.close()
+        invalider_tables(cle_plan(campagne))
         
-        return True, f"✅ {nb_updated} ligne(s) ajustée(s) - Ratio: {ratio:.3f}"
+        ratio = float(nouveau_total) / total_actuel
+        return True, (f"✅ {resultat['nb_lignes']} ligne(s) ajustée(s) - Ratio: {ratio:.3f} - "
+                      f"{float(resultat['volume_brut']):,.1f} T brut, {float(resultat['hectares']):,.1f} ha")
         
     except Exception as e:
         if 'conn' in locals():
@@ -571,91 +262,64 @@ def ajuster_volume_proportionnel(marque, type_produit, nouveau_total, campagne):
 
 # ========== VARIÉTÉ ==========
 
-@st.cache_data(ttl=60)
 def get_varietes_disponibles(campagne):
     """Liste des variétés disponibles"""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT DISTINCT variete
-            FROM plans_recolte
-            WHERE campagne = %s AND is_active = TRUE
-            ORDER BY variete
-        """, (campagne,))
-        
-        rows = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        
-        return [row['variete'] for row in rows] if rows else []
-    except Exception as e:
-        st.error(f"Erreur : {e}")
-        return []
+    return varietes_disponibles(get_plan(campagne))
 
 
-@st.cache_data(ttl=60)
 def get_recap_variete_detail(campagne, variete):
     """Récap détaillé pour une variété"""
+    return recap_variete_detail(get_plan(campagne), variete)
+
+
+def _ajuster_parametre_variete(colonne, valeur, variete, campagne, mois_list):
+    """
+    Applique une valeur de colonne (dechets_pct / rendement_t_ha) à une variété,
+    sur tous les mois ou sur mois_list, en une requête qui renvoie le bilan
+    des lignes modifiées (colonnes GENERATED déjà recalculées)
+    """
     try:
         conn = get_connection()
         cursor = conn.cursor()
         
-        # Total
-        cursor.execute("""
-            SELECT 
+        cursor.execute(f"""
+            WITH maj AS (
+                UPDATE plans_recolte
+                SET {colonne} = %(valeur)s,
+                    updated_by = %(updated_by)s,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE campagne = %(campagne)s
+                  AND variete = %(variete)s
+                  AND is_active = TRUE
+                  AND (%(mois)s::TEXT[] IS NULL OR mois = ANY(%(mois)s::TEXT[]))
+                RETURNING volume_brut_t, hectares_necessaires
+            )
+            SELECT
                 COUNT(*) as nb_lignes,
-                SUM(volume_net_t) as total_volume_net,
-                AVG(dechets_pct) as dechets_moyen,
-                AVG(rendement_t_ha) as rendement_moyen
-            FROM plans_recolte
-            WHERE campagne = %s AND variete = %s AND is_active = TRUE
-        """, (campagne, variete))
+                COALESCE(SUM(volume_brut_t), 0) as volume_brut,
+                COALESCE(SUM(hectares_necessaires), 0) as hectares
+            FROM maj
+        """, {
+            'valeur': float(valeur), 'updated_by': get_current_username(),
+            'campagne': campagne, 'variete': variete,
+            'mois': list(mois_list) if mois_list else None,
+        })
         
-        total = cursor.fetchone()
+        resultat = cursor.fetchone()
         
-        # Détail par mois
-        cursor.execute("""
-            SELECT 
-                mois,
-                COUNT(*) as nb_lignes,
-                SUM(volume_net_t) as volume_net,
-                AVG(dechets_pct) as dechets_pct,
-                AVG(rendement_t_ha) as rendement_t_ha
-            FROM plans_recolte
-            WHERE campagne = %s AND variete = %s AND is_active = TRUE
-            GROUP BY mois
-            ORDER BY mois
-        """, (campagne, variete))
-        
-        detail = cursor.fetchall()
+        conn.commit()
         cursor.close()
         conn.close()
+        invalider_tables(cle_plan(campagne))
         
-        df_detail = pd.DataFrame(detail) if detail else pd.DataFrame()
+        return True, (f"✅ {resultat['nb_lignes']} ligne(s) mise(s) à jour - "
+                      f"{float(resultat['volume_brut']):,.1f} T brut, {float(resultat['hectares']):,.1f} ha")
         
-        # Convertir colonnes numériques Decimal → float
-        if not df_detail.empty:
-            numeric_cols = ['nb_lignes', 'volume_net', 'dechets_pct', 'rendement_t_ha']
-            for col in numeric_cols:
-                if col in df_detail.columns:
-                    df_detail[col] = pd.to_numeric(df_detail[col], errors='coerce')
-        
-        result = {
-            'total': {
-                'nb_lignes': total['nb_lignes'],
-                'volume_net': float(total['total_volume_net'] or 0),
-                'dechets_moyen': float(total['dechets_moyen'] or 0),
-                'rendement_moyen': float(total['rendement_moyen'] or 0)
-            },
-            'detail': df_detail
-        }
-        
-        return result
     except Exception as e:
-        st.error(f"Erreur : {e}")
-        return None
+        if 'conn' in locals():
+            conn.rollback()
+            conn.close()
+        return False, f"❌ Erreur : {str(e)}"
 
 
 def ajuster_dechets_variete(variete, nouveau_dechets_pct, campagne, mois_list=None):
@@ -671,54 +335,7 @@ def ajuster_dechets_variete(variete, nouveau_dechets_pct, campagne, mois_list=No
     ⚠️ IMPORTANT : Ne modifie que dechets_pct
     La colonne GENERATED volume_brut_t se recalcule auto
     """
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        updated_by = get_current_username()
-        nouveau_dechets_float = float(nouveau_dechets_pct)
-        
-        if mois_list:
-            # Appliquer sur certains mois uniquement
-            placeholders = ','.join(['%s'] * len(mois_list))
-            query = f"""
-                UPDATE plans_recolte
-                SET dechets_pct = %s,
-                    updated_by = %s,
-                    updated_at = CURRENT_TIMESTAMP
-                WHERE campagne = %s 
-                  AND variete = %s 
-                  AND mois IN ({placeholders})
-                  AND is_active = TRUE
-            """
-            params = [nouveau_dechets_float, updated_by, campagne, variete] + mois_list
-        else:
-            # Appliquer sur tous les mois
-            query = """
-                UPDATE plans_recolte
-                SET dechets_pct = %s,
-                    updated_by = %s,
-                    updated_at = CURRENT_TIMESTAMP
-                WHERE campagne = %s 
-                  AND variete = %s 
-                  AND is_active = TRUE
-            """
-            params = [nouveau_dechets_float, updated_by, campagne, variete]
-        
-        cursor.execute(query, params)
-        nb_updated = cursor.rowcount
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
-        
-        return True, f"✅ {nb_updated} ligne(s) mise(s) à jour"
-        
-    except Exception as e:
-        if 'conn' in locals():
-            conn.rollback()
-            conn.close()
-        return False, f"❌ Erreur : {str(e)}"
+    return _ajuster_parametre_variete('dechets_pct', nouveau_dechets_pct, variete, campagne, mois_list)
 
 
 def ajuster_rendement_variete(variete, nouveau_rendement, campagne, mois_list=None):
@@ -734,54 +351,7 @@ def ajuster_rendement_variete(variete, nouveau_rendement, campagne, mois_list=No
     ⚠️ IMPORTANT : Ne modifie que rendement_t_ha
     La colonne GENERATED hectares_necessaires se recalcule auto
     """
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        updated_by = get_current_username()
-        nouveau_rendement_float = float(nouveau_rendement)
-        
-        if mois_list:
-            # Appliquer sur certains mois uniquement
-            placeholders = ','.join(['%s'] * len(mois_list))
-            query = f"""
-                UPDATE plans_recolte
-                SET rendement_t_ha = %s,
-                    updated_by = %s,
-                    updated_at = CURRENT_TIMESTAMP
-                WHERE campagne = %s 
-                  AND variete = %s 
-                  AND mois IN ({placeholders})
-                  AND is_active = TRUE
-            """
-            params = [nouveau_rendement_float, updated_by, campagne, variete] + mois_list
-        else:
-            # Appliquer sur tous les mois
-            query = """
-                UPDATE plans_recolte
-                SET rendement_t_ha = %s,
-                    updated_by = %s,
-                    updated_at = CURRENT_TIMESTAMP
-                WHERE campagne = %s 
-                  AND variete = %s 
-                  AND is_active = TRUE
-            """
-            params = [nouveau_rendement_float, updated_by, campagne, variete]
-        
-        cursor.execute(query, params)
-        nb_updated = cursor.rowcount
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
-        
-        return True, f"✅ {nb_updated} ligne(s) mise(s) à jour"
-        
-    except Exception as e:
-        if 'conn' in locals():
-            conn.rollback()
-            conn.close()
-        return False, f"❌ Erreur : {str(e)}"
+    return _ajuster_parametre_variete('rendement_t_ha', nouveau_rendement, variete, campagne, mois_list)
 
 
 # ==========================================
@@ -1026,7 +596,6 @@ with tab6:
                                 st.success(message)
                                 st.balloons()
                                 time.sleep(2)
-                                st.cache_data.clear()  # Vider le cache
                                 st.rerun()
                             else:
                                 st.error(message)
@@ -1172,7 +741,6 @@ with tab7:
                                 st.success(message)
                                 st.balloons()
                                 time.sleep(2)
-                                st.cache_data.clear()
                                 st.rerun()
                             else:
                                 st.error(message)
@@ -1201,7 +769,6 @@ with tab7:
                                 st.success(message)
                                 st.balloons()
                                 time.sleep(2)
-                                st.cache_data.clear()
                                 st.rerun()
                             else:
                                 st.error(message)
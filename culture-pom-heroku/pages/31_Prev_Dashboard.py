@@ -4,6 +4,8 @@ from datetime import datetime, date
 from database import get_connection
 from components import show_footer
 from auth import is_authenticated
+from utils.cache_tables import versions_tables
+from utils.synthese_previsions import TOUS, TABLES_SYNTHESE, lire_synthese_site
 
 st.set_page_config(page_title="Prévisions Dashboard - Culture Pom", page_icon="📊", layout="wide")
 
@@ -87,6 +89,7 @@ CAMPAGNE = get_campagne_info()
 # FONCTIONS DONNÉES
 # ============================================================
 
+@st.cache_data(ttl=300)
 def get_sites_production():
     """Récupère les sites de production distincts"""
     try:
@@ -106,224 +109,25 @@ def get_sites_production():
         return []
 
 
-def get_kpis_globaux(site_filter=None):
-    """Récupère les KPIs globaux du module prévisions - VERSION CORRIGÉE"""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        today = date.today()
-        semaine_courante = today.isocalendar()[1]
-        annee_courante = today.year
-        
-        # KPI 1: Stock brut total (tonnes) - lots actifs
-        query_stock = """
-            SELECT COALESCE(SUM(poids_total_brut_kg), 0) / 1000 as stock_brut_tonnes
-            FROM lots_bruts 
-            WHERE is_active = TRUE
-        """
-        cursor.execute(query_stock)
-        stock_brut = float(cursor.fetchone()['stock_brut_tonnes'] or 0)
-        
-        # KPI 2: Stock net estimé (avec tare moyenne 22%)
-        stock_net = stock_brut * 0.78
-        
-        # KPI 3: Besoins jusqu'à fin campagne - REQUÊTE CORRIGÉE
-        # On prend toutes les prévisions de la semaine courante jusqu'à fin juin de l'année de fin de campagne
-        query_besoins = """
-            SELECT COALESCE(SUM(quantite_prevue_tonnes), 0) as besoin_total
-            FROM previsions_ventes
-            WHERE (
-                -- Semaines restantes cette année
-                (annee = %s AND semaine >= %s)
-                OR
-                -- Toutes les semaines de l'année suivante jusqu'à S26 (fin juin)
-                (annee = %s AND semaine <= 26)
-            )
-        """
-        cursor.execute(query_besoins, (annee_courante, semaine_courante, CAMPAGNE['annee_fin']))
-        besoin_total = float(cursor.fetchone()['besoin_total'] or 0)
-        
-        # KPI 4: Lots affectés
-        query_affectes = """
-            SELECT COUNT(DISTINCT lot_id) as nb_lots_affectes,
-                   COALESCE(SUM(quantite_affectee_tonnes), 0) as tonnes_affectees
-            FROM previsions_affectations
-            WHERE is_active = TRUE
-        """
-        cursor.execute(query_affectes)
-        result = cursor.fetchone()
-        nb_lots_affectes = result['nb_lots_affectes'] or 0
-        tonnes_affectees = float(result['tonnes_affectees'] or 0)
-        
-        # KPI 5: Produits avec prévisions actives
-        query_produits = """
-            SELECT COUNT(DISTINCT code_produit_commercial) as nb_produits
-            FROM previsions_ventes
-            WHERE (annee = %s AND semaine >= %s) OR (annee = %s AND semaine <= 26)
-        """
-        cursor.execute(query_produits, (annee_courante, semaine_courante, CAMPAGNE['annee_fin']))
-        nb_produits = cursor.fetchone()['nb_produits'] or 0
-        
-        cursor.close()
-        conn.close()
-        
-        return {
-            'stock_brut_tonnes': stock_brut,
-            'stock_net_tonnes': stock_net,
-            'besoin_total_tonnes': besoin_total,
-            'nb_lots_affectes': nb_lots_affectes,
-            'tonnes_affectees': tonnes_affectees,
-            'nb_produits': nb_produits,
-            'semaines_restantes': CAMPAGNE['semaines_restantes'],
-            'difference': stock_net - besoin_total
-        }
-        
-    except Exception as e:
-        st.error(f"Erreur KPIs: {str(e)}")
-        return None
+@st.cache_data(ttl=30)
+def _get_synthese(site, versions):
+    """Synthèse du site lue en une requête (utils/synthese_previsions)"""
+    return lire_synthese_site(site)
 
 
-def get_alertes_produits(site_filter=None):
-    """Récupère les alertes par produit (manque/surplus) - VERSION CORRIGÉE"""
+def get_synthese(site_filter=None):
+    """KPIs, alertes produits, marques et semaines du site (None = tous les sites)"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        today = date.today()
-        semaine_courante = today.isocalendar()[1]
-        annee_courante = today.year
-        
-        # Besoins par produit jusqu'à fin campagne
-        query = f"""
-            WITH besoins AS (
-                SELECT 
-                    pv.code_produit_commercial,
-                    pc.marque,
-                    pc.type_produit,
-                    pc.atelier,
-                    SUM(pv.quantite_prevue_tonnes) as besoin_tonnes
-                FROM previsions_ventes pv
-                JOIN ref_produits_commerciaux pc ON pv.code_produit_commercial = pc.code_produit
-                WHERE (pv.annee = %s AND pv.semaine >= %s)
-                   OR (pv.annee = %s AND pv.semaine <= 26)
-                GROUP BY pv.code_produit_commercial, pc.marque, pc.type_produit, pc.atelier
-            ),
-            affectations AS (
-                SELECT 
-                    pa.code_produit_commercial,
-                    SUM(COALESCE(pa.poids_net_estime_tonnes, pa.quantite_affectee_tonnes * 0.78)) as stock_affecte
-                FROM previsions_affectations pa
-                WHERE pa.is_active = TRUE
-                GROUP BY pa.code_produit_commercial
-            )
-            SELECT 
-                b.code_produit_commercial,
-                b.marque,
-                b.type_produit,
-                b.atelier,
-                b.besoin_tonnes,
-                COALESCE(a.stock_affecte, 0) as stock_affecte,
-                COALESCE(a.stock_affecte, 0) - b.besoin_tonnes as difference,
-                CASE 
-                    WHEN COALESCE(a.stock_affecte, 0) - b.besoin_tonnes < -50 THEN 'MANQUE'
-                    WHEN COALESCE(a.stock_affecte, 0) - b.besoin_tonnes > 50 THEN 'SURPLUS'
-                    ELSE 'EQUILIBRE'
-                END as statut
-            FROM besoins b
-            LEFT JOIN affectations a ON b.code_produit_commercial = a.code_produit_commercial
-            ORDER BY difference ASC
-        """
-        
-        cursor.execute(query, (annee_courante, semaine_courante, CAMPAGNE['annee_fin']))
-        rows = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        
-        if rows:
-            df = pd.DataFrame(rows)
-            for col in ['besoin_tonnes', 'stock_affecte', 'difference']:
-                if col in df.columns:
-                    df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
-            return df
-        return pd.DataFrame()
-        
+        synthese = _get_synthese(site_filter or TOUS, versions_tables(*TABLES_SYNTHESE))
     except Exception as e:
-        st.error(f"Erreur alertes: {str(e)}")
-        return pd.DataFrame()
-
-
-def get_consommation_semaine():
-    """Récupère la consommation par semaine (12 prochaines semaines)"""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        today = date.today()
-        semaine_courante = today.isocalendar()[1]
-        annee_courante = today.year
-        
-        query = """
-            SELECT 
-                pv.semaine,
-                pv.annee,
-                SUM(pv.quantite_prevue_tonnes) as total_tonnes
-            FROM previsions_ventes pv
-            WHERE (pv.annee = %s AND pv.semaine >= %s)
-               OR (pv.annee > %s)
-            GROUP BY pv.annee, pv.semaine
-            ORDER BY pv.annee, pv.semaine
-            LIMIT 12
-        """
-        
-        cursor.execute(query, (annee_courante, semaine_courante, annee_courante))
-        rows = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        
-        if rows:
-            df = pd.DataFrame(rows)
-            df['total_tonnes'] = pd.to_numeric(df['total_tonnes'], errors='coerce').fillna(0)
-            df['semaine_label'] = df.apply(
-                lambda r: f"S{int(r['semaine']):02d}", axis=1
-            )
-            return df
-        return pd.DataFrame()
-        
-    except Exception as e:
-        return pd.DataFrame()
-
-
-def get_stock_par_marque():
-    """Récupère le stock affecté par marque"""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        query = """
-            SELECT 
-                pc.marque,
-                SUM(COALESCE(pa.poids_net_estime_tonnes, pa.quantite_affectee_tonnes * 0.78)) as tonnes_affectees
-            FROM previsions_affectations pa
-            JOIN ref_produits_commerciaux pc ON pa.code_produit_commercial = pc.code_produit
-            WHERE pa.is_active = TRUE
-            GROUP BY pc.marque
-            ORDER BY tonnes_affectees DESC
-        """
-        
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        
-        if rows:
-            df = pd.DataFrame(rows)
-            df['tonnes_affectees'] = pd.to_numeric(df['tonnes_affectees'], errors='coerce').fillna(0)
-            return df
-        return pd.DataFrame()
-        
-    except Exception as e:
-        return pd.DataFrame()
+        st.error(f"❌ Erreur synthèse prévisions : {str(e)}")
+        return None
+    
+    kpis = dict(synthese['kpis'])
+    kpis['stock_net_tonnes'] = kpis['stock_brut_tonnes'] * 0.78  # tare moyenne 22%
+    kpis['semaines_restantes'] = CAMPAGNE['semaines_restantes']
+    kpis['difference'] = kpis['stock_net_tonnes'] - kpis['besoin_total_tonnes']
+    return {**synthese, 'kpis': kpis}
 
 
 # ============================================================
@@ -345,6 +149,7 @@ with col_site:
 with col_refresh:
     st.write("")
     if st.button("🔄 Actualiser", use_container_width=True):
+        _get_synthese.clear()
         st.rerun()
 
 st.markdown("---")
@@ -353,7 +158,8 @@ st.markdown("---")
 # KPIs PRINCIPAUX
 # ============================================================
 
-kpis = get_kpis_globaux(site_filter)
+synthese = get_synthese(site_filter)
+kpis = synthese['kpis'] if synthese else None
 
 if kpis:
     col1, col2, col3, col4, col5, col6 = st.columns(6)
@@ -411,7 +217,7 @@ st.markdown("---")
 
 st.subheader("🚨 Alertes par Produit")
 
-alertes_df = get_alertes_produits(site_filter)
+alertes_df = synthese['produits'] if synthese else pd.DataFrame()
 
 if not alertes_df.empty:
     # Compter les alertes
@@ -453,12 +259,13 @@ if not alertes_df.empty:
     if not alertes_critiques.empty:
         st.markdown("#### ⚠️ Produits en Manque (Top 10)")
         
-        df_display = alertes_critiques[['marque', 'type_produit', 'besoin_tonnes', 'stock_affecte', 'difference']].copy()
-        df_display.columns = ['Marque', 'Type Produit', 'Besoin (T)', 'Stock Affecté (T)', 'Manque (T)']
+        df_display = alertes_critiques[['marque', 'type_produit', 'besoin_tonnes', 'stock_affecte', 'difference', 'couverture_semaines']].copy()
+        df_display.columns = ['Marque', 'Type Produit', 'Besoin (T)', 'Stock Affecté (T)', 'Manque (T)', 'Couverture']
         
         df_display['Besoin (T)'] = df_display['Besoin (T)'].apply(lambda x: f"{x:,.0f}")
         df_display['Stock Affecté (T)'] = df_display['Stock Affecté (T)'].apply(lambda x: f"{x:,.0f}")
         df_display['Manque (T)'] = df_display['Manque (T)'].apply(lambda x: f"{x:,.0f}")
+        df_display['Couverture'] = df_display['Couverture'].apply(lambda x: f"{x:.0f} sem" if pd.notna(x) else "—")
         
         st.dataframe(df_display, use_container_width=True, hide_index=True)
     
@@ -491,7 +298,7 @@ col_chart1, col_chart2 = st.columns(2)
 with col_chart1:
     st.subheader("📈 Prévisions par Semaine")
     
-    conso_df = get_consommation_semaine()
+    conso_df = synthese['semaines'] if synthese else pd.DataFrame()
     
     if not conso_df.empty:
         st.bar_chart(
@@ -504,7 +311,7 @@ with col_chart1:
 with col_chart2:
     st.subheader("🏷️ Stock Affecté par Marque")
     
-    stock_marque_df = get_stock_par_marque()
+    stock_marque_df = synthese['marques'] if synthese else pd.DataFrame()
     
     if not stock_marque_df.empty and stock_marque_df['tonnes_affectees'].sum() > 0:
         chart_data = stock_marque_df.set_index('marque')['tonnes_affectees']
@@ -4,6 +4,9 @@ from datetime import datetime, date, timedelta
 from database import get_connection
 from components import show_footer
 from auth import is_authenticated
+from utils.cache_tables import versions_tables, invalider_tables
+from utils.synthese_previsions import marquer_synthese_a_recalculer
+from utils.soldes_produits import TABLES_SOLDES, date_fin_campagne, charger_soldes
 
 st.set_page_config(page_title="Affectations Prévisions - Culture Pom", page_icon="📋", layout="wide")
 
@@ -58,20 +61,14 @@ if not is_authenticated():
     st.stop()
 
 # Date fin campagne dynamique
-def get_date_fin_campagne():
-    today = date.today()
-    if today.month >= 7:
-        return date(today.year + 1, 6, 30)
-    else:
-        return date(today.year, 6, 30)
-
-DATE_FIN_CAMPAGNE = get_date_fin_campagne()
+DATE_FIN_CAMPAGNE = date_fin_campagne()
 
 def clear_data_cache():
     """Invalide tous les caches de données après modification"""
     _get_all_lots_raw.clear()
     get_affectations_existantes.clear()
-    get_resume_par_produit.clear()
+    invalider_tables('previsions_affectations')
+    marquer_synthese_a_recalculer('previsions_affectations')
     get_varietes_disponibles.clear()
     get_producteurs_disponibles.clear()
     get_produits_commerciaux.clear()
@@ -307,82 +304,41 @@ def get_produits_commerciaux():
         return pd.DataFrame()
 
 
-def get_conso_moyenne_produit(code_produit):
-    """Récupère la consommation moyenne hebdomadaire d'un produit"""
+@st.cache_data(ttl=300)
+def _get_soldes(versions, date_fin, today):
+    """Soldes de tous les produits (clé : versions des tables lues)"""
+    return charger_soldes(date_fin, today)
+
+
+def get_soldes_produits():
+    """Besoin, stock affecté, conso, solde, statut et date de fin projetée de TOUS les produits"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        today = date.today()
-        semaine_courante = today.isocalendar()[1]
-        annee_courante = today.year
-        
-        cursor.execute("""
-            WITH semaines_5_prochaines AS (
-                SELECT 
-                    quantite_prevue_tonnes,
-                    ROW_NUMBER() OVER (ORDER BY annee, semaine) as rn
-                FROM previsions_ventes
-                WHERE code_produit_commercial = %s
-                  AND ((annee = %s AND semaine >= %s) OR annee > %s)
-            )
-            SELECT AVG(quantite_prevue_tonnes) as conso_moyenne
-            FROM semaines_5_prochaines
-            WHERE rn <= 5
-        """, (code_produit, annee_courante, semaine_courante, annee_courante))
-        
-        result = cursor.fetchone()
-        cursor.close()
-        conn.close()
-        
-        if result and result['conso_moyenne']:
-            return float(result['conso_moyenne'])
-        return 0
-        
-    except:
-        return 0
+        return _get_soldes(versions_tables(*TABLES_SOLDES), DATE_FIN_CAMPAGNE, date.today())
+    except Exception as e:
+        st.error(f"Erreur soldes: {str(e)}")
+        return pd.DataFrame()
+
+
+def _solde(code_produit, colonne, defaut=0.0):
+    soldes = get_soldes_produits()
+    if soldes.empty or code_produit not in soldes.index:
+        return defaut
+    return soldes.at[code_produit, colonne]
+
+
+def get_conso_moyenne_produit(code_produit):
+    """Consommation moyenne hebdomadaire d'un produit (5 prochaines semaines)"""
+    return float(_solde(code_produit, 'conso_hebdo'))
 
 
 def get_besoin_total_produit(code_produit):
-    """Calcule le besoin total d'un produit jusqu'à fin de campagne"""
-    try:
-        today = date.today()
-        nb_semaines = (DATE_FIN_CAMPAGNE - today).days / 7.0
-        
-        if nb_semaines <= 0:
-            return 0.0
-        
-        conso_hebdo = get_conso_moyenne_produit(code_produit)
-        besoin = conso_hebdo * nb_semaines
-        
-        return float(besoin)
-        
-    except:
-        return 0.0
+    """Besoin total d'un produit jusqu'à fin de campagne"""
+    return float(_solde(code_produit, 'besoin_campagne'))
 
 
 def get_stock_affecte_produit(code_produit):
-    """Récupère le stock net affecté pour un produit"""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT COALESCE(SUM(poids_net_estime_tonnes), 0) as stock_net
-            FROM previsions_affectations
-            WHERE code_produit_commercial = %s AND is_active = TRUE
-        """, (code_produit,))
-        
-        result = cursor.fetchone()
-        cursor.close()
-        conn.close()
-        
-        if result and result['stock_net'] is not None:
-            return float(result['stock_net'])
-        return 0.0
-        
-    except:
-        return 0.0
+    """Stock net affecté pour un produit"""
+    return float(_solde(code_produit, 'total_net'))
 
 
 def calc_date_fin_lot(stock_tonnes, conso_hebdo, date_debut=None):
@@ -401,23 +357,15 @@ def calc_date_fin_lot(stock_tonnes, conso_hebdo, date_debut=None):
 
 
 def get_solde_produit(code_produit):
-    """Calcule le solde (surplus/manque) d'un produit"""
-    besoin = float(get_besoin_total_produit(code_produit) or 0)
-    stock = float(get_stock_affecte_produit(code_produit) or 0)
-    solde = stock - besoin
-    
-    if solde > 0:
-        statut = 'SURPLUS'
-    elif solde < 0:
-        statut = 'MANQUE'
-    else:
-        statut = 'EQUILIBRE'
+    """Solde (surplus/manque) d'un produit"""
+    besoin = get_besoin_total_produit(code_produit)
+    stock = get_stock_affecte_produit(code_produit)
     
     return {
         'besoin_total': besoin,
         'stock_affecte': stock,
-        'solde': solde,
-        'statut': statut
+        'solde': stock - besoin,
+        'statut': _solde(code_produit, 'statut', 'EQUILIBRE')
     }
 
 
@@ -502,6 +450,8 @@ def create_affectation(code_produit, lot_id, quantite_tonnes, tare_pct, tare_sou
         conn.commit()
         cursor.close()
         conn.close()
+        invalider_tables('stock_emplacements')
+        marquer_synthese_a_recalculer('stock_emplacements')
         
         return True, result['id']
         
@@ -591,97 +541,12 @@ def get_affectations_existantes():
         return pd.DataFrame()
 
 
-@st.cache_data(ttl=60)
 def get_resume_par_produit():
-    """Calcule le résumé par produit avec solde et dates"""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        today = date.today()
-        nb_semaines_restantes = max(0, (DATE_FIN_CAMPAGNE - today).days / 7.0)
-        semaine_courante = today.isocalendar()[1]
-        annee_courante = today.year
-        
-        cursor.execute("""
-            WITH conso_5_semaines AS (
-                SELECT 
-                    code_produit_commercial,
-                    AVG(quantite_prevue_tonnes) as conso_hebdo
-                FROM (
-                    SELECT 
-                        code_produit_commercial,
-                        quantite_prevue_tonnes,
-                        ROW_NUMBER() OVER (PARTITION BY code_produit_commercial ORDER BY annee, semaine) as rn
-                    FROM previsions_ventes
-                    WHERE (annee = %s AND semaine >= %s) OR annee > %s
-                ) sub
-                WHERE rn <= 5
-                GROUP BY code_produit_commercial
-            ),
-            affectations_agg AS (
-                SELECT 
-                    code_produit_commercial,
-                    SUM(quantite_affectee_tonnes) as total_brut,
-                    SUM(poids_net_estime_tonnes) as total_net,
-                    COUNT(*) as nb_lots,
-                    MAX(date_fin_estimee) as date_fin_derniere
-                FROM previsions_affectations
-                WHERE is_active = TRUE
-                GROUP BY code_produit_commercial
-            ),
-            produits_avec_prev AS (
-                SELECT DISTINCT code_produit_commercial
-                FROM previsions_ventes
-            )
-            SELECT 
-                pc.code_produit,
-                pc.marque,
-                pc.libelle,
-                pc.type_produit,
-                pc.atelier,
-                COALESCE(a.total_brut, 0) as total_brut,
-                COALESCE(a.total_net, 0) as total_net,
-                COALESCE(a.nb_lots, 0) as nb_lots,
-                a.date_fin_derniere,
-                COALESCE(c.conso_hebdo, 0) as conso_hebdo,
-                COALESCE(c.conso_hebdo, 0) * %s as besoin_campagne,
-                COALESCE(a.total_net, 0) - (COALESCE(c.conso_hebdo, 0) * %s) as solde
-            FROM ref_produits_commerciaux pc
-            JOIN produits_avec_prev pap ON pc.code_produit = pap.code_produit_commercial
-            LEFT JOIN conso_5_semaines c ON pc.code_produit = c.code_produit_commercial
-            LEFT JOIN affectations_agg a ON pc.code_produit = a.code_produit_commercial
-            WHERE pc.is_active = TRUE
-            ORDER BY pc.marque, pc.libelle
-        """, (annee_courante, semaine_courante, annee_courante, nb_semaines_restantes, nb_semaines_restantes))
-        
-        rows = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        
-        if rows:
-            df = pd.DataFrame(rows)
-            
-            numeric_cols = ['total_brut', 'total_net', 'nb_lots', 'conso_hebdo', 'besoin_campagne', 'solde']
-            for col in numeric_cols:
-                if col in df.columns:
-                    df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
-            
-            df['semaines_couvertes'] = df.apply(
-                lambda r: float(r['total_net']) / float(r['conso_hebdo']) if r['conso_hebdo'] > 0 else 0,
-                axis=1
-            )
-            
-            df['statut'] = df['solde'].apply(
-                lambda s: 'SURPLUS' if s > 0 else ('MANQUE' if s < 0 else 'EQUILIBRE')
-            )
-            
-            return df
-        return pd.DataFrame()
-        
-    except Exception as e:
-        st.error(f"Erreur résumé: {str(e)}")
+    """Résumé par produit (produits ayant des prévisions) avec solde et dates"""
+    soldes = get_soldes_produits()
+    if soldes.empty:
         return pd.DataFrame()
+    return soldes[soldes['a_previsions']].reset_index()
 
 
 def get_totaux_par_type_stock():
@@ -1186,7 +1051,8 @@ with tab3:
             df_display = df_resume[[
                 'marque', 'libelle', 'atelier', 'nb_lots',
                 'total_brut', 'total_net', 'conso_hebdo',
-                'semaines_couvertes', 'besoin_campagne', 'solde', 'statut', 'date_fin_derniere'
+                'semaines_couvertes', 'besoin_campagne', 'solde', 'statut', 'date_fin_derniere',
+                'date_fin_projetee'
             ]].copy()
             
             df_display = df_display.sort_values('solde')
@@ -1203,7 +1069,9 @@ with tab3:
                 'besoin_campagne': st.column_config.NumberColumn('Besoin (T)', format="%.1f"),
                 'solde': st.column_config.NumberColumn('Solde (T)', format="%.1f"),
                 'statut': st.column_config.TextColumn('Statut', width='small'),
-                'date_fin_derniere': st.column_config.DateColumn('Fin Dernière', format="DD/MM/YY")
+                'date_fin_derniere': st.column_config.DateColumn('Fin Dernière', format="DD/MM/YY"),
+                'date_fin_projetee': st.column_config.DateColumn('Fin Projetée', format="DD/MM/YY",
+                                                                 help="Stock net affecté ÷ conso hebdo, à partir d'aujourd'hui")
             }
             
             st.dataframe(
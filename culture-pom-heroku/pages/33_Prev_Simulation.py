@@ -5,14 +5,23 @@ v5 - Radio buttons (évite reset tabs)
    - Évolution chronologique de la marge par lot
    - Suppression coût stockage
    - Prix vente min pour 10%
+v6 - Moteur vectorisé (utils/simulation_marges)
+   - Lots de tous les produits chargés en une requête
+   - Portefeuille : matrice produit × échéance, scénarios, Monte Carlo
 """
 
 import streamlit as st
 import pandas as pd
 from datetime import datetime, date, timedelta
-from database import get_connection
+from database import get_connection, a_table, a_colonne, expr_tare_lots
+from utils.cache_tables import invalider_tables
+from utils.synthese_previsions import marquer_synthese_a_recalculer
 from components import show_footer
 from auth import is_authenticated
+from utils.simulation_marges import (
+    ECHEANCES, calculer_marges, grille_prix, preparer_portefeuille,
+    marges_portefeuille, grille_scenarios, monte_carlo
+)
 
 st.set_page_config(page_title="Simulation Rentabilité - Culture Pom", page_icon="💰", layout="wide")
 
@@ -67,14 +76,11 @@ def get_couts_production():
 
 @st.cache_data(ttl=30)
 def get_prix_ventes_previsions():
+    if not a_table('prix_ventes_previsions'):
+        return pd.DataFrame()
     try:
         conn = get_connection()
         cursor = conn.cursor()
-        cursor.execute("SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_name = 'prix_ventes_previsions')")
-        if not cursor.fetchone()['exists']:
-            cursor.close()
-            conn.close()
-            return pd.DataFrame()
         
         cursor.execute("""
             SELECT code_produit_commercial, prix_actuel, prix_2_semaines, 
@@ -97,6 +103,8 @@ def get_prix_ventes_previsions():
 
 @st.cache_data(ttl=30)
 def get_produits_avec_affectations():
+    if not a_table('previsions_affectations'):
+        return pd.DataFrame()
     try:
         conn = get_connection()
         cursor = conn.cursor()
@@ -106,15 +114,7 @@ def get_produits_avec_affectations():
         semaine_courante = today.isocalendar()[1]
         annee_courante = today.year
         
-        cursor.execute("SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_name = 'previsions_affectations')")
-        if not cursor.fetchone()['exists']:
-            cursor.close()
-            conn.close()
-            return pd.DataFrame()
-        
-        cursor.execute("SELECT EXISTS (SELECT FROM information_schema.columns WHERE table_name = 'lots_bruts' AND column_name = 'tare_theorique_pct')")
-        tare_col = cursor.fetchone()['exists']
-        tare_expr = "COALESCE(l.tare_lavage_totale_pct, l.tare_theorique_pct, 22)" if tare_col else "COALESCE(l.tare_lavage_totale_pct, 22)"
+        tare_expr = expr_tare_lots()
         
         query = f"""
             WITH conso_hebdo AS (
@@ -173,15 +173,13 @@ def get_produits_avec_affectations():
         return pd.DataFrame()
 
 @st.cache_data(ttl=30)
-def get_lots_affectes_chronologique(code_produit):
-    """Récupère les lots affectés ordonnés par date de passage"""
+def get_lots_affectes():
+    """Lots affectés de TOUS les produits, ordonnés par produit puis date de passage"""
     try:
         conn = get_connection()
         cursor = conn.cursor()
         
-        cursor.execute("SELECT EXISTS (SELECT FROM information_schema.columns WHERE table_name = 'lots_bruts' AND column_name = 'tare_theorique_pct')")
-        tare_col = cursor.fetchone()['exists']
-        tare_expr = "COALESCE(l.tare_lavage_totale_pct, l.tare_theorique_pct, 22)" if tare_col else "COALESCE(l.tare_lavage_totale_pct, 22)"
+        tare_expr = expr_tare_lots()
         
         query = f"""
             SELECT pa.id as affectation_id, pa.lot_id, l.code_lot_interne, v.nom_variete,
@@ -189,15 +187,18 @@ def get_lots_affectes_chronologique(code_produit):
                    pa.poids_net_estime_tonnes as poids_net,
                    COALESCE(l.prix_achat_euro_tonne, 0) as prix_achat,
                    {tare_expr} as tare_pct,
-                   l.date_entree_stock, pa.date_passage_prevue
+                   l.date_entree_stock, pa.date_passage_prevue,
+                   pa.code_produit_commercial, pc.atelier
             FROM previsions_affectations pa
             JOIN lots_bruts l ON pa.lot_id = l.id
+            JOIN ref_produits_commerciaux pc ON pa.code_produit_commercial = pc.code_produit
             LEFT JOIN ref_varietes v ON l.code_variete = v.code_variete
-            WHERE pa.code_produit_commercial = %s AND pa.is_active = TRUE
-            ORDER BY pa.date_passage_prevue NULLS LAST, l.date_entree_stock, l.prix_achat_euro_tonne ASC
+            WHERE pa.is_active = TRUE AND pc.is_active = TRUE
+            ORDER BY pa.code_produit_commercial, pa.date_passage_prevue NULLS LAST,
+                     l.date_entree_stock, l.prix_achat_euro_tonne ASC
         """
         
-        cursor.execute(query, (code_produit,))
+        cursor.execute(query)
         rows = cursor.fetchall()
         cursor.close()
         conn.close()
@@ -218,10 +219,7 @@ def get_lots_pour_tare():
         conn = get_connection()
         cursor = conn.cursor()
         
-        cursor.execute("SELECT EXISTS (SELECT FROM information_schema.columns WHERE table_name = 'lots_bruts' AND column_name = 'tare_theorique_pct')")
-        col_exists = cursor.fetchone()['exists']
-        
-        if col_exists:
+        if a_colonne('lots_bruts', 'tare_theorique_pct'):
             query = """
                 SELECT l.id, l.code_lot_interne, l.nom_usage, v.nom_variete,
                        l.poids_total_brut_kg / 1000 as poids_brut_tonnes,
@@ -262,35 +260,48 @@ def get_lots_pour_tare():
         return pd.DataFrame()
 
 def update_tare_theorique(lot_id, tare_pct):
+    if not a_colonne('lots_bruts', 'tare_theorique_pct'):
+        return False
     try:
         conn = get_connection()
         cursor = conn.cursor()
-        cursor.execute("SELECT EXISTS (SELECT FROM information_schema.columns WHERE table_name = 'lots_bruts' AND column_name = 'tare_theorique_pct')")
-        if not cursor.fetchone()['exists']:
-            cursor.close()
-            conn.close()
-            return False
-        
         cursor.execute("UPDATE lots_bruts SET tare_theorique_pct = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s",
                       (float(tare_pct) if tare_pct else None, int(lot_id)))
         conn.commit()
         cursor.close()
         conn.close()
+        invalider_tables('lots_bruts')
+        marquer_synthese_a_recalculer('lots_bruts')
         return True
     except:
         return False
 
+def update_tare_theorique_lots(lot_ids, tare_pct):
+    """Même tare théorique pour plusieurs lots, en une requête"""
+    if not a_colonne('lots_bruts', 'tare_theorique_pct'):
+        return 0
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("UPDATE lots_bruts SET tare_theorique_pct = %s, updated_at = CURRENT_TIMESTAMP WHERE id = ANY(%s)",
+                      (float(tare_pct) if tare_pct else None, [int(i) for i in lot_ids]))
+        nb = cursor.rowcount
+        conn.commit()
+        cursor.close()
+        conn.close()
+        invalider_tables('lots_bruts')
+        marquer_synthese_a_recalculer('lots_bruts')
+        return nb
+    except:
+        return 0
+
 def save_prix_previsions(code_produit, prix_actuel, prix_2sem, prix_1mois, prix_3mois, prix_6mois):
+    if not a_table('prix_ventes_previsions'):
+        return False
     try:
         conn = get_connection()
         cursor = conn.cursor()
         
-        cursor.execute("SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_name = 'prix_ventes_previsions')")
-        if not cursor.fetchone()['exists']:
-            cursor.close()
-            conn.close()
-            return False
-        
         created_by = st.session_state.get('username', 'system')
         cursor.execute("""
             INSERT INTO prix_ventes_previsions 
@@ -318,53 +329,12 @@ def update_cout_production(type_atelier, cout_tonne):
         conn.commit()
         cursor.close()
         conn.close()
+        invalider_tables('production_lignes')
+        marquer_synthese_a_recalculer('production_lignes')
         return True
     except:
         return False
 
-def calculer_marge(poids_net, prix_achat_brut, tare_pct, cout_prod, prix_vente):
-    if poids_net <= 0 or prix_vente <= 0:
-        return {'marge_tonne': 0, 'marge_totale': 0, 'marge_pct': 0, 'cout_revient': 0, 'cout_matiere_net': 0}
-    
-    cout_matiere_net = prix_achat_brut / (1 - tare_pct / 100) if tare_pct < 100 else prix_achat_brut
-    cout_revient = cout_matiere_net + cout_prod
-    marge_tonne = prix_vente - cout_revient
-    marge_totale = marge_tonne * poids_net
-    marge_pct = (marge_tonne / cout_revient * 100) if cout_revient > 0 else 0
-    
-    return {
-        'cout_matiere_net': cout_matiere_net,
-        'cout_prod': cout_prod,
-        'cout_revient': cout_revient,
-        'marge_tonne': marge_tonne,
-        'marge_totale': marge_totale,
-        'marge_pct': marge_pct
-    }
-
-def get_prix_vente_pour_date(prix_row, date_passage, date_ref=None):
-    """Retourne le prix de vente estimé selon la date de passage"""
-    if date_ref is None:
-        date_ref = date.today()
-    
-    if date_passage is None:
-        return float(prix_row['prix_actuel']), "Actuel"
-    
-    if isinstance(date_passage, str):
-        date_passage = datetime.strptime(date_passage, '%Y-%m-%d').date()
-    
-    delta_jours = (date_passage - date_ref).days
-    
-    if delta_jours <= 0:
-        return float(prix_row['prix_actuel']), "Actuel"
-    elif delta_jours <= 14:
-        return float(prix_row['prix_2_semaines']) or float(prix_row['prix_actuel']), "+2 sem"
-    elif delta_jours <= 45:
-        return float(prix_row['prix_1_mois']) or float(prix_row['prix_actuel']), "+1 mois"
-    elif delta_jours <= 120:
-        return float(prix_row['prix_3_mois']) or float(prix_row['prix_actuel']), "+3 mois"
-    else:
-        return float(prix_row['prix_6_mois']) or float(prix_row['prix_actuel']), "+6 mois"
-
 def calculer_prix_vente_cible(prix_achat_brut, tare_pct, cout_prod, marge_cible_pct=10):
     cout_matiere_net = prix_achat_brut / (1 - tare_pct / 100) if tare_pct < 100 else prix_achat_brut
     cout_revient = cout_matiere_net + cout_prod
@@ -385,7 +355,7 @@ prix_previsions = get_prix_ventes_previsions()
 # Navigation RADIO (évite reset des tabs)
 onglet = st.radio(
     "Navigation",
-    options=["📊 Marge par Produit", "📈 Évolution Chronologique", "💵 Simulation Achat", "⚙️ Paramétrage"],
+    options=["📊 Marge par Produit", "📈 Évolution Chronologique", "🧮 Portefeuille", "💵 Simulation Achat", "⚙️ Paramétrage"],
     horizontal=True,
     label_visibility="collapsed"
 )
@@ -472,29 +442,18 @@ if onglet == "📊 Marge par Produit":
             poids_net = float(produit['total_net'])
             
             if poids_net > 0 and not prix_produit.empty:
-                px = prix_produit.iloc[0]
-                echeances = [
-                    ('Actuel', float(px['prix_actuel'])),
-                    ('+2 semaines', float(px['prix_2_semaines'])),
-                    ('+1 mois', float(px['prix_1_mois'])),
-                    ('+3 mois', float(px['prix_3_mois'])),
-                    ('+6 mois', float(px['prix_6_mois']))
-                ]
+                prix_echeances = grille_prix(prix_produit, [code_produit], repli_actuel=False)[0]
+                marge = calculer_marges(poids_net, prix_achat, tare, cout_prod, prix_echeances)
                 
-                marge_data = []
-                for echeance, prix_vente in echeances:
-                    if prix_vente > 0:
-                        marge = calculer_marge(poids_net, prix_achat, tare, cout_prod, prix_vente)
-                        marge_data.append({
-                            'Échéance': echeance,
-                            'Prix vente €/T': prix_vente,
-                            'Marge €/T': marge['marge_tonne'],
-                            'Marge totale €': marge['marge_totale'],
-                            'Marge %': marge['marge_pct']
-                        })
+                df_marge = pd.DataFrame({
+                    'Échéance': [libelle for _, libelle in ECHEANCES],
+                    'Prix vente €/T': prix_echeances,
+                    'Marge €/T': marge['marge_tonne'],
+                    'Marge totale €': marge['marge_totale'],
+                    'Marge %': marge['marge_pct']
+                })[prix_echeances > 0]
                 
-                if marge_data:
-                    df_marge = pd.DataFrame(marge_data)
+                if not df_marge.empty:
                     df_display = df_marge.copy()
                     df_display['Prix vente €/T'] = df_display['Prix vente €/T'].apply(lambda x: f"{x:,.0f}")
                     df_display['Marge €/T'] = df_display['Marge €/T'].apply(lambda x: f"{x:+,.0f}")
@@ -528,7 +487,8 @@ elif onglet == "📈 Évolution Chronologique":
             code_produit = produit['code_produit']
             
             prix_produit = prix_previsions[prix_previsions['code_produit_commercial'] == code_produit] if not prix_previsions.empty else pd.DataFrame()
-            lots_df = get_lots_affectes_chronologique(code_produit)
+            lots_tous = get_lots_affectes()
+            lots_df = lots_tous[lots_tous['code_produit_commercial'] == code_produit].reset_index(drop=True) if not lots_tous.empty else pd.DataFrame()
             
             atelier = produit['atelier'] or 'SBU'
             cout_prod = couts_prod.get(atelier, 45.0)
@@ -549,48 +509,31 @@ elif onglet == "📈 Évolution Chronologique":
                 st.markdown("---")
                 st.markdown("#### 📅 Évolution chronologique de la marge")
                 
-                chrono_data = []
-                marge_cumulee = 0
-                poids_cumule = 0
-                cout_cumule = 0
+                # Marges de tous les lots en une passe, au prix de l'échéance de leur date de passage
+                pf = preparer_portefeuille(lots_df, prix_produit, {produit['atelier'] or 'SBU': cout_prod})
+                marges, _ = marges_portefeuille(pf)
+                lignes = range(len(lots_df))
+                echeance = pf['echeance']
+                marge_lot = marges['marge_totale'][lignes, echeance]
+                marge_cumulee = marge_lot.cumsum()
+                cout_cumule = (marges['cout_revient'][lignes, echeance] * pf['poids']).cumsum()
                 
-                for i, (_, lot) in enumerate(lots_df.iterrows()):
-                    prix_achat = float(lot['prix_achat'])
-                    tare = float(lot['tare_pct'])
-                    poids_net = float(lot['poids_net'])
-                    date_passage = lot['date_passage_prevue']
-                    
-                    prix_vente, echeance_label = get_prix_vente_pour_date(prix_row, date_passage)
-                    marge = calculer_marge(poids_net, prix_achat, tare, cout_prod, prix_vente)
-                    
-                    marge_cumulee += marge['marge_totale']
-                    poids_cumule += poids_net
-                    cout_cumule += marge['cout_revient'] * poids_net
-                    marge_cumulee_pct = (marge_cumulee / cout_cumule * 100) if cout_cumule > 0 else 0
-                    
-                    if date_passage:
-                        if isinstance(date_passage, str):
-                            date_passage = datetime.strptime(date_passage, '%Y-%m-%d').date()
-                        mois_label = date_passage.strftime('%b %Y')
-                    else:
-                        mois_label = "Non planifié"
-                    
-                    chrono_data.append({
-                        'Ordre': i + 1,
-                        'Mois': mois_label,
-                        'Lot': lot['code_lot_interne'],
-                        'Variété': lot['nom_variete'] or '-',
-                        'Poids net (T)': poids_net,
-                        'Prix achat €/T': prix_achat,
-                        'Prix vente €/T': prix_vente,
-                        'Échéance prix': echeance_label,
-                        'Marge lot %': marge['marge_pct'],
-                        'Marge lot €': marge['marge_totale'],
-                        'Marge cumulée €': marge_cumulee,
-                        'Marge cumulée %': marge_cumulee_pct
-                    })
+                dates_passage = pd.to_datetime(lots_df['date_passage_prevue'], errors='coerce')
                 
-                df_chrono = pd.DataFrame(chrono_data)
+                df_chrono = pd.DataFrame({
+                    'Ordre': range(1, len(lots_df) + 1),
+                    'Mois': dates_passage.dt.strftime('%b %Y').fillna("Non planifié"),
+                    'Lot': lots_df['code_lot_interne'],
+                    'Variété': lots_df['nom_variete'].fillna('-'),
+                    'Poids net (T)': pf['poids'],
+                    'Prix achat €/T': pf['achat'],
+                    'Prix vente €/T': pf['prix'][lignes, echeance],
+                    'Échéance prix': [ECHEANCES[i][1] for i in echeance],
+                    'Marge lot %': marges['marge_pct'][lignes, echeance],
+                    'Marge lot €': marge_lot,
+                    'Marge cumulée €': marge_cumulee,
+                    'Marge cumulée %': [m / c * 100 if c > 0 else 0 for m, c in zip(marge_cumulee, cout_cumule)]
+                })
                 
                 # Graphique
                 st.markdown("##### 📊 Évolution de la marge cumulée")
@@ -680,7 +623,110 @@ elif onglet == "📈 Évolution Chronologique":
         st.info("Aucun produit avec affectations")
 
 # ============================================================
-# ONGLET 3: SIMULATION ACHAT
+# ONGLET 3: PORTEFEUILLE (tous produits, moteur vectorisé)
+# ============================================================
+
+elif onglet == "🧮 Portefeuille":
+    st.subheader("🧮 Marge du Portefeuille")
+    st.markdown("*Tous les lots affectés × toutes les échéances de prix, en un calcul*")
+    
+    produits_df = get_produits_avec_affectations()
+    lots_tous = get_lots_affectes()
+    
+    if not lots_tous.empty:
+        pf = preparer_portefeuille(lots_tous, prix_previsions, couts_prod)
+        
+        st.markdown("#### ⚙️ Hypothèses")
+        col_h1, col_h2, col_h3 = st.columns(3)
+        with col_h1:
+            var_cout = st.slider("Coût production (%)", -30, 30, 0, step=5, key="pf_cout")
+        with col_h2:
+            var_tare = st.slider("Tare (points)", -10, 10, 0, key="pf_tare")
+        with col_h3:
+            var_achat = st.slider("Prix achat (%)", -30, 30, 0, step=5, key="pf_achat")
+        
+        _, df_pf = marges_portefeuille(pf, 1 + var_cout / 100, var_tare, 1 + var_achat / 100)
+        
+        libelles = [libelle for _, libelle in ECHEANCES] + ["Planifié"]
+        total_marge = df_pf['marge_Planifié'].sum()
+        
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("📦 Produits", len(df_pf))
+        with col2:
+            st.metric("📋 Tonnage net", f"{df_pf['poids_net'].sum():,.0f} T")
+        with col3:
+            st.metric("💰 Marge planifiée", f"{total_marge:+,.0f} €")
+        with col4:
+            st.metric("⚠️ Produits < 10%", int((df_pf['pct_Planifié'] < 10).sum()))
+        
+        st.markdown("---")
+        st.markdown("#### 📊 Matrice produit × échéance")
+        vue = st.radio("Afficher", ["Marge %", "Marge €"], horizontal=True, key="pf_vue")
+        prefixe = "pct_" if vue == "Marge %" else "marge_"
+        
+        noms = produits_df.set_index('code_produit')[['marque', 'type_produit']] if not produits_df.empty else pd.DataFrame(columns=['marque', 'type_produit'])
+        df_matrice = df_pf[[prefixe + l for l in libelles]].rename(columns=lambda c: c[len(prefixe):])
+        df_matrice = noms.reindex(df_matrice.index).join(df_matrice).reset_index()
+        df_matrice = df_matrice.rename(columns={'code_produit': 'Code', 'marque': 'Marque', 'type_produit': 'Produit'})
+        
+        format_cellule = "{:+.1f}%" if vue == "Marge %" else "{:+,.0f}"
+        seuil = 10 if vue == "Marge %" else 0
+        st.dataframe(
+            df_matrice.style.format({l: format_cellule for l in libelles}).map(
+                lambda v: 'color: #c62828' if v < seuil else 'color: #2e7d32', subset=libelles
+            ),
+            use_container_width=True, hide_index=True
+        )
+        st.caption("💡 *Planifié* : chaque lot au prix de l'échéance de sa date de passage prévue")
+        
+        st.markdown("---")
+        st.markdown("#### 🎯 Sensibilité tare × prix d'achat")
+        deltas_tare = list(range(-6, 7, 2))
+        facteurs_achat = [1 + v / 100 for v in range(-20, 21, 10)]
+        df_sens = grille_scenarios(pf, (1 + var_cout / 100,), deltas_tare, facteurs_achat)
+        df_sens = df_sens.pivot_table(index='delta_tare', columns='facteur_achat', values='marge_pct')
+        df_sens.index = [f"Tare {v:+.0f} pts" for v in df_sens.index]
+        df_sens.columns = [f"Achat {(v - 1) * 100:+.0f}%" for v in df_sens.columns]
+        st.dataframe(
+            df_sens.style.format("{:+.1f}%").map(lambda v: 'color: #c62828' if v < 10 else 'color: #2e7d32'),
+            use_container_width=True
+        )
+        st.caption("Marge planifiée du portefeuille (%) avec le coût de production choisi ci-dessus")
+        
+        st.markdown("---")
+        with st.expander("🎲 Monte Carlo (incertitude sur les prix et la tare)"):
+            col_m1, col_m2, col_m3, col_m4 = st.columns(4)
+            with col_m1:
+                n_tirages = st.number_input("Tirages", 100, 5000, 1000, step=100, key="mc_n")
+            with col_m2:
+                sigma_vente = st.number_input("σ prix vente (%)", 0.0, 50.0, 10.0, step=1.0, key="mc_sv")
+            with col_m3:
+                sigma_achat = st.number_input("σ prix achat (%)", 0.0, 50.0, 5.0, step=1.0, key="mc_sa")
+            with col_m4:
+                sigma_tare = st.number_input("σ tare (pts)", 0.0, 10.0, 2.0, step=0.5, key="mc_st")
+            
+            if st.button("🎲 Lancer la simulation", key="mc_go"):
+                df_mc = monte_carlo(pf, int(n_tirages), sigma_vente, sigma_achat, sigma_tare)
+                df_mc = noms.reindex(df_mc.index).join(df_mc).reset_index()
+                df_mc = df_mc.rename(columns={
+                    'code_produit': 'Code', 'marque': 'Marque', 'type_produit': 'Produit',
+                    'marge_moyenne': 'Marge moy. €', 'marge_p5': 'P5 €', 'marge_p50': 'Médiane €',
+                    'marge_p95': 'P95 €', 'pct_moyen': 'Marge moy. %', 'proba_sous_cible': 'Risque < 10%'
+                })
+                st.dataframe(
+                    df_mc.style.format({
+                        'Marge moy. €': "{:+,.0f}", 'P5 €': "{:+,.0f}", 'Médiane €': "{:+,.0f}",
+                        'P95 €': "{:+,.0f}", 'Marge moy. %': "{:+.1f}%", 'Risque < 10%': "{:.0f}%"
+                    }),
+                    use_container_width=True, hide_index=True
+                )
+                st.caption("P5 / P95 : 90% des tirages entre ces deux marges • Risque : part des tirages sous 10% de marge")
+    else:
+        st.info("Aucun lot affecté")
+
+# ============================================================
+# ONGLET 4: SIMULATION ACHAT
 # ============================================================
 
 elif onglet == "💵 Simulation Achat":
@@ -816,7 +862,7 @@ elif onglet == "💵 Simulation Achat":
         st.info("Aucun produit avec affectations")
 
 # ============================================================
-# ONGLET 4: PARAMÉTRAGE
+# ONGLET 5: PARAMÉTRAGE
 # ============================================================
 
 elif onglet == "⚙️ Paramétrage":
@@ -917,10 +963,7 @@ elif onglet == "⚙️ Paramétrage":
                 with col_a2:
                     st.markdown("<br>", unsafe_allow_html=True)
                     if st.button(f"🎯 Appliquer {tare_groupe:.0f}% aux {len(df_filtered)} lots", type="primary"):
-                        success = 0
-                        for _, lot in df_filtered.iterrows():
-                            if update_tare_theorique(lot['id'], tare_groupe if tare_groupe != 22.0 else None):
-                                success += 1
+                        success = update_tare_theorique_lots(df_filtered['id'].tolist(), tare_groupe if tare_groupe != 22.0 else None)
                         st.success(f"✅ {success} lot(s) mis à jour !")
                         st.rerun()
                 
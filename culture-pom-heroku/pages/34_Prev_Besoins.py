@@ -1,6 +1,9 @@
 """
 34_Prev_Besoins.py - Analyse des Besoins Campagne
 =================================================
+v3 - Chargement unique de la campagne
+   - Besoins, lots affectés, prévisions et stock par variété : une requête
+   - Détail produit sans requête (dictionnaires par code produit)
 v2 - Optimisé avec intégration marge et couverture
    - Radio buttons (évite reset)
    - Couverture en semaines
@@ -10,10 +13,14 @@ v2 - Optimisé avec intégration marge et couverture
 
 import streamlit as st
 import pandas as pd
+import numpy as np
 from datetime import datetime, date, timedelta
-from database import get_connection
+from database import get_connection, a_table
 from components import show_footer
 from auth import is_authenticated
+from utils.cache_tables import versions_tables
+from utils.soldes_produits import date_fin_campagne
+from utils.besoins_campagne import TABLES_BESOINS, charger_besoins_campagne
 
 st.set_page_config(page_title="Besoins Campagne - Culture Pom", page_icon="📊", layout="wide")
 
@@ -44,7 +51,7 @@ if not is_authenticated():
     st.stop()
 
 # Constantes
-DATE_FIN_CAMPAGNE = date(2026, 6, 30)
+DATE_FIN_CAMPAGNE = date_fin_campagne()
 
 # ============================================================
 # FONCTIONS
@@ -65,15 +72,11 @@ def get_couts_production():
 
 @st.cache_data(ttl=30)
 def get_prix_ventes():
+    if not a_table('prix_ventes_previsions'):
+        return pd.DataFrame()
     try:
         conn = get_connection()
         cursor = conn.cursor()
-        cursor.execute("SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_name = 'prix_ventes_previsions')")
-        if not cursor.fetchone()['exists']:
-            cursor.close()
-            conn.close()
-            return pd.DataFrame()
-        
         cursor.execute("SELECT * FROM prix_ventes_previsions")
         rows = cursor.fetchall()
         cursor.close()
@@ -89,247 +92,30 @@ def get_prix_ventes():
     except:
         return pd.DataFrame()
 
-@st.cache_data(ttl=30)
-def get_besoins_complet():
-    """Calcule les besoins avec intégration prix et marge"""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        today = date.today()
-        semaines_restantes = max(1, (DATE_FIN_CAMPAGNE - today).days / 7.0)
-        semaine_courante = today.isocalendar()[1]
-        annee_courante = today.year
-        
-        # Vérifier colonne tare_theorique_pct
-        cursor.execute("SELECT EXISTS (SELECT FROM information_schema.columns WHERE table_name = 'lots_bruts' AND column_name = 'tare_theorique_pct')")
-        tare_col = cursor.fetchone()['exists']
-        tare_expr = "COALESCE(l.tare_lavage_totale_pct, l.tare_theorique_pct, 22)" if tare_col else "COALESCE(l.tare_lavage_totale_pct, 22)"
-        
-        query = f"""
-            WITH conso_hebdo AS (
-                SELECT code_produit_commercial, AVG(quantite_prevue_tonnes) as conso_hebdo
-                FROM (
-                    SELECT code_produit_commercial, quantite_prevue_tonnes,
-                           ROW_NUMBER() OVER (PARTITION BY code_produit_commercial ORDER BY annee, semaine) as rn
-                    FROM previsions_ventes
-                    WHERE (annee = %s AND semaine >= %s) OR annee > %s
-                ) sub WHERE rn <= 5
-                GROUP BY code_produit_commercial
-            ),
-            affectations_detail AS (
-                SELECT 
-                    pa.code_produit_commercial,
-                    COUNT(*) as nb_lots,
-                    SUM(pa.quantite_affectee_tonnes) as total_brut,
-                    SUM(pa.poids_net_estime_tonnes) as total_net,
-                    SUM(pa.quantite_affectee_tonnes * COALESCE(l.prix_achat_euro_tonne, 0)) / 
-                        NULLIF(SUM(pa.quantite_affectee_tonnes), 0) as prix_achat_moyen,
-                    SUM(pa.quantite_affectee_tonnes * {tare_expr}) / 
-                        NULLIF(SUM(pa.quantite_affectee_tonnes), 0) as tare_moyenne
-                FROM previsions_affectations pa
-                JOIN lots_bruts l ON pa.lot_id = l.id
-                WHERE pa.is_active = TRUE
-                GROUP BY pa.code_produit_commercial
-            )
-            SELECT 
-                pc.code_produit,
-                pc.marque,
-                pc.type_produit,
-                pc.libelle,
-                pc.atelier,
-                COALESCE(ch.conso_hebdo, 0) as conso_hebdo,
-                COALESCE(ch.conso_hebdo, 0) * %s as besoin_campagne,
-                COALESCE(ad.nb_lots, 0) as nb_lots,
-                COALESCE(ad.total_brut, 0) as total_brut,
-                COALESCE(ad.total_net, 0) as total_net,
-                COALESCE(ad.prix_achat_moyen, 0) as prix_achat_moyen,
-                COALESCE(ad.tare_moyenne, 22) as tare_moyenne,
-                COALESCE(ad.total_net, 0) - (COALESCE(ch.conso_hebdo, 0) * %s) as solde,
-                -- Couverture en semaines
-                CASE 
-                    WHEN COALESCE(ch.conso_hebdo, 0) > 0 
-                    THEN COALESCE(ad.total_net, 0) / ch.conso_hebdo
-                    ELSE 0 
-                END as couverture_semaines
-            FROM ref_produits_commerciaux pc
-            LEFT JOIN conso_hebdo ch ON pc.code_produit = ch.code_produit_commercial
-            LEFT JOIN affectations_detail ad ON pc.code_produit = ad.code_produit_commercial
-            WHERE pc.is_active = TRUE
-              AND (COALESCE(ch.conso_hebdo, 0) > 0 OR COALESCE(ad.total_net, 0) > 0)
-            ORDER BY 
-                CASE 
-                    WHEN COALESCE(ad.total_net, 0) - (COALESCE(ch.conso_hebdo, 0) * %s) < -100 THEN 1
-                    WHEN COALESCE(ad.total_net, 0) - (COALESCE(ch.conso_hebdo, 0) * %s) < 0 THEN 2
-                    ELSE 3
-                END,
-                COALESCE(ad.total_net, 0) - (COALESCE(ch.conso_hebdo, 0) * %s) ASC
-        """
-        
-        cursor.execute(query, (
-            annee_courante, semaine_courante, annee_courante,
-            semaines_restantes, semaines_restantes,
-            semaines_restantes, semaines_restantes, semaines_restantes
-        ))
-        
-        rows = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        
-        if rows:
-            df = pd.DataFrame(rows)
-            numeric_cols = ['conso_hebdo', 'besoin_campagne', 'nb_lots', 'total_brut', 
-                           'total_net', 'prix_achat_moyen', 'tare_moyenne', 'solde', 'couverture_semaines']
-            for col in numeric_cols:
-                if col in df.columns:
-                    df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
-            return df, semaines_restantes
-        return pd.DataFrame(), semaines_restantes
-        
-    except Exception as e:
-        st.error(f"Erreur: {str(e)}")
-        return pd.DataFrame(), 0
-
-@st.cache_data(ttl=30)
-def get_lots_affectes_produit(code_produit):
-    """Récupère les lots affectés à un produit avec dates"""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT EXISTS (SELECT FROM information_schema.columns WHERE table_name = 'lots_bruts' AND column_name = 'tare_theorique_pct')")
-        tare_col = cursor.fetchone()['exists']
-        tare_expr = "COALESCE(l.tare_lavage_totale_pct, l.tare_theorique_pct, 22)" if tare_col else "COALESCE(l.tare_lavage_totale_pct, 22)"
-        
-        query = f"""
-            SELECT 
-                pa.id,
-                l.code_lot_interne,
-                v.nom_variete,
-                pa.quantite_affectee_tonnes as poids_brut,
-                pa.poids_net_estime_tonnes as poids_net,
-                COALESCE(l.prix_achat_euro_tonne, 0) as prix_achat,
-                {tare_expr} as tare_pct,
-                pa.date_passage_prevue,
-                l.date_entree_stock
-            FROM previsions_affectations pa
-            JOIN lots_bruts l ON pa.lot_id = l.id
-            LEFT JOIN ref_varietes v ON l.code_variete = v.code_variete
-            WHERE pa.code_produit_commercial = %s AND pa.is_active = TRUE
-            ORDER BY pa.date_passage_prevue NULLS LAST, l.prix_achat_euro_tonne ASC
-        """
-        
-        cursor.execute(query, (code_produit,))
-        rows = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        
-        if rows:
-            df = pd.DataFrame(rows)
-            for col in ['poids_brut', 'poids_net', 'prix_achat', 'tare_pct']:
-                if col in df.columns:
-                    df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
-            return df
-        return pd.DataFrame()
-    except:
-        return pd.DataFrame()
-
-@st.cache_data(ttl=30)
-def get_previsions_semaines(code_produit, nb_semaines=12):
-    """Récupère les prévisions semaine par semaine"""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        today = date.today()
-        semaine_courante = today.isocalendar()[1]
-        annee_courante = today.year
-        
-        cursor.execute("""
-            SELECT annee, semaine, quantite_prevue_tonnes
-            FROM previsions_ventes
-            WHERE code_produit_commercial = %s
-              AND ((annee = %s AND semaine >= %s) OR annee > %s)
-            ORDER BY annee, semaine
-            LIMIT %s
-        """, (code_produit, annee_courante, semaine_courante, annee_courante, nb_semaines))
-        
-        rows = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        
-        if rows:
-            df = pd.DataFrame(rows)
-            df['semaine_label'] = df.apply(lambda x: f"S{x['semaine']}", axis=1)
-            df['quantite_prevue_tonnes'] = pd.to_numeric(df['quantite_prevue_tonnes'], errors='coerce').fillna(0)
-            return df
-        return pd.DataFrame()
-    except:
-        return pd.DataFrame()
+@st.cache_data(ttl=300)
+def _get_donnees_besoins(date_fin, today, versions):
+    """Besoins, lots affectés, prévisions 12 sem. et stock par variété en une requête (clé = campagne + versions des tables)"""
+    return charger_besoins_campagne(date_fin, today, nb_semaines_prev=12)
 
-@st.cache_data(ttl=30)
-def get_stock_disponible_variete():
-    """Stock disponible par variété (non affecté)"""
+def get_donnees_besoins():
+    """Données de la page ; le détail d'un produit est une lecture de dictionnaire"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT EXISTS (SELECT FROM information_schema.columns WHERE table_name = 'lots_bruts' AND column_name = 'tare_theorique_pct')")
-        tare_col = cursor.fetchone()['exists']
-        tare_expr = "COALESCE(l.tare_lavage_totale_pct, l.tare_theorique_pct, 22)" if tare_col else "COALESCE(l.tare_lavage_totale_pct, 22)"
-        
-        query = f"""
-            WITH lots_stock AS (
-                SELECT 
-                    l.id,
-                    v.nom_variete,
-                    l.poids_total_brut_kg / 1000 as poids_brut,
-                    (l.poids_total_brut_kg / 1000) * (1 - {tare_expr} / 100) as poids_net
-                FROM lots_bruts l
-                LEFT JOIN ref_varietes v ON l.code_variete = v.code_variete
-                WHERE l.is_active = TRUE AND l.poids_total_brut_kg > 0
-            ),
-            affectations AS (
-                SELECT lot_id, SUM(quantite_affectee_tonnes) as affecte
-                FROM previsions_affectations
-                WHERE is_active = TRUE
-                GROUP BY lot_id
-            )
-            SELECT 
-                ls.nom_variete,
-                SUM(ls.poids_brut) as poids_brut_total,
-                SUM(ls.poids_net) as poids_net_total,
-                SUM(COALESCE(a.affecte, 0)) as affecte_total,
-                SUM(ls.poids_brut - COALESCE(a.affecte, 0)) as disponible_brut
-            FROM lots_stock ls
-            LEFT JOIN affectations a ON ls.id = a.lot_id
-            GROUP BY ls.nom_variete
-            HAVING SUM(ls.poids_brut - COALESCE(a.affecte, 0)) > 0
-            ORDER BY SUM(ls.poids_brut - COALESCE(a.affecte, 0)) DESC
-        """
-        
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        
-        if rows:
-            df = pd.DataFrame(rows)
-            for col in ['poids_brut_total', 'poids_net_total', 'affecte_total', 'disponible_brut']:
-                if col in df.columns:
-                    df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
-            return df
-        return pd.DataFrame()
-    except:
-        return pd.DataFrame()
+        return _get_donnees_besoins(DATE_FIN_CAMPAGNE, date.today(), versions_tables(*TABLES_BESOINS))
+    except Exception as e:
+        st.error(f"❌ Erreur chargement besoins : {str(e)}")
+        return {'besoins': pd.DataFrame(), 'semaines_restantes': 0, 'lots': {},
+                'previsions': {}, 'stock_varietes': pd.DataFrame()}
 
 def calculer_marge_produit(prix_achat, tare_pct, cout_prod, prix_vente):
-    """Calcule la marge pour un produit"""
-    if prix_vente <= 0:
-        return 0, 0
-    cout_matiere = prix_achat / (1 - tare_pct / 100) if tare_pct < 100 else prix_achat
-    cout_revient = cout_matiere + cout_prod
-    marge_pct = ((prix_vente - cout_revient) / cout_revient * 100) if cout_revient > 0 else 0
+    """Calcule coût de revient et marge (scalaires ou colonnes)"""
+    prix_achat, tare_pct, cout_prod, prix_vente = (
+        np.asarray(x, dtype=float) for x in (prix_achat, tare_pct, cout_prod, prix_vente)
+    )
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cout_matiere = np.where(tare_pct < 100, prix_achat / (1 - tare_pct / 100), prix_achat)
+        cout_revient = cout_matiere + cout_prod
+        marge_pct = np.where((prix_vente > 0) & (cout_revient > 0),
+                             (prix_vente - cout_revient) / cout_revient * 100, 0.0)
     return cout_revient, marge_pct
 
 # ============================================================
@@ -346,10 +132,12 @@ st.caption(f"Campagne jusqu'au {DATE_FIN_CAMPAGNE.strftime('%d/%m/%Y')} • {sem
 st.markdown("---")
 
 # Charger données
-besoins_df, sem_rest = get_besoins_complet()
+donnees = get_donnees_besoins()
+besoins_df = donnees['besoins']
+sem_rest = donnees['semaines_restantes']
+stock_variete_df = donnees['stock_varietes']
 prix_df = get_prix_ventes()
 couts_prod = get_couts_production()
-stock_variete_df = get_stock_disponible_variete()
 
 # KPIs globaux
 if not besoins_df.empty:
@@ -423,43 +211,32 @@ if onglet == "📋 Vue Synthèse":
         st.markdown("---")
         
         if not df_filtered.empty:
-            # Enrichir avec prix et marge
-            enriched_data = []
+            # Enrichir avec prix et marge (en colonnes)
+            if not prix_df.empty:
+                prix_par_code = prix_df.drop_duplicates('code_produit_commercial').set_index('code_produit_commercial')['prix_actuel']
+                prix_vente = df_filtered['code_produit'].map(prix_par_code).fillna(0)
+            else:
+                prix_vente = pd.Series(0.0, index=df_filtered.index)
             
-            for _, row in df_filtered.iterrows():
-                code = row['code_produit']
-                prix_row = prix_df[prix_df['code_produit_commercial'] == code] if not prix_df.empty else pd.DataFrame()
-                prix_vente = float(prix_row.iloc[0]['prix_actuel']) if not prix_row.empty else 0
-                
-                atelier = row['atelier'] or 'SBU'
-                cout_prod = couts_prod.get(atelier, 45.0)
-                cout_revient, marge_pct = calculer_marge_produit(
-                    row['prix_achat_moyen'], row['tare_moyenne'], cout_prod, prix_vente
-                )
-                
-                # Statut
-                if row['solde'] < -100:
-                    statut = "🔴"
-                elif row['solde'] < 0:
-                    statut = "🟠"
-                else:
-                    statut = "🟢"
-                
-                enriched_data.append({
-                    'Statut': statut,
-                    'Marque': row['marque'],
-                    'Type': row['type_produit'],
-                    'Conso/sem': row['conso_hebdo'],
-                    'Besoin': row['besoin_campagne'],
-                    'Affecté': row['total_net'],
-                    'Solde': row['solde'],
-                    'Couverture': row['couverture_semaines'],
-                    'Prix vente': prix_vente,
-                    'Marge %': marge_pct,
-                    'code_produit': code
-                })
+            ateliers = df_filtered['atelier'].fillna('').replace('', 'SBU')
+            cout_prod = ateliers.map(lambda a: couts_prod.get(a, 45.0))
+            _, marge_pct = calculer_marge_produit(
+                df_filtered['prix_achat_moyen'], df_filtered['tare_moyenne'], cout_prod, prix_vente
+            )
             
-            df_display = pd.DataFrame(enriched_data)
+            df_display = pd.DataFrame({
+                'Statut': np.select([df_filtered['solde'] < -100, df_filtered['solde'] < 0], ["🔴", "🟠"], "🟢"),
+                'Marque': df_filtered['marque'].to_numpy(),
+                'Type': df_filtered['type_produit'].to_numpy(),
+                'Conso/sem': df_filtered['conso_hebdo'].to_numpy(),
+                'Besoin': df_filtered['besoin_campagne'].to_numpy(),
+                'Affecté': df_filtered['total_net'].to_numpy(),
+                'Solde': df_filtered['solde'].to_numpy(),
+                'Couverture': df_filtered['couverture_semaines'].to_numpy(),
+                'Prix vente': prix_vente.to_numpy(dtype=float),
+                'Marge %': marge_pct,
+                'code_produit': df_filtered['code_produit'].to_numpy()
+            })
             
             # Formater
             df_show = df_display.drop(columns=['code_produit']).copy()
@@ -615,7 +392,7 @@ elif onglet == "🔍 Détail Produit":
         with col_right:
             st.markdown("#### 📈 Prévisions semaines")
             
-            prev_df = get_previsions_semaines(code_produit, 12)
+            prev_df = donnees['previsions'].get(code_produit, pd.DataFrame())
             
             if not prev_df.empty:
                 st.bar_chart(prev_df.set_index('semaine_label')['quantite_prevue_tonnes'])
@@ -633,7 +410,7 @@ elif onglet == "🔍 Détail Produit":
         # Lots affectés
         st.markdown("#### 📦 Lots affectés")
         
-        lots_df = get_lots_affectes_produit(code_produit)
+        lots_df = donnees['lots'].get(code_produit, pd.DataFrame())
         
         if not lots_df.empty:
             st.success(f"{len(lots_df)} lot(s) affecté(s) • {lots_df['poids_net'].sum():,.0f} T net")
@@ -2,7 +2,7 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 from datetime import datetime, date, timedelta
-from database import get_connection
+from database import get_connection, premiere_colonne
 from components import show_footer
 from auth import require_access
 import plotly.express as px
@@ -122,7 +122,6 @@ def pct_evol(v_new, v_old):
 # FONCTIONS BDD
 # ============================================================================
 
-@st.cache_data(ttl=3600)
 def detect_table_mapping_marque():
     """Détecte la table de mapping Emballage+Marque → Produit (défensif).
     
@@ -131,6 +130,7 @@ def detect_table_mapping_marque():
       - ref_produits_commerciaux (générique)
     
     Identifie les colonnes 'marque' et 'code' (= code_produit_commercial).
+    Lecture du catalogue du schéma en mémoire (database.schema), sans requête.
     
     Retourne un dict {'table', 'col_code', 'col_marque'} ou None si rien trouvé.
     """
@@ -138,32 +138,13 @@ def detect_table_mapping_marque():
     candidats_col_marque = ['marque', 'brand', 'nom_marque', 'marque_commerciale']
     candidats_col_code = ['code', 'code_produit_commercial', 'code_produit', 'codeproduit']
     
-    try:
-        conn = get_connection(); cur = conn.cursor()
-        for table in candidats_table:
-            # Lister les colonnes de la table
-            cur.execute("""
-                SELECT column_name FROM information_schema.columns
-                WHERE table_name = %s
-            """, (table,))
-            cols_rows = cur.fetchall()
-            if not cols_rows:
-                continue  # table n'existe pas
-            cols = [r['column_name'] if hasattr(r, 'get') else r[0] for r in cols_rows]
-            
-            # Trouver la colonne marque (premier match dans l'ordre des candidats)
-            col_marque = next((c for c in candidats_col_marque if c in cols), None)
-            # Trouver la colonne code
-            col_code = next((c for c in candidats_col_code if c in cols), None)
-            
-            if col_marque and col_code:
-                cur.close(); conn.close()
-                return {'table': table, 'col_code': col_code, 'col_marque': col_marque}
-        
-        cur.close(); conn.close()
-        return None
-    except Exception:
-        return None
+    for table in candidats_table:
+        # Premier match dans l'ordre des candidats (None si la table n'existe pas)
+        col_marque = premiere_colonne(table, candidats_col_marque)
+        col_code = premiere_colonne(table, candidats_col_code)
+        if col_marque and col_code:
+            return {'table': table, 'col_code': col_code, 'col_marque': col_marque}
+    return None
 
 
 MAPPING_MARQUE = detect_table_mapping_marque()  # détecté une fois au chargement
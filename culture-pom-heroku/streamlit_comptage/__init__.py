@@ -0,0 +1,164 @@
+"""
+Composant Streamlit de saisie d'inventaire tolérant aux coupures réseau.
+
+La saisie se fait dans l'iframe du composant, pas dans des widgets Streamlit :
+chaque comptage est d'abord écrit dans le stockage local du téléphone
+(localStorage), puis envoyé par lots quand la connexion le permet. Une coupure
+(chambre froide, bout de hangar) ne perd rien et ne bloque pas la saisie.
+
+Protocole navigateur -> Python (un lot en vol à la fois) :
+
+    {'type': 'lot', 'seq': N, 'lot_id': uuid, 'inventaire_id': id,
+     'encoding': 'gzip-b64' | 'json', 'data': [[ligne_id, quantité, ts_ms], ...]}
+
+Python -> navigateur : la liste des lot_id acquittés ('acks'). Tant que son
+lot n'est pas acquitté, le navigateur le renvoie avec le MÊME lot_id ; la
+fusion côté base est idempotente sur cet identifiant.
+
+Un lot refusé définitivement (inventaire clôturé) : appliquer() lève
+LotRejete. Le lot est acquitté ET listé dans 'rejets' ({lot_id: message}) ;
+le téléphone vide sa file, affiche le message et bloque la saisie.
+
+Les files d'inventaires absents de 'ouverts' (clôturés pendant une coupure,
+jamais renvoyés) sont supprimées du téléphone, avec le nombre de comptages
+perdus affiché ; file_comptage(None, ...) ne fait que ce nettoyage.
+"""
+import base64
+import gzip
+import json
+import os
+from datetime import datetime
+
+import streamlit as st
+import streamlit.components.v1 as components
+
+_component_func = components.declare_component(
+    "comptage_offline",
+    path=os.path.join(os.path.dirname(__file__), "frontend")
+)
+
+_STATE_PREFIX = "_comptage_state_"
+
+# Acquittements renvoyés au navigateur (les plus récents suffisent)
+_NB_ACKS = 50
+
+
+class LotRejete(Exception):
+    """Lot refusé définitivement : acquitté (plus de renvoi) et signalé au téléphone."""
+
+
+def _get_state(key):
+    state_key = f"{_STATE_PREFIX}{key}"
+    if state_key not in st.session_state:
+        st.session_state[state_key] = {
+            'last_seq': None,  # dernier message client traité
+            'acks': [],        # lot_id déjà fusionnés
+            'rejets': {},      # lot_id -> message, lots refusés définitivement
+            'resultat': None,  # résultat du dernier lot, non encore consommé
+        }
+    return st.session_state[state_key]
+
+
+def _decoder(payload):
+    """Comptages du lot : [(ligne_id, quantité, saisi_at datetime), ...]"""
+    data = payload.get('data')
+    if payload.get('encoding') == 'gzip-b64':
+        data = json.loads(gzip.decompress(base64.b64decode(data)).decode('utf-8'))
+    comptages = []
+    for ligne_id, qte, ts_ms in data or []:
+        comptages.append((
+            int(ligne_id),
+            None if qte is None else int(qte),
+            datetime.fromtimestamp(float(ts_ms) / 1000.0),
+        ))
+    return comptages
+
+
+def traiter_lots(key, appliquer):
+    """
+    Fusionne (une seule fois) le dernier lot envoyé par le navigateur.
+
+    À appeler AVANT de charger les lignes : la page affiche alors les valeurs
+    fusionnées dans le même rerun.
+
+    Args:
+        appliquer: fonction (inventaire_id, lot_id, comptages) -> (ok, message) ;
+                   le lot n'est acquitté que si ok, ou si elle lève LotRejete
+
+    Returns:
+        (ok, message) du lot traité pendant ce rerun, sinon None
+    """
+    state = _get_state(key)
+    payload = st.session_state.get(key)
+    if not isinstance(payload, dict):
+        return None
+    seq = payload.get('seq')
+    if seq is None or seq == state['last_seq']:
+        return None
+    state['last_seq'] = seq
+    if payload.get('type') != 'lot' or not payload.get('lot_id'):
+        return None
+
+    lot_id = str(payload['lot_id'])[:64]
+    if lot_id in state['acks']:
+        # Renvoi d'un lot déjà fusionné (acquittement perdu) : on réacquitte
+        return None
+    try:
+        comptages = _decoder(payload)
+    except Exception as e:
+        return False, f"❌ Lot illisible : {str(e)}"
+
+    try:
+        ok, message = appliquer(int(payload['inventaire_id']), lot_id, comptages)
+    except LotRejete as e:
+        ok, message = False, str(e)
+        state['rejets'][lot_id] = message
+        state['rejets'] = dict(list(state['rejets'].items())[-_NB_ACKS:])
+        state['acks'] = (state['acks'] + [lot_id])[-_NB_ACKS:]
+        return ok, message
+    if ok:
+        state['acks'] = (state['acks'] + [lot_id])[-_NB_ACKS:]
+    return ok, message
+
+
+def file_comptage(inventaire_id, lignes, appliquer, inventaires_ouverts=None, height=600, key=None):
+    """
+    Affiche la saisie hors ligne d'un inventaire.
+
+    Args:
+        inventaire_id: inventaire saisi, ou None (aucun ouvert : nettoyage seul)
+        lignes: [{id, nom, unite, atelier, stock_compte}, ...] tels qu'en base
+        appliquer: voir traiter_lots
+        inventaires_ouverts: ids des inventaires en cours ; les files des autres
+                             sont purgées du téléphone (None : pas de purge)
+        key: clé Streamlit (obligatoire, porte l'état de synchronisation)
+
+    Returns:
+        (ok, message) du lot traité pendant ce rerun, sinon None
+    """
+    if key is None:
+        raise ValueError("file_comptage() nécessite une clé (key)")
+
+    resultat = traiter_lots(key, appliquer)
+    state = _get_state(key)
+
+    _component_func(
+        inventaire_id=None if inventaire_id is None else int(inventaire_id),
+        lignes=[
+            {
+                'id': int(l['id']),
+                'nom': str(l['nom']),
+                'unite': str(l['unite']) if l.get('unite') else 'Unité',
+                'atelier': str(l['atelier']) if l.get('atelier') else 'SANS ATELIER',
+                'stock_compte': None if l.get('stock_compte') is None else int(l['stock_compte']),
+            }
+            for l in lignes
+        ],
+        acks=state['acks'],
+        rejets=state['rejets'],
+        ouverts=None if inventaires_ouverts is None else [int(i) for i in inventaires_ouverts],
+        height=height,
+        key=key,
+        default=None
+    )
+    return resultat
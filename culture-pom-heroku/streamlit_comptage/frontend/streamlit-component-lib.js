@@ -0,0 +1,28 @@
+(function(window) {
+  'use strict';
+  
+  window.Streamlit = {
+    RENDER_EVENT: 'streamlit:render',
+    events: {
+      addEventListener: function(type, callback) {
+        window.addEventListener(type, callback);
+      }
+    },
+    setComponentReady: function() {
+      window.parent.postMessage({isStreamlitMessage: true, type: 'streamlit:componentReady', apiVersion: 1}, '*');
+    },
+    setFrameHeight: function(height) {
+      window.parent.postMessage({isStreamlitMessage: true, type: 'streamlit:setFrameHeight', height: height}, '*');
+    },
+    setComponentValue: function(value) {
+      window.parent.postMessage({isStreamlitMessage: true, type: 'streamlit:setComponentValue', value: value, dataType: 'json'}, '*');
+    }
+  };
+  
+  window.addEventListener('message', function(event) {
+    if (event.data.type === 'streamlit:render') {
+      var renderEvent = new CustomEvent('streamlit:render', {detail: {args: event.data.args}});
+      window.dispatchEvent(renderEvent);
+    }
+  });
+})(window);
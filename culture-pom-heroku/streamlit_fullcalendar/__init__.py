@@ -1,28 +1,269 @@
-import streamlit.components.v1 as components
+"""
+Composant Streamlit bidirectionnel FullCalendar (declare_component).
+
+Contrairement à un components.html ré-injecté à chaque rerun, l'iframe du
+composant est montée une seule fois : FullCalendar et ses événements restent
+côté navigateur. Python n'envoie que des deltas :
+
+    {'revision': R, 'base_revision': R0, 'reset': bool,
+     'add': [event, ...], 'update': [event, ...], 'remove': [id, ...]}
+
+Le navigateur applique le delta seulement si sa révision locale vaut
+base_revision ; sinon il demande une resynchronisation complète ('resync').
+
+Protocole fenêtré :
+- le calendrier signale la plage visible à chaque navigation ('range') ;
+- la page appelle get_visible_range(key) puis ne charge que cette plage ;
+- fullcalendar(events, window=...) calcule le delta sur cette fenêtre uniquement
+  (les semaines déjà visitées restent en cache côté client).
+
+Les assets FullCalendar (version figée) sont servis localement depuis
+frontend/vendor/ (voir fetch_assets.py), avec repli CDN de la même version
+tant que le dossier n'a pas été alimenté et committé.
+"""
+import json
+import math
 import os
+from datetime import date, datetime, timedelta
+
+import streamlit as st
+import streamlit.components.v1 as components
 
 _component_func = components.declare_component(
     "fullcalendar",
     path=os.path.join(os.path.dirname(__file__), "frontend")
 )
 
+_STATE_PREFIX = "_fullcalendar_state_"
+
+# Messages consommés par le protocole (non renvoyés à la page)
+_INTERNAL_TYPES = {'range', 'resync', 'ready'}
+
+
+def _get_state(key):
+    """État de synchronisation Python ↔ navigateur pour un calendrier."""
+    state_key = f"{_STATE_PREFIX}{key}"
+    if state_key not in st.session_state:
+        st.session_state[state_key] = {
+            'revision': 0,       # dernière révision envoyée
+            'sent': {},          # id -> (signature, date début ISO)
+            'range': None,       # (date_debut, date_fin exclusive)
+            'initial_date': None,
+            'needs_reset': True, # le client doit repartir d'un instantané
+            'last_seq': None,    # dernier message client traité
+            'pending': None,     # événement utilisateur non encore consommé
+        }
+    return st.session_state[state_key]
+
+
+def _clean(value):
+    """Rend une valeur sérialisable JSON (types numpy, NaN, dates)."""
+    if value is None or isinstance(value, (str, bool)):
+        return value
+    if isinstance(value, dict):
+        return {str(k): _clean(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_clean(v) for v in value]
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, float):
+        return None if math.isnan(value) or math.isinf(value) else value
+    if isinstance(value, int):
+        return value
+    return str(value)
+
+
+def _signature(event):
+    return json.dumps(event, sort_keys=True, separators=(',', ':'))
+
+
+def _week_window(initial_date):
+    if isinstance(initial_date, str):
+        initial_date = date.fromisoformat(initial_date[:10])
+    if isinstance(initial_date, datetime):
+        initial_date = initial_date.date()
+    initial_date = initial_date or date.today()
+    week_start = initial_date - timedelta(days=initial_date.weekday())
+    return week_start, week_start + timedelta(days=7)
+
+
+def _sync_from_client(key):
+    """Traite (une seule fois) le dernier message envoyé par le navigateur."""
+    state = _get_state(key)
+    payload = st.session_state.get(key)
+    if not isinstance(payload, dict):
+        return state
+    seq = payload.get('seq')
+    if seq is None or seq == state['last_seq']:
+        return state
+    state['last_seq'] = seq
+
+    visible = payload.get('range') or {}
+    if visible.get('start') and visible.get('end'):
+        state['range'] = (
+            date.fromisoformat(visible['start'][:10]),
+            date.fromisoformat(visible['end'][:10]),
+        )
+
+    if payload.get('type') == 'resync':
+        # Iframe rechargée ou delta manqué : on renverra la fenêtre complète
+        state['sent'] = {}
+        state['needs_reset'] = True
+    elif payload.get('type') not in _INTERNAL_TYPES:
+        state['pending'] = payload
+    return state
+
+
+def get_visible_range(key, initial_date=None):
+    """
+    Plage de dates actuellement affichée par le calendrier.
+
+    Returns:
+        (date_debut, date_fin) avec date_fin exclusive. Avant le premier
+        message du navigateur : la semaine (lundi → lundi suivant) de initial_date.
+    """
+    state = _sync_from_client(key)
+    if initial_date is not None and str(initial_date) != state['initial_date']:
+        # La page a changé la date de référence (sélecteur de semaine)
+        state['initial_date'] = str(initial_date)
+        state['range'] = _week_window(initial_date)
+    if state['range'] is None:
+        state['range'] = _week_window(initial_date)
+    return state['range']
+
+
+def consume_event(key):
+    """
+    Retourne le dernier événement utilisateur (click, drop, resize,
+    external_drop) une seule fois, puis None aux reruns suivants.
+
+    À appeler AVANT de charger les données : les écritures faites en réaction
+    sont alors incluses dans le delta du même rerun (pas de st.rerun()).
+    """
+    state = _sync_from_client(key)
+    event, state['pending'] = state['pending'], None
+    return event
+
+
+def invalidate_events(key, event_ids=None):
+    """
+    Force le renvoi d'événements au prochain rendu (ex : drop refusé en base,
+    le navigateur doit revenir à la position enregistrée). Sans ids : tous.
+    """
+    state = _get_state(key)
+    if event_ids is None:
+        state['sent'] = {}
+        return
+    for event_id in event_ids:
+        state['sent'].pop(str(event_id), None)
+
+
+def compute_delta(sent, events, window=None):
+    """
+    Compare les événements courants à ceux déjà envoyés.
+
+    Args:
+        sent: dict id -> (signature, début ISO) des événements connus du client
+        events: événements courants (dicts FullCalendar déjà nettoyés)
+        window: (date_debut, date_fin exclusive) couverte par events, ou None
+                si events représente l'ensemble des données
+
+    Returns:
+        (add, update, remove, new_sent)
+    """
+    add, update = [], []
+    new_sent = dict(sent)
+    current_ids = set()
+    for event in events:
+        event_id = str(event['id'])
+        current_ids.add(event_id)
+        signature = _signature(event)
+        known = sent.get(event_id)
+        if known is None:
+            add.append(event)
+        elif known[0] != signature:
+            update.append(event)
+        else:
+            continue
+        new_sent[event_id] = (signature, str(event.get('start') or '')[:10])
+
+    if window is not None:
+        start_iso, end_iso = window[0].isoformat(), window[1].isoformat()
+    remove = []
+    for event_id, (_, start) in sent.items():
+        if event_id in current_ids:
+            continue
+        if window is None or (start_iso <= start < end_iso):
+            remove.append(event_id)
+            new_sent.pop(event_id, None)
+    return add, update, remove, new_sent
+
+
 def fullcalendar(
     events=None,
-    external_events=None,
+    window=None,
     initial_date=None,
     locale='fr',
     editable=True,
     droppable=True,
+    height=650,
+    options=None,
     key=None
 ):
-    component_value = _component_func(
-        events=events or [],
-        external_events=external_events or [],
-        initial_date=initial_date,
+    """
+    Affiche le calendrier et synchronise les événements par delta.
+
+    Args:
+        events: événements [{id, title, start, end, color, extendedProps}, ...]
+                de la fenêtre `window` (ou de tout le jeu si window=None)
+        window: (date_debut, date_fin exclusive) chargée par la page,
+                en général get_visible_range(key)
+        initial_date: date de positionnement initial
+        options: options FullCalendar supplémentaires (slotMinTime, ...)
+        key: clé Streamlit (obligatoire, porte l'état de synchronisation)
+
+    Returns:
+        Dernier événement utilisateur non consommé (voir consume_event), ou None.
+    """
+    if key is None:
+        raise ValueError("fullcalendar() nécessite une clé (key) pour le suivi des deltas")
+
+    state = _sync_from_client(key)
+    if state['range'] is None:
+        state['range'] = window or _week_window(initial_date)
+
+    cleaned = [_clean(e) for e in (events or [])]
+    reset = state['needs_reset']
+    add, update, remove, new_sent = compute_delta(state['sent'], cleaned, window)
+
+    base_revision = state['revision']
+    if reset or add or update or remove:
+        state['revision'] += 1
+    state['sent'] = new_sent
+    state['needs_reset'] = False
+
+    delta = {
+        'revision': state['revision'],
+        'base_revision': base_revision,
+        'reset': reset,
+        'add': add,
+        'update': update,
+        'remove': remove,
+    }
+    visible = state['range']
+
+    _component_func(
+        delta=delta,
+        initial_date=str(initial_date or visible[0]),
+        window={'start': visible[0].isoformat(), 'end': visible[1].isoformat()},
         locale=locale,
         editable=editable,
         droppable=droppable,
+        height=height,
+        options=_clean(options or {}),
         key=key,
         default=None
     )
-    return component_value
+    return consume_event(key)
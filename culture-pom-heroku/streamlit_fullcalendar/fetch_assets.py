@@ -0,0 +1,46 @@
+"""
+Télécharge les assets FullCalendar dans frontend/vendor/ pour un chargement
+hors-ligne (et mis en cache navigateur) du composant.
+
+Exécuter une fois, puis committer le dossier vendor :
+    python -m streamlit_fullcalendar.fetch_assets
+"""
+import os
+import sys
+
+import requests
+
+FULLCALENDAR_VERSION = "6.1.10"
+
+VENDOR_DIR = os.path.join(
+    os.path.dirname(__file__), "frontend", "vendor", f"fullcalendar-{FULLCALENDAR_VERSION}"
+)
+
+# Chemin local (relatif à VENDOR_DIR) -> URL CDN
+ASSETS = {
+    "index.global.min.js":
+        f"https://cdn.jsdelivr.net/npm/fullcalendar@{FULLCALENDAR_VERSION}/index.global.min.js",
+    "locales/fr.global.min.js":
+        f"https://cdn.jsdelivr.net/npm/@fullcalendar/core@{FULLCALENDAR_VERSION}/locales/fr.global.min.js",
+}
+
+
+def fetch_assets(force=False):
+    """Télécharge les assets manquants. Retourne la liste des fichiers écrits."""
+    written = []
+    for rel_path, url in ASSETS.items():
+        target = os.path.join(VENDOR_DIR, rel_path)
+        if os.path.exists(target) and not force:
+            continue
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        response = requests.get(url, timeout=30)
+        response.raise_for_status()
+        with open(target, "wb") as f:
+            f.write(response.content)
+        written.append(target)
+    return written
+
+
+if __name__ == "__main__":
+    for path in fetch_assets(force="--force" in sys.argv):
+        print(f"OK {path}")
@@ -9,13 +9,13 @@
       }
     },
     setComponentReady: function() {
-      window.parent.postMessage({type: 'streamlit:componentReady', apiVersion: 1}, '*');
+      window.parent.postMessage({isStreamlitMessage: true, type: 'streamlit:componentReady', apiVersion: 1}, '*');
     },
     setFrameHeight: function(height) {
-      window.parent.postMessage({type: 'streamlit:setFrameHeight', height: height}, '*');
+      window.parent.postMessage({isStreamlitMessage: true, type: 'streamlit:setFrameHeight', height: height}, '*');
     },
     setComponentValue: function(value) {
-      window.parent.postMessage({type: 'streamlit:setComponentValue', value: value}, '*');
+      window.parent.postMessage({isStreamlitMessage: true, type: 'streamlit:setComponentValue', value: value, dataType: 'json'}, '*');
     }
   };
   
@@ -0,0 +1,338 @@
+# utils/allocation_fifo.py
+"""
+Allocation FIFO des lots en stock aux prévisions de vente, sur toute la campagne.
+
+Demande : previsions_ventes, matrice produits × semaines (semaine en cours →
+fin de campagne). Le net déjà affecté à un produit couvre d'abord ses
+semaines les plus proches (comme la vue par semaine de la page).
+
+Offre : stock libre de get_stock_par_lot, découpé en unités (lot, LAVÉ) et
+(lot, BRUT) — net après tare réelle ou théorique, brut pour l'écriture.
+Unités servies en FIFO : date de passage prévue du lot, puis date d'entrée
+en stock, LAVÉ avant BRUT.
+
+Semaine par semaine, chaque produit consomme les unités compatibles
+(même variété, ou toutes si le produit n'impose pas de variété) dans
+l'ordre FIFO ; les produits à variété imposée sont servis en premier dans
+la semaine. Chaque consommation est vectorisée (sommes cumulées sur les
+unités candidates) : la campagne complète se calcule en quelques dizaines
+de millisecondes.
+
+L'écriture des allocations acceptées est UNE requête : répartition sur les
+emplacements du lot (plus gros d'abord) et contrôle du disponible au moment
+de l'écriture — ce qui a été pris entre-temps est simplement écarté.
+
+Fonctions exposées :
+- semaines_campagne(today=None) -> (premier index, dernier index)
+- charger_demande(premiere, derniere) -> (demande, varietes par produit, net déjà affecté)
+- unites_stock(stock_df) -> DataFrame des unités, en ordre FIFO
+- allouer(demande, affecte, varietes, unites) -> dict de tableaux + DataFrame allocations
+- enregistrer_allocations(allocations, created_by) -> (ok, message)
+"""
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from database import get_connection
+from utils.previsions import index_semaine, semaine_de_index, matrice_previsions
+from utils.soldes_produits import date_fin_campagne
+
+EPS = 1e-6
+
+
+def _lundi(idx):
+    return date.fromordinal(int(idx) * 7 + 1)
+
+
+def semaines_campagne(today=None):
+    """Index de la semaine en cours et de la semaine de fin de campagne"""
+    today = today or date.today()
+    fin = date_fin_campagne(today).isocalendar()
+    iso = today.isocalendar()
+    return index_semaine(iso[0], iso[1]), index_semaine(fin[0], fin[1])
+
+
+# ============================================================
+# DONNÉES
+# ============================================================
+
+def charger_demande(premiere, derniere):
+    """
+    Prévisions de la campagne, variété de chaque produit et net déjà affecté.
+
+    Returns:
+        (DataFrame produits × index semaine (0 = pas de prévision),
+         Series code_variete par produit ('' = toutes variétés),
+         Series net déjà affecté par produit)
+    """
+    a1, s1 = semaine_de_index(premiere)
+    a2, s2 = semaine_de_index(derniere)
+
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT pv.code_produit_commercial, pv.annee, pv.semaine, pv.quantite_prevue_tonnes
+            FROM previsions_ventes pv
+            JOIN ref_produits_commerciaux pc ON pc.code_produit = pv.code_produit_commercial
+            WHERE pc.is_active = TRUE
+              AND (pv.annee, pv.semaine) BETWEEN (%s, %s) AND (%s, %s)
+              AND pv.quantite_prevue_tonnes > 0
+        """, (a1, s1, a2, s2))
+        previsions = cursor.fetchall()
+
+        cursor.execute("""
+            SELECT pc.code_produit, COALESCE(pc.code_variete, '') AS code_variete,
+                   COALESCE(SUM(pa.poids_net_estime_tonnes), 0) AS affecte_net
+            FROM ref_produits_commerciaux pc
+            LEFT JOIN previsions_affectations pa
+                   ON pa.code_produit_commercial = pc.code_produit AND pa.is_active = TRUE
+            WHERE pc.is_active = TRUE
+            GROUP BY pc.code_produit, pc.code_variete
+        """)
+        produits = cursor.fetchall()
+        cursor.close()
+    finally:
+        conn.close()
+
+    demande = matrice_previsions(pd.DataFrame(previsions) if previsions else None,
+                                 premiere=premiere, derniere=derniere)
+    demande = demande.reindex(columns=range(premiere, derniere + 1)).fillna(0.0)
+
+    produits = pd.DataFrame(produits, columns=['code_produit', 'code_variete', 'affecte_net']).set_index('code_produit')
+    varietes = produits['code_variete'].reindex(demande.index).fillna('')
+    affecte = pd.to_numeric(produits['affecte_net'], errors='coerce').reindex(demande.index).fillna(0.0)
+    return demande, varietes, affecte
+
+
+def unites_stock(stock_df):
+    """
+    Unités d'offre (lot × LAVÉ/BRUT) depuis get_stock_par_lot, triées FIFO.
+
+    Returns:
+        DataFrame lot_id, code_lot_interne, code_variete, statut_stock, net, brut,
+        tare_pct, tare_source
+    """
+    colonnes = ['lot_id', 'code_lot_interne', 'code_variete', 'statut_stock',
+                'net', 'brut', 'tare_pct', 'tare_source']
+    if stock_df is None or stock_df.empty:
+        return pd.DataFrame(columns=colonnes)
+
+    base = stock_df.assign(
+        passage=pd.to_datetime(stock_df.get('date_passage_prevue'), errors='coerce'),
+        entree=pd.to_datetime(stock_df.get('date_entree_stock'), errors='coerce'),
+    )
+    lave = base.assign(
+        statut_stock='LAVÉ', rang_type=0,
+        net=base['stock_lave_tonnes'], brut=base['stock_lave_tonnes'],
+        tare_pct=0.0, tare_source='AUCUNE',
+    )
+    brut = base.assign(
+        statut_stock='BRUT', rang_type=1,
+        net=base['stock_brut_net_tonnes'], brut=base['stock_brut_tonnes'],
+    )
+    with np.errstate(divide='ignore', invalid='ignore'):
+        brut['tare_pct'] = np.where(brut['brut'] > 0, (1 - brut['net'] / brut['brut']) * 100, 0.0)
+    brut['tare_source'] = brut['tare_source'].fillna('THEORIQUE')
+
+    unites = pd.concat([lave, brut], ignore_index=True)
+    unites = unites[(unites['net'] > EPS) & (unites['brut'] > EPS)]
+    unites['code_variete'] = unites['code_variete'].fillna('').astype(str)
+    unites = unites.sort_values(['passage', 'entree', 'rang_type', 'code_lot_interne'], na_position='last')
+    return unites[colonnes].reset_index(drop=True)
+
+
+# ============================================================
+# ALLOCATION
+# ============================================================
+
+def allouer(demande, affecte, varietes, unites):
+    """
+    Couverture semaine par semaine de toute la campagne.
+
+    Returns:
+        dict :
+        - 'demande', 'couvert_existant', 'couvert_nouveau', 'manque' : tableaux produits × semaines
+        - 'produits' (codes), 'semaines' (index de semaine)
+        - 'reste_unites' : net restant par unité
+        - 'allocations' : DataFrame lot_id, statut_stock, code_produit, net, brut, tare_pct,
+          tare_source, annee, semaine, date_debut, date_fin (une ligne par unité × produit)
+    """
+    produits = demande.index.to_numpy()
+    semaines = np.asarray(demande.columns, dtype=int)
+    D = np.clip(demande.to_numpy(dtype=float), 0, None)
+    P, W = D.shape
+
+    # Le déjà-affecté couvre d'abord les semaines les plus proches
+    E = affecte.reindex(demande.index).fillna(0).to_numpy(dtype=float)
+    couvert_existant = np.clip(E[:, None] - (np.cumsum(D, axis=1) - D), 0, D)
+    besoin = D - couvert_existant
+
+    reste = unites['net'].to_numpy(dtype=float).copy()
+    U = len(reste)
+    var_p = varietes.reindex(demande.index).fillna('').astype(str).to_numpy()
+    var_u = unites['code_variete'].to_numpy(dtype=str)
+    compatible = (var_p[:, None] == '') | (var_p[:, None] == var_u[None, :])
+    candidats = [np.flatnonzero(compatible[p]) for p in range(P)]
+    ordre = np.argsort(var_p == '', kind='stable')      # variété imposée d'abord
+
+    alloue = np.zeros((U, P))
+    debut = np.full((U, P), -1)
+    fin = np.full((U, P), -1)
+    couvert_nouveau = np.zeros((P, W))
+
+    for w in range(W):
+        for p in ordre:
+            b = besoin[p, w]
+            idx = candidats[p]
+            if b <= EPS or not len(idx):
+                continue
+            r = reste[idx]
+            pris = np.clip(b - (np.cumsum(r) - r), 0, r)
+            touches = pris > EPS
+            if not touches.any():
+                continue
+            u = idx[touches]
+            reste[u] -= pris[touches]
+            alloue[u, p] += pris[touches]
+            debut[u, p] = np.where(debut[u, p] < 0, w, debut[u, p])
+            fin[u, p] = w
+            couvert_nouveau[p, w] = pris.sum()
+            candidats[p] = idx[reste[idx] > EPS]
+
+    iu, ip = np.nonzero(alloue > EPS)
+    net_u = unites['net'].to_numpy(dtype=float)
+    brut_u = unites['brut'].to_numpy(dtype=float)
+    net = alloue[iu, ip]
+    semaine_debut = semaines[debut[iu, ip]] if len(iu) else np.array([], dtype=int)
+    semaine_fin = semaines[fin[iu, ip]] if len(iu) else np.array([], dtype=int)
+    iso = [semaine_de_index(s) for s in semaine_debut]
+
+    allocations = pd.DataFrame({
+        'lot_id': unites['lot_id'].to_numpy()[iu],
+        'code_lot_interne': unites['code_lot_interne'].to_numpy()[iu],
+        'statut_stock': unites['statut_stock'].to_numpy()[iu],
+        'code_produit': produits[ip],
+        'net': net,
+        'brut': net * brut_u[iu] / net_u[iu],
+        'tare_pct': unites['tare_pct'].to_numpy(dtype=float)[iu],
+        'tare_source': unites['tare_source'].to_numpy()[iu],
+        'annee': [a for a, _ in iso],
+        'semaine': [s for _, s in iso],
+        'date_debut': [_lundi(s) for s in semaine_debut],
+        'date_fin': [_lundi(s) + timedelta(days=6) for s in semaine_fin],
+    })
+
+    return {
+        'produits': produits,
+        'semaines': semaines,
+        'demande': D,
+        'couvert_existant': couvert_existant,
+        'couvert_nouveau': couvert_nouveau,
+        'manque': besoin - couvert_nouveau,
+        'reste_unites': reste,
+        'allocations': allocations.sort_values(['date_debut', 'code_produit']).reset_index(drop=True),
+    }
+
+
+# ============================================================
+# ÉCRITURE
+# ============================================================
+
+def enregistrer_allocations(allocations, created_by):
+    """
+    Crée les affectations acceptées en UNE requête.
+
+    Chaque allocation est répartie sur les emplacements actifs du lot et du
+    type de stock (plus gros disponible d'abord), dans la limite du
+    disponible à l'instant de l'écriture.
+
+    Returns:
+        (ok, message)
+    """
+    if allocations is None or allocations.empty:
+        return False, "❌ Aucune allocation à enregistrer"
+
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext('previsions_affectations'))")
+
+        valeurs = ",".join(
+            cursor.mogrify(
+                "(%s::integer, %s::integer, %s::text, %s::text, %s::numeric, %s::numeric, "
+                "%s::numeric, %s::text, %s::integer, %s::integer, %s::date, %s::date)",
+                (rang, int(a.lot_id), a.statut_stock, a.code_produit, float(a.brut), float(a.net),
+                 float(a.tare_pct), a.tare_source, int(a.annee), int(a.semaine), a.date_debut, a.date_fin)
+            ).decode()
+            for rang, a in enumerate(allocations.itertuples(index=False))
+        )
+
+        cursor.execute(f"""
+            WITH v (rang, lot_id, statut_stock, code_produit, brut, net, tare_pct, tare_source,
+                    annee, semaine, date_debut, date_fin) AS (
+                VALUES {valeurs}
+            ),
+            aff AS (
+                SELECT emplacement_id, SUM(quantite_affectee_tonnes) AS tonnes
+                FROM previsions_affectations
+                WHERE is_active = TRUE
+                GROUP BY emplacement_id
+            ),
+            empl AS (
+                SELECT se.id AS emplacement_id, se.lot_id,
+                       CASE WHEN COALESCE(se.type_stock, se.statut_lavage, 'BRUT') = 'LAVÉ'
+                            THEN 'LAVÉ' ELSE 'BRUT' END AS statut_stock,
+                       se.poids_total_kg / 1000.0 - COALESCE(aff.tonnes, 0) AS dispo
+                FROM stock_emplacements se
+                LEFT JOIN aff ON aff.emplacement_id = se.id
+                WHERE se.is_active = TRUE AND se.nombre_unites > 0
+                  AND COALESCE(se.type_stock, se.statut_lavage, 'BRUT') IN ('LAVÉ', 'BRUT', 'GRENAILLES')
+                  AND se.lot_id IN (SELECT lot_id FROM v)
+            ),
+            empl_cumul AS (
+                SELECT e.*, SUM(dispo) OVER (PARTITION BY lot_id, statut_stock
+                                             ORDER BY dispo DESC, emplacement_id) AS fin_e
+                FROM empl e
+                WHERE dispo > 0
+            ),
+            demandes AS (
+                SELECT v.*, SUM(brut) OVER (PARTITION BY lot_id, statut_stock ORDER BY rang) AS fin_v
+                FROM v
+            ),
+            parts AS (
+                SELECT d.*, e.emplacement_id,
+                       LEAST(d.fin_v, e.fin_e) - GREATEST(d.fin_v - d.brut, e.fin_e - e.dispo) AS part
+                FROM demandes d
+                JOIN empl_cumul e ON e.lot_id = d.lot_id AND e.statut_stock = d.statut_stock
+            )
+            INSERT INTO previsions_affectations (
+                code_produit_commercial, annee, semaine, lot_id, emplacement_id, statut_stock,
+                quantite_affectee_tonnes, poids_net_estime_tonnes, tare_utilisee_pct, tare_source,
+                type_affectation, date_debut_estimee, date_fin_estimee, date_passage_prevue,
+                is_active, created_by
+            )
+            SELECT code_produit, annee, semaine, lot_id, emplacement_id, statut_stock,
+                   part, part * net / brut, tare_pct, tare_source,
+                   'CT', date_debut, date_fin, date_debut,
+                   TRUE, %s
+            FROM parts
+            WHERE part > 0.0005
+            RETURNING poids_net_estime_tonnes
+        """, (created_by,))
+        ecrits = cursor.fetchall()
+        conn.commit()
+        cursor.close()
+    except Exception as e:
+        conn.rollback()
+        return False, f"❌ Erreur : {str(e)}"
+    finally:
+        conn.close()
+
+    net_ecrit = sum(float(r['poids_net_estime_tonnes']) for r in ecrits)
+    net_demande = float(allocations['net'].sum())
+    message = f"✅ {len(ecrits)} affectation(s) créée(s) — {net_ecrit:.1f} T net"
+    if net_ecrit < net_demande - 0.05:
+        message += f" ⚠️ {net_demande - net_ecrit:.1f} T écartées (stock pris entre-temps)"
+    return True, message
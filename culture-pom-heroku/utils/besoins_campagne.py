@@ -0,0 +1,225 @@
+# utils/besoins_campagne.py
+"""
+Besoins de la campagne : UNE requête pour toute la page Analyse des Besoins.
+
+La requête renvoie une seule ligne de quatre agrégats JSON, calculés sur
+les mêmes CTE (les affectations actives ne sont lues qu'une fois) :
+- besoins       : conso hebdo, besoin, affecté, prix/tare moyens, solde,
+                  couverture, par produit ;
+- lots          : lots affectés de tous ces produits, ordre de passage ;
+- previsions    : les N prochaines semaines de prévision de ces produits ;
+- stock_varietes: stock brut non affecté par variété.
+
+Lots et prévisions sont rangés dans des dictionnaires par code produit :
+changer de produit sur la page est une simple lecture, sans requête.
+
+Tables lues : voir TABLES_BESOINS (clé d'invalidation, cf. utils/cache_tables).
+
+Fonctions exposées :
+- TABLES_BESOINS
+- charger_besoins_campagne(date_fin, today=None, nb_semaines_prev=12) -> dict
+"""
+from datetime import date
+
+import pandas as pd
+
+from database import get_connection, expr_tare_lots
+
+TABLES_BESOINS = ('previsions_ventes', 'previsions_affectations', 'ref_produits_commerciaux', 'lots_bruts')
+
+
+def _numeriques(df, colonnes):
+    for col in colonnes:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+    return df
+
+
+def _dates(df, colonnes):
+    for col in colonnes:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], errors='coerce').dt.date
+    return df
+
+
+def charger_besoins_campagne(date_fin, today=None, nb_semaines_prev=12):
+    """
+    Returns:
+        dict
+        - 'besoins': DataFrame (tri : critiques, attention, OK puis solde croissant)
+        - 'semaines_restantes': float
+        - 'lots': {code_produit: DataFrame des lots affectés}
+        - 'previsions': {code_produit: DataFrame annee, semaine, quantite_prevue_tonnes, semaine_label}
+        - 'stock_varietes': DataFrame
+    """
+    today = today or date.today()
+    semaines_restantes = max(1, (date_fin - today).days / 7.0)
+    semaine_courante = today.isocalendar()[1]
+    annee_courante = today.year
+
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        tare_expr = expr_tare_lots()
+        cursor.execute(f"""
+            WITH conso_hebdo AS (
+                SELECT code_produit_commercial, AVG(quantite_prevue_tonnes) as conso_hebdo
+                FROM (
+                    SELECT code_produit_commercial, quantite_prevue_tonnes,
+                           ROW_NUMBER() OVER (PARTITION BY code_produit_commercial ORDER BY annee, semaine) as rn
+                    FROM previsions_ventes
+                    WHERE (annee = %(annee)s AND semaine >= %(semaine)s) OR annee > %(annee)s
+                ) sub WHERE rn <= 5
+                GROUP BY code_produit_commercial
+            ),
+            aff AS (
+                SELECT
+                    pa.id,
+                    pa.code_produit_commercial,
+                    pa.lot_id,
+                    l.code_lot_interne,
+                    v.nom_variete,
+                    pa.quantite_affectee_tonnes as poids_brut,
+                    pa.poids_net_estime_tonnes as poids_net,
+                    COALESCE(l.prix_achat_euro_tonne, 0) as prix_achat,
+                    {tare_expr} as tare_pct,
+                    pa.date_passage_prevue,
+                    l.date_entree_stock
+                FROM previsions_affectations pa
+                JOIN lots_bruts l ON pa.lot_id = l.id
+                LEFT JOIN ref_varietes v ON l.code_variete = v.code_variete
+                WHERE pa.is_active = TRUE
+            ),
+            affectations_detail AS (
+                SELECT
+                    code_produit_commercial,
+                    COUNT(*) as nb_lots,
+                    SUM(poids_brut) as total_brut,
+                    SUM(poids_net) as total_net,
+                    SUM(poids_brut * prix_achat) / NULLIF(SUM(poids_brut), 0) as prix_achat_moyen,
+                    SUM(poids_brut * tare_pct) / NULLIF(SUM(poids_brut), 0) as tare_moyenne
+                FROM aff
+                GROUP BY code_produit_commercial
+            ),
+            besoins AS (
+                SELECT
+                    pc.code_produit,
+                    pc.marque,
+                    pc.type_produit,
+                    pc.libelle,
+                    pc.atelier,
+                    COALESCE(ch.conso_hebdo, 0) as conso_hebdo,
+                    COALESCE(ch.conso_hebdo, 0) * %(sem_rest)s as besoin_campagne,
+                    COALESCE(ad.nb_lots, 0) as nb_lots,
+                    COALESCE(ad.total_brut, 0) as total_brut,
+                    COALESCE(ad.total_net, 0) as total_net,
+                    COALESCE(ad.prix_achat_moyen, 0) as prix_achat_moyen,
+                    COALESCE(ad.tare_moyenne, 22) as tare_moyenne,
+                    COALESCE(ad.total_net, 0) - (COALESCE(ch.conso_hebdo, 0) * %(sem_rest)s) as solde,
+                    CASE
+                        WHEN COALESCE(ch.conso_hebdo, 0) > 0
+                        THEN COALESCE(ad.total_net, 0) / ch.conso_hebdo
+                        ELSE 0
+                    END as couverture_semaines
+                FROM ref_produits_commerciaux pc
+                LEFT JOIN conso_hebdo ch ON pc.code_produit = ch.code_produit_commercial
+                LEFT JOIN affectations_detail ad ON pc.code_produit = ad.code_produit_commercial
+                WHERE pc.is_active = TRUE
+                  AND (COALESCE(ch.conso_hebdo, 0) > 0 OR COALESCE(ad.total_net, 0) > 0)
+            ),
+            previsions AS (
+                SELECT code_produit_commercial, annee, semaine, quantite_prevue_tonnes
+                FROM (
+                    SELECT code_produit_commercial, annee, semaine, quantite_prevue_tonnes,
+                           ROW_NUMBER() OVER (PARTITION BY code_produit_commercial ORDER BY annee, semaine) as rn
+                    FROM previsions_ventes
+                    WHERE ((annee = %(annee)s AND semaine >= %(semaine)s) OR annee > %(annee)s)
+                      AND code_produit_commercial IN (SELECT code_produit FROM besoins)
+                ) sub WHERE rn <= %(nb_prev)s
+            ),
+            lots_stock AS (
+                SELECT
+                    l.id,
+                    v.nom_variete,
+                    l.poids_total_brut_kg / 1000 as poids_brut,
+                    (l.poids_total_brut_kg / 1000) * (1 - {tare_expr} / 100) as poids_net
+                FROM lots_bruts l
+                LEFT JOIN ref_varietes v ON l.code_variete = v.code_variete
+                WHERE l.is_active = TRUE AND l.poids_total_brut_kg > 0
+            ),
+            affecte_lot AS (
+                SELECT lot_id, SUM(poids_brut) as affecte
+                FROM aff
+                GROUP BY lot_id
+            ),
+            stock_varietes AS (
+                SELECT
+                    ls.nom_variete,
+                    SUM(ls.poids_brut) as poids_brut_total,
+                    SUM(ls.poids_net) as poids_net_total,
+                    SUM(COALESCE(a.affecte, 0)) as affecte_total,
+                    SUM(ls.poids_brut - COALESCE(a.affecte, 0)) as disponible_brut
+                FROM lots_stock ls
+                LEFT JOIN affecte_lot a ON ls.id = a.lot_id
+                GROUP BY ls.nom_variete
+                HAVING SUM(ls.poids_brut - COALESCE(a.affecte, 0)) > 0
+            )
+            SELECT
+                (SELECT COALESCE(json_agg(b), '[]') FROM besoins b) as besoins,
+                (SELECT COALESCE(json_agg(a ORDER BY a.code_produit_commercial, a.date_passage_prevue NULLS LAST, a.prix_achat), '[]')
+                 FROM aff a WHERE a.code_produit_commercial IN (SELECT code_produit FROM besoins)) as lots,
+                (SELECT COALESCE(json_agg(p ORDER BY p.code_produit_commercial, p.annee, p.semaine), '[]')
+                 FROM previsions p) as previsions,
+                (SELECT COALESCE(json_agg(s ORDER BY s.disponible_brut DESC), '[]') FROM stock_varietes s) as stock_varietes
+        """, {
+            'annee': annee_courante, 'semaine': semaine_courante,
+            'sem_rest': semaines_restantes, 'nb_prev': nb_semaines_prev,
+        })
+        row = cursor.fetchone()
+        cursor.close()
+    finally:
+        conn.close()
+
+    # Besoins
+    besoins = pd.DataFrame(row['besoins'])
+    if not besoins.empty:
+        besoins = _numeriques(besoins, ['conso_hebdo', 'besoin_campagne', 'nb_lots', 'total_brut', 'total_net',
+                                        'prix_achat_moyen', 'tare_moyenne', 'solde', 'couverture_semaines'])
+        priorite = pd.cut(besoins['solde'], [-float('inf'), -100, 0, float('inf')], right=False, labels=[1, 2, 3])
+        besoins = (besoins.assign(_priorite=priorite.astype(int))
+                   .sort_values(['_priorite', 'solde'])
+                   .drop(columns='_priorite')
+                   .reset_index(drop=True))
+
+    # Lots affectés, par produit
+    lots = pd.DataFrame(row['lots'])
+    lots_par_produit = {}
+    if not lots.empty:
+        lots = _dates(_numeriques(lots, ['poids_brut', 'poids_net', 'prix_achat', 'tare_pct']),
+                      ['date_passage_prevue', 'date_entree_stock'])
+        lots_par_produit = {
+            code: groupe.drop(columns='code_produit_commercial').reset_index(drop=True)
+            for code, groupe in lots.groupby('code_produit_commercial', sort=False)
+        }
+
+    # Prévisions des prochaines semaines, par produit
+    previsions = pd.DataFrame(row['previsions'])
+    previsions_par_produit = {}
+    if not previsions.empty:
+        previsions = _numeriques(previsions, ['quantite_prevue_tonnes'])
+        previsions['semaine_label'] = "S" + previsions['semaine'].astype(int).astype(str)
+        previsions_par_produit = {
+            code: groupe.drop(columns='code_produit_commercial').reset_index(drop=True)
+            for code, groupe in previsions.groupby('code_produit_commercial', sort=False)
+        }
+
+    stock_varietes = _numeriques(pd.DataFrame(row['stock_varietes']),
+                                 ['poids_brut_total', 'poids_net_total', 'affecte_total', 'disponible_brut'])
+
+    return {
+        'besoins': besoins,
+        'semaines_restantes': semaines_restantes,
+        'lots': lots_par_produit,
+        'previsions': previsions_par_produit,
+        'stock_varietes': stock_varietes,
+    }
@@ -0,0 +1,38 @@
+# utils/cache_tables.py
+"""
+Invalidation des caches par table.
+
+Chaque table a un numéro de version, propre au process (partagé par toutes
+les sessions). Une fonction @st.cache_data reçoit en argument les versions
+des tables qu'elle lit : dès qu'une écriture appelle invalider_tables() sur
+l'une d'elles, la clé du cache change et la donnée est recalculée, sur
+toutes les pages et pour tous les utilisateurs, sans connaître la liste des
+fonctions en cache. Le ttl des caches reste le filet de sécurité pour les
+écritures faites hors de l'application.
+
+    @st.cache_data(ttl=600)
+    def _charger(versions): ...
+
+    df = _charger(versions_tables('previsions_ventes', 'previsions_affectations'))
+
+Fonctions exposées :
+- versions_tables(*tables) -> tuple
+- invalider_tables(*tables)
+"""
+import threading
+
+_versions = {}
+_verrou = threading.Lock()
+
+
+def versions_tables(*tables):
+    """Versions courantes des tables (à passer en argument d'une fonction en cache)"""
+    with _verrou:
+        return tuple((t, _versions.get(t, 0)) for t in tables)
+
+
+def invalider_tables(*tables):
+    """À appeler après un commit modifiant ces tables"""
+    with _verrou:
+        for t in tables:
+            _versions[t] = _versions.get(t, 0) + 1
@@ -0,0 +1,267 @@
+# utils/capacite.py
+"""
+Moteur de capacité multi-semaines pour les lignes de lavage et de production.
+
+Remplace le calcul jour par jour (get_capacite_jour / calculer_temps_utilise)
+par un calcul sur tout un horizon :
+- UNE requête : grille jours × lignes (generate_series) jointe aux horaires
+  configurés et aux minutes planifiées agrégées par jour/ligne ;
+- UNE passe NumPy : heures disponibles, heures planifiées, charge, surcharge ;
+- le temps planifié sur une ligne inconnue ou inactive (ou sans ligne :
+  LIGNE_NON_AFFECTEE) n'est pas perdu : il ressort avec capacite_connue = False,
+  capacité 0 et niveau NIVEAU_CAPACITE_INCONNUE, donc aussi dans les alertes.
+
+Fonctions exposées :
+- get_capacite_horizon(atelier, date_debut, nb_semaines) : frame long
+  (ligne × jour) prêt pour les tableaux de capacité ;
+- index_capacite(df), capacites_inconnues(index, jour) : lookups des vues semaine ;
+- pivot_heatmap(df, valeur) : matrice ligne × jour pour une heatmap ;
+- get_alertes_surcharge(atelier, date_debut, nb_semaines, seuil_pct) :
+  jours et semaines en surcharge, pour anticiper la saison.
+"""
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from database import get_connection
+
+# Paramètres par atelier : tables sources et capacité par défaut (heures/jour)
+# quand aucun horaire n'est configuré pour le jour (cf. get_capacite_jour des pages).
+ATELIERS = {
+    'LAVAGE': {
+        'table_lignes': 'lavages_lignes',
+        'table_planning': 'lavages_planning_elements',
+        'colonne_ligne': 'ligne_lavage',
+        'table_horaires': 'lavages_config_horaires',
+        'horaires_par_ligne': False,
+        'heures_defaut': 24.0,
+    },
+    'PRODUCTION': {
+        'table_lignes': 'production_lignes',
+        'table_planning': 'production_planning_elements',
+        'colonne_ligne': 'ligne_production',
+        'table_horaires': 'production_config_horaires',
+        'horaires_par_ligne': True,
+        'heures_defaut': 17.0,
+    },
+}
+
+# Jours affichés dans les plannings (Lun → Sam) ; le dimanche n'a de capacité
+# que s'il est explicitement configuré dans les horaires.
+JOURS_OUVRES = (0, 1, 2, 3, 4, 5)
+
+SEUIL_ATTENTION_PCT = 80
+SEUIL_SURCHARGE_PCT = 100
+
+# Charge affichée quand du temps est planifié sur un jour sans capacité
+CHARGE_SANS_CAPACITE = 999.0
+
+# Temps planifié sans ligne active correspondante
+LIGNE_NON_AFFECTEE = 'NON_AFFECTEE'
+LIBELLE_CAPACITE_INCONNUE = 'Capacité inconnue'
+NIVEAU_CAPACITE_INCONNUE = '❔'
+
+
+def _charge_pct(planifie_h, capacite_h):
+    return np.divide(
+        planifie_h * 100, capacite_h,
+        out=np.where(planifie_h > 0, CHARGE_SANS_CAPACITE, 0.0), where=capacite_h > 0
+    )
+
+
+def _requete_capacite(atelier):
+    cfg = ATELIERS[atelier]
+    join_horaires = "h.jour_semaine = (EXTRACT(ISODOW FROM j.jour)::int - 1)"
+    if cfg['horaires_par_ligne']:
+        join_horaires += " AND h.ligne_code = l.code"
+    return f"""
+        WITH jours AS (
+            SELECT generate_series(%s::date, %s::date - 1, interval '1 day')::date AS jour
+        ),
+        planifie AS (
+            SELECT pe.{cfg['colonne_ligne']} AS ligne, pe.date_prevue AS jour,
+                   SUM(COALESCE(pe.duree_minutes, 0)) AS minutes_planifiees,
+                   COUNT(*) AS nb_elements
+            FROM {cfg['table_planning']} pe
+            WHERE pe.date_prevue >= %s AND pe.date_prevue < %s
+            GROUP BY pe.{cfg['colonne_ligne']}, pe.date_prevue
+        )
+        SELECT l.code AS ligne, l.libelle, l.capacite_th, j.jour,
+               EXTRACT(HOUR FROM h.heure_debut) * 60 + EXTRACT(MINUTE FROM h.heure_debut) AS debut_min,
+               EXTRACT(HOUR FROM h.heure_fin) * 60 + EXTRACT(MINUTE FROM h.heure_fin) AS fin_min,
+               COALESCE(p.minutes_planifiees, 0) AS minutes_planifiees,
+               COALESCE(p.nb_elements, 0) AS nb_elements,
+               TRUE AS capacite_connue
+        FROM {cfg['table_lignes']} l
+        CROSS JOIN jours j
+        LEFT JOIN {cfg['table_horaires']} h ON {join_horaires} AND h.is_active = TRUE
+        LEFT JOIN planifie p ON p.ligne = l.code AND p.jour = j.jour
+        WHERE l.is_active = TRUE
+        UNION ALL
+        -- Temps planifié sans ligne active : remonté tel quel, capacité inconnue
+        SELECT COALESCE(p.ligne, '{LIGNE_NON_AFFECTEE}'), '{LIBELLE_CAPACITE_INCONNUE}', NULL, p.jour,
+               NULL, NULL, p.minutes_planifiees, p.nb_elements, FALSE
+        FROM planifie p
+        WHERE NOT EXISTS (
+            SELECT 1 FROM {cfg['table_lignes']} l WHERE l.code = p.ligne AND l.is_active = TRUE
+        )
+        ORDER BY 1, 4
+    """
+
+
+def calculer_capacite(df, heures_defaut, jours_ouvres=JOURS_OUVRES):
+    """
+    Passe vectorisée : à partir des lignes brutes (debut_min, fin_min,
+    minutes_planifiees, jour), calcule capacité, planifié, disponible et charge.
+
+    Un jour sans horaire configuré vaut heures_defaut s'il est ouvré, 0 sinon ;
+    une ligne à capacité inconnue (capacite_connue False) vaut 0.
+    """
+    if df.empty:
+        return df
+    df = df.copy()
+    df['jour'] = pd.to_datetime(df['jour'])
+    debut = pd.to_numeric(df['debut_min'], errors='coerce').to_numpy(dtype=float)
+    fin = pd.to_numeric(df['fin_min'], errors='coerce').to_numpy(dtype=float)
+    planifie_h = pd.to_numeric(df['minutes_planifiees'], errors='coerce').fillna(0).to_numpy(dtype=float) / 60
+    jour_semaine = df['jour'].dt.weekday.to_numpy()
+
+    if 'capacite_connue' not in df.columns:
+        df['capacite_connue'] = True
+    connue = df['capacite_connue'].fillna(True).astype(bool).to_numpy()
+
+    configure = ~np.isnan(debut) & ~np.isnan(fin)
+    ouvre = np.isin(jour_semaine, np.asarray(jours_ouvres))
+    capacite_h = np.where(
+        configure,
+        np.clip(np.nan_to_num(fin) - np.nan_to_num(debut), 0, None) / 60,
+        np.where(ouvre & connue, heures_defaut, 0.0)
+    )
+    charge_pct = _charge_pct(planifie_h, capacite_h)
+
+    iso = df['jour'].dt.isocalendar()
+    df['annee'] = iso['year'].astype(int)
+    df['semaine'] = iso['week'].astype(int)
+    df['jour_semaine'] = jour_semaine
+    df['capacite_h'] = capacite_h.round(2)
+    df['planifie_h'] = planifie_h.round(2)
+    df['disponible_h'] = np.clip(capacite_h - planifie_h, 0, None).round(2)
+    df['depassement_h'] = np.clip(planifie_h - capacite_h, 0, None).round(2)
+    df['charge_pct'] = charge_pct.round(1)
+    df['capacite_connue'] = connue
+    df['niveau'] = np.select(
+        [~connue, charge_pct >= SEUIL_SURCHARGE_PCT, charge_pct >= SEUIL_ATTENTION_PCT, charge_pct >= 50],
+        [NIVEAU_CAPACITE_INCONNUE, '🔴', '🟠', '🟡'], default='🟢'
+    )
+    df['capacite_th'] = pd.to_numeric(df['capacite_th'], errors='coerce')
+    return df.drop(columns=['debut_min', 'fin_min'])
+
+
+def get_capacite_horizon(atelier, date_debut, nb_semaines=12, jours_ouvres=JOURS_OUVRES):
+    """
+    Capacité planifiée vs disponible par ligne et par jour sur nb_semaines.
+
+    Args:
+        atelier: 'LAVAGE' ou 'PRODUCTION'
+        date_debut: premier jour (ramené au lundi de sa semaine)
+        nb_semaines: horizon (8 à 26 semaines en usage courant)
+
+    Returns:
+        DataFrame (ligne, libelle, capacite_th, jour, annee, semaine, jour_semaine,
+        capacite_h, planifie_h, disponible_h, depassement_h, charge_pct, niveau,
+        nb_elements, capacite_connue), une ligne par (ligne, jour) ; les lignes à
+        capacité inconnue n'ont que les jours où du temps est planifié.
+    """
+    if atelier not in ATELIERS:
+        raise ValueError(f"Atelier inconnu : {atelier}")
+    if isinstance(date_debut, pd.Timestamp):
+        date_debut = date_debut.date()
+    lundi = date_debut - timedelta(days=date_debut.weekday())
+    date_fin = lundi + timedelta(weeks=int(nb_semaines))
+
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(_requete_capacite(atelier), (lundi, date_fin, lundi, date_fin))
+        rows = cursor.fetchall()
+        cursor.close()
+    finally:
+        conn.close()
+
+    if not rows:
+        return pd.DataFrame()
+    df = pd.DataFrame([dict(r) for r in rows])
+    return calculer_capacite(df, ATELIERS[atelier]['heures_defaut'], jours_ouvres)
+
+
+def index_capacite(df_capacite):
+    """Index {(ligne, 'AAAA-MM-JJ'): dict} pour les lookups de la vue semaine."""
+    if df_capacite.empty:
+        return {}
+    records = df_capacite.assign(jour_str=df_capacite['jour'].dt.strftime('%Y-%m-%d')).to_dict('records')
+    return {(r['ligne'], r['jour_str']): r for r in records}
+
+
+def capacites_inconnues(index, jour_str):
+    """[(ligne, planifie_h), ...] planifiés ce jour sur une ligne à capacité inconnue (cf. index_capacite)."""
+    return sorted((ligne, r['planifie_h']) for (ligne, jour), r in index.items()
+                  if jour == jour_str and not r.get('capacite_connue', True))
+
+
+def pivot_heatmap(df_capacite, valeur='charge_pct', par='jour'):
+    """
+    Matrice ligne × période pour une heatmap.
+
+    Args:
+        valeur: colonne à représenter (charge_pct, disponible_h, planifie_h...)
+        par: 'jour' (une colonne par jour ouvré) ou 'semaine' (agrégé ISO)
+    """
+    if df_capacite.empty:
+        return pd.DataFrame()
+    if par == 'semaine':
+        hebdo = agreger_semaines(df_capacite)
+        hebdo['periode'] = 'S' + hebdo['semaine'].astype(str).str.zfill(2) + '-' + hebdo['annee'].astype(str)
+        return hebdo.pivot(index='ligne', columns='periode', values=valeur).reindex(
+            columns=hebdo['periode'].drop_duplicates().tolist())
+    df = df_capacite[(df_capacite['capacite_h'] > 0) | (df_capacite['planifie_h'] > 0)]
+    return df.pivot(index='ligne', columns='jour', values=valeur)
+
+
+def agreger_semaines(df_capacite):
+    """Agrégat hebdomadaire par ligne (heures sommées, charge recalculée)."""
+    if df_capacite.empty:
+        return pd.DataFrame()
+    hebdo = (
+        df_capacite
+        .groupby(['ligne', 'annee', 'semaine'], as_index=False)
+        .agg(capacite_h=('capacite_h', 'sum'), planifie_h=('planifie_h', 'sum'),
+             nb_elements=('nb_elements', 'sum'), debut_semaine=('jour', 'min'),
+             capacite_connue=('capacite_connue', 'all'))
+        .sort_values(['ligne', 'debut_semaine'])
+    )
+    cap = hebdo['capacite_h'].to_numpy(dtype=float)
+    plan = hebdo['planifie_h'].to_numpy(dtype=float)
+    hebdo['disponible_h'] = np.clip(cap - plan, 0, None).round(2)
+    hebdo['charge_pct'] = _charge_pct(plan, cap).round(1)
+    return hebdo
+
+
+def get_alertes_surcharge(atelier, date_debut, nb_semaines=12, seuil_pct=SEUIL_SURCHARGE_PCT,
+                          df_capacite=None):
+    """
+    Alertes de surcharge sur l'horizon.
+
+    Returns:
+        (jours, semaines) : deux DataFrames triés par date, contenant les
+        jours (resp. semaines) dont la charge atteint seuil_pct.
+    """
+    if df_capacite is None:
+        df_capacite = get_capacite_horizon(atelier, date_debut, nb_semaines)
+    if df_capacite.empty:
+        return pd.DataFrame(), pd.DataFrame()
+    jours = df_capacite[df_capacite['charge_pct'] >= seuil_pct].sort_values(['jour', 'ligne'])
+    hebdo = agreger_semaines(df_capacite)
+    semaines = hebdo[hebdo['charge_pct'] >= seuil_pct].sort_values(['debut_semaine', 'ligne'])
+    return jours.reset_index(drop=True), semaines.reset_index(drop=True)
+
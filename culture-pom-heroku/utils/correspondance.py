@@ -0,0 +1,106 @@
+# utils/correspondance.py
+"""
+Correspondance approchée (fuzzy) de codes saisis contre une liste de références.
+
+L'index est construit UNE fois par import à partir des références valides :
+- dictionnaire exact sur la valeur normalisée (MAJUSCULES, espaces réduits) ;
+- index de trigrammes : seules les références partageant des trigrammes avec
+  la valeur, et de longueur compatible avec le seuil, sont comparées par
+  difflib (même score que get_close_matches) ;
+- mémo par valeur distincte : une valeur répétée sur 5 000 lignes n'est
+  évaluée qu'une fois.
+
+Fonctions exposées :
+- construire_index(valeurs, seuil=0.8) -> index
+- correspondre(index, valeur) -> (valide, valeur_référence, 'exact'|'fuzzy'|'empty'|'error')
+"""
+import re
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+
+import pandas as pd
+
+# En dessous, trop peu de trigrammes : comparaison à toutes les références
+_LONGUEUR_MIN_TRIGRAMMES = 4
+
+
+def normaliser(valeur):
+    return re.sub(r'\s+', ' ', str(valeur).strip().upper())
+
+
+def _trigrammes(texte):
+    texte = f"  {texte} "
+    return {texte[i:i + 3] for i in range(len(texte) - 2)}
+
+
+def construire_index(valeurs, seuil=0.8):
+    """Index exact + trigrammes sur une liste de références"""
+    exact = {}
+    for valeur in valeurs:
+        if valeur is None:
+            continue
+        # Première référence gagnante en cas de doublon après normalisation
+        exact.setdefault(normaliser(valeur), valeur)
+
+    trigrammes = defaultdict(set)
+    for norme in exact:
+        for tri in _trigrammes(norme):
+            trigrammes[tri].add(norme)
+
+    return {
+        'seuil': seuil,
+        'exact': exact,
+        'trigrammes': trigrammes,
+        'memo': {},
+    }
+
+
+def _candidats(index, norme):
+    """Références plausibles : trigrammes communs et longueur compatible avec le seuil"""
+    if len(norme) < _LONGUEUR_MIN_TRIGRAMMES:
+        candidats = index['exact'].keys()
+    else:
+        communs = Counter()
+        for tri in _trigrammes(norme):
+            communs.update(index['trigrammes'].get(tri, ()))
+        candidats = communs.keys()
+
+    # ratio difflib <= 2*min(la, lb)/(la + lb)
+    seuil, n = index['seuil'], len(norme)
+    return [c for c in candidats if 2.0 * min(n, len(c)) / (n + len(c)) >= seuil]
+
+
+def _meilleure_correspondance(index, norme):
+    """Même choix que difflib.get_close_matches(n=1) restreint aux candidats"""
+    matcher = SequenceMatcher()
+    matcher.set_seq2(norme)
+    meilleur = None
+    for candidat in _candidats(index, norme):
+        matcher.set_seq1(candidat)
+        if (matcher.real_quick_ratio() >= index['seuil']
+                and matcher.quick_ratio() >= index['seuil']):
+            score = matcher.ratio()
+            if score >= index['seuil'] and (meilleur is None or (score, candidat) > meilleur):
+                meilleur = (score, candidat)
+    return meilleur[1] if meilleur else None
+
+
+def correspondre(index, valeur):
+    """
+    Returns:
+        (valide, référence trouvée, type) — type 'exact', 'fuzzy', 'empty' ou 'error'
+    """
+    if valeur is None or pd.isna(valeur) or str(valeur).strip() == '':
+        return (True, None, "empty")
+
+    norme = normaliser(valeur)
+    if norme in index['memo']:
+        return index['memo'][norme]
+
+    if norme in index['exact']:
+        resultat = (True, index['exact'][norme], "exact")
+    else:
+        trouve = _meilleure_correspondance(index, norme)
+        resultat = (True, index['exact'][trouve], "fuzzy") if trouve else (False, None, "error")
+    index['memo'][norme] = resultat
+    return resultat
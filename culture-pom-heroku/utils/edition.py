@@ -0,0 +1,183 @@
+# utils/edition.py
+"""
+Enregistrement des modifications d'un st.data_editor en un seul aller-retour.
+
+1. diff_modifications() compare l'original et l'édité colonne par colonne
+   (comparaison vectorisée, deux NaN = pas de changement) et ne garde que les
+   cellules réellement modifiées, converties en types Python natifs ;
+2. appliquer_modifications() envoie toutes les lignes dans UN SEUL
+   UPDATE ... FROM (VALUES ...) : chaque valeur est typée (cast SQL de la
+   colonne cible) et accompagnée d'un indicateur « modifiée » pour ne toucher
+   que les cellules éditées de chaque ligne.
+
+Les types SQL des colonnes sont lus une fois par table et par processus
+(pg_attribute), puis gardés en mémoire.
+
+Fonctions exposées :
+- valeur_native(valeur)
+- diff_modifications(original_df, edited_df, colonnes, cle='id') -> {id: {colonne: valeur}}
+- appliquer_modifications(cursor, table, modifications, cle='id', ...) -> {id: bool}
+"""
+import datetime
+
+import numpy as np
+import pandas as pd
+
+# Types SQL par table : {table: {colonne: 'numeric(10,2)', ...}}
+_TYPES_TABLES = {}
+
+
+def valeur_native(valeur):
+    """Convertit une cellule pandas/numpy en valeur psycopg2 (NaN/NaT -> None)"""
+    if valeur is None:
+        return None
+    if not isinstance(valeur, (list, tuple, dict, np.ndarray)) and pd.isna(valeur):
+        return None
+    if isinstance(valeur, (np.bool_, bool)):
+        return bool(valeur)
+    if isinstance(valeur, np.integer):
+        return int(valeur)
+    if isinstance(valeur, np.floating):
+        return float(valeur)
+    if isinstance(valeur, pd.Timestamp):
+        return valeur.to_pydatetime()
+    return valeur
+
+
+def diff_modifications(original_df, edited_df, colonnes, cle='id'):
+    """
+    Cellules modifiées entre deux DataFrames alignés sur le même index.
+
+    Args:
+        colonnes: colonnes éditables à comparer (les absentes sont ignorées)
+        cle: colonne identifiant la ligne en base
+
+    Returns:
+        {id: {colonne: nouvelle valeur native}} — lignes sans changement absentes
+    """
+    colonnes = [c for c in colonnes if c in original_df.columns and c in edited_df.columns]
+    if not colonnes or cle not in edited_df.columns:
+        return {}
+
+    communs = edited_df.index.intersection(original_df.index)
+    avant = original_df.loc[communs, colonnes]
+    apres = edited_df.loc[communs, colonnes]
+
+    # Modifiée = ni égale, ni NaN des deux côtés
+    masque = pd.DataFrame({
+        col: ~(avant[col].eq(apres[col]) | (avant[col].isna() & apres[col].isna()))
+        for col in colonnes
+    }, index=communs)
+    lignes = masque.index[masque.any(axis=1)]
+    if len(lignes) == 0:
+        return {}
+
+    ids = edited_df.loc[lignes, cle]
+    modifications = {}
+    for idx in lignes:
+        row_id = valeur_native(ids.at[idx])
+        if row_id is None:
+            continue
+        cols = masque.columns[masque.loc[idx].to_numpy()]
+        modifications[row_id] = {col: valeur_native(apres.at[idx, col]) for col in cols}
+    return modifications
+
+
+def _types_colonnes(cursor, table):
+    """
+    Types SQL des colonnes d'une table (lus une seule fois par processus).
+
+    Type de base sans modificateur (varchar, numeric, bpchar...) : un cast
+    explicite en varchar(n) tronquerait sans erreur ; c'est l'affectation de
+    l'UPDATE qui contrôle longueur et échelle, comme une requête directe.
+    """
+    if table not in _TYPES_TABLES:
+        cursor.execute("""
+            SELECT a.attname AS colonne, format_type(a.atttypid, NULL) AS type_sql
+            FROM pg_attribute a
+            WHERE a.attrelid = to_regclass(%s)
+              AND a.attnum > 0
+              AND NOT a.attisdropped
+        """, (table,))
+        types = {row['colonne']: row['type_sql'] for row in cursor.fetchall()}
+        if not types:
+            raise ValueError(f"Table inconnue : {table}")
+        _TYPES_TABLES[table] = types
+    return _TYPES_TABLES[table]
+
+
+def _type_python(valeurs):
+    """Type SQL déduit des valeurs (si la table n'est pas connue)"""
+    for v in valeurs:
+        if v is None:
+            continue
+        if isinstance(v, bool):
+            return 'boolean'
+        if isinstance(v, (int, float)):
+            return 'numeric'
+        if isinstance(v, datetime.datetime):
+            return 'timestamp'
+        if isinstance(v, datetime.date):
+            return 'date'
+        return 'text'
+    return 'text'
+
+
+def appliquer_modifications(cursor, table, modifications, cle='id', types=None,
+                            set_fixe=None, params_fixe=None):
+    """
+    Applique {id: {colonne: valeur}} en un seul UPDATE ... FROM (VALUES ...).
+
+    Args:
+        cursor: curseur dans la transaction de l'appelant (pas de commit ici)
+        types: {colonne: type SQL} — sinon lus dans le catalogue Postgres
+        set_fixe: affectations communes, ex. "updated_at = CURRENT_TIMESTAMP"
+        params_fixe: paramètres de set_fixe
+
+    Returns:
+        {id: True si la ligne a été mise à jour, False si introuvable}
+    """
+    modifications = {row_id: changes for row_id, changes in modifications.items() if changes}
+    if not modifications:
+        return {}
+
+    colonnes = list(dict.fromkeys(col for changes in modifications.values() for col in changes))
+    if types is None:
+        types = _types_colonnes(cursor, table)
+    types = dict(types)
+    for col in [cle] + colonnes:
+        if col not in types:
+            valeurs = modifications.keys() if col == cle else (c.get(col) for c in modifications.values())
+            types[col] = _type_python(valeurs)
+
+    # Une ligne VALUES : (id, valeur_0, modifiée_0, valeur_1, modifiée_1, ...)
+    gabarit = "(" + ", ".join(
+        [f"%s::{types[cle]}"] + [f"%s::{types[col]}, %s::boolean" for col in colonnes]
+    ) + ")"
+    lignes = []
+    for row_id, changes in modifications.items():
+        params = [row_id]
+        for col in colonnes:
+            params += [changes.get(col), col in changes]
+        lignes.append(cursor.mogrify(gabarit, params).decode())
+
+    affectations = []
+    for i, col in enumerate(colonnes):
+        if all(col in changes for changes in modifications.values()):
+            affectations.append(f"{col} = v.c{i}")
+        else:
+            affectations.append(f"{col} = CASE WHEN v.m{i} THEN v.c{i} ELSE t.{col} END")
+    if set_fixe:
+        affectations.append(cursor.mogrify(set_fixe, params_fixe).decode() if params_fixe else set_fixe)
+
+    alias = ", ".join(["k"] + [f"c{i}, m{i}" for i in range(len(colonnes))])
+    # Requête déjà littérale : exécutée sans paramètres (les % des valeurs restent intacts)
+    cursor.execute(f"""
+        UPDATE {table} AS t
+        SET {", ".join(affectations)}
+        FROM (VALUES {", ".join(lignes)}) AS v({alias})
+        WHERE t.{cle} = v.k
+        RETURNING t.{cle} AS id
+    """)
+    mises_a_jour = {row['id'] for row in cursor.fetchall()}
+    return {row_id: row_id in mises_a_jour for row_id in modifications}
@@ -0,0 +1,188 @@
+# utils/grille.py
+"""
+Modèle de lignes côté serveur pour les grandes grilles (st.data_editor / st.dataframe).
+
+Au lieu de charger toute la table puis filtrer/trier en pandas, la page décrit
+sa grille (spec) et ne demande à Postgres que la page visible :
+- filtres et tri traduits en SQL (colonnes en liste blanche, valeurs paramétrées) ;
+- pagination par clé (keyset) : WHERE (tri, id) < (dernier_tri, dernier_id)
+  ORDER BY tri, id LIMIT n — coût constant quelle que soit la page ;
+- compteurs et totaux calculés par agrégat SQL sur le même filtre.
+
+Spec d'une grille :
+    {
+        'from': "lots_bruts l LEFT JOIN ref_varietes v ON ...",
+        'where': "l.is_active = TRUE",            # filtre fixe (optionnel)
+        'cle': 'id',                              # alias unique, entier
+        'colonnes': {'id': 'l.id', 'nom_usage': 'l.nom_usage', ...},
+        'types': {'date_entree_stock': 'date', 'nom_usage': 'texte', ...},
+    }
+
+Filtres : liste de (alias, opérateur, valeur), opérateurs
+'=', '!=', '<', '<=', '>', '>=', 'contient', 'in'.
+
+Fonctions exposées :
+- charger_page(spec, filtres, tri, taille, apres) -> (DataFrame, curseur_suivant)
+- compter(spec, filtres) / agreger(spec, filtres, agregats)
+- valeurs_distinctes(spec, alias, filtres)
+- charger_tout(spec, filtres, tri) : export ponctuel
+"""
+import pandas as pd
+
+from database import get_connection
+
+# Valeur de remplacement des NULL pour un tri stable (NULL en fin de tri décroissant)
+_SENTINELLES = {
+    'texte': "''",
+    'nombre': "(-1e30)::numeric",
+    'date': "'0001-01-01'::timestamp",
+}
+
+_OPERATEURS = {'=': '=', '!=': '<>', '<': '<', '<=': '<=', '>': '>', '>=': '>='}
+
+
+def _expr(spec, alias):
+    if alias not in spec['colonnes']:
+        raise ValueError(f"Colonne inconnue pour la grille : {alias}")
+    return spec['colonnes'][alias]
+
+
+def _expr_tri(spec, alias):
+    """Expression de tri sans NULL (les comparaisons de lignes ignorent NULLS LAST)."""
+    type_col = spec.get('types', {}).get(alias, 'texte')
+    expr = _expr(spec, alias)
+    if type_col == 'date':
+        expr = f"({expr})::timestamp"
+    elif type_col == 'nombre':
+        expr = f"({expr})::numeric"
+    else:
+        expr = f"({expr})::text"
+    return f"COALESCE({expr}, {_SENTINELLES.get(type_col, _SENTINELLES['texte'])})"
+
+
+def construire_where(spec, filtres=None):
+    """Clause WHERE (sans le mot-clé) et paramètres."""
+    clauses, params = [], []
+    if spec.get('where'):
+        clauses.append(f"({spec['where']})")
+    for alias, operateur, valeur in (filtres or []):
+        if valeur is None or valeur == '' or valeur == []:
+            continue
+        expr = _expr(spec, alias)
+        if operateur == 'contient':
+            clauses.append(f"({expr})::text ILIKE %s")
+            params.append(f"%{valeur}%")
+        elif operateur == 'in':
+            clauses.append(f"{expr} = ANY(%s)")
+            params.append(list(valeur))
+        elif operateur in _OPERATEURS:
+            clauses.append(f"{expr} {_OPERATEURS[operateur]} %s")
+            params.append(valeur)
+        else:
+            raise ValueError(f"Opérateur de filtre inconnu : {operateur}")
+    return (" AND ".join(clauses) or "TRUE"), params
+
+
+def _select(spec):
+    return ", ".join(f"{expr} AS {alias}" for alias, expr in spec['colonnes'].items())
+
+
+def _lire(query, params):
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+        cursor.close()
+    finally:
+        conn.close()
+    return rows
+
+
+def charger_page(spec, filtres=None, tri=None, taille=50, apres=None):
+    """
+    Une page de la grille.
+
+    Args:
+        tri: (alias, 'ASC'|'DESC') ; la clé départage les égalités
+        apres: curseur renvoyé par l'appel précédent (None = première page)
+
+    Returns:
+        (DataFrame de la page, curseur_suivant ou None si dernière page)
+    """
+    cle = spec['cle']
+    alias_tri, sens = tri or (cle, 'ASC')
+    sens = 'DESC' if str(sens).upper() == 'DESC' else 'ASC'
+    expr_tri, expr_cle = _expr_tri(spec, alias_tri), _expr(spec, cle)
+
+    where, params = construire_where(spec, filtres)
+    if apres is not None:
+        comparateur = '<' if sens == 'DESC' else '>'
+        where += f" AND ({expr_tri}, {expr_cle}) {comparateur} (%s, %s)"
+        params += [apres[0], apres[1]]
+
+    query = f"""
+        SELECT {_select(spec)}, {expr_tri} AS _tri
+        FROM {spec['from']}
+        WHERE {where}
+        ORDER BY {expr_tri} {sens}, {expr_cle} {sens}
+        LIMIT %s
+    """
+    rows = _lire(query, params + [int(taille) + 1])
+
+    suivant = None
+    if len(rows) > taille:
+        rows = rows[:taille]
+        suivant = (rows[-1]['_tri'], rows[-1][cle])
+    if not rows:
+        return pd.DataFrame(columns=list(spec['colonnes'])), None
+    df = pd.DataFrame(rows).drop(columns=['_tri'])
+    return df, suivant
+
+
+def charger_tout(spec, filtres=None, tri=None):
+    """Toutes les lignes filtrées (exports à la demande, pas l'affichage)."""
+    cle = spec['cle']
+    alias_tri, sens = tri or (cle, 'ASC')
+    sens = 'DESC' if str(sens).upper() == 'DESC' else 'ASC'
+    where, params = construire_where(spec, filtres)
+    rows = _lire(f"""
+        SELECT {_select(spec)}
+        FROM {spec['from']}
+        WHERE {where}
+        ORDER BY {_expr_tri(spec, alias_tri)} {sens}, {_expr(spec, cle)} {sens}
+    """, params)
+    return pd.DataFrame(rows) if rows else pd.DataFrame(columns=list(spec['colonnes']))
+
+
+def agreger(spec, filtres=None, agregats=None):
+    """
+    Agrégats SQL sur le filtre courant.
+
+    Args:
+        agregats: {nom: 'SUM({poids})'} — les {alias} sont remplacés par leur expression
+    """
+    agregats = agregats or {'nb': 'COUNT(*)'}
+    exprs = {alias: f"({expr})" for alias, expr in spec['colonnes'].items()}
+    select = ", ".join(f"{modele.format(**exprs)} AS {nom}" for nom, modele in agregats.items())
+    where, params = construire_where(spec, filtres)
+    rows = _lire(f"SELECT {select} FROM {spec['from']} WHERE {where}", params)
+    return dict(rows[0]) if rows else {nom: None for nom in agregats}
+
+
+def compter(spec, filtres=None):
+    return int(agreger(spec, filtres, {'nb': 'COUNT(*)'})['nb'] or 0)
+
+
+def valeurs_distinctes(spec, alias, filtres=None, limite=1000):
+    """Valeurs possibles d'une colonne (listes déroulantes de filtre)."""
+    expr = _expr(spec, alias)
+    where, params = construire_where(spec, filtres)
+    rows = _lire(f"""
+        SELECT DISTINCT {expr} AS valeur
+        FROM {spec['from']}
+        WHERE {where} AND {expr} IS NOT NULL
+        ORDER BY 1
+        LIMIT %s
+    """, params + [int(limite)])
+    return [r['valeur'] for r in rows]
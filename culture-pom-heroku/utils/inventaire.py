@@ -0,0 +1,283 @@
+# utils/inventaire.py
+"""
+Inventaires consommables : création et saisie des comptages en requêtes ensemblistes.
+
+- creer_inventaire_site() : en-tête + toutes les lignes du site en UNE requête
+  (INSERT ... SELECT depuis stock_consommables) ;
+- enregistrer_comptages() : tous les comptages d'un compteur en UNE requête
+  (UPDATE ... FROM VALUES), lignes inchangées ignorées ;
+- le compteur d'avancement inventaires.nb_lignes_comptees est mis à jour dans
+  la même requête (+ lignes passées de « non comptée » à « comptée »), sans
+  recompter toutes les lignes ;
+- fusionner_lot_comptages() : lots envoyés par la file hors ligne des
+  téléphones (streamlit_comptage). Chaque lot porte un identifiant
+  d'idempotence (inventaires_sync_lots) : un lot renvoyé après une coupure
+  n'est appliqué qu'une fois. Chaque comptage porte son heure de saisie
+  (saisi_at) : un lot ancien arrivé en retard n'écrase pas une saisie plus récente ;
+- aucune écriture sur un inventaire qui n'est plus EN_COURS (lot rejeté).
+
+Fonctions exposées :
+- init_schema_inventaire(conn=None)
+- creer_inventaire_site(cursor, date_inv, site, compteur_1, compteur_2, mois, annee, created_by)
+- LOT_APPLIQUE, LOT_DEJA_RECU, INVENTAIRE_CLOTURE
+- enregistrer_comptages(inventaire_id, comptages) -> (nb_maj, nb_comptees, nb_lignes)
+- fusionner_lot_comptages(inventaire_id, lot_id, comptages) -> (statut, nb_maj, nb_comptees, nb_lignes)
+"""
+from datetime import datetime
+
+from database import get_connection
+
+# Issue de fusionner_lot_comptages()
+LOT_APPLIQUE = 'APPLIQUE'
+LOT_DEJA_RECU = 'DEJA_RECU'
+INVENTAIRE_CLOTURE = 'CLOTURE'
+
+_schema_pret = False
+
+
+def init_schema_inventaire(conn=None):
+    """Ajoute si besoin (une fois par process) le compteur d'avancement des inventaires."""
+    global _schema_pret
+    if _schema_pret:
+        return
+    own = conn is None
+    conn = conn or get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = 'inventaires' AND column_name = 'nb_lignes_comptees'
+        """)
+        if not cur.fetchone():
+            cur.execute("ALTER TABLE inventaires ADD COLUMN IF NOT EXISTS nb_lignes_comptees INTEGER DEFAULT 0")
+            # Reprise des inventaires existants (une seule fois)
+            cur.execute("""
+                UPDATE inventaires i
+                SET nb_lignes_comptees = c.nb
+                FROM (
+                    SELECT inventaire_id, COUNT(*) AS nb
+                    FROM inventaires_consommables_lignes
+                    WHERE stock_compte IS NOT NULL
+                    GROUP BY inventaire_id
+                ) c
+                WHERE c.inventaire_id = i.id
+            """)
+            # nb_lignes = nombre total de lignes (la saisie y écrivait le nombre compté)
+            cur.execute("""
+                UPDATE inventaires i
+                SET nb_lignes = c.nb
+                FROM (
+                    SELECT inventaire_id, COUNT(*) AS nb
+                    FROM inventaires_consommables_lignes
+                    GROUP BY inventaire_id
+                ) c
+                WHERE c.inventaire_id = i.id AND i.statut = 'EN_COURS'
+            """)
+        cur.execute("""
+            ALTER TABLE inventaires_consommables_lignes
+                ADD COLUMN IF NOT EXISTS saisi_at TIMESTAMP
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS inventaires_sync_lots (
+                lot_id        VARCHAR(64) PRIMARY KEY,
+                inventaire_id INTEGER NOT NULL,
+                nb_comptages  INTEGER NOT NULL DEFAULT 0,
+                recu_at       TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        conn.commit()
+        cur.close()
+        _schema_pret = True
+    finally:
+        if own:
+            conn.close()
+
+
+def creer_inventaire_site(cursor, date_inv, site, compteur_1, compteur_2, mois, annee, created_by):
+    """
+    Crée l'inventaire et ses lignes (toutes refs affectées au site, même stock = 0)
+    en une requête, dans la transaction de l'appelant.
+
+    Returns:
+        (inventaire_id, nb_lignes) ou (None, 0) si aucune référence sur le site
+    """
+    cursor.execute("""
+        WITH refs AS (
+            SELECT sc.consommable_id, sc.site, sc.atelier, sc.emplacement,
+                   sc.quantite AS stock_theorique,
+                   COALESCE(sc.coefficient_conversion, 1.0) AS coefficient_conversion
+            FROM stock_consommables sc
+            WHERE sc.is_active = TRUE AND sc.site = %s
+        ),
+        inv AS (
+            INSERT INTO inventaires (type_inventaire, date_inventaire, mois, annee, site,
+                                     statut, compteur_1, compteur_2, created_by,
+                                     nb_lignes, nb_lignes_comptees)
+            SELECT 'CONSOMMABLES', %s, %s, %s, %s, 'EN_COURS', %s, %s, %s,
+                   (SELECT COUNT(*) FROM refs), 0
+            WHERE EXISTS (SELECT 1 FROM refs)
+            RETURNING id
+        ),
+        lignes AS (
+            INSERT INTO inventaires_consommables_lignes
+                (inventaire_id, consommable_id, site, atelier, emplacement,
+                 stock_theorique, coefficient_conversion)
+            SELECT inv.id, refs.consommable_id, refs.site, refs.atelier, refs.emplacement,
+                   refs.stock_theorique, refs.coefficient_conversion
+            FROM inv CROSS JOIN refs
+            RETURNING 1
+        )
+        SELECT inv.id, (SELECT COUNT(*) FROM lignes) AS nb_lignes
+        FROM inv
+    """, (site, date_inv, mois, annee, site, compteur_1, compteur_2, created_by))
+    row = cursor.fetchone()
+    if not row:
+        return None, 0
+    return row['id'], int(row['nb_lignes'])
+
+
+def _fusionner(inventaire_id, valeurs, lot_id=None):
+    """
+    Applique [(ligne_id, quantité, saisi_at), ...] en une requête.
+
+    Sans lot_id (saisie en ligne) : la valeur envoyée fait foi.
+    Avec lot_id (file hors ligne) : lot appliqué une seule fois, et seulement
+    sur les lignes dont la saisie en base est plus ancienne.
+    Dans les deux cas, seules les lignes de l'inventaire indiqué sont modifiées,
+    et seulement s'il est encore EN_COURS (verrou partagé sur l'en-tête : une
+    validation concurrente attend la fin de la fusion). Le lot_id est enregistré
+    même si l'inventaire est clôturé, pour que le téléphone arrête de le renvoyer.
+
+    Returns:
+        (nouveau_lot, ouvert, nb_maj, nb_lignes_comptees, nb_lignes)
+    """
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        lignes_sql = ", ".join(
+            cursor.mogrify("(%s::integer, %s::integer, %s::timestamp)", v).decode() for v in valeurs
+        )
+        params = {'inventaire_id': int(inventaire_id)}
+        if lot_id is None:
+            cte_lot, garde_lot, garde_date, nouveau_lot = "", "", "", "TRUE"
+        else:
+            cte_lot = """
+            lot AS (
+                INSERT INTO inventaires_sync_lots (lot_id, inventaire_id, nb_comptages)
+                VALUES (%(lot_id)s, %(inventaire_id)s, %(nb_comptages)s)
+                ON CONFLICT (lot_id) DO NOTHING
+                RETURNING lot_id
+            ),"""
+            garde_lot = "AND EXISTS (SELECT 1 FROM lot)"
+            garde_date = "AND (l.saisi_at IS NULL OR l.saisi_at <= v.saisi_at)"
+            nouveau_lot = "EXISTS (SELECT 1 FROM lot)"
+            params.update(lot_id=str(lot_id), nb_comptages=len(valeurs))
+
+        cursor.execute(f"""
+            WITH {cte_lot}
+            v(id, qte, saisi_at) AS (VALUES {lignes_sql}),
+            avant AS (
+                -- Lignes réellement modifiées, verrouillées (état le plus récent en cas de saisie concurrente)
+                SELECT l.id, l.stock_compte IS NULL AS nouvelle
+                FROM inventaires_consommables_lignes l
+                JOIN v ON v.id = l.id
+                JOIN inventaires i ON i.id = l.inventaire_id AND i.statut = 'EN_COURS'
+                WHERE l.inventaire_id = %(inventaire_id)s
+                  AND l.stock_compte IS DISTINCT FROM v.qte
+                  {garde_date}
+                  {garde_lot}
+                FOR UPDATE OF l
+                FOR SHARE OF i
+            ),
+            maj AS (
+                UPDATE inventaires_consommables_lignes l
+                SET stock_compte = v.qte,
+                    ecart = v.qte - l.stock_theorique,
+                    saisi_at = v.saisi_at,
+                    updated_at = CURRENT_TIMESTAMP
+                FROM v
+                JOIN avant a ON a.id = v.id
+                WHERE l.id = v.id
+                RETURNING l.id
+            ),
+            avancement AS (
+                UPDATE inventaires i
+                SET nb_lignes_comptees = COALESCE(i.nb_lignes_comptees, 0)
+                                         + (SELECT COUNT(*) FROM avant WHERE nouvelle)
+                WHERE i.id = %(inventaire_id)s AND i.statut = 'EN_COURS'
+                RETURNING i.nb_lignes_comptees, i.nb_lignes
+            )
+            SELECT {nouveau_lot} AS nouveau_lot,
+                   EXISTS (SELECT 1 FROM avancement) AS ouvert,
+                   (SELECT COUNT(*) FROM maj) AS nb_maj,
+                   (SELECT nb_lignes_comptees FROM avancement) AS nb_lignes_comptees,
+                   (SELECT nb_lignes FROM avancement) AS nb_lignes
+        """, params)
+        row = cursor.fetchone()
+        conn.commit()
+        cursor.close()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    return (bool(row['nouveau_lot']), bool(row['ouvert']), int(row['nb_maj']),
+            row['nb_lignes_comptees'], row['nb_lignes'])
+
+
+def enregistrer_comptages(inventaire_id, comptages):
+    """
+    Enregistre {ligne_id: quantité comptée} en un aller-retour.
+
+    Returns:
+        (nb lignes modifiées, nb lignes comptées de l'inventaire, nb lignes total)
+
+    Raises:
+        ValueError si l'inventaire n'est plus EN_COURS (rien n'est écrit)
+    """
+    maintenant = datetime.now()
+    valeurs = [(int(ligne_id), int(qte), maintenant) for ligne_id, qte in comptages.items() if qte is not None]
+    if not valeurs:
+        return 0, None, None
+    _, ouvert, nb_maj, nb_comptees, nb_lignes = _fusionner(inventaire_id, valeurs)
+    if not ouvert:
+        raise ValueError("Inventaire clôturé : saisie refusée")
+    return nb_maj, nb_comptees, nb_lignes
+
+
+def fusionner_lot_comptages(inventaire_id, lot_id, comptages):
+    """
+    Fusionne un lot de la file hors ligne.
+
+    Args:
+        comptages: [(ligne_id, quantité, saisi_at datetime), ...] ; pour une même
+                   ligne, la saisie la plus récente du lot l'emporte
+
+    saisi_at vient de l'horloge du téléphone : l'ordre entre téléphones suppose
+    des horloges à peu près à l'heure (réglage réseau automatique). Une heure
+    dans le futur est ramenée à l'heure du serveur, pour qu'un téléphone en
+    avance ne bloque pas les corrections suivantes sur ses lignes.
+
+    Returns:
+        (statut, nb lignes modifiées, nb comptées, nb lignes) — statut :
+        LOT_APPLIQUE, LOT_DEJA_RECU (rien n'est réappliqué) ou
+        INVENTAIRE_CLOTURE (lot enregistré mais rejeté, rien n'est écrit)
+    """
+    maintenant = datetime.now()
+    derniers = {}
+    for ligne_id, qte, saisi_at in comptages:
+        if qte is None:
+            continue
+        cle = int(ligne_id)
+        if cle not in derniers or saisi_at >= derniers[cle][2]:
+            derniers[cle] = (cle, int(qte), saisi_at)
+    if not derniers:
+        return LOT_APPLIQUE, 0, None, None
+    valeurs = [(cle, qte, min(saisi_at, maintenant)) for cle, qte, saisi_at in derniers.values()]
+    nouveau, ouvert, nb_maj, nb_comptees, nb_lignes = _fusionner(inventaire_id, valeurs, lot_id=lot_id)
+    if not nouveau:
+        return LOT_DEJA_RECU, 0, nb_comptees, nb_lignes
+    if not ouvert:
+        return INVENTAIRE_CLOTURE, 0, None, None
+    return LOT_APPLIQUE, nb_maj, nb_comptees, nb_lignes
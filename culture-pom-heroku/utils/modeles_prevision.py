@@ -0,0 +1,557 @@
+# utils/modeles_prevision.py
+"""
+Prévisions statistiques par produit commercial, ajustées en lot.
+
+Série par produit : tonnes expédiées par semaine ISO (frulog_lignes_condi,
+types E/C) ; pour un produit jamais expédié, les prévisions saisies
+(previsions_ventes). Trois modèles sont évalués pour TOUS les produits à la
+fois (matrices produits × semaines, une seule boucle sur le temps) :
+
+- 'naif'     : saisonnier naïf, même semaine un an avant (52 semaines) ;
+- 'campagne' : naïf × effet campagne (volume campagne à date / même période
+  de la campagne précédente, campagne = juin → mai, borné entre 0,5 et 2) ;
+- 'lissage'  : lissage exponentiel à saisonnalité hebdomadaire (niveau +
+  52 coefficients saisonniers additifs), alpha/gamma choisis par produit sur
+  une grille évaluée en parallèle.
+
+Backtest : sur les 13 dernières semaines, prévisions à 1..6 semaines faites
+avec les seules données antérieures. Le modèle retenu par produit est celui
+de plus faible erreur absolue moyenne ; le rapport donne le WAPE de chaque
+modèle et celui des prévisions saisies.
+
+Cache : previsions_modeles garde par produit le modèle retenu, l'état du
+lissage (niveau, saisons) et les prévisions à venir. Quand de nouvelles
+semaines arrivent, l'état est avancé sur ces seules semaines (fenêtre de
+données réduite) ; l'ajustement complet (grille + backtest) n'est refait que
+toutes les 13 semaines, à l'apparition d'un produit ou à la demande.
+
+Fonctions exposées :
+- init_schema_modeles(conn=None)
+- ajuster_modeles(force=False) -> (mode 'a_jour'|'incremental'|'complet', nb produits)
+- get_suggestions(semaines_cibles) -> {(annee, sem): {code_produit: tonnes}}
+- get_rapport_backtest() -> DataFrame
+"""
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+from database import get_connection
+from utils.edition import appliquer_modifications
+from utils.previsions import index_semaine, semaine_de_index, matrice_previsions, charger_matrice
+
+SAISON = 52
+HORIZON = 6                 # semaine en cours + S+1..S+5
+FENETRE_BACKTEST = 13
+REAJUSTEMENT_SEMAINES = 13
+GRILLE_ALPHA = (0.1, 0.2, 0.3, 0.5)
+GRILLE_GAMMA = (0.05, 0.1, 0.2)
+RATIO_CAMPAGNE_MIN, RATIO_CAMPAGNE_MAX = 0.5, 2.0
+
+MODELES = {
+    'lissage': "Lissage exponentiel saisonnier",
+    'campagne': "Saisonnier × effet campagne",
+    'naif': "Saisonnier naïf",
+}
+
+_table_prete = False
+
+
+# ============================================================
+# SCHÉMA
+# ============================================================
+
+def init_schema_modeles(conn=None):
+    """Crée si besoin (une fois par process) la table des modèles ajustés."""
+    global _table_prete
+    if _table_prete:
+        return
+    own = conn is None
+    conn = conn or get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS previsions_modeles (
+                code_produit    VARCHAR(100) PRIMARY KEY,
+                source          VARCHAR(20) NOT NULL,
+                modele          VARCHAR(20) NOT NULL,
+                alpha           DOUBLE PRECISION,
+                gamma           DOUBLE PRECISION,
+                niveau          DOUBLE PRECISION,
+                saisons         DOUBLE PRECISION[],
+                semaine_idx     INTEGER NOT NULL,
+                ajuste_idx      INTEGER NOT NULL,
+                prevision       DOUBLE PRECISION[],
+                wape_naif       DOUBLE PRECISION,
+                wape_campagne   DOUBLE PRECISION,
+                wape_lissage    DOUBLE PRECISION,
+                wape_manuel     DOUBLE PRECISION,
+                volume_backtest DOUBLE PRECISION,
+                updated_at      TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        conn.commit()
+        cur.close()
+        _table_prete = True
+    finally:
+        if own:
+            conn.close()
+
+
+# ============================================================
+# DONNÉES
+# ============================================================
+
+def semaine_reference():
+    """Index de la dernière semaine complète (semaine précédant la semaine en cours)"""
+    iso = datetime.now().isocalendar()
+    return index_semaine(iso[0], iso[1]) - 1
+
+
+def _lundi(idx):
+    return date.fromordinal(int(idx) * 7 + 1)
+
+
+def _debut_campagne(idx):
+    """Index de la semaine du 1er juin ouvrant la campagne de la semaine idx"""
+    lundi = _lundi(idx)
+    annee = lundi.year if lundi.month >= 6 else lundi.year - 1
+    return (date(annee, 6, 1).toordinal() - 1) // 7
+
+
+def charger_ventes(premiere_idx=None, derniere_idx=None):
+    """Tonnes expédiées par produit et semaine ISO de chargement, en matrice produit × semaine"""
+    conditions = ["type IN ('E','C')", "code_produit_commercial IS NOT NULL", "date_charg IS NOT NULL"]
+    params = []
+    if premiere_idx is not None:
+        conditions.append("date_charg >= %s")
+        params.append(_lundi(premiere_idx))
+    if derniere_idx is not None:
+        conditions.append("date_charg < %s")
+        params.append(_lundi(derniere_idx + 1))
+
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT code_produit_commercial,
+                   EXTRACT(ISOYEAR FROM date_charg)::int AS annee,
+                   EXTRACT(WEEK FROM date_charg)::int AS semaine,
+                   SUM(pds_net) / 1000.0 AS t
+            FROM frulog_lignes_condi
+            WHERE {" AND ".join(conditions)}
+            GROUP BY 1, 2, 3
+        """, params)
+        rows = cursor.fetchall()
+        cursor.close()
+    finally:
+        conn.close()
+    return matrice_previsions(pd.DataFrame(rows) if rows else None, colonne='t',
+                              premiere=premiere_idx, derniere=derniere_idx)
+
+
+def _combiner(ventes, manuel, premiere, derniere, codes_ventes=()):
+    """
+    Série par produit sur les colonnes premiere..derniere.
+
+    Produit expédié : tonnes expédiées, 0 les semaines sans expédition après
+    la première (ou sur toute la fenêtre s'il est dans codes_ventes) ;
+    sinon : prévisions saisies.
+
+    Returns:
+        (Y produits × semaines, codes, source par produit, matrice manuelle alignée)
+    """
+    codes = ventes.index.union(manuel.index)
+    colonnes = range(premiere, derniere + 1)
+    v = ventes.reindex(index=codes, columns=colonnes).to_numpy(dtype=float)
+    m = manuel.reindex(index=codes, columns=colonnes).to_numpy(dtype=float)
+
+    deja = np.isin(codes.to_numpy(), list(codes_ventes))
+    demarre = (np.cumsum(~np.isnan(v), axis=1) > 0) | deja[:, None]
+    v = np.where(demarre & np.isnan(v), 0.0, v)
+    expedie = demarre.any(axis=1)
+
+    y = np.where(expedie[:, None], v, m)
+    source = np.where(expedie, 'ventes', 'previsions')
+    return y, codes, source, m
+
+
+# ============================================================
+# MODÈLES (vectorisés sur les produits)
+# ============================================================
+
+def _sommes(y):
+    """Sommes et nombres cumulés (colonne 0 en tête) : somme(a..b) = c[:, b+1] - c[:, a]"""
+    present = ~np.isnan(y)
+    zeros = np.zeros((y.shape[0], 1))
+    return (np.concatenate([zeros, np.cumsum(np.where(present, y, 0.0), axis=1)], axis=1),
+            np.concatenate([zeros, np.cumsum(present, axis=1)], axis=1))
+
+
+def _somme(cum, a, b):
+    a, b = max(a, 0), max(b, -1)
+    return cum[:, b + 1] - cum[:, a] if b >= a else np.zeros(cum.shape[0])
+
+
+def _prevision_naive(y, cums, c0, origine, h):
+    """
+    Prévisions 'naif' et 'campagne' pour la colonne origine + h, faites en origine.
+
+    Returns:
+        (naif, campagne) — tableaux par produit
+    """
+    cum_val, cum_nb = cums
+    cible = origine + h
+
+    # Semaine récente si l'an passé manque : moyenne des 4 dernières semaines renseignées
+    nb = _somme(cum_nb, origine - 3, origine)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        recente = np.where(nb > 0, _somme(cum_val, origine - 3, origine) / np.maximum(nb, 1), np.nan)
+    an_passe = y[:, cible - SAISON] if cible - SAISON >= 0 else np.full(y.shape[0], np.nan)
+    naif = np.where(np.isnan(an_passe), recente, an_passe)
+
+    # Effet campagne : campagne à date (au moins 8 semaines) vs même période un an avant
+    debut = min(_debut_campagne(c0 + origine) - c0, origine - 7)
+    if debut - SAISON < 0:
+        ratio = np.ones(y.shape[0])
+    else:
+        num = _somme(cum_val, debut, origine)
+        den = _somme(cum_val, debut - SAISON, origine - SAISON)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ratio = np.where(den > 0, num / den, 1.0)
+        ratio = np.clip(ratio, RATIO_CAMPAGNE_MIN, RATIO_CAMPAGNE_MAX)
+    return naif, naif * ratio
+
+
+def _init_lissage(y, c0):
+    """Niveau initial (moyenne de la 1re saison) et saisons (écarts de la 1re saison si >= 2 ans d'historique)"""
+    p, t = y.shape
+    present = ~np.isnan(y)
+    debut = np.where(present.any(axis=1), present.argmax(axis=1), t)
+    colonnes = debut[:, None] + np.arange(SAISON)[None, :]
+    lignes = np.arange(p)[:, None]
+    valeurs = np.where(colonnes < t, y[lignes, np.minimum(colonnes, t - 1)], np.nan)
+    nb = (~np.isnan(valeurs)).sum(axis=1)
+    niveau = np.where(nb > 0, np.nansum(valeurs, axis=1) / np.maximum(nb, 1), 0.0)
+
+    saisons = np.zeros((p, SAISON))
+    amorce = (t - debut) >= 2 * SAISON
+    ecarts = np.where(np.isnan(valeurs) | ~amorce[:, None], 0.0, valeurs - niveau[:, None])
+    saisons[lignes, (c0 + colonnes) % SAISON] = ecarts
+    return debut, niveau, saisons
+
+
+def _lissage(y, c0, debut_bt):
+    """
+    Lissage exponentiel saisonnier, toute la grille alpha × gamma et tous les produits en une passe.
+
+    Returns:
+        dict alpha, gamma, niveau, saisons (paramètres retenus par produit),
+        backtest (H, P, B) et futur (H, P)
+    """
+    p, t = y.shape
+    grille = [(alpha, gamma) for alpha in GRILLE_ALPHA for gamma in GRILLE_GAMMA]
+    alphas = np.array([alpha for alpha, _ in grille])
+    gammas = np.array([gamma for _, gamma in grille])
+    nb_grille = len(grille)
+    debut, niveau0, saisons0 = _init_lissage(y, c0)
+
+    niveau = np.repeat(niveau0[None, :], nb_grille, axis=0)             # (G, P)
+    saisons = np.repeat(saisons0[None, :, :], nb_grille, axis=0)        # (G, P, 52)
+    a, g = alphas[:, None], gammas[:, None]
+    sse = np.zeros((nb_grille, p))
+    nb_bt = t - debut_bt
+    backtest = np.full((nb_grille, HORIZON, p, nb_bt), np.nan)
+
+    for col in range(t):
+        phase = (c0 + col) % SAISON
+        obs = y[:, col]
+        actif = (col >= debut) & ~np.isnan(obs)
+        erreur = np.where(actif[None, :], np.nan_to_num(obs)[None, :] - niveau - saisons[:, :, phase], 0.0)
+        if col < debut_bt:
+            sse += erreur ** 2
+        niveau = niveau + a * erreur
+        saisons[:, :, phase] += g * erreur
+
+        demarre = (col >= debut)[None, :]
+        for h in range(1, HORIZON + 1):
+            cible = col + h
+            if debut_bt <= cible < t:
+                prevu = niveau + saisons[:, :, (c0 + cible) % SAISON]
+                backtest[:, h - 1, :, cible - debut_bt] = np.where(demarre, prevu, np.nan)
+
+    choix = sse.argmin(axis=0)
+    lignes = np.arange(p)
+    niveau_f = niveau[choix, lignes]
+    saisons_f = saisons[choix, lignes, :]
+    futur = np.stack([
+        niveau_f + saisons_f[:, (c0 + t - 1 + h) % SAISON] for h in range(1, HORIZON + 1)
+    ])
+    return {
+        'alpha': alphas[choix],
+        'gamma': gammas[choix],
+        'niveau': niveau_f,
+        'saisons': saisons_f,
+        'backtest': np.transpose(backtest[choix, :, lignes, :], (1, 0, 2)),
+        'futur': futur,
+    }
+
+
+def _erreurs(previsions, reel):
+    """Erreur absolue totale, nb de points et volume réel par produit (points prévus ET observés)"""
+    valide = ~np.isnan(previsions) & ~np.isnan(reel)
+    ecarts = np.where(valide, np.abs(np.nan_to_num(previsions) - np.nan_to_num(reel)), 0.0)
+    axes = tuple(range(previsions.ndim))[:-2] + (previsions.ndim - 1,)
+    return (ecarts.sum(axis=axes), valide.sum(axis=axes),
+            np.where(valide, np.nan_to_num(reel), 0.0).sum(axis=axes))
+
+
+def _wape(erreur, volume):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(volume > 0, erreur / volume, np.nan)
+
+
+# ============================================================
+# AJUSTEMENT
+# ============================================================
+
+def _ajuster_complet(cursor, t_fin):
+    """Grille + backtest + choix du modèle pour tous les produits ; réécrit previsions_modeles"""
+    ventes = charger_ventes(derniere_idx=t_fin)
+    manuel, _ = charger_matrice(derniere=semaine_de_index(t_fin))
+    colonnes = [c for c in list(ventes.columns) + list(manuel.columns) if c <= t_fin]
+    if not colonnes:
+        cursor.execute("DELETE FROM previsions_modeles")
+        return 0
+    c0 = int(min(colonnes))
+    y, codes, source, m = _combiner(ventes, manuel, c0, t_fin)
+    t = y.shape[1]
+    debut_bt = max(1, t - FENETRE_BACKTEST)
+
+    lissage = _lissage(y, c0, debut_bt)
+
+    # Naïf et campagne : prévision faite en (cible - h), pour chaque cible du backtest et chaque h
+    cums = _sommes(y)
+    p, nb_bt = y.shape[0], t - debut_bt
+    bt_naif = np.full((HORIZON, p, nb_bt), np.nan)
+    bt_campagne = np.full((HORIZON, p, nb_bt), np.nan)
+    for j, cible in enumerate(range(debut_bt, t)):
+        for h in range(1, HORIZON + 1):
+            if cible - h >= 0:
+                bt_naif[h - 1, :, j], bt_campagne[h - 1, :, j] = _prevision_naive(y, cums, c0, cible - h, h)
+
+    reel = y[:, debut_bt:]
+    erreurs = {
+        'lissage': _erreurs(lissage['backtest'], reel[None]),
+        'campagne': _erreurs(bt_campagne, reel[None]),
+        'naif': _erreurs(bt_naif, reel[None]),
+    }
+    err_manuel, _, vol_manuel = _erreurs(m[:, debut_bt:][None], reel[None])
+    volume_reel = np.nansum(reel, axis=1)
+
+    # Modèle retenu : plus faible erreur absolue moyenne (ordre de MODELES en cas d'égalité)
+    noms = list(MODELES)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mae = np.stack([np.where(erreurs[n][1] > 0, erreurs[n][0] / np.maximum(erreurs[n][1], 1), np.inf)
+                        for n in noms])
+    choix = mae.argmin(axis=0)
+
+    futurs = {'lissage': lissage['futur']}
+    naifs = [_prevision_naive(y, cums, c0, t - 1, h) for h in range(1, HORIZON + 1)]
+    futurs['naif'] = np.stack([n for n, _ in naifs])
+    futurs['campagne'] = np.stack([c for _, c in naifs])
+
+    lignes = []
+    for i, code in enumerate(codes):
+        modele = noms[choix[i]]
+        prevision = np.clip(np.nan_to_num(futurs[modele][:, i]), 0, None)
+        lignes.append(cursor.mogrify(
+            "(%s, %s, %s, %s, %s, %s, %s::double precision[], %s, %s, %s::double precision[], "
+            "%s, %s, %s, %s, %s)",
+            (
+                str(code), str(source[i]), modele,
+                float(lissage['alpha'][i]), float(lissage['gamma'][i]),
+                float(lissage['niveau'][i]), [float(v) for v in lissage['saisons'][i]],
+                int(t_fin), int(t_fin), [round(float(v), 3) for v in prevision],
+                *[None if np.isnan(w) else float(w) for w in (
+                    _wape(erreurs['naif'][0][i], erreurs['naif'][2][i]),
+                    _wape(erreurs['campagne'][0][i], erreurs['campagne'][2][i]),
+                    _wape(erreurs['lissage'][0][i], erreurs['lissage'][2][i]),
+                    _wape(err_manuel[i], vol_manuel[i]),
+                )],
+                float(volume_reel[i]),
+            )
+        ).decode())
+
+    cursor.execute("DELETE FROM previsions_modeles")
+    cursor.execute(f"""
+        INSERT INTO previsions_modeles
+            (code_produit, source, modele, alpha, gamma, niveau, saisons,
+             semaine_idx, ajuste_idx, prevision,
+             wape_naif, wape_campagne, wape_lissage, wape_manuel, volume_backtest)
+        VALUES {", ".join(lignes)}
+    """)
+    return len(lignes)
+
+
+def _mettre_a_jour(cursor, etats, t_fin):
+    """
+    Avance l'état des modèles sur les semaines arrivées depuis le dernier calcul.
+
+    Returns:
+        nb de produits mis à jour, ou None si un ajustement complet est nécessaire
+        (nouveau produit dans la fenêtre)
+    """
+    depuis = min(e['semaine_idx'] for e in etats) + 1
+    premiere = min(depuis, min(_debut_campagne(t_fin), t_fin - 7) - SAISON, t_fin - 3)
+    ventes = charger_ventes(premiere, t_fin)
+    manuel, _ = charger_matrice(semaine_de_index(premiere), semaine_de_index(t_fin))
+    codes_ventes = {e['code_produit'] for e in etats if e['source'] == 'ventes'}
+    y, codes, _, _ = _combiner(ventes, manuel, premiere, t_fin, codes_ventes)
+
+    par_code = {e['code_produit']: e for e in etats}
+    if any(c not in par_code for c in codes):
+        return None
+
+    # Produits sans donnée dans la fenêtre : seulement décalés (prévisions recalculées à vide)
+    tous = list(par_code)
+    y = pd.DataFrame(y, index=codes).reindex(tous).to_numpy(dtype=float)
+    etats = [par_code[c] for c in tous]
+
+    alpha = np.array([e['alpha'] or 0.0 for e in etats])
+    gamma = np.array([e['gamma'] or 0.0 for e in etats])
+    niveau = np.array([e['niveau'] or 0.0 for e in etats])
+    saisons = np.array([list(e['saisons']) if e['saisons'] else [0.0] * SAISON for e in etats])
+    deja = np.array([e['semaine_idx'] for e in etats])
+
+    for idx in range(depuis, t_fin + 1):
+        col = idx - premiere
+        phase = idx % SAISON
+        obs = y[:, col]
+        actif = (idx > deja) & ~np.isnan(obs)
+        erreur = np.where(actif, np.nan_to_num(obs) - niveau - saisons[:, phase], 0.0)
+        niveau = niveau + alpha * erreur
+        saisons[:, phase] += gamma * erreur
+
+    cums = _sommes(y)
+    t = y.shape[1]
+    modifications = {}
+    for i, e in enumerate(etats):
+        modifications[e['code_produit']] = {
+            'niveau': float(niveau[i]),
+            'saisons': [float(v) for v in saisons[i]],
+            'semaine_idx': int(t_fin),
+        }
+    previsions = np.zeros((len(etats), HORIZON))
+    for h in range(1, HORIZON + 1):
+        naif, campagne = _prevision_naive(y, cums, premiere, t - 1, h)
+        lissage = niveau + saisons[:, (t_fin + h) % SAISON]
+        for i, e in enumerate(etats):
+            valeur = {'naif': naif, 'campagne': campagne, 'lissage': lissage}[e['modele']][i]
+            previsions[i, h - 1] = max(0.0, float(np.nan_to_num(valeur)))
+    for i, e in enumerate(etats):
+        modifications[e['code_produit']]['prevision'] = [round(float(v), 3) for v in previsions[i]]
+
+    appliquer_modifications(cursor, 'previsions_modeles', modifications, cle='code_produit',
+                            set_fixe="updated_at = CURRENT_TIMESTAMP")
+    return len(etats)
+
+
+def ajuster_modeles(force=False):
+    """
+    Met les modèles à jour jusqu'à la dernière semaine complète.
+
+    Returns:
+        ('a_jour' | 'incremental' | 'complet', nb produits)
+    """
+    init_schema_modeles()
+    t_fin = semaine_reference()
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        # Un seul ajustement à la fois (plusieurs sessions ouvrent la page en même temps)
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext('previsions_modeles'))")
+        cursor.execute("""
+            SELECT code_produit, source, modele, alpha, gamma, niveau, saisons, semaine_idx, ajuste_idx
+            FROM previsions_modeles
+        """)
+        etats = cursor.fetchall()
+
+        mode, nb = 'complet', None
+        if etats and not force:
+            if min(e['semaine_idx'] for e in etats) >= t_fin:
+                mode, nb = 'a_jour', len(etats)
+            elif min(e['ajuste_idx'] for e in etats) >= t_fin - REAJUSTEMENT_SEMAINES:
+                nb = _mettre_a_jour(cursor, etats, t_fin)
+                mode = 'incremental' if nb is not None else 'complet'
+        if nb is None:
+            nb = _ajuster_complet(cursor, t_fin)
+
+        conn.commit()
+        cursor.close()
+        return mode, nb
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+# ============================================================
+# LECTURE
+# ============================================================
+
+def get_suggestions(semaines_cibles):
+    """
+    Prévisions du modèle retenu pour les semaines cibles.
+
+    Returns:
+        {(annee, sem): {code_produit: tonnes}} — semaines hors horizon : dict vide
+    """
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT code_produit, semaine_idx, prevision FROM previsions_modeles")
+        rows = cursor.fetchall()
+        cursor.close()
+    finally:
+        conn.close()
+
+    resultat = {}
+    for annee, sem in semaines_cibles:
+        cible = index_semaine(annee, sem)
+        valeurs = {}
+        for row in rows:
+            h = cible - row['semaine_idx']
+            prevision = row['prevision'] or []
+            if 1 <= h <= len(prevision):
+                valeurs[row['code_produit']] = float(prevision[h - 1])
+        resultat[(annee, sem)] = valeurs
+    return resultat
+
+
+def get_rapport_backtest():
+    """Rapport du dernier ajustement complet : modèle retenu et WAPE par produit"""
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT pm.code_produit, pc.marque, pc.libelle, pm.source, pm.modele,
+                   pm.wape_naif, pm.wape_campagne, pm.wape_lissage, pm.wape_manuel,
+                   pm.volume_backtest, pm.alpha, pm.gamma, pm.ajuste_idx, pm.semaine_idx
+            FROM previsions_modeles pm
+            LEFT JOIN ref_produits_commerciaux pc ON pc.code_produit = pm.code_produit
+            ORDER BY pm.volume_backtest DESC NULLS LAST, pm.code_produit
+        """)
+        rows = cursor.fetchall()
+        cursor.close()
+    finally:
+        conn.close()
+
+    if not rows:
+        return pd.DataFrame()
+    df = pd.DataFrame(rows)
+    for col in ['wape_naif', 'wape_campagne', 'wape_lissage', 'wape_manuel', 'volume_backtest', 'alpha', 'gamma']:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    df['wape_retenu'] = df.apply(lambda r: r[f"wape_{r['modele']}"], axis=1)
+    return df
@@ -0,0 +1,225 @@
+# utils/previsions.py
+"""
+Base de calcul des prévisions de ventes : matrice dense produit × semaine ISO.
+
+Les semaines sont repérées par un index absolu (nombre de lundis depuis
+l'an 1) : S01/2027 suit S53/2026 sans calcul « +52 » approximatif, et les
+années ISO de 53 semaines sont gérées naturellement.
+
+previsions_ventes est chargée UNE fois en matrice (lignes = produits,
+colonnes = index de semaine contigus, NaN = pas de prévision). Moyennes
+glissantes, tendances et agrégats par marque sont ensuite des opérations
+vectorisées sur cette matrice, pour tous les produits et toutes les
+semaines cibles d'un coup.
+
+Fonctions exposées :
+- index_semaine(annee, semaine) / semaine_de_index(index) / decaler_semaine(annee, semaine, n)
+- matrice_previsions(df, colonne='quantite_prevue_tonnes') -> DataFrame produits × index
+- charger_matrice(premiere=None, derniere=None) -> (matrice, marques)
+- moyennes_precedentes(matrice, semaines_cibles, fenetre=3) -> {(annee, sem): {code: moyenne}}
+- tendances(matrice) -> DataFrame [variation_moyenne, variation_pct, nb_semaines]
+- evolution_marques(matrice, marques) -> DataFrame [marque, annee, semaine, quantite_prevue_tonnes]
+"""
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from database import get_connection
+
+
+# ============================================================
+# SEMAINES ISO
+# ============================================================
+
+def index_semaine(annee, semaine):
+    """Index absolu de la semaine ISO (lundis écoulés depuis le 01/01/0001)"""
+    return (date.fromisocalendar(int(annee), int(semaine), 1).toordinal() - 1) // 7
+
+
+def semaine_de_index(index):
+    """(annee, semaine) ISO d'un index absolu"""
+    iso = date.fromordinal(int(index) * 7 + 1).isocalendar()
+    return iso[0], iso[1]
+
+
+def decaler_semaine(annee, semaine, n):
+    """Semaine ISO n semaines après (n < 0 : avant)"""
+    return semaine_de_index(index_semaine(annee, semaine) + n)
+
+
+# ============================================================
+# MATRICE
+# ============================================================
+
+def matrice_previsions(df, colonne='quantite_prevue_tonnes', premiere=None, derniere=None):
+    """
+    Matrice dense produit × semaine depuis des lignes (code_produit_commercial, annee, semaine, valeur).
+
+    Args:
+        premiere, derniere: bornes (index de semaine) à couvrir au minimum
+
+    Returns:
+        DataFrame, index = code produit, colonnes = index de semaine contigus
+    """
+    if df is None or df.empty:
+        colonnes = range(premiere, derniere + 1) if premiere is not None and derniere is not None else []
+        return pd.DataFrame(columns=list(colonnes), dtype=float)
+
+    # Index de semaine : calculé une fois par couple (annee, semaine) distinct
+    couples = list(zip(df['annee'].astype(int), df['semaine'].astype(int)))
+    index_par_couple = {c: index_semaine(*c) for c in set(couples)}
+
+    matrice = pd.DataFrame({
+        'code': df['code_produit_commercial'].to_numpy(),
+        'idx': [index_par_couple[c] for c in couples],
+        'valeur': pd.to_numeric(df[colonne], errors='coerce').to_numpy(dtype=float),
+    }).dropna(subset=['valeur']).pivot_table(index='code', columns='idx', values='valeur', aggfunc='sum')
+    if matrice.empty:
+        return matrice_previsions(None, colonne, premiere, derniere)
+
+    debut = int(matrice.columns.min()) if premiere is None else min(premiere, int(matrice.columns.min()))
+    fin = int(matrice.columns.max()) if derniere is None else max(derniere, int(matrice.columns.max()))
+    return matrice.reindex(columns=range(debut, fin + 1))
+
+
+def charger_matrice(premiere=None, derniere=None):
+    """
+    Charge previsions_ventes (entre deux semaines (annee, sem) incluses, ou tout) en une requête.
+
+    Returns:
+        (matrice produit × semaine, Series marque par code produit)
+    """
+    conditions, params = [], []
+    if premiere is not None:
+        conditions.append("(pv.annee, pv.semaine) >= (%s, %s)")
+        params += list(premiere)
+    if derniere is not None:
+        conditions.append("(pv.annee, pv.semaine) <= (%s, %s)")
+        params += list(derniere)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT pv.code_produit_commercial, pv.annee, pv.semaine,
+                   pv.quantite_prevue_tonnes, pc.marque
+            FROM previsions_ventes pv
+            LEFT JOIN ref_produits_commerciaux pc ON pv.code_produit_commercial = pc.code_produit
+            {where}
+        """, params)
+        rows = cursor.fetchall()
+        cursor.close()
+    finally:
+        conn.close()
+
+    bornes = dict(
+        premiere=index_semaine(*premiere) if premiere is not None else None,
+        derniere=index_semaine(*derniere) if derniere is not None else None,
+    )
+    if not rows:
+        return matrice_previsions(None, **bornes), pd.Series(dtype=object)
+    df = pd.DataFrame(rows)
+    marques = df.drop_duplicates('code_produit_commercial').set_index('code_produit_commercial')['marque']
+    return matrice_previsions(df, **bornes), marques
+
+
+# ============================================================
+# CALCULS VECTORISÉS
+# ============================================================
+
+def moyennes_precedentes(matrice, semaines_cibles, fenetre=3):
+    """
+    Moyenne, par produit, des semaines renseignées parmi les `fenetre` semaines
+    précédant chaque semaine cible (toutes cibles en une passe, sommes cumulées).
+
+    Returns:
+        {(annee, sem): {code_produit: moyenne}} — produits sans donnée absents
+    """
+    if not semaines_cibles:
+        return {}
+    cibles = np.array([index_semaine(a, s) for a, s in semaines_cibles])
+    if matrice.empty or len(matrice.index) == 0:
+        return {tuple(c): {} for c in semaines_cibles}
+
+    debut = min(int(matrice.columns.min()), int(cibles.min()) - fenetre)
+    fin = max(int(matrice.columns.max()), int(cibles.max()))
+    m = matrice.reindex(columns=range(debut, fin + 1)).to_numpy(dtype=float)
+
+    presentes = ~np.isnan(m)
+    # Sommes cumulées avec une colonne 0 en tête : somme(a..b-1) = cum[b] - cum[a]
+    cum_val = np.concatenate([np.zeros((m.shape[0], 1)), np.cumsum(np.where(presentes, m, 0.0), axis=1)], axis=1)
+    cum_nb = np.concatenate([np.zeros((m.shape[0], 1)), np.cumsum(presentes, axis=1)], axis=1)
+
+    fins = cibles - debut               # colonne de la cible (exclue)
+    debuts = fins - fenetre
+    sommes = cum_val[:, fins] - cum_val[:, debuts]
+    nombres = cum_nb[:, fins] - cum_nb[:, debuts]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        moyennes = np.where(nombres > 0, sommes / nombres, np.nan)
+
+    codes = matrice.index.to_numpy()
+    resultat = {}
+    for j, cible in enumerate(semaines_cibles):
+        col = moyennes[:, j]
+        ok = ~np.isnan(col)
+        resultat[tuple(cible)] = dict(zip(codes[ok], col[ok].astype(float)))
+    return resultat
+
+
+def tendances(matrice):
+    """
+    Variation moyenne d'une semaine renseignée à la suivante, par produit.
+
+    La moyenne des écarts successifs vaut (dernière - première) / (n - 1) :
+    calculée pour tous les produits sans tri ni boucle.
+
+    Returns:
+        DataFrame indexé par code produit : variation_moyenne (NaN si < 2 semaines),
+        variation_pct (% de la moyenne, 0 si moyenne <= 0), nb_semaines
+    """
+    if matrice.empty:
+        return pd.DataFrame(columns=['variation_moyenne', 'variation_pct', 'nb_semaines'])
+    m = matrice.to_numpy(dtype=float)
+    presentes = ~np.isnan(m)
+    nb = presentes.sum(axis=1)
+    lignes = np.arange(m.shape[0])
+    premiere = m[lignes, presentes.argmax(axis=1)]
+    derniere = m[lignes, m.shape[1] - 1 - presentes[:, ::-1].argmax(axis=1)]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        variation = np.where(nb >= 2, (derniere - premiere) / np.maximum(nb - 1, 1), np.nan)
+        moyenne = np.nansum(m, axis=1) / np.maximum(nb, 1)
+        pct = np.where(moyenne > 0, variation / moyenne * 100, 0.0)
+
+    return pd.DataFrame({
+        'variation_moyenne': variation,
+        'variation_pct': np.where(nb >= 2, pct, np.nan),
+        'nb_semaines': nb,
+    }, index=matrice.index)
+
+
+def evolution_marques(matrice, marques):
+    """
+    Total par marque et par semaine (semaines où au moins un produit de la marque a une prévision).
+
+    Returns:
+        DataFrame [marque, annee, semaine, quantite_prevue_tonnes, semaine_label]
+    """
+    colonnes = ['marque', 'annee', 'semaine', 'quantite_prevue_tonnes', 'semaine_label']
+    if matrice.empty:
+        return pd.DataFrame(columns=colonnes)
+    par_marque = matrice.groupby(marques.reindex(matrice.index).to_numpy()).sum(min_count=1)
+    long = par_marque.stack().dropna().rename('quantite_prevue_tonnes').reset_index()
+    long.columns = ['marque', 'idx', 'quantite_prevue_tonnes']
+    if long.empty:
+        return pd.DataFrame(columns=colonnes)
+
+    semaines = {i: semaine_de_index(i) for i in long['idx'].unique()}
+    long['annee'] = long['idx'].map(lambda i: semaines[i][0]).astype(int)
+    long['semaine'] = long['idx'].map(lambda i: semaines[i][1]).astype(int)
+    long['semaine_label'] = (
+        "S" + long['semaine'].astype(str).str.zfill(2) + "/" + long['annee'].astype(str)
+    )
+    return long.sort_values(['marque', 'idx'])[colonnes].reset_index(drop=True)
@@ -0,0 +1,227 @@
+# utils/recaps_plan.py
+"""
+Récaps du plan de récolte calculés en mémoire.
+
+Une requête charge les lignes actives d'une campagne dans un DataFrame
+compact (textes en category, mesures en float) ; toutes les vues de la page
+Récaps (KPIs, par mois / variété / marque / type, besoins, marque+type,
+variété) en sont dérivées par groupby pandas, sans autre requête.
+
+Agrégats identiques au SQL d'origine : COUNT(DISTINCT) ignore les valeurs
+vides, les groupes à clé vide sont conservés, les mois sont triés par
+mois_numero.
+
+Cache : clé 'plans_recolte' (toute écriture) + cle_plan(campagne) (écritures
+limitées à une campagne, cf. utils/cache_tables).
+
+Fonctions exposées :
+- cle_plan(campagne) -> str
+- charger_plan_campagne(campagne) -> DataFrame
+- kpis_globaux(plan) -> dict | None
+- recap_par_mois(plan), recap_par_variete(plan), recap_par_marque(plan), recap_par_type(plan) -> DataFrame
+- besoins_avec_couverture(plan) -> DataFrame
+- marques_disponibles(plan), types_pour_marque(plan, marque), varietes_disponibles(plan) -> list
+- recap_marque_type(plan, marque, type_produit) -> dict
+- recap_variete_detail(plan, variete) -> dict
+"""
+import pandas as pd
+
+from database import get_connection
+
+COLONNES_TEXTE = ['mois', 'variete', 'marque', 'type_produit']
+COLONNES_MESURES = ['volume_net_t', 'volume_brut_t', 'hectares_necessaires', 'hectares_ajustes',
+                    'taux_couverture_cible', 'dechets_pct', 'rendement_t_ha']
+COLONNES_PLAN = ['id', 'mois_numero'] + COLONNES_TEXTE + COLONNES_MESURES
+
+_COLONNES_VOLUMES = {
+    'volume_net': ('volume_net_t', 'sum'),
+    'volume_brut': ('volume_brut_t', 'sum'),
+    'hectares': ('hectares_necessaires', 'sum'),
+}
+
+_NOMS_AFFICHAGE = {
+    'nb_lignes': 'Lignes',
+    'volume_net': 'Volume Net (T)',
+    'volume_brut': 'Volume Brut (T)',
+    'hectares': 'Hectares',
+    'hectares_arrondi': 'Ha Arrondi',
+}
+
+
+def cle_plan(campagne):
+    """Clé d'invalidation du plan d'une seule campagne"""
+    return f'plans_recolte/{campagne}'
+
+
+def charger_plan_campagne(campagne):
+    """Lignes actives du plan de la campagne, typées (une requête)"""
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT {', '.join(COLONNES_PLAN)}
+            FROM plans_recolte
+            WHERE campagne = %s AND is_active = TRUE
+            ORDER BY mois_numero, id
+        """, (campagne,))
+        rows = cursor.fetchall()
+        cursor.close()
+    finally:
+        conn.close()
+
+    plan = pd.DataFrame(rows, columns=COLONNES_PLAN)
+    plan['id'] = plan['id'].astype('int64')
+    plan['mois_numero'] = pd.to_numeric(plan['mois_numero'], errors='coerce').astype('Int16')
+    for col in COLONNES_TEXTE:
+        plan[col] = plan[col].astype('category')
+    for col in COLONNES_MESURES:
+        plan[col] = pd.to_numeric(plan[col], errors='coerce').astype('float64')
+    return plan
+
+
+def _grouper(plan, cles):
+    return plan.groupby(cles, observed=True, dropna=False, sort=False)
+
+
+def _texte(df, colonnes):
+    """Clés de groupe category → texte (affichage, export)"""
+    for col in colonnes:
+        df[col] = df[col].astype(object)
+    return df
+
+
+def kpis_globaux(plan):
+    if plan.empty:
+        return None
+    total_hectares = float(plan['hectares_necessaires'].sum())
+    return {
+        'nb_lignes': len(plan),
+        'nb_varietes': int(plan['variete'].nunique()),
+        'nb_marques': int(plan['marque'].nunique()),
+        'nb_types': int(plan['type_produit'].nunique()),
+        'total_volume_net': float(plan['volume_net_t'].sum()),
+        'total_volume_brut': float(plan['volume_brut_t'].sum()),
+        'total_hectares': total_hectares,
+        'total_hectares_arrondi': round(total_hectares, 1),
+    }
+
+
+def _recap(plan, cles, distinct, nom_distinct, libelles):
+    """Récap par clé(s) : lignes, nb distinct d'une autre colonne, volumes, hectares"""
+    if plan.empty:
+        return pd.DataFrame()
+    df = (_grouper(plan, cles)
+          .agg(nb_lignes=('id', 'size'), **{nom_distinct: (distinct, 'nunique')}, **_COLONNES_VOLUMES)
+          .reset_index())
+    df['hectares_arrondi'] = df['hectares'].round(1)
+    df = _texte(df, [c for c in cles if c in COLONNES_TEXTE])
+    return df.rename(columns={**_NOMS_AFFICHAGE, **libelles})
+
+
+def _par_volume(df):
+    return df.sort_values('Volume Net (T)', ascending=False).reset_index(drop=True) if not df.empty else df
+
+
+def recap_par_mois(plan):
+    df = _recap(plan, ['mois', 'mois_numero'], 'variete', 'nb_varietes', {'mois': 'Mois', 'nb_varietes': 'Variétés'})
+    return df.sort_values('mois_numero').reset_index(drop=True) if not df.empty else df
+
+
+def recap_par_variete(plan):
+    return _par_volume(_recap(plan, ['variete'], 'mois', 'nb_mois', {'variete': 'Variété', 'nb_mois': 'Mois'}))
+
+
+def recap_par_marque(plan):
+    return _par_volume(_recap(plan, ['marque'], 'type_produit', 'nb_types', {'marque': 'Marque', 'nb_types': 'Types'}))
+
+
+def recap_par_type(plan):
+    return _par_volume(_recap(plan, ['type_produit'], 'marque', 'nb_marques',
+                              {'type_produit': 'Type Produit', 'nb_marques': 'Marques'}))
+
+
+def besoins_avec_couverture(plan):
+    """Besoins par mois et variété avec taux de couverture moyen et hectares ajustés"""
+    if plan.empty:
+        return pd.DataFrame()
+    df = (plan.assign(_ha_couverture=plan['hectares_ajustes'].fillna(plan['hectares_necessaires']))
+          .pipe(_grouper, ['mois_numero', 'mois', 'variete'])
+          .agg(volume_net=('volume_net_t', 'sum'),
+               volume_brut=('volume_brut_t', 'sum'),
+               hectares_necessaires=('hectares_necessaires', 'sum'),
+               taux_couverture_moyen=('taux_couverture_cible', 'mean'),
+               hectares_avec_couverture=('_ha_couverture', 'sum'))
+          .reset_index()
+          .sort_values(['mois_numero', 'variete'])
+          .drop(columns='mois_numero')
+          .reset_index(drop=True))
+    df.insert(df.columns.get_loc('hectares_necessaires') + 1, 'hectares_arrondi', df['hectares_necessaires'].round(1))
+    df = _texte(df, ['mois', 'variete'])
+    return df.rename(columns={
+        'mois': 'Mois',
+        'variete': 'Variété',
+        'volume_net': 'Volume Net (T)',
+        'volume_brut': 'Volume Brut (T)',
+        'hectares_necessaires': 'Ha Nécessaires',
+        'hectares_arrondi': 'Ha Arrondi',
+        'taux_couverture_moyen': 'Taux Couverture (%)',
+        'hectares_avec_couverture': 'Ha Avec Couverture'
+    })
+
+
+def _valeurs(serie):
+    return sorted(str(v) for v in serie.dropna().unique())
+
+
+def marques_disponibles(plan):
+    return _valeurs(plan['marque'])
+
+
+def types_pour_marque(plan, marque):
+    return _valeurs(plan.loc[plan['marque'] == marque, 'type_produit'])
+
+
+def varietes_disponibles(plan):
+    return _valeurs(plan['variete'])
+
+
+def _detail_mensuel(lignes, **mesures):
+    detail = (_grouper(lignes, ['mois_numero', 'mois'])
+              .agg(nb_lignes=('id', 'size'), **mesures)
+              .reset_index()
+              .sort_values('mois_numero')
+              .drop(columns='mois_numero')
+              .reset_index(drop=True))
+    return _texte(detail, ['mois'])
+
+
+def recap_marque_type(plan, marque, type_produit):
+    """Total annuel et détail mensuel d'une combinaison Marque + Type"""
+    lignes = plan[(plan['marque'] == marque) & (plan['type_produit'] == type_produit)]
+    return {
+        'total': {
+            'nb_lignes': len(lignes),
+            'nb_mois': int(lignes['mois'].nunique()),
+            'volume_net': float(lignes['volume_net_t'].sum())
+        },
+        'detail': _detail_mensuel(lignes, volume_net=('volume_net_t', 'sum')) if not lignes.empty else pd.DataFrame()
+    }
+
+
+def recap_variete_detail(plan, variete):
+    """Total et détail mensuel d'une variété (déchets et rendement moyens)"""
+    lignes = plan[plan['variete'] == variete]
+    return {
+        'total': {
+            'nb_lignes': len(lignes),
+            'volume_net': float(lignes['volume_net_t'].sum()),
+            'dechets_moyen': float(lignes['dechets_pct'].mean()) if lignes['dechets_pct'].notna().any() else 0.0,
+            'rendement_moyen': float(lignes['rendement_t_ha'].mean()) if lignes['rendement_t_ha'].notna().any() else 0.0
+        },
+        'detail': _detail_mensuel(
+            lignes,
+            volume_net=('volume_net_t', 'sum'),
+            dechets_pct=('dechets_pct', 'mean'),
+            rendement_t_ha=('rendement_t_ha', 'mean')
+        ) if not lignes.empty else pd.DataFrame()
+    }
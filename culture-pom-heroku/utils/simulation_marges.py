@@ -0,0 +1,268 @@
+# utils/simulation_marges.py
+"""
+Moteur de simulation de marge, vectorisé sur tout le portefeuille.
+
+Les lots affectés (previsions_affectations) sont chargés une fois en tableaux
+alignés (un élément par affectation). Les marges de tous les lots, pour les
+5 échéances de prix de vente, sont un seul calcul matriciel lots × échéances ;
+l'agrégation par produit est un produit matriciel avec la matrice
+d'appartenance lot → produit.
+
+Les mêmes formules acceptent des axes supplémentaires : grille de scénarios
+(coût de production × tare × prix d'achat) et tirages Monte Carlo sont
+évalués par diffusion (broadcasting), sans boucle sur les lots ni les produits.
+
+Formules (identiques à la page Simulation) :
+    coût matière net = prix achat brut / (1 - tare)
+    coût de revient  = coût matière net + coût production atelier
+    marge €/T        = prix vente - coût de revient
+    marge %          = marge €/T / coût de revient
+
+Fonctions exposées :
+- ECHEANCES
+- calculer_marges(poids_net, prix_achat, tare_pct, cout_prod, prix_vente) -> dict de tableaux
+- grille_prix(prix_df, codes, repli_actuel=True) -> tableau produits × échéances
+- indices_echeance(dates_passage, date_ref=None) -> index d'échéance par lot
+- preparer_portefeuille(lots_df, prix_df, couts_prod, date_ref=None) -> dict de tableaux
+- marges_portefeuille(portefeuille, ...) -> (marges lots × échéances, DataFrame produit × échéance)
+- grille_scenarios(portefeuille, facteurs_cout, deltas_tare, facteurs_achat) -> DataFrame
+- monte_carlo(portefeuille, n_tirages=1000, ...) -> DataFrame par produit
+"""
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+# (colonne prix_ventes_previsions, libellé)
+ECHEANCES = (
+    ('prix_actuel', "Actuel"),
+    ('prix_2_semaines', "+2 sem"),
+    ('prix_1_mois', "+1 mois"),
+    ('prix_3_mois', "+3 mois"),
+    ('prix_6_mois', "+6 mois"),
+)
+
+# Délai (jours) jusqu'au passage : <= 0 Actuel, <= 14 +2 sem, <= 45 +1 mois, <= 120 +3 mois, au-delà +6 mois
+_BORNES_JOURS = np.array([0, 14, 45, 120])
+
+COUT_PROD_DEFAUT = 45.0
+ATELIER_DEFAUT = 'SBU'
+MARGE_CIBLE_PCT = 10.0
+
+
+# ============================================================
+# FORMULES
+# ============================================================
+
+def calculer_marges(poids_net, prix_achat, tare_pct, cout_prod, prix_vente):
+    """
+    Marges pour des tableaux de formes compatibles (diffusion numpy).
+
+    Éléments sans poids ou sans prix de vente : tout à 0 (comme calculer_marge).
+
+    Returns:
+        dict cout_matiere_net, cout_revient, marge_tonne, marge_totale, marge_pct
+    """
+    poids_net, prix_achat, tare_pct, cout_prod, prix_vente = np.broadcast_arrays(
+        *[np.asarray(x, dtype=float) for x in (poids_net, prix_achat, tare_pct, cout_prod, prix_vente)]
+    )
+    valide = (poids_net > 0) & (prix_vente > 0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cout_matiere = np.where(tare_pct < 100, prix_achat / (1 - tare_pct / 100), prix_achat)
+        cout_revient = cout_matiere + cout_prod
+        marge_tonne = prix_vente - cout_revient
+        marge_pct = np.where(cout_revient > 0, marge_tonne / cout_revient * 100, 0.0)
+
+    return {
+        'cout_matiere_net': np.where(valide, cout_matiere, 0.0),
+        'cout_revient': np.where(valide, cout_revient, 0.0),
+        'marge_tonne': np.where(valide, marge_tonne, 0.0),
+        'marge_totale': np.where(valide, marge_tonne * poids_net, 0.0),
+        'marge_pct': np.where(valide, marge_pct, 0.0),
+    }
+
+
+def _pct(marge, cout):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(cout > 0, marge / cout * 100, 0.0)
+
+
+# ============================================================
+# PRÉPARATION
+# ============================================================
+
+def grille_prix(prix_df, codes, repli_actuel=True):
+    """
+    Prix de vente €/T par produit (lignes = codes) et échéance (colonnes = ECHEANCES).
+
+    Args:
+        repli_actuel: échéance non renseignée (0) -> prix actuel
+    """
+    colonnes = [c for c, _ in ECHEANCES]
+    if prix_df is None or prix_df.empty:
+        return np.zeros((len(codes), len(ECHEANCES)))
+    prix = (prix_df.drop_duplicates('code_produit_commercial')
+            .set_index('code_produit_commercial')
+            .reindex(index=list(codes), columns=colonnes))
+    prix = prix.apply(pd.to_numeric, errors='coerce').fillna(0).to_numpy(dtype=float)
+    if repli_actuel:
+        prix[:, 1:] = np.where(prix[:, 1:] == 0, prix[:, :1], prix[:, 1:])
+    return prix
+
+
+def indices_echeance(dates_passage, date_ref=None):
+    """Index (dans ECHEANCES) du prix applicable à chaque date de passage ; sans date -> Actuel"""
+    date_ref = date_ref or date.today()
+    dates = pd.to_datetime(pd.Series(dates_passage, dtype=object), errors='coerce')
+    delta = (dates - pd.Timestamp(date_ref)).dt.days.to_numpy(dtype=float)
+    idx = np.searchsorted(_BORNES_JOURS, np.nan_to_num(delta, nan=0.0), side='left')
+    return np.where(np.isnan(delta), 0, idx)
+
+
+def preparer_portefeuille(lots_df, prix_df, couts_prod, date_ref=None):
+    """
+    Tableaux alignés du portefeuille (un élément par lot affecté).
+
+    Args:
+        lots_df: colonnes code_produit_commercial, atelier, poids_net, prix_achat,
+                 tare_pct, date_passage_prevue
+        couts_prod: {type_atelier: coût €/T}
+
+    Returns:
+        dict codes (produits), produit (index par lot), appartenance (lots × produits),
+        poids, achat, tare, cout, prix (lots × échéances), echeance (index par lot)
+    """
+    if lots_df is None or lots_df.empty:
+        return None
+    codes, produit = np.unique(lots_df['code_produit_commercial'].astype(str).to_numpy(), return_inverse=True)
+    ateliers = lots_df['atelier'].fillna(ATELIER_DEFAUT).replace('', ATELIER_DEFAUT)
+
+    appartenance = np.zeros((len(produit), len(codes)))
+    appartenance[np.arange(len(produit)), produit] = 1.0
+
+    return {
+        'codes': codes,
+        'produit': produit,
+        'appartenance': appartenance,
+        'poids': pd.to_numeric(lots_df['poids_net'], errors='coerce').fillna(0).to_numpy(dtype=float),
+        'achat': pd.to_numeric(lots_df['prix_achat'], errors='coerce').fillna(0).to_numpy(dtype=float),
+        'tare': pd.to_numeric(lots_df['tare_pct'], errors='coerce').fillna(22).to_numpy(dtype=float),
+        'cout': ateliers.map(lambda a: couts_prod.get(a, COUT_PROD_DEFAUT)).to_numpy(dtype=float),
+        'prix': grille_prix(prix_df, codes)[produit],
+        'echeance': indices_echeance(lots_df['date_passage_prevue'].to_numpy(), date_ref),
+    }
+
+
+# ============================================================
+# SIMULATIONS
+# ============================================================
+
+def _hypotheses(pf, facteur_cout=1.0, delta_tare=0.0, facteur_achat=1.0):
+    """Coût production, tare et prix d'achat des lots sous une hypothèse (diffusables)"""
+    return (
+        pf['cout'] * facteur_cout,
+        np.clip(pf['tare'] + delta_tare, 0, 99),
+        pf['achat'] * facteur_achat,
+    )
+
+
+def marges_portefeuille(pf, facteur_cout=1.0, delta_tare=0.0, facteur_achat=1.0):
+    """
+    Marges de tous les lots à toutes les échéances, et agrégat par produit.
+
+    La colonne 'Planifié' applique à chaque lot le prix de l'échéance de sa
+    date de passage prévue.
+
+    Returns:
+        (dict de tableaux lots × échéances, DataFrame indexé par produit :
+         marge_<échéance>, pct_<échéance> pour chaque échéance et 'Planifié', poids_net)
+    """
+    cout, tare, achat = _hypotheses(pf, facteur_cout, delta_tare, facteur_achat)
+    m = calculer_marges(pf['poids'][:, None], achat[:, None], tare[:, None], cout[:, None], pf['prix'])
+
+    lignes = np.arange(len(pf['poids']))
+    planifie_marge = m['marge_totale'][lignes, pf['echeance']]
+    planifie_cout = (m['cout_revient'] * pf['poids'][:, None])[lignes, pf['echeance']]
+
+    a = pf['appartenance']
+    marge = np.column_stack([m['marge_totale'], planifie_marge]).T @ a        # (H+1, P)
+    cout_total = np.column_stack([m['cout_revient'] * pf['poids'][:, None], planifie_cout]).T @ a
+    pct = _pct(marge, cout_total)
+
+    libelles = [l for _, l in ECHEANCES] + ["Planifié"]
+    df = pd.DataFrame(index=pd.Index(pf['codes'], name='code_produit'))
+    for i, libelle in enumerate(libelles):
+        df[f"marge_{libelle}"] = marge[i]
+        df[f"pct_{libelle}"] = pct[i]
+    df['poids_net'] = pf['poids'] @ a
+    return m, df
+
+
+def grille_scenarios(pf, facteurs_cout=(1.0,), deltas_tare=(0.0,), facteurs_achat=(1.0,)):
+    """
+    Marge du portefeuille (prix à la date de passage prévue de chaque lot) pour
+    toutes les combinaisons coût production × tare × prix d'achat, en un calcul
+    de forme (C, T, A, lots).
+
+    Returns:
+        DataFrame [facteur_cout, delta_tare, facteur_achat, marge_totale, cout_total, marge_pct]
+    """
+    fc = np.asarray(facteurs_cout, dtype=float)[:, None, None, None]
+    dt = np.asarray(deltas_tare, dtype=float)[None, :, None, None]
+    fa = np.asarray(facteurs_achat, dtype=float)[None, None, :, None]
+
+    cout, tare, achat = _hypotheses(pf, fc, dt, fa)
+    prix = pf['prix'][np.arange(len(pf['poids'])), pf['echeance']]
+    m = calculer_marges(pf['poids'], achat, tare, cout, prix)
+
+    marge = m['marge_totale'].sum(axis=-1)
+    cout_total = (m['cout_revient'] * pf['poids']).sum(axis=-1)
+
+    C, T, A = marge.shape
+    ic, it, ia = np.meshgrid(np.arange(C), np.arange(T), np.arange(A), indexing='ij')
+    return pd.DataFrame({
+        'facteur_cout': np.asarray(facteurs_cout, dtype=float)[ic.ravel()],
+        'delta_tare': np.asarray(deltas_tare, dtype=float)[it.ravel()],
+        'facteur_achat': np.asarray(facteurs_achat, dtype=float)[ia.ravel()],
+        'marge_totale': marge.ravel(),
+        'cout_total': cout_total.ravel(),
+        'marge_pct': _pct(marge, cout_total).ravel(),
+    })
+
+
+def monte_carlo(pf, n_tirages=1000, sigma_vente_pct=10.0, sigma_achat_pct=5.0,
+                sigma_tare_pts=2.0, graine=None):
+    """
+    Distribution de la marge par produit (prix à la date de passage prévue).
+
+    Aléas : prix de vente par produit (commun à ses lots), prix d'achat et
+    tare par lot ; lois normales centrées. Calcul de forme (tirages, lots).
+
+    Returns:
+        DataFrame indexé par produit (+ ligne 'TOTAL') : marge_moyenne, marge_p5,
+        marge_p50, marge_p95, pct_moyen, proba_sous_cible (% des tirages < 10 %)
+    """
+    rng = np.random.default_rng(graine)
+    n_lots, n_produits = pf['appartenance'].shape
+
+    choc_vente = 1 + rng.normal(0, sigma_vente_pct / 100, (n_tirages, n_produits))[:, pf['produit']]
+    choc_achat = 1 + rng.normal(0, sigma_achat_pct / 100, (n_tirages, n_lots))
+    choc_tare = rng.normal(0, sigma_tare_pts, (n_tirages, n_lots))
+
+    cout, tare, achat = _hypotheses(pf, 1.0, choc_tare, choc_achat)
+    prix = pf['prix'][np.arange(n_lots), pf['echeance']] * np.maximum(choc_vente, 0)
+    m = calculer_marges(pf['poids'], np.maximum(achat, 0), tare, cout, prix)
+
+    a = np.column_stack([pf['appartenance'], np.ones(n_lots)])       # + colonne TOTAL
+    marge = m['marge_totale'] @ a                                     # (tirages, P+1)
+    pct = _pct(marge, (m['cout_revient'] * pf['poids']) @ a)
+
+    return pd.DataFrame({
+        'marge_moyenne': marge.mean(axis=0),
+        'marge_p5': np.percentile(marge, 5, axis=0),
+        'marge_p50': np.percentile(marge, 50, axis=0),
+        'marge_p95': np.percentile(marge, 95, axis=0),
+        'pct_moyen': pct.mean(axis=0),
+        'proba_sous_cible': (pct < MARGE_CIBLE_PCT).mean(axis=0) * 100,
+    }, index=pd.Index(list(pf['codes']) + ['TOTAL'], name='code_produit'))
@@ -0,0 +1,119 @@
+# utils/soldes_produits.py
+"""
+Soldes (surplus / manque) de TOUS les produits commerciaux en une requête.
+
+Une requête agrège, pour chaque produit actif : consommation hebdo moyenne
+(5 prochaines semaines de prévision), stock net affecté, brut, nombre de
+lots, dernière date de fin estimée. Besoin jusqu'à fin de campagne, solde,
+statut, semaines couvertes et date de fin projetée sont ensuite calculés
+en colonnes (pandas/numpy), sans requête par produit.
+
+Tables lues : voir TABLES_SOLDES (clé d'invalidation, cf. utils/cache_tables).
+
+Fonctions exposées :
+- TABLES_SOLDES
+- date_fin_campagne(today=None)
+- charger_soldes(date_fin, today=None) -> DataFrame indexé par code_produit
+"""
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from database import get_connection
+
+TABLES_SOLDES = ('previsions_ventes', 'previsions_affectations', 'ref_produits_commerciaux')
+
+COLONNES_NUMERIQUES = ['conso_hebdo', 'total_brut', 'total_net', 'nb_lots']
+
+
+def date_fin_campagne(today=None):
+    """30 juin de la campagne en cours (campagne juillet → juin)"""
+    today = today or date.today()
+    return date(today.year + 1, 6, 30) if today.month >= 7 else date(today.year, 6, 30)
+
+
+def charger_soldes(date_fin, today=None):
+    """
+    Solde de chaque produit actif jusqu'à date_fin.
+
+    Returns:
+        DataFrame indexé par code_produit : marque, libelle, type_produit, atelier,
+        a_previsions, conso_hebdo, total_brut, total_net, nb_lots, date_fin_derniere,
+        besoin_campagne, solde, statut, semaines_couvertes, date_fin_projetee
+    """
+    today = today or date.today()
+    nb_semaines = max(0.0, (date_fin - today).days / 7.0)
+
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            WITH conso_5_semaines AS (
+                SELECT code_produit_commercial, AVG(quantite_prevue_tonnes) AS conso_hebdo
+                FROM (
+                    SELECT code_produit_commercial, quantite_prevue_tonnes,
+                           ROW_NUMBER() OVER (PARTITION BY code_produit_commercial ORDER BY annee, semaine) AS rn
+                    FROM previsions_ventes
+                    WHERE (annee = %s AND semaine >= %s) OR annee > %s
+                ) sub
+                WHERE rn <= 5
+                GROUP BY code_produit_commercial
+            ),
+            affectations_agg AS (
+                SELECT code_produit_commercial,
+                       SUM(quantite_affectee_tonnes) AS total_brut,
+                       SUM(poids_net_estime_tonnes) AS total_net,
+                       COUNT(*) AS nb_lots,
+                       MAX(date_fin_estimee) AS date_fin_derniere
+                FROM previsions_affectations
+                WHERE is_active = TRUE
+                GROUP BY code_produit_commercial
+            ),
+            produits_avec_prev AS (
+                SELECT DISTINCT code_produit_commercial FROM previsions_ventes
+            )
+            SELECT pc.code_produit, pc.marque, pc.libelle, pc.type_produit, pc.atelier,
+                   (pap.code_produit_commercial IS NOT NULL) AS a_previsions,
+                   COALESCE(c.conso_hebdo, 0) AS conso_hebdo,
+                   COALESCE(a.total_brut, 0) AS total_brut,
+                   COALESCE(a.total_net, 0) AS total_net,
+                   COALESCE(a.nb_lots, 0) AS nb_lots,
+                   a.date_fin_derniere
+            FROM ref_produits_commerciaux pc
+            LEFT JOIN produits_avec_prev pap ON pc.code_produit = pap.code_produit_commercial
+            LEFT JOIN conso_5_semaines c ON pc.code_produit = c.code_produit_commercial
+            LEFT JOIN affectations_agg a ON pc.code_produit = a.code_produit_commercial
+            WHERE pc.is_active = TRUE
+            ORDER BY pc.marque, pc.libelle
+        """, (today.year, today.isocalendar()[1], today.year))
+        rows = cursor.fetchall()
+        cursor.close()
+    finally:
+        conn.close()
+
+    if not rows:
+        return pd.DataFrame()
+
+    df = pd.DataFrame(rows).set_index('code_produit')
+    for col in COLONNES_NUMERIQUES:
+        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+
+    conso = df['conso_hebdo'].to_numpy(dtype=float)
+    net = df['total_net'].to_numpy(dtype=float)
+
+    df['besoin_campagne'] = conso * nb_semaines
+    df['solde'] = net - df['besoin_campagne']
+    df['statut'] = np.select([df['solde'] > 0, df['solde'] < 0], ['SURPLUS', 'MANQUE'], 'EQUILIBRE')
+
+    # Même calcul que calc_date_fin_lot (jours entiers tronqués), pour tous les produits
+    with np.errstate(divide='ignore', invalid='ignore'):
+        semaines = np.where(conso > 0, net / conso, 0.0)
+    df['semaines_couvertes'] = semaines
+    jours = np.trunc(semaines * 7)
+    df['date_fin_projetee'] = np.where(
+        conso > 0,
+        (pd.Timestamp(today) + pd.to_timedelta(jours, unit='D')).date,
+        None
+    )
+    return df
@@ -0,0 +1,331 @@
+# utils/stock_consommables.py
+"""
+Stock consommables : écritures ensemblistes et synthèse tenue à jour.
+
+- stock_consommables_synthese : une ligne par (site, atelier) et par niveau
+  d'agrégat ('*' = tous) avec nb de références, nb d'emplacements, quantité,
+  valeur (quantité × coefficient × prix) et nb d'alertes. Les KPIs de la page
+  se lisent en UNE ligne, quel que soit le filtre ;
+- chaque écriture (entrée, bon de livraison, ajustement) met à jour le stock,
+  journalise les mouvements et applique les variations à la synthèse dans la
+  transaction de l'appelant : stock et synthèse ne divergent jamais ;
+- les changements qui touchent toutes les lignes (prix, coefficient, seuil,
+  validation d'inventaire) reconstruisent la synthèse en une requête
+  (GROUPING SETS).
+
+Fonctions exposées :
+- init_synthese_consommables(conn=None)
+- reconstruire_synthese(cursor)
+- get_synthese(site=None, atelier=None) -> dict
+- get_sites_ateliers_synthese() -> (sites, ateliers)
+- entrer_stock(cursor, lignes, user, fournisseur=None, reference_bl=None, notes=None) -> nb lignes
+- ajuster_stock(cursor, consommable_id, site, atelier, emplacement, nouvelle_qte, motif, user) -> écart ou None
+"""
+from database import get_connection
+
+# Niveau « tous » dans la synthèse (site ou atelier)
+TOUS = '*'
+
+_synthese_prete = False
+
+
+def init_synthese_consommables(conn=None):
+    """Crée si besoin (une fois par process) la table de synthèse, puis la remplit si vide."""
+    global _synthese_prete
+    if _synthese_prete:
+        return
+    own = conn is None
+    conn = conn or get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS stock_consommables_synthese (
+                site            VARCHAR(100) NOT NULL,
+                atelier_cle     VARCHAR(100) NOT NULL,
+                nb_refs         INTEGER NOT NULL DEFAULT 0,
+                nb_emplacements INTEGER NOT NULL DEFAULT 0,
+                quantite        NUMERIC NOT NULL DEFAULT 0,
+                valeur          NUMERIC NOT NULL DEFAULT 0,
+                nb_alertes      INTEGER NOT NULL DEFAULT 0,
+                updated_at      TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (site, atelier_cle)
+            )
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_stock_consommables_cle
+            ON stock_consommables (consommable_id, site)
+            WHERE is_active = TRUE
+        """)
+        cur.execute("SELECT 1 FROM stock_consommables_synthese LIMIT 1")
+        if not cur.fetchone():
+            reconstruire_synthese(cur)
+        conn.commit()
+        cur.close()
+        _synthese_prete = True
+    finally:
+        if own:
+            conn.close()
+
+
+def reconstruire_synthese(cursor):
+    """Recalcule toute la synthèse depuis stock_consommables (transaction de l'appelant)."""
+    cursor.execute("DELETE FROM stock_consommables_synthese")
+    cursor.execute("""
+        INSERT INTO stock_consommables_synthese
+            (site, atelier_cle, nb_refs, nb_emplacements, quantite, valeur, nb_alertes)
+        SELECT
+            CASE WHEN GROUPING(sc.site) = 1 THEN %s ELSE sc.site END,
+            CASE WHEN GROUPING(COALESCE(sc.atelier, '')) = 1 THEN %s ELSE COALESCE(sc.atelier, '') END,
+            COUNT(DISTINCT sc.consommable_id),
+            COUNT(*),
+            COALESCE(SUM(sc.quantite), 0),
+            COALESCE(SUM(sc.quantite * COALESCE(rc.coefficient_conversion, 1) * COALESCE(rc.prix_unitaire, 0)), 0),
+            COUNT(*) FILTER (WHERE rc.seuil_alerte > 0 AND sc.quantite <= rc.seuil_alerte)
+        FROM stock_consommables sc
+        JOIN ref_consommables rc ON sc.consommable_id = rc.id
+        WHERE sc.is_active = TRUE
+        GROUPING SETS (
+            (sc.site, COALESCE(sc.atelier, '')),
+            (sc.site),
+            (COALESCE(sc.atelier, '')),
+            ()
+        )
+    """, (TOUS, TOUS))
+
+
+def get_synthese(site=None, atelier=None):
+    """
+    KPIs du filtre (site / atelier, None ou 'Tous' = tous) en une ligne.
+
+    Returns:
+        {'nb_refs', 'valeur_totale', 'nb_emplacements', 'nb_alertes'}
+    """
+    site = site if site and site != "Tous" else TOUS
+    atelier = atelier if atelier and atelier != "Tous" else TOUS
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT nb_refs, valeur, nb_emplacements, nb_alertes
+            FROM stock_consommables_synthese
+            WHERE site = %s AND atelier_cle = %s
+        """, (site, atelier))
+        row = cursor.fetchone()
+        cursor.close()
+    finally:
+        conn.close()
+
+    if not row:
+        return {'nb_refs': 0, 'valeur_totale': 0.0, 'nb_emplacements': 0, 'nb_alertes': 0}
+    return {
+        'nb_refs': int(row['nb_refs']),
+        'valeur_totale': float(row['valeur']),
+        'nb_emplacements': int(row['nb_emplacements']),
+        'nb_alertes': int(row['nb_alertes']),
+    }
+
+
+def get_sites_ateliers_synthese():
+    """Sites et ateliers ayant du stock actif, lus dans la synthèse."""
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT site, atelier_cle
+            FROM stock_consommables_synthese
+            WHERE nb_emplacements > 0 AND (site = %s) <> (atelier_cle = %s)
+        """, (TOUS, TOUS))
+        rows = cursor.fetchall()
+        cursor.close()
+    finally:
+        conn.close()
+    sites = sorted(r['site'] for r in rows if r['atelier_cle'] == TOUS)
+    ateliers = sorted(r['atelier_cle'] for r in rows if r['site'] == TOUS and r['atelier_cle'])
+    return sites, ateliers
+
+
+# ============================================================
+# ÉCRITURES
+# ============================================================
+
+def _niveaux(site, atelier_cle):
+    """Les 4 lignes de synthèse touchées par un emplacement."""
+    return [(site, atelier_cle), (site, TOUS), (TOUS, atelier_cle), (TOUS, TOUS)]
+
+
+def _appliquer_variations(cursor, lignes):
+    """
+    Reporte dans la synthèse les variations des lignes écrites par _ecrire_stock.
+
+    Une référence n'est ajoutée au nb_refs d'un niveau que si elle n'y avait
+    encore aucun emplacement actif avant l'écriture.
+    """
+    variations = {}
+    refs_ajoutees = set()
+    for l in lignes:
+        facteur = float(l['coefficient']) * float(l['prix'])
+        seuil = float(l['seuil'] or 0)
+        apres = float(l['quantite_apres'])
+        avant = None if l['quantite_avant'] is None else float(l['quantite_avant'])
+        alerte_apres = seuil > 0 and apres <= seuil
+        alerte_avant = avant is not None and seuil > 0 and avant <= seuil
+
+        deja = [l['deja_site_atelier'], l['deja_site'], l['deja_atelier'], l['deja_global']]
+        for niveau, existait in zip(_niveaux(l['site'], l['atelier_cle']), deja):
+            v = variations.setdefault(niveau, [0, 0, 0.0, 0.0, 0])
+            if avant is None:
+                v[1] += 1
+                if not existait and (niveau, l['consommable_id']) not in refs_ajoutees:
+                    refs_ajoutees.add((niveau, l['consommable_id']))
+                    v[0] += 1
+            v[2] += apres - (avant or 0.0)
+            v[3] += (apres - (avant or 0.0)) * facteur
+            v[4] += int(alerte_apres) - int(alerte_avant)
+
+    if not variations:
+        return
+    valeurs = ", ".join(
+        cursor.mogrify("(%s, %s, %s, %s, %s::numeric, %s::numeric, %s)", (site, atelier, *v)).decode()
+        for (site, atelier), v in variations.items()
+    )
+    cursor.execute(f"""
+        INSERT INTO stock_consommables_synthese AS s
+            (site, atelier_cle, nb_refs, nb_emplacements, quantite, valeur, nb_alertes)
+        VALUES {valeurs}
+        ON CONFLICT (site, atelier_cle) DO UPDATE
+        SET nb_refs = s.nb_refs + EXCLUDED.nb_refs,
+            nb_emplacements = s.nb_emplacements + EXCLUDED.nb_emplacements,
+            quantite = s.quantite + EXCLUDED.quantite,
+            valeur = s.valeur + EXCLUDED.valeur,
+            nb_alertes = s.nb_alertes + EXCLUDED.nb_alertes,
+            updated_at = CURRENT_TIMESTAMP
+    """)
+
+
+def _ecrire_stock(cursor, lignes, mode, user, fournisseur=None, reference_document=None, notes=None):
+    """
+    Écrit [(consommable_id, site, atelier, emplacement, quantité), ...] en une requête.
+
+    mode 'ENTREE' : quantité ajoutée (emplacement créé si absent) ;
+    mode 'AJUSTEMENT' : quantité comptée (emplacements absents ignorés).
+    Les emplacements sont verrouillés (FOR UPDATE) avant calcul.
+
+    Returns:
+        lignes écrites avec quantités avant/après et présence antérieure de la référence
+    """
+    valeurs = ", ".join(
+        cursor.mogrify(
+            "(%s::integer, %s::integer, %s::varchar, %s::varchar, %s::varchar, %s::numeric)",
+            (n, *ligne)
+        ).decode()
+        for n, ligne in enumerate(lignes)
+    )
+    entree = mode == 'ENTREE'
+    cursor.execute(f"""
+        WITH v(n, consommable_id, site, atelier, emplacement, qte) AS (VALUES {valeurs}),
+        avant AS (
+            SELECT v.n, sc.id, sc.quantite
+            FROM stock_consommables sc
+            JOIN v ON sc.consommable_id = v.consommable_id
+                  AND sc.site = v.site
+                  AND COALESCE(sc.atelier, '') = COALESCE(v.atelier, '')
+                  AND COALESCE(sc.emplacement, '') = COALESCE(v.emplacement, '')
+            WHERE sc.is_active = TRUE
+            FOR UPDATE OF sc
+        ),
+        maj AS (
+            UPDATE stock_consommables sc
+            SET quantite = {"sc.quantite + v.qte" if entree else "v.qte"},
+                updated_at = CURRENT_TIMESTAMP
+            FROM avant a
+            JOIN v ON v.n = a.n
+            WHERE sc.id = a.id
+            RETURNING sc.id
+        ),
+        ins AS (
+            INSERT INTO stock_consommables (consommable_id, site, atelier, emplacement, quantite)
+            SELECT v.consommable_id, v.site, v.atelier, v.emplacement, v.qte
+            FROM v
+            WHERE %s AND NOT EXISTS (SELECT 1 FROM avant a WHERE a.n = v.n)
+            RETURNING id
+        ),
+        mvt AS (
+            INSERT INTO mouvements_consommables
+                (consommable_id, type_mouvement, quantite, site, atelier, emplacement,
+                 fournisseur, reference_document, notes, created_by)
+            SELECT v.consommable_id, %s, {"v.qte" if entree else "v.qte - a.quantite"},
+                   v.site, v.atelier, v.emplacement, %s, %s, %s, %s
+            FROM v
+            LEFT JOIN avant a ON a.n = v.n
+            WHERE %s OR a.n IS NOT NULL
+            RETURNING 1
+        )
+        SELECT v.n, v.consommable_id, v.site, COALESCE(v.atelier, '') AS atelier_cle,
+               a.quantite AS quantite_avant,
+               {"COALESCE(a.quantite, 0) + v.qte" if entree else "v.qte"} AS quantite_apres,
+               COALESCE(rc.coefficient_conversion, 1) AS coefficient,
+               COALESCE(rc.prix_unitaire, 0) AS prix,
+               rc.seuil_alerte AS seuil,
+               -- État avant l'écriture (les CTE ne voient pas les lignes insérées)
+               EXISTS (SELECT 1 FROM stock_consommables x
+                       WHERE x.is_active AND x.consommable_id = v.consommable_id
+                         AND x.site = v.site AND COALESCE(x.atelier, '') = COALESCE(v.atelier, '')) AS deja_site_atelier,
+               EXISTS (SELECT 1 FROM stock_consommables x
+                       WHERE x.is_active AND x.consommable_id = v.consommable_id
+                         AND x.site = v.site) AS deja_site,
+               EXISTS (SELECT 1 FROM stock_consommables x
+                       WHERE x.is_active AND x.consommable_id = v.consommable_id
+                         AND COALESCE(x.atelier, '') = COALESCE(v.atelier, '')) AS deja_atelier,
+               EXISTS (SELECT 1 FROM stock_consommables x
+                       WHERE x.is_active AND x.consommable_id = v.consommable_id) AS deja_global
+        FROM v
+        LEFT JOIN avant a ON a.n = v.n
+        JOIN ref_consommables rc ON rc.id = v.consommable_id
+        WHERE %s OR a.n IS NOT NULL
+        ORDER BY v.n
+    """, (entree, mode, fournisseur, reference_document, notes, user, entree, entree))
+    ecrites = cursor.fetchall()
+    _appliquer_variations(cursor, ecrites)
+    return ecrites
+
+
+def entrer_stock(cursor, lignes, user, fournisseur=None, reference_bl=None, notes=None):
+    """
+    Entrée de stock d'un bon de livraison complet en une requête.
+
+    Args:
+        lignes: [(consommable_id, site, atelier, emplacement, quantité), ...] ;
+                les doublons d'un même emplacement sont cumulés
+
+    Returns:
+        nombre d'emplacements mouvementés
+    """
+    cumul = {}
+    for consommable_id, site, atelier, emplacement, quantite in lignes:
+        if not quantite:
+            continue
+        cle = (int(consommable_id), site, atelier or None, emplacement or None)
+        cumul[cle] = cumul.get(cle, 0) + quantite
+    if not cumul:
+        return 0
+    ecrites = _ecrire_stock(
+        cursor, [(*cle, qte) for cle, qte in cumul.items()], 'ENTREE', user,
+        fournisseur=fournisseur, reference_document=reference_bl, notes=notes
+    )
+    return len(ecrites)
+
+
+def ajuster_stock(cursor, consommable_id, site, atelier, emplacement, nouvelle_qte, motif, user):
+    """
+    Fixe la quantité d'un emplacement existant (inventaire ponctuel).
+
+    Returns:
+        écart appliqué, ou None si l'emplacement n'existe pas
+    """
+    ecrites = _ecrire_stock(
+        cursor, [(int(consommable_id), site, atelier or None, emplacement or None, nouvelle_qte)],
+        'AJUSTEMENT', user, notes=motif
+    )
+    if not ecrites:
+        return None
+    return float(ecrites[0]['quantite_apres']) - float(ecrites[0]['quantite_avant'])
@@ -0,0 +1,823 @@
+# utils/stock_historique.py
+"""
+Reconstruction du stock à date à partir d'instantanés (stock_snapshots).
+
+Principe :
+- des instantanés périodiques (quotidiens ou hebdomadaires) stockent, pour
+  chaque (lot, site, emplacement), le nombre d'unités et le poids à un instant
+  snapshot_at ; l'état actuel de stock_emplacements sert d'instantané virtuel
+  « maintenant » ;
+- pour une date cible, on part de l'instantané le plus proche et on applique
+  uniquement les mouvements situés entre les deux (en avant ou en arrière),
+  sous forme de deltas signés agrégés par groupby (pas de boucle Python).
+
+Les mouvements rejoués sont ceux de l'ancienne méthode (AJOUT, SUPPRESSION,
+TRANSFERT, MODIFICATION). Les MODIFICATION portent leur effet dans les colonnes
+numériques delta_unites / delta_poids_kg ; pour l'historique antérieur à ces
+colonnes, backfill_deltas_modification() les remplit depuis le champ notes
+("Quantité: avant+après | Poids: avant+aprèskg" ou "Quantité: avant→après").
+Le parsing des notes à la volée ne sert plus qu'en dernier recours.
+
+Fonctions exposées :
+- get_stock_a_date(date_cible_ts) -> (DataFrame, nb_modif_non_parsees)
+- creer_snapshot() / assurer_snapshot_recent(freq_jours)
+- get_stock_series(date_from, date_to, freq, group_by) : évolution sur N dates
+  en une passe (cumul inverse des deltas)
+- backfill_deltas_modification(dry_run) : reprise des MODIFICATION historiques
+- verifier_coherence(date_cible_ts) : snapshot + rejeu vs annulation complète
+- benchmark(...) : jeu synthétique d'un an de mouvements (python -m utils.stock_historique)
+"""
+import re
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from database import get_connection
+
+CLE = ['lot_id', 'site_stockage', 'emplacement_stockage']
+TYPES_REJOUES = ('AJOUT', 'SUPPRESSION', 'TRANSFERT', 'MODIFICATION')
+
+# Deux formats historiques : "avant+après" (MAJ en masse) et "avant→après" (Détails stock)
+_RE_QTY = r'Quantit[eé]\s*:\s*(\d+(?:\.\d+)?)\s*(?:\+|→)\s*(\d+(?:\.\d+)?)'
+_RE_PDS = r'Poids\s*:\s*([\d.]+)\s*(?:\+|→)\s*([\d.]+)'
+
+_table_prete = False
+
+
+# ============================================================
+# SCHÉMA
+# ============================================================
+
+def init_schema_historique(conn=None):
+    """
+    Crée si besoin (une fois par process) la table stock_snapshots, l'index de
+    rejeu et les colonnes delta_unites / delta_poids_kg de stock_mouvements.
+    """
+    global _table_prete
+    if _table_prete:
+        return
+    own = conn is None
+    conn = conn or get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS stock_snapshots (
+                snapshot_at          TIMESTAMP    NOT NULL,
+                lot_id               INTEGER      NOT NULL,
+                site_stockage        VARCHAR(100) NOT NULL DEFAULT '',
+                emplacement_stockage VARCHAR(100) NOT NULL DEFAULT '',
+                nombre_unites        NUMERIC(12,2) NOT NULL DEFAULT 0,
+                poids_total_kg       NUMERIC(14,2) NOT NULL DEFAULT 0,
+                PRIMARY KEY (snapshot_at, lot_id, site_stockage, emplacement_stockage)
+            )
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_stock_mouvements_created_at
+            ON stock_mouvements (created_at)
+        """)
+        cur.execute("""
+            ALTER TABLE stock_mouvements
+                ADD COLUMN IF NOT EXISTS delta_unites   NUMERIC(12,2),
+                ADD COLUMN IF NOT EXISTS delta_poids_kg NUMERIC(14,2)
+        """)
+        conn.commit()
+        cur.close()
+        _table_prete = True
+    finally:
+        if own:
+            conn.close()
+
+
+# ============================================================
+# CALCULS VECTORISÉS (sans base)
+# ============================================================
+
+def parser_notes_modification(notes):
+    """
+    Version vectorisée de _parser_notes_modification.
+
+    Returns:
+        DataFrame (qty_avant, qty_apres, pds_avant, pds_apres), NaN si non parsable.
+    """
+    notes = notes.fillna('').astype(str)
+    qty = notes.str.extract(_RE_QTY, flags=re.IGNORECASE)
+    pds = notes.str.extract(_RE_PDS, flags=re.IGNORECASE)
+    return pd.DataFrame({
+        'qty_avant': pd.to_numeric(qty[0], errors='coerce'),
+        'qty_apres': pd.to_numeric(qty[1], errors='coerce'),
+        'pds_avant': pd.to_numeric(pds[0], errors='coerce'),
+        'pds_apres': pd.to_numeric(pds[1], errors='coerce'),
+    }, index=notes.index)
+
+
+def _colonne_float(df, col):
+    if col not in df.columns:
+        return np.full(len(df), np.nan)
+    return pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=float)
+
+
+def _normaliser_cles(df, site_col, empl_col):
+    return pd.DataFrame({
+        'lot_id': df['lot_id'].to_numpy(),
+        'site_stockage': df[site_col].fillna('').astype(str).to_numpy(),
+        'emplacement_stockage': df[empl_col].fillna('').astype(str).to_numpy(),
+    })
+
+
+def mouvements_en_deltas(mvts):
+    """
+    Convertit des stock_mouvements en deltas signés par (lot, site, emplacement).
+
+    Args:
+        mvts: DataFrame (lot_id, type_mouvement, site_origine, emplacement_origine,
+              site_destination, emplacement_destination, quantite, poids_kg,
+              notes, created_at)
+
+    Returns:
+        (deltas, nb_modif_non_parsees) ; deltas = DataFrame (lot_id, site_stockage,
+        emplacement_stockage, d_unites, d_poids, created_at), une ligne par effet.
+    """
+    colonnes = CLE + ['d_unites', 'd_poids', 'created_at']
+    if mvts.empty:
+        return pd.DataFrame(columns=colonnes), 0
+
+    t = mvts['type_mouvement'].to_numpy()
+    qty = pd.to_numeric(mvts['quantite'], errors='coerce').fillna(0).to_numpy(dtype=float)
+    pds = pd.to_numeric(mvts['poids_kg'], errors='coerce').fillna(0).to_numpy(dtype=float)
+
+    # MODIFICATION : delta structuré (delta_unites / delta_poids_kg) ;
+    # à défaut, delta = après - avant lu dans notes
+    est_modif = t == 'MODIFICATION'
+    d_qty_modif = _colonne_float(mvts, 'delta_unites')
+    d_pds_modif = _colonne_float(mvts, 'delta_poids_kg')
+    modif_ok = est_modif & ~np.isnan(d_qty_modif) & ~np.isnan(d_pds_modif)
+    a_parser = est_modif & ~modif_ok
+    if a_parser.any():
+        parsed = parser_notes_modification(mvts.loc[a_parser, 'notes'])
+        ok = (parsed['qty_avant'].notna() & parsed['pds_avant'].notna()).to_numpy()
+        d_qty_modif[a_parser] = (parsed['qty_apres'] - parsed['qty_avant']).to_numpy()
+        d_pds_modif[a_parser] = (parsed['pds_apres'] - parsed['pds_avant']).to_numpy()
+        modif_ok[a_parser] = ok
+    d_qty_modif = np.nan_to_num(d_qty_modif)
+    d_pds_modif = np.nan_to_num(d_pds_modif)
+    nb_modif_non_parsees = int(est_modif.sum() - modif_ok.sum())
+
+    # Effets côté destination (+) : AJOUT, TRANSFERT, MODIFICATION parsée
+    cote_dst = np.isin(t, ('AJOUT', 'TRANSFERT')) | modif_ok
+    dst = _normaliser_cles(mvts[cote_dst], 'site_destination', 'emplacement_destination')
+    dst['d_unites'] = np.where(est_modif, d_qty_modif, qty)[cote_dst]
+    dst['d_poids'] = np.where(est_modif, d_pds_modif, pds)[cote_dst]
+    dst['created_at'] = mvts['created_at'].to_numpy()[cote_dst]
+
+    # Effets côté origine (-) : SUPPRESSION, TRANSFERT
+    cote_ori = np.isin(t, ('SUPPRESSION', 'TRANSFERT'))
+    ori = _normaliser_cles(mvts[cote_ori], 'site_origine', 'emplacement_origine')
+    ori['d_unites'] = -qty[cote_ori]
+    ori['d_poids'] = -pds[cote_ori]
+    ori['created_at'] = mvts['created_at'].to_numpy()[cote_ori]
+
+    return pd.concat([dst, ori], ignore_index=True)[colonnes], nb_modif_non_parsees
+
+
+def appliquer_deltas(base, deltas, sens=1):
+    """
+    Applique des deltas agrégés à un état de base.
+
+    Args:
+        base: DataFrame (lot_id, site_stockage, emplacement_stockage, nombre_unites, poids_total_kg)
+        deltas: sortie de mouvements_en_deltas
+        sens: +1 pour rejouer en avant, -1 pour annuler (rejeu en arrière)
+    """
+    etat = base.groupby(CLE)[['nombre_unites', 'poids_total_kg']].sum()
+    if deltas.empty:
+        return etat.reset_index()
+    agg = deltas.groupby(CLE)[['d_unites', 'd_poids']].sum()
+    agg.columns = ['nombre_unites', 'poids_total_kg']
+    return etat.add(agg * sens, fill_value=0).reset_index()
+
+
+def reconstruire_par_annulation(etat_actuel, mvts, date_cible_ts):
+    """
+    Méthode historique (boucle Python) : annule un à un tous les mouvements
+    postérieurs à date_cible_ts. Conservée pour la vérification de cohérence
+    et le benchmark ; les doublons de clé sont cumulés.
+    """
+    stock = {}
+    for r in etat_actuel.to_dict('records'):
+        k = (r['lot_id'], str(r['site_stockage'] or ''), str(r['emplacement_stockage'] or ''))
+        v = stock.setdefault(k, [0.0, 0.0])
+        v[0] += float(r['nombre_unites'] or 0)
+        v[1] += float(r['poids_total_kg'] or 0)
+
+    posterieurs = mvts[mvts['created_at'] > date_cible_ts]
+    parsed = parser_notes_modification(posterieurs['notes']) if not posterieurs.empty else None
+    a_delta = 'delta_unites' in posterieurs.columns
+    nb_modif_non_parsees = 0
+    for idx, r in posterieurs.iterrows():
+        t, lid = r['type_mouvement'], r['lot_id']
+        qty, pds = float(r['quantite'] or 0), float(r['poids_kg'] or 0)
+        ori = (lid, str(r['site_origine'] or ''), str(r['emplacement_origine'] or ''))
+        dst = (lid, str(r['site_destination'] or ''), str(r['emplacement_destination'] or ''))
+        if t == 'AJOUT':
+            v = stock.setdefault(dst, [0.0, 0.0]); v[0] -= qty; v[1] -= pds
+        elif t == 'SUPPRESSION':
+            v = stock.setdefault(ori, [0.0, 0.0]); v[0] += qty; v[1] += pds
+        elif t == 'TRANSFERT':
+            v = stock.setdefault(ori, [0.0, 0.0]); v[0] += qty; v[1] += pds
+            v = stock.setdefault(dst, [0.0, 0.0]); v[0] -= qty; v[1] -= pds
+        elif t == 'MODIFICATION':
+            p = parsed.loc[idx]
+            if a_delta and pd.notna(r['delta_unites']) and pd.notna(r['delta_poids_kg']):
+                v = stock.setdefault(dst, [0.0, 0.0])
+                v[0] -= float(r['delta_unites'])
+                v[1] -= float(r['delta_poids_kg'])
+            elif pd.notna(p['qty_avant']) and pd.notna(p['pds_avant']):
+                v = stock.setdefault(dst, [0.0, 0.0])
+                v[0] -= p['qty_apres'] - p['qty_avant']
+                v[1] -= p['pds_apres'] - p['pds_avant']
+            else:
+                nb_modif_non_parsees += 1
+
+    df = pd.DataFrame(
+        [(k[0], k[1], k[2], v[0], v[1]) for k, v in stock.items()],
+        columns=CLE + ['nombre_unites', 'poids_total_kg']
+    )
+    return df, nb_modif_non_parsees
+
+
+def filtrer_stock_positif(etat):
+    """Emplacements réellement occupés (même règle d'affichage que l'ancienne méthode)."""
+    etat = etat.copy()
+    etat['nombre_unites'] = etat['nombre_unites'].round().astype(int)
+    etat['poids_total_kg'] = etat['poids_total_kg'].round(1)
+    return etat[(etat['nombre_unites'] > 0) & (etat['site_stockage'] != '')].reset_index(drop=True)
+
+
+def choisir_reference(instants, date_cible_ts, maintenant):
+    """
+    Instantané le plus proche de la date cible (None = état actuel).
+
+    Returns:
+        (reference, sens) : sens = +1 si on rejoue en avant depuis la référence,
+        -1 si on annule en arrière.
+    """
+    meilleur, ecart = None, abs(maintenant - date_cible_ts)
+    for instant in instants:
+        e = abs(instant - date_cible_ts)
+        if e < ecart:
+            meilleur, ecart = instant, e
+    if meilleur is None:
+        return None, -1
+    return meilleur, (1 if meilleur <= date_cible_ts else -1)
+
+
+# ============================================================
+# ACCÈS BASE
+# ============================================================
+
+_SQL_MOUVEMENTS = """
+    SELECT lot_id, type_mouvement,
+           site_origine, emplacement_origine,
+           site_destination, emplacement_destination,
+           COALESCE(quantite, 0)   AS quantite,
+           COALESCE(poids_kg, 0.0) AS poids_kg,
+           delta_unites, delta_poids_kg,
+           notes, created_at
+    FROM stock_mouvements
+    WHERE type_mouvement IN ('AJOUT', 'SUPPRESSION', 'TRANSFERT', 'MODIFICATION')
+"""
+
+_SQL_ETAT_ACTUEL = """
+    SELECT se.lot_id,
+           COALESCE(se.site_stockage, '') AS site_stockage,
+           COALESCE(se.emplacement_stockage, '') AS emplacement_stockage,
+           SUM(COALESCE(se.nombre_unites, 0)) AS nombre_unites,
+           SUM(COALESCE(se.poids_total_kg, 0)) AS poids_total_kg
+    FROM stock_emplacements se
+    GROUP BY se.lot_id, COALESCE(se.site_stockage, ''), COALESCE(se.emplacement_stockage, '')
+"""
+
+
+def _frame(cursor, colonnes=None):
+    rows = cursor.fetchall()
+    if not rows:
+        return pd.DataFrame(columns=colonnes or [])
+    return pd.DataFrame([dict(r) for r in rows])
+
+
+def charger_mouvements(cursor, apres=None, jusqu_a=None):
+    """Mouvements rejouables dans ]apres, jusqu_a] (bornes optionnelles)."""
+    query, params = _SQL_MOUVEMENTS, []
+    if apres is not None:
+        query += " AND created_at > %s"
+        params.append(apres)
+    if jusqu_a is not None:
+        query += " AND created_at <= %s"
+        params.append(jusqu_a)
+    cursor.execute(query, params)
+    return _frame(cursor, ['lot_id', 'type_mouvement', 'site_origine', 'emplacement_origine',
+                           'site_destination', 'emplacement_destination',
+                           'quantite', 'poids_kg', 'delta_unites', 'delta_poids_kg',
+                           'notes', 'created_at'])
+
+
+def charger_etat(cursor, snapshot_at=None):
+    """État de référence : instantané snapshot_at, ou stock_emplacements si None."""
+    if snapshot_at is None:
+        cursor.execute(_SQL_ETAT_ACTUEL)
+    else:
+        cursor.execute("""
+            SELECT lot_id, site_stockage, emplacement_stockage, nombre_unites, poids_total_kg
+            FROM stock_snapshots WHERE snapshot_at = %s
+        """, (snapshot_at,))
+    df = _frame(cursor, CLE + ['nombre_unites', 'poids_total_kg'])
+    for col in ['nombre_unites', 'poids_total_kg']:
+        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(float)
+    return df
+
+
+def lister_snapshots(cursor):
+    cursor.execute("SELECT DISTINCT snapshot_at FROM stock_snapshots ORDER BY snapshot_at")
+    return [r['snapshot_at'] for r in cursor.fetchall()]
+
+
+def _ajouter_meta(cursor, etat):
+    """Infos d'affichage : lot (code, nom, variété) + conditionnement de l'emplacement."""
+    if etat.empty:
+        return etat.assign(code_lot_interne='', nom_usage='', code_variete='', type_conditionnement='')
+    lot_ids = [int(x) for x in etat['lot_id'].unique()]
+    cursor.execute("""
+        SELECT id AS lot_id, code_lot_interne, nom_usage, code_variete
+        FROM lots_bruts WHERE id = ANY(%s)
+    """, (lot_ids,))
+    lots = _frame(cursor, ['lot_id', 'code_lot_interne', 'nom_usage', 'code_variete'])
+    cursor.execute("""
+        SELECT DISTINCT ON (lot_id, COALESCE(site_stockage, ''), COALESCE(emplacement_stockage, ''))
+               lot_id, COALESCE(site_stockage, '') AS site_stockage,
+               COALESCE(emplacement_stockage, '') AS emplacement_stockage,
+               type_conditionnement
+        FROM stock_emplacements WHERE lot_id = ANY(%s)
+        ORDER BY lot_id, COALESCE(site_stockage, ''), COALESCE(emplacement_stockage, ''), is_active DESC, id DESC
+    """, (lot_ids,))
+    cond = _frame(cursor, CLE + ['type_conditionnement'])
+    etat = etat.merge(lots, on='lot_id', how='left').merge(cond, on=CLE, how='left')
+    for col in ['code_lot_interne', 'nom_usage', 'code_variete', 'type_conditionnement']:
+        etat[col] = etat[col].fillna('')
+    return etat
+
+
+def get_stock_a_date(date_cible_ts):
+    """
+    Reconstruit le stock à une date donnée depuis l'instantané le plus proche.
+
+    Returns:
+        (DataFrame, nb_modif_non_parsees) — mêmes colonnes que l'ancienne
+        méthode : lot_id, code_lot_interne, nom_usage, code_variete,
+        site_stockage, emplacement_stockage, nombre_unites, poids_total_kg,
+        type_conditionnement.
+    """
+    conn = get_connection()
+    try:
+        init_schema_historique(conn)
+        cursor = conn.cursor()
+        cursor.execute("SELECT LOCALTIMESTAMP AS maintenant")
+        maintenant = cursor.fetchone()['maintenant']
+        reference, sens = choisir_reference(lister_snapshots(cursor), date_cible_ts, maintenant)
+
+        base = charger_etat(cursor, reference)
+        if sens < 0:
+            mvts = charger_mouvements(cursor, apres=date_cible_ts, jusqu_a=reference)
+        else:
+            mvts = charger_mouvements(cursor, apres=reference, jusqu_a=date_cible_ts)
+        deltas, nb_modif_non_parsees = mouvements_en_deltas(mvts)
+        etat = filtrer_stock_positif(appliquer_deltas(base, deltas, sens))
+        etat = _ajouter_meta(cursor, etat)
+        cursor.close()
+    finally:
+        conn.close()
+
+    colonnes = ['lot_id', 'code_lot_interne', 'nom_usage', 'code_variete', 'site_stockage',
+                'emplacement_stockage', 'nombre_unites', 'poids_total_kg', 'type_conditionnement']
+    return etat[colonnes], nb_modif_non_parsees
+
+
+def creer_snapshot():
+    """Fige l'état actuel de stock_emplacements. Retourne (snapshot_at, nb_lignes)."""
+    conn = get_connection()
+    try:
+        init_schema_historique(conn)
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO stock_snapshots (snapshot_at, lot_id, site_stockage, emplacement_stockage,
+                                         nombre_unites, poids_total_kg)
+            SELECT LOCALTIMESTAMP, e.lot_id, e.site_stockage, e.emplacement_stockage,
+                   e.nombre_unites, e.poids_total_kg
+            FROM ({etat}) e
+            WHERE e.nombre_unites <> 0 OR e.poids_total_kg <> 0
+        """.format(etat=_SQL_ETAT_ACTUEL))
+        nb = cursor.rowcount
+        cursor.execute("SELECT LOCALTIMESTAMP AS snapshot_at")
+        snapshot_at = cursor.fetchone()['snapshot_at']
+        conn.commit()
+        cursor.close()
+        return snapshot_at, nb
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def assurer_snapshot_recent(freq_jours=7):
+    """Crée un instantané si le dernier date de plus de freq_jours (1 = quotidien, 7 = hebdo)."""
+    conn = get_connection()
+    try:
+        init_schema_historique(conn)
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT MAX(snapshot_at) < LOCALTIMESTAMP - make_interval(days => %s) AS perime,
+                   MAX(snapshot_at) IS NULL AS vide
+            FROM stock_snapshots
+        """, (int(freq_jours),))
+        row = cursor.fetchone()
+        cursor.close()
+    finally:
+        conn.close()
+    if row['vide'] or row['perime']:
+        return creer_snapshot()
+    return None
+
+
+def purger_snapshots(garder_jours=400):
+    """Supprime les instantanés plus anciens que garder_jours."""
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            DELETE FROM stock_snapshots
+            WHERE snapshot_at < LOCALTIMESTAMP - make_interval(days => %s)
+        """, (int(garder_jours),))
+        nb = cursor.rowcount
+        conn.commit()
+        cursor.close()
+        return nb
+    finally:
+        conn.close()
+
+
+# Calcul des deltas depuis notes (regexp_match Postgres, mêmes formats que _RE_QTY/_RE_PDS)
+_SQL_BACKFILL_CALCUL = r"""
+    WITH parse AS (
+        SELECT id, poids_kg,
+               COALESCE(notes, '') ~* 'Type\s*:' AS type_modifie,
+               regexp_match(notes, 'Quantit[eé]\s*:\s*(\d+(?:\.\d+)?)\s*(?:\+|→)\s*(\d+(?:\.\d+)?)', 'i') AS q,
+               regexp_match(notes, 'Poids\s*:\s*([\d.]+)\s*(?:\+|→)\s*([\d.]+)', 'i') AS p
+        FROM stock_mouvements
+        WHERE type_mouvement = 'MODIFICATION'
+          AND (delta_unites IS NULL OR delta_poids_kg IS NULL)
+    ),
+    calcul AS (
+        SELECT id,
+               CASE
+                   WHEN q IS NOT NULL THEN q[2]::numeric - q[1]::numeric
+                   WHEN p IS NOT NULL OR NOT type_modifie THEN 0
+               END AS d_unites,
+               CASE
+                   WHEN p IS NOT NULL THEN p[2]::numeric - p[1]::numeric
+                   WHEN q IS NOT NULL AND NOT type_modifie AND q[2]::numeric > 0
+                       THEN COALESCE(poids_kg, 0) * (1 - q[1]::numeric / q[2]::numeric)
+                   WHEN q IS NULL AND NOT type_modifie THEN 0
+               END AS d_poids
+        FROM parse
+    )
+"""
+
+
+def backfill_deltas_modification(dry_run=False):
+    """
+    Reprise en masse des MODIFICATION historiques sans delta structuré.
+
+    Une seule requête UPDATE ... FROM, parsing des notes côté Postgres :
+    - "Quantité: a+b" / "Quantité: a→b" -> delta_unites = b - a ;
+    - "Poids: a+b" / "Poids: a→bkg"     -> delta_poids_kg = b - a ;
+    - quantité seule (Détails stock recalcule le poids sans le tracer) :
+      poids avant estimé au prorata, poids_kg × a / b ;
+    - ni quantité, ni poids, ni type (statut, calibre) : deltas nuls.
+    Les lignes restantes (changement de type sans poids tracé) restent NULL
+    et continuent d'être signalées comme non parsées.
+
+    Returns:
+        dict (a_traiter, remplies, non_resolues) ; en dry_run, remplies est
+        le nombre de lignes qui seraient remplies.
+    """
+    conn = get_connection()
+    try:
+        init_schema_historique(conn)
+        cursor = conn.cursor()
+        cursor.execute(_SQL_BACKFILL_CALCUL + """
+            SELECT COUNT(*) AS a_traiter,
+                   COUNT(*) FILTER (WHERE d_unites IS NOT NULL AND d_poids IS NOT NULL) AS resolues
+            FROM calcul
+        """)
+        compte = cursor.fetchone()
+        a_traiter, resolues = int(compte['a_traiter']), int(compte['resolues'])
+
+        remplies = resolues
+        if not dry_run and resolues:
+            cursor.execute(_SQL_BACKFILL_CALCUL + """
+                UPDATE stock_mouvements sm
+                SET delta_unites = c.d_unites,
+                    delta_poids_kg = ROUND(c.d_poids, 2)
+                FROM calcul c
+                WHERE sm.id = c.id
+                  AND c.d_unites IS NOT NULL AND c.d_poids IS NOT NULL
+            """)
+            remplies = cursor.rowcount
+            conn.commit()
+        cursor.close()
+        return {'a_traiter': a_traiter, 'remplies': remplies, 'non_resolues': a_traiter - resolues}
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def comparer_etats(a, b, tolerance_kg=0.5):
+    """Écarts entre deux reconstructions (lignes dont unités ou poids diffèrent)."""
+    cols = ['nombre_unites', 'poids_total_kg']
+    fusion = a.set_index(CLE)[cols].join(b.set_index(CLE)[cols], how='outer',
+                                         lsuffix='_a', rsuffix='_b').fillna(0)
+    ecarts = fusion[
+        (fusion['nombre_unites_a'] != fusion['nombre_unites_b'])
+        | ((fusion['poids_total_kg_a'] - fusion['poids_total_kg_b']).abs() > tolerance_kg)
+    ]
+    return ecarts.reset_index()
+
+
+def verifier_coherence(date_cible_ts):
+    """
+    Compare snapshot + rejeu et annulation complète depuis l'état actuel.
+
+    Returns:
+        dict (nb_emplacements, nb_ecarts, ecarts DataFrame, durées en secondes)
+    """
+    t0 = time.perf_counter()
+    df_snap, _ = get_stock_a_date(date_cible_ts)
+    duree_snapshot = time.perf_counter() - t0
+
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        t0 = time.perf_counter()
+        etat_actuel = charger_etat(cursor)
+        mvts = charger_mouvements(cursor, apres=date_cible_ts)
+        df_ref, _ = reconstruire_par_annulation(etat_actuel, mvts, date_cible_ts)
+        df_ref = filtrer_stock_positif(df_ref)
+        duree_annulation = time.perf_counter() - t0
+        cursor.close()
+    finally:
+        conn.close()
+
+    ecarts = comparer_etats(df_snap, df_ref)
+    return {
+        'nb_emplacements': len(df_ref),
+        'nb_ecarts': len(ecarts),
+        'ecarts': ecarts,
+        'duree_snapshot_s': round(duree_snapshot, 3),
+        'duree_annulation_s': round(duree_annulation, 3),
+    }
+
+
+# ============================================================
+# SÉRIES TEMPORELLES
+# ============================================================
+
+GROUPES_SERIE = ('site_stockage', 'emplacement_stockage', 'code_variete', 'nom_usage', 'lot_id')
+
+
+def grille_dates(date_from, date_to, freq='W'):
+    """
+    Points de la série (fin de journée) : 'D' quotidien, 'W' hebdo (dimanche),
+    'M' fin de mois. date_to est toujours inclus.
+    """
+    alias = {'D': 'D', 'W': 'W-SUN', 'M': 'ME'}.get(freq, freq)
+    debut, fin = pd.Timestamp(date_from).normalize(), pd.Timestamp(date_to).normalize()
+    try:
+        jours = pd.date_range(debut, fin, freq=alias)
+    except ValueError:
+        jours = pd.date_range(debut, fin, freq='M')  # pandas < 2.2
+    jours = jours.union(pd.DatetimeIndex([fin]))
+    return jours + pd.Timedelta(days=1) - pd.Timedelta(microseconds=1)
+
+
+def calculer_serie(etat_final, deltas, points):
+    """
+    Stock par (lot, site, emplacement) à chaque point, en une passe.
+
+    etat_final est l'état après tous les deltas ; un delta daté c modifie les
+    points t < c. Chaque delta est rangé dans un seau j = searchsorted(points, c)
+    et le stock au point i vaut etat_final - somme des seaux j > i (cumul inverse).
+
+    Returns:
+        DataFrame long (lot_id, site_stockage, emplacement_stockage, date,
+        nombre_unites, poids_total_kg), emplacements occupés uniquement
+        (même règle que get_stock_a_date).
+    """
+    valeurs = ['nombre_unites', 'poids_total_kg']
+    nb_points = len(points)
+    d = deltas
+    if not d.empty:
+        seau = np.searchsorted(points.to_numpy(), pd.to_datetime(d['created_at']).to_numpy(), side='left')
+        d = d.assign(seau=seau)
+        d = d[d['seau'] > 0]  # antérieurs au premier point : sans effet
+    cles = pd.concat([etat_final[CLE], d[CLE]], ignore_index=True).drop_duplicates()
+    if cles.empty:
+        return pd.DataFrame(columns=CLE + ['date'] + valeurs)
+    etat = (
+        etat_final.groupby(CLE)[valeurs].sum()
+        .reindex(pd.MultiIndex.from_frame(cles), fill_value=0.0)
+    )
+
+    resultats = []
+    for col, col_delta in zip(valeurs, ['d_unites', 'd_poids']):
+        fin = etat[col].to_numpy(dtype=float)
+        if d.empty:
+            matrice = np.repeat(fin[:, None], nb_points, axis=1)
+        else:
+            seaux = (
+                d.groupby(CLE + ['seau'])[col_delta].sum()
+                .unstack('seau', fill_value=0.0)
+                .reindex(index=etat.index, columns=range(nb_points + 1), fill_value=0.0)
+                .to_numpy(dtype=float)
+            )
+            # somme des seaux strictement postérieurs à chaque point
+            apres = np.cumsum(seaux[:, ::-1], axis=1)[:, ::-1]
+            matrice = fin[:, None] - apres[:, 1:]
+        resultats.append(matrice.ravel())
+
+    cles = etat.index.to_frame(index=False)
+    serie = cles.loc[cles.index.repeat(nb_points)].reset_index(drop=True)
+    serie['date'] = np.tile(points.normalize().to_numpy(), len(etat))
+    serie['nombre_unites'] = np.round(resultats[0]).astype(int)
+    serie['poids_total_kg'] = resultats[1].round(1)
+    occupe = (serie['nombre_unites'] > 0) & (serie['site_stockage'] != '')
+    return serie[occupe].reset_index(drop=True)
+
+
+def get_stock_series(date_from, date_to, freq='W', group_by=('site_stockage',)):
+    """
+    Évolution du stock sur une période, tous les points calculés en une fois.
+
+    Une seule lecture de l'état actuel et des mouvements postérieurs à date_from,
+    puis cumul inverse des deltas (calculer_serie) : 52 points hebdomadaires
+    coûtent à peu près le prix d'un get_stock_a_date.
+
+    Args:
+        freq: 'D', 'W' ou 'M'
+        group_by: colonnes parmi GROUPES_SERIE (vide = total)
+
+    Returns:
+        (DataFrame tidy [date, *group_by, nombre_unites, poids_total_kg, tonnage],
+         nb_modif_non_parsees) — prêt pour px.line / px.area.
+    """
+    group_by = [g for g in (group_by or []) if g in GROUPES_SERIE]
+    points = grille_dates(date_from, date_to, freq)
+
+    conn = get_connection()
+    try:
+        init_schema_historique(conn)
+        cursor = conn.cursor()
+        etat_actuel = charger_etat(cursor)
+        mvts = charger_mouvements(cursor, apres=points[0])
+        deltas, nb_modif_non_parsees = mouvements_en_deltas(mvts)
+        serie = calculer_serie(etat_actuel, deltas, points)
+        if serie.empty:
+            cursor.close()
+            return pd.DataFrame(columns=['date'] + group_by + ['nombre_unites', 'poids_total_kg', 'tonnage']), \
+                nb_modif_non_parsees
+        if {'code_variete', 'nom_usage'} & set(group_by):
+            cursor.execute("""
+                SELECT id AS lot_id, nom_usage, code_variete
+                FROM lots_bruts WHERE id = ANY(%s)
+            """, ([int(x) for x in serie['lot_id'].unique()],))
+            lots = _frame(cursor, ['lot_id', 'nom_usage', 'code_variete'])
+            serie = serie.merge(lots, on='lot_id', how='left')
+            for col in ['nom_usage', 'code_variete']:
+                serie[col] = serie[col].fillna('')
+        cursor.close()
+    finally:
+        conn.close()
+
+    agg = (
+        serie.groupby(['date'] + group_by, as_index=False)[['nombre_unites', 'poids_total_kg']].sum()
+        .sort_values(['date'] + group_by)
+        .reset_index(drop=True)
+    )
+    agg['tonnage'] = (agg['poids_total_kg'] / 1000).round(1)
+    return agg, nb_modif_non_parsees
+
+
+# ============================================================
+# BENCHMARK (jeu synthétique, sans base)
+# ============================================================
+
+def generer_mouvements_synthetiques(nb_lots=400, nb_mouvements=60000, debut=None, seed=42):
+    """Une saison synthétique : AJOUT / TRANSFERT / MODIFICATION / SUPPRESSION sur un an."""
+    rng = np.random.default_rng(seed)
+    debut = debut or datetime(2025, 7, 1)
+    sites = np.array(['SAINT_FLAVY', 'CHAMPAGNE', 'BEAUCE', 'PICARDIE'])
+    empls = np.array([f'C{i:02d}' for i in range(1, 21)])
+    secondes = np.sort(rng.integers(0, 365 * 24 * 3600, nb_mouvements))
+    types = rng.choice(np.array(TYPES_REJOUES), nb_mouvements, p=[0.35, 0.15, 0.35, 0.15])
+    qty = rng.integers(1, 12, nb_mouvements)
+    avant = rng.integers(1, 30, nb_mouvements)
+    notes = np.where(
+        types == 'MODIFICATION',
+        [f"Quantité: {a}+{a + q} | Poids: {a * 1900.0}+{(a + q) * 1900.0}kg" for a, q in zip(avant, qty)],
+        None
+    )
+    # La moitié des MODIFICATION porte le delta structuré, l'autre n'a que les notes
+    avec_delta = (types == 'MODIFICATION') & (rng.random(nb_mouvements) < 0.5)
+    return pd.DataFrame({
+        'lot_id': rng.integers(1, nb_lots + 1, nb_mouvements),
+        'type_mouvement': types,
+        'site_origine': rng.choice(sites, nb_mouvements),
+        'emplacement_origine': rng.choice(empls, nb_mouvements),
+        'site_destination': rng.choice(sites, nb_mouvements),
+        'emplacement_destination': rng.choice(empls, nb_mouvements),
+        'quantite': qty,
+        'poids_kg': qty * 1900.0,
+        'delta_unites': np.where(avec_delta, qty, np.nan),
+        'delta_poids_kg': np.where(avec_delta, qty * 1900.0, np.nan),
+        'notes': notes,
+        'created_at': pd.to_datetime(debut) + pd.to_timedelta(secondes, unit='s'),
+    })
+
+
+def benchmark(nb_lots=400, nb_mouvements=60000, recul_jours=180, freq_jours=7):
+    """
+    Compare l'annulation complète (boucle) et snapshot + rejeu vectorisé sur un an
+    de mouvements synthétiques, et vérifie que les deux résultats coïncident.
+    """
+    mvts = generer_mouvements_synthetiques(nb_lots, nb_mouvements)
+    maintenant = mvts['created_at'].max() + pd.Timedelta(seconds=1)
+    # État « actuel » = cumul de tous les mouvements depuis un stock vide
+    deltas_tous, _ = mouvements_en_deltas(mvts)
+    etat_actuel = (
+        deltas_tous.groupby(CLE, as_index=False)[['d_unites', 'd_poids']].sum()
+        .rename(columns={'d_unites': 'nombre_unites', 'd_poids': 'poids_total_kg'})
+    )
+
+    # Instantanés périodiques (construits une fois, hors chronométrage)
+    instants = pd.date_range(mvts['created_at'].min().normalize(), maintenant, freq=f'{freq_jours}D')
+    snapshots = {
+        instant: appliquer_deltas(etat_actuel, deltas_tous[deltas_tous['created_at'] > instant], -1)
+        for instant in instants
+    }
+
+    cible = maintenant - pd.Timedelta(days=recul_jours)
+
+    t0 = time.perf_counter()
+    ref, _ = reconstruire_par_annulation(etat_actuel, mvts, cible)
+    ref = filtrer_stock_positif(ref)
+    duree_boucle = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    reference, sens = choisir_reference(list(snapshots), cible, maintenant)
+    base = snapshots[reference] if reference is not None else etat_actuel
+    if sens < 0:
+        fenetre = mvts[(mvts['created_at'] > cible) & (mvts['created_at'] <= (reference or maintenant))]
+    else:
+        fenetre = mvts[(mvts['created_at'] > reference) & (mvts['created_at'] <= cible)]
+    deltas, _ = mouvements_en_deltas(fenetre)
+    snap = filtrer_stock_positif(appliquer_deltas(base, deltas, sens))
+    duree_snapshot = time.perf_counter() - t0
+
+    ecarts = comparer_etats(snap, ref)
+
+    # Série hebdomadaire sur un an, en une passe
+    t0 = time.perf_counter()
+    points = grille_dates(maintenant - pd.Timedelta(days=365), maintenant, 'W')
+    serie = calculer_serie(etat_actuel, deltas_tous, points)
+    duree_serie = time.perf_counter() - t0
+
+    return {
+        'mouvements': nb_mouvements,
+        'mouvements_rejoues_boucle': int((mvts['created_at'] > cible).sum()),
+        'mouvements_rejoues_snapshot': len(fenetre),
+        'duree_boucle_s': round(duree_boucle, 3),
+        'duree_snapshot_s': round(duree_snapshot, 3),
+        'acceleration': round(duree_boucle / duree_snapshot, 1) if duree_snapshot else None,
+        'nb_ecarts': len(ecarts),
+        'points_serie': len(points),
+        'lignes_serie': len(serie),
+        'duree_serie_s': round(duree_serie, 3),
+    }
+
+
+if __name__ == "__main__":
+    for k, v in benchmark().items():
+        print(f"{k:30} {v}")
@@ -0,0 +1,238 @@
+# utils/stock_operations.py
+"""
+Opérations d'écriture sur stock_emplacements avec verrou de ligne.
+
+Chaque opération reçoit un curseur déjà en transaction (voir
+database.executer_transaction), verrouille les emplacements lus avec
+SELECT ... FOR UPDATE avant de calculer les nouvelles valeurs, et retourne
+(succès, message). Deux opérateurs qui transfèrent depuis le même emplacement
+sont ainsi sérialisés par Postgres au lieu de s'écraser mutuellement.
+Une destination qui n'existe pas encore n'a pas de ligne à verrouiller : un
+verrou consultatif sur sa clé (lot, site, emplacement, conditionnement,
+lavage) empêche deux premiers transferts simultanés de créer deux lignes.
+
+Fonctions exposées :
+- transferer_emplacement(cursor, lot_id, empl_source_id, quantite, site_dest, empl_dest, user)
+- modifier_emplacement(cursor, empl_id, user, nouvelle_quantite=None, ...)
+- supprimer_emplacement(cursor, empl_id, user)
+"""
+from database import verrouiller
+
+# Poids unitaire par conditionnement (kg), Pallox par défaut
+POIDS_UNITAIRES = {
+    'Pallox': 1900.0,
+    'Petit Pallox': 1200.0,
+    'Big Bag': 1600.0,
+}
+
+
+def poids_unitaire(type_conditionnement):
+    return POIDS_UNITAIRES.get(type_conditionnement, 1900.0)
+
+
+def _verrouiller_destination(cursor, lot_id, site, emplacement, type_conditionnement, statut_lavage):
+    """Verrou consultatif (fin de transaction) sur la clé d'un emplacement, existant ou non"""
+    cle = f"stock_emplacements|{int(lot_id)}|{site}|{emplacement}|{type_conditionnement}|{statut_lavage}"
+    verrouiller(cursor, "SELECT pg_advisory_xact_lock(hashtext(%s))", (cle,))
+
+
+def transferer_emplacement(cursor, lot_id, empl_source_id, quantite_transfert, site_dest, empl_dest, user):
+    """Transfère du stock d'un emplacement vers un autre (source et destination verrouillées)"""
+    source = verrouiller(cursor, """
+        SELECT site_stockage, emplacement_stockage, nombre_unites,
+               type_conditionnement, poids_total_kg, statut_lavage
+        FROM stock_emplacements
+        WHERE id = %s AND is_active = TRUE
+        FOR UPDATE
+    """, (empl_source_id,))
+
+    if not source:
+        return False, "❌ Emplacement source introuvable"
+
+    if int(quantite_transfert) > int(source['nombre_unites']):
+        return False, f"❌ Quantité insuffisante (disponible: {source['nombre_unites']})"
+
+    pu = poids_unitaire(source['type_conditionnement'])
+    poids_transfere = int(quantite_transfert) * pu
+
+    # Déduire de la source
+    nouvelle_quantite_source = int(source['nombre_unites']) - int(quantite_transfert)
+    nouveau_poids_source = nouvelle_quantite_source * pu
+
+    if nouvelle_quantite_source == 0:
+        cursor.execute("""
+            UPDATE stock_emplacements
+            SET is_active = FALSE
+            WHERE id = %s
+        """, (empl_source_id,))
+    else:
+        cursor.execute("""
+            UPDATE stock_emplacements
+            SET nombre_unites = %s, poids_total_kg = %s
+            WHERE id = %s
+        """, (nouvelle_quantite_source, nouveau_poids_source, empl_source_id))
+
+    # Destination existante (verrouillée à son tour) ; la clé d'abord, pour
+    # sérialiser aussi la création d'une destination encore absente
+    _verrouiller_destination(cursor, lot_id, site_dest, empl_dest,
+                             source['type_conditionnement'], source['statut_lavage'])
+    dest_existant = verrouiller(cursor, """
+        SELECT id, nombre_unites, poids_total_kg
+        FROM stock_emplacements
+        WHERE lot_id = %s
+          AND site_stockage = %s
+          AND emplacement_stockage = %s
+          AND type_conditionnement = %s
+          AND statut_lavage = %s
+          AND is_active = TRUE
+        ORDER BY id
+        LIMIT 1
+        FOR UPDATE
+    """, (int(lot_id), site_dest, empl_dest, source['type_conditionnement'], source['statut_lavage']))
+
+    if dest_existant:
+        cursor.execute("""
+            UPDATE stock_emplacements
+            SET nombre_unites = %s, poids_total_kg = %s
+            WHERE id = %s
+        """, (int(dest_existant['nombre_unites']) + int(quantite_transfert),
+              float(dest_existant['poids_total_kg']) + poids_transfere, dest_existant['id']))
+    else:
+        cursor.execute("""
+            INSERT INTO stock_emplacements (
+                lot_id, site_stockage, emplacement_stockage,
+                nombre_unites, type_conditionnement, poids_total_kg,
+                statut_lavage, is_active
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s, TRUE)
+        """, (int(lot_id), site_dest, empl_dest, int(quantite_transfert),
+              source['type_conditionnement'], poids_transfere, source['statut_lavage']))
+
+    cursor.execute("""
+        INSERT INTO stock_mouvements (
+            lot_id, type_mouvement,
+            site_origine, emplacement_origine,
+            site_destination, emplacement_destination,
+            quantite, type_conditionnement, poids_kg, user_action, created_by
+        ) VALUES (%s, 'TRANSFERT', %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """, (int(lot_id), source['site_stockage'], source['emplacement_stockage'],
+          site_dest, empl_dest, int(quantite_transfert),
+          source['type_conditionnement'], poids_transfere, user, user))
+
+    return True, "✅ Transfert effectué"
+
+
+def modifier_emplacement(cursor, empl_id, user, nouvelle_quantite=None, nouveau_type=None, nouveau_statut=None,
+                         nouveau_poids=None, nouveau_calibre_min=None, nouveau_calibre_max=None):
+    """
+    Modifie complètement un emplacement avec traçabilité (ligne verrouillée).
+    Suppose les colonnes delta_* présentes (init_schema_historique).
+    """
+    if nouveau_calibre_min is not None and nouveau_calibre_max is not None:
+        if nouveau_calibre_min >= nouveau_calibre_max:
+            return False, "❌ Calibre min doit être inférieur à calibre max"
+
+    empl = verrouiller(cursor, """
+        SELECT lot_id, site_stockage, emplacement_stockage,
+               nombre_unites, type_conditionnement, poids_total_kg,
+               statut_lavage, calibre_min, calibre_max
+        FROM stock_emplacements
+        WHERE id = %s AND is_active = TRUE
+        FOR UPDATE
+    """, (empl_id,))
+
+    if not empl:
+        return False, "❌ Emplacement introuvable"
+
+    # Nouvelles valeurs (anciennes si non spécifiées)
+    final_quantite = int(nouvelle_quantite) if nouvelle_quantite is not None else int(empl['nombre_unites'])
+    final_type = nouveau_type if nouveau_type is not None else empl['type_conditionnement']
+    final_statut = nouveau_statut if nouveau_statut is not None else empl['statut_lavage']
+
+    if nouveau_poids is not None:
+        final_poids = float(nouveau_poids)
+    else:
+        final_poids = final_quantite * poids_unitaire(final_type)
+
+    final_calibre_min = int(nouveau_calibre_min) if nouveau_calibre_min is not None else empl['calibre_min']
+    final_calibre_max = int(nouveau_calibre_max) if nouveau_calibre_max is not None else empl['calibre_max']
+
+    # Notes de modification pour traçabilité
+    modifications = []
+    if nouvelle_quantite is not None and int(nouvelle_quantite) != int(empl['nombre_unites']):
+        modifications.append(f"Quantité: {empl['nombre_unites']}→{final_quantite}")
+    if nouveau_type is not None and nouveau_type != empl['type_conditionnement']:
+        modifications.append(f"Type: {empl['type_conditionnement']}→{final_type}")
+    if nouveau_statut is not None and nouveau_statut != empl['statut_lavage']:
+        modifications.append(f"Statut: {empl['statut_lavage']}→{final_statut}")
+    if nouveau_poids is not None and abs(float(nouveau_poids) - float(empl['poids_total_kg'])) > 1:
+        modifications.append(f"Poids: {empl['poids_total_kg']:.0f}→{final_poids:.0f}kg")
+    if nouveau_calibre_min is not None or nouveau_calibre_max is not None:
+        old_cal = f"{empl['calibre_min'] or '?'}-{empl['calibre_max'] or '?'}"
+        new_cal = f"{final_calibre_min or '?'}-{final_calibre_max or '?'}"
+        if old_cal != new_cal:
+            modifications.append(f"Calibre: {old_cal}→{new_cal}")
+
+    if not modifications:
+        return True, "ℹ️ Aucune modification détectée"
+
+    cursor.execute("""
+        UPDATE stock_emplacements
+        SET nombre_unites = %s,
+            type_conditionnement = %s,
+            poids_total_kg = %s,
+            statut_lavage = %s,
+            calibre_min = %s,
+            calibre_max = %s,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE id = %s
+    """, (final_quantite, final_type, final_poids, final_statut,
+          final_calibre_min, final_calibre_max, empl_id))
+
+    # Deltas structurés : rejeu du stock à date sans parser les notes
+    delta_unites = final_quantite - int(empl['nombre_unites'] or 0)
+    delta_poids = round(float(final_poids) - float(empl['poids_total_kg'] or 0), 2)
+
+    cursor.execute("""
+        INSERT INTO stock_mouvements (
+            lot_id, type_mouvement,
+            site_destination, emplacement_destination,
+            quantite, type_conditionnement, poids_kg, user_action, created_by,
+            notes, delta_unites, delta_poids_kg
+        ) VALUES (%s, 'MODIFICATION', %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """, (int(empl['lot_id']), empl['site_stockage'], empl['emplacement_stockage'],
+          final_quantite, final_type, final_poids, user, user, " | ".join(modifications),
+          delta_unites, delta_poids))
+
+    return True, f"✅ Emplacement modifié ({len(modifications)} changement(s))"
+
+
+def supprimer_emplacement(cursor, empl_id, user):
+    """Supprime (soft delete) un emplacement (ligne verrouillée)"""
+    empl = verrouiller(cursor, """
+        SELECT lot_id, site_stockage, emplacement_stockage,
+               nombre_unites, type_conditionnement, poids_total_kg
+        FROM stock_emplacements
+        WHERE id = %s AND is_active = TRUE
+        FOR UPDATE
+    """, (empl_id,))
+
+    if not empl:
+        return False, "❌ Emplacement introuvable"
+
+    cursor.execute("""
+        UPDATE stock_emplacements
+        SET is_active = FALSE
+        WHERE id = %s
+    """, (empl_id,))
+
+    cursor.execute("""
+        INSERT INTO stock_mouvements (
+            lot_id, type_mouvement,
+            site_origine, emplacement_origine,
+            quantite, type_conditionnement, poids_kg, user_action, created_by
+        ) VALUES (%s, 'SUPPRESSION', %s, %s, %s, %s, %s, %s, %s)
+    """, (int(empl['lot_id']), empl['site_stockage'], empl['emplacement_stockage'],
+          int(empl['nombre_unites']), empl['type_conditionnement'],
+          float(empl['poids_total_kg']), user, user))
+
+    return True, "✅ Emplacement supprimé"
@@ -0,0 +1,326 @@
+# utils/stock_pf.py
+"""
+Grand livre hebdomadaire du stock produits finis (pf_stock_hebdo).
+
+Une ligne par (produit commercial × sur-emballage × semaine ISO) ayant eu des
+mouvements : stock d'ouverture, entrées, sorties, stock de clôture, plus les
+indicateurs de rotation (jours de sortie, première entrée, dernière sortie).
+Les graphiques lisent ces quelques centaines de lignes au lieu de rescanner
+tout mouvements_produits_finis.
+
+Tenue à jour :
+- incrémentale : maj_semaine() est appelée dans la transaction qui insère ou
+  supprime un mouvement ; elle recalcule la seule semaine touchée depuis les
+  mouvements (index produit/semaine) et décale ouverture/clôture des semaines
+  suivantes du même produit ;
+- en masse : reconstruire_grand_livre() (installation, reprise, contrôle).
+
+Disponibilité (pf_stock_lots) : stock réel par (produit, date de production,
+sur-emballage), tenu par maj_stock_lot() dans les mêmes transactions. Les
+réservations actives sont soustraites à la lecture ; les réservations échues
+passent en EXPIREE au moment de la lecture (pas de tâche planifiée).
+get_disponibilites() renvoie la disponibilité de toute une liste de produits
+en une requête.
+
+Fonctions exposées :
+- init_grand_livre(conn=None) : tables + index, reconstruction si vide
+- maj_semaine(cursor, code_produit, sur_emballage_id, annee, semaine)
+- maj_stock_lot(cursor, code_produit, date_production, sur_emballage_id)
+- reconstruire_grand_livre(conn=None) -> nb de lignes
+- get_disponibilites(codes_produits=None) -> DataFrame stock / réservé / libre
+"""
+import pandas as pd
+
+from database import get_connection
+
+_table_prete = False
+
+# Agrégats d'une semaine, communs au recalcul incrémental et à la reconstruction
+_SQL_AGREGATS = """
+    SUM(quantite_tonnes) FILTER (WHERE quantite_tonnes > 0)      AS entrees_t,
+    ABS(SUM(quantite_tonnes) FILTER (WHERE quantite_tonnes < 0)) AS sorties_t,
+    SUM(quantite_tonnes)                                         AS net_t,
+    COUNT(*)                                                     AS nb_mouvements,
+    COUNT(DISTINCT CASE WHEN quantite_tonnes < 0 THEN date_mouvement::date END) AS nb_jours_sortie,
+    MIN(date_mouvement) FILTER (WHERE quantite_tonnes > 0)       AS premiere_entree,
+    MAX(date_mouvement) FILTER (WHERE quantite_tonnes < 0)       AS derniere_sortie
+"""
+
+
+def init_grand_livre(conn=None):
+    """Crée si besoin (une fois par process) la table du grand livre ; la remplit si elle est vide."""
+    global _table_prete
+    if _table_prete:
+        return
+    own = conn is None
+    conn = conn or get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS pf_stock_hebdo (
+                code_produit_commercial VARCHAR(100) NOT NULL,
+                sur_emballage_id        INTEGER     NOT NULL DEFAULT 0,
+                annee                   INTEGER     NOT NULL,
+                semaine                 INTEGER     NOT NULL,
+                semaine_debut           DATE        NOT NULL,
+                ouverture_t             NUMERIC(14,4) NOT NULL DEFAULT 0,
+                entrees_t               NUMERIC(14,4) NOT NULL DEFAULT 0,
+                sorties_t               NUMERIC(14,4) NOT NULL DEFAULT 0,
+                cloture_t               NUMERIC(14,4) NOT NULL DEFAULT 0,
+                nb_mouvements           INTEGER     NOT NULL DEFAULT 0,
+                nb_jours_sortie         INTEGER     NOT NULL DEFAULT 0,
+                premiere_entree         DATE,
+                derniere_sortie         DATE,
+                PRIMARY KEY (code_produit_commercial, sur_emballage_id, annee, semaine)
+            )
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_pf_stock_hebdo_semaine
+            ON pf_stock_hebdo (semaine_debut)
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_mvt_pf_produit_semaine
+            ON mouvements_produits_finis (code_produit_commercial, annee, semaine)
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS pf_stock_lots (
+                code_produit_commercial VARCHAR(100) NOT NULL,
+                date_production         DATE,
+                sur_emballage_id        INTEGER     NOT NULL DEFAULT 0,
+                stock_t                 NUMERIC(14,6) NOT NULL DEFAULT 0,
+                updated_at              TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cur.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS uq_pf_stock_lots
+            ON pf_stock_lots (code_produit_commercial, COALESCE(date_production, '0001-01-01'::date),
+                              sur_emballage_id)
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_pf_reservations_actives
+            ON pf_reservations (code_produit_commercial, expire_at)
+            WHERE statut = 'ACTIVE'
+        """)
+        conn.commit()
+        cur.execute("""
+            SELECT EXISTS (SELECT 1 FROM pf_stock_hebdo)
+               AND EXISTS (SELECT 1 FROM pf_stock_lots) AS rempli
+        """)
+        rempli = cur.fetchone()['rempli']
+        cur.close()
+        if not rempli:
+            reconstruire_grand_livre(conn)
+        _table_prete = True
+    finally:
+        if own:
+            conn.close()
+
+
+def maj_semaine(cursor, code_produit, sur_emballage_id, annee, semaine):
+    """
+    Recalcule une semaine du grand livre depuis les mouvements (dans la
+    transaction de l'appelant, sans commit) et reporte l'écart de stock sur les
+    semaines suivantes du même produit / sur-emballage.
+    """
+    cle = (code_produit, int(sur_emballage_id or 0))
+    semaine_cle = (int(annee), int(semaine))
+
+    # Sérialise les mises à jour concurrentes d'un même produit / sur-emballage
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s || '|' || %s::text))", cle)
+
+    cursor.execute(f"""
+        SELECT {_SQL_AGREGATS}
+        FROM mouvements_produits_finis
+        WHERE code_produit_commercial = %s
+          AND COALESCE(sur_emballage_id, 0) = %s
+          AND annee = %s AND semaine = %s
+    """, cle + semaine_cle)
+    agg = cursor.fetchone()
+
+    cursor.execute("""
+        SELECT cloture_t - ouverture_t AS net_t
+        FROM pf_stock_hebdo
+        WHERE code_produit_commercial = %s AND sur_emballage_id = %s
+          AND annee = %s AND semaine = %s
+    """, cle + semaine_cle)
+    ancienne = cursor.fetchone()
+    ancien_net = float(ancienne['net_t']) if ancienne else 0.0
+
+    cursor.execute("""
+        SELECT cloture_t
+        FROM pf_stock_hebdo
+        WHERE code_produit_commercial = %s AND sur_emballage_id = %s
+          AND (annee, semaine) < (%s, %s)
+        ORDER BY annee DESC, semaine DESC
+        LIMIT 1
+    """, cle + semaine_cle)
+    precedente = cursor.fetchone()
+    ouverture = float(precedente['cloture_t']) if precedente else 0.0
+
+    if not agg['nb_mouvements']:
+        nouveau_net = 0.0
+        cursor.execute("""
+            DELETE FROM pf_stock_hebdo
+            WHERE code_produit_commercial = %s AND sur_emballage_id = %s
+              AND annee = %s AND semaine = %s
+        """, cle + semaine_cle)
+    else:
+        nouveau_net = float(agg['net_t'] or 0)
+        cursor.execute("""
+            INSERT INTO pf_stock_hebdo (
+                code_produit_commercial, sur_emballage_id, annee, semaine, semaine_debut,
+                ouverture_t, entrees_t, sorties_t, cloture_t,
+                nb_mouvements, nb_jours_sortie, premiere_entree, derniere_sortie
+            ) VALUES (%s, %s, %s, %s, to_date(%s || '-' || %s, 'IYYY-IW'),
+                      %s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (code_produit_commercial, sur_emballage_id, annee, semaine) DO UPDATE SET
+                ouverture_t = EXCLUDED.ouverture_t,
+                entrees_t = EXCLUDED.entrees_t,
+                sorties_t = EXCLUDED.sorties_t,
+                cloture_t = EXCLUDED.cloture_t,
+                nb_mouvements = EXCLUDED.nb_mouvements,
+                nb_jours_sortie = EXCLUDED.nb_jours_sortie,
+                premiere_entree = EXCLUDED.premiere_entree,
+                derniere_sortie = EXCLUDED.derniere_sortie
+        """, cle + semaine_cle + (str(semaine_cle[0]), str(semaine_cle[1]),
+              ouverture, float(agg['entrees_t'] or 0), float(agg['sorties_t'] or 0),
+              ouverture + nouveau_net, int(agg['nb_mouvements']), int(agg['nb_jours_sortie'] or 0),
+              agg['premiere_entree'], agg['derniere_sortie']))
+
+    # Report de l'écart sur les semaines suivantes
+    ecart = round(nouveau_net - ancien_net, 6)
+    if ecart:
+        cursor.execute("""
+            UPDATE pf_stock_hebdo
+            SET ouverture_t = ouverture_t + %s,
+                cloture_t = cloture_t + %s
+            WHERE code_produit_commercial = %s AND sur_emballage_id = %s
+              AND (annee, semaine) > (%s, %s)
+        """, (ecart, ecart) + cle + semaine_cle)
+
+
+def maj_stock_lot(cursor, code_produit, date_production, sur_emballage_id):
+    """
+    Recalcule le stock réel d'un (produit, date de production, sur-emballage)
+    depuis les mouvements, dans la transaction de l'appelant.
+    """
+    se = int(sur_emballage_id or 0)
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s || '|' || %s::text))", (code_produit, se))
+    cursor.execute("""
+        INSERT INTO pf_stock_lots (code_produit_commercial, date_production, sur_emballage_id, stock_t)
+        SELECT %s, %s, %s, COALESCE(SUM(quantite_tonnes), 0)
+        FROM mouvements_produits_finis
+        WHERE code_produit_commercial = %s
+          AND date_production IS NOT DISTINCT FROM %s
+          AND COALESCE(sur_emballage_id, 0) = %s
+        ON CONFLICT (code_produit_commercial, COALESCE(date_production, '0001-01-01'::date), sur_emballage_id)
+        DO UPDATE SET stock_t = EXCLUDED.stock_t, updated_at = CURRENT_TIMESTAMP
+    """, (code_produit, date_production, se, code_produit, date_production, se))
+
+
+def get_disponibilites(codes_produits=None):
+    """
+    Disponibilité par (produit, date de production, sur-emballage) en une requête :
+    stock réel, réservations actives, quantité libre.
+
+    Les réservations échues sont marquées EXPIREE dans le même aller-retour.
+    """
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE pf_reservations SET statut = 'EXPIREE'
+            WHERE statut = 'ACTIVE' AND expire_at <= NOW();
+
+            SELECT COALESCE(l.code_produit_commercial, r.code_produit_commercial) AS code_produit_commercial,
+                   COALESCE(l.date_production, r.date_production) AS date_production,
+                   NULLIF(COALESCE(l.sur_emballage_id, r.sur_emballage_id), 0) AS sur_emballage_id,
+                   COALESCE(l.stock_t, 0) AS stock_t,
+                   COALESCE(r.reserve_t, 0) AS reserve_t,
+                   COALESCE(l.stock_t, 0) - COALESCE(r.reserve_t, 0) AS libre_t
+            FROM (
+                SELECT code_produit_commercial, date_production, sur_emballage_id, stock_t
+                FROM pf_stock_lots
+                WHERE %(codes)s::text[] IS NULL OR code_produit_commercial = ANY(%(codes)s::text[])
+            ) l
+            FULL JOIN (
+                SELECT code_produit_commercial, date_production,
+                       COALESCE(sur_emballage_id, 0) AS sur_emballage_id,
+                       SUM(quantite_tonnes) AS reserve_t
+                FROM pf_reservations
+                WHERE statut = 'ACTIVE'
+                  AND (%(codes)s::text[] IS NULL OR code_produit_commercial = ANY(%(codes)s::text[]))
+                GROUP BY code_produit_commercial, date_production, COALESCE(sur_emballage_id, 0)
+            ) r ON r.code_produit_commercial = l.code_produit_commercial
+               -- égalités simples : un FULL JOIN refuse IS NOT DISTINCT FROM
+               AND COALESCE(r.date_production, '0001-01-01'::date) = COALESCE(l.date_production, '0001-01-01'::date)
+               AND r.sur_emballage_id = l.sur_emballage_id
+            -- Lots vides gardés s'ils portent encore des réservations (libre négatif visible)
+            WHERE ROUND(COALESCE(l.stock_t, 0), 6) != 0 OR COALESCE(r.reserve_t, 0) != 0
+        """, {'codes': codes_produits and list(codes_produits)})
+        rows = cur.fetchall()
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+
+    colonnes = ['code_produit_commercial', 'date_production', 'sur_emballage_id',
+                'stock_t', 'reserve_t', 'libre_t']
+    df = pd.DataFrame(rows, columns=colonnes) if rows else pd.DataFrame(columns=colonnes)
+    for col in ['stock_t', 'reserve_t', 'libre_t']:
+        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0.0)
+    return df
+
+
+def reconstruire_grand_livre(conn=None):
+    """Reconstruit tout le grand livre et les stocks par lot depuis les mouvements (requêtes ensemblistes)."""
+    own = conn is None
+    conn = conn or get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("LOCK TABLE pf_stock_lots IN EXCLUSIVE MODE")
+        cur.execute("DELETE FROM pf_stock_lots")
+        cur.execute("""
+            INSERT INTO pf_stock_lots (code_produit_commercial, date_production, sur_emballage_id, stock_t)
+            SELECT code_produit_commercial, date_production, COALESCE(sur_emballage_id, 0),
+                   COALESCE(SUM(quantite_tonnes), 0)
+            FROM mouvements_produits_finis
+            WHERE code_produit_commercial IS NOT NULL
+            GROUP BY code_produit_commercial, date_production, COALESCE(sur_emballage_id, 0)
+        """)
+        cur.execute("LOCK TABLE pf_stock_hebdo IN EXCLUSIVE MODE")
+        cur.execute("DELETE FROM pf_stock_hebdo")
+        cur.execute(f"""
+            INSERT INTO pf_stock_hebdo (
+                code_produit_commercial, sur_emballage_id, annee, semaine, semaine_debut,
+                ouverture_t, entrees_t, sorties_t, cloture_t,
+                nb_mouvements, nb_jours_sortie, premiere_entree, derniere_sortie
+            )
+            SELECT
+                code_produit_commercial, sur_emballage_id, annee, semaine,
+                to_date(annee || '-' || semaine, 'IYYY-IW'),
+                SUM(COALESCE(net_t, 0)) OVER w - COALESCE(net_t, 0),
+                COALESCE(entrees_t, 0), COALESCE(sorties_t, 0),
+                SUM(COALESCE(net_t, 0)) OVER w,
+                nb_mouvements, nb_jours_sortie, premiere_entree, derniere_sortie
+            FROM (
+                SELECT code_produit_commercial, COALESCE(sur_emballage_id, 0) AS sur_emballage_id,
+                       annee, semaine, {_SQL_AGREGATS}
+                FROM mouvements_produits_finis
+                WHERE code_produit_commercial IS NOT NULL
+                  AND annee IS NOT NULL AND semaine IS NOT NULL
+                GROUP BY code_produit_commercial, COALESCE(sur_emballage_id, 0), annee, semaine
+            ) g
+            WINDOW w AS (PARTITION BY code_produit_commercial, sur_emballage_id
+                         ORDER BY annee, semaine)
+        """)
+        nb = cur.rowcount
+        conn.commit()
+        cur.close()
+        return nb
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if own:
+            conn.close()
@@ -0,0 +1,393 @@
+# utils/synthese_previsions.py
+"""
+Synthèse prévisions par site, tenue en table pour le Dashboard Prévisions.
+
+- previsions_synthese_sites : par site de production ('*' = tous) et par
+  niveau, les agrégats du dashboard :
+    SITE    : stock brut, besoin campagne, affecté, nb lots, nb produits, nb manques
+    PRODUIT : besoin, affecté, différence, couverture (semaines), statut d'alerte
+    MARQUE  : besoin, affecté, différence, couverture, nb produits en manque
+    SEMAINE : prévision totale des 12 prochaines semaines
+  Un produit appartient aux sites ayant une ligne de production active de
+  son atelier ; le stock d'un site est celui stocké sur ce site (tous les
+  lots actifs pour '*').
+- une page lit son site en UNE requête sur la clé primaire ; la même
+  requête renvoie l'état de la synthèse : date de calcul, indicateur
+  a_recalculer et signature d'écriture des tables sources. Si l'indicateur
+  est levé, si le jour a changé ou si la signature a bougé, la synthèse est
+  reconstruite en une requête (INSERT ... SELECT) puis relue.
+- a_recalculer est levé par les pages qui écrivent une table source
+  (marquer_synthese_a_recalculer, après leur commit, quel que soit le
+  process) : c'est le déclencheur de référence.
+- la signature (compteurs insert/update/delete de pg_stat_user_tables) n'est
+  qu'un filet pour les écritures faites hors de l'application : ces compteurs
+  ne sont pas transactionnels et remontent en différé.
+
+Tables lues : voir TABLES_SYNTHESE (signature et clé d'invalidation, cf. utils/cache_tables).
+
+Fonctions exposées :
+- TOUS, TABLES_SYNTHESE
+- init_synthese_previsions(conn=None)
+- marquer_synthese_a_recalculer(*tables)
+- reconstruire_synthese_previsions(cursor, today=None)
+- lire_synthese_site(site=None, today=None) -> dict
+"""
+from datetime import date
+
+import pandas as pd
+
+from database import get_connection, rafraichir_schema
+from utils.soldes_produits import date_fin_campagne
+
+# Niveau « tous les sites » dans la synthèse
+TOUS = '*'
+
+TABLES_SYNTHESE = ('previsions_ventes', 'previsions_affectations', 'ref_produits_commerciaux',
+                   'lots_bruts', 'stock_emplacements', 'production_lignes')
+
+# Écart affecté - besoin au-delà duquel un produit est en MANQUE / SURPLUS (tonnes)
+SEUIL_ALERTE_T = 50
+NB_SEMAINES_GRAPHE = 12
+
+_synthese_prete = False
+
+
+def init_synthese_previsions(conn=None):
+    """Crée si besoin (une fois par process) les tables de synthèse."""
+    global _synthese_prete
+    if _synthese_prete:
+        return
+    own = conn is None
+    conn = conn or get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS previsions_synthese_sites (
+                site            VARCHAR(100) NOT NULL,
+                niveau          VARCHAR(10) NOT NULL,
+                cle             VARCHAR(100) NOT NULL,
+                marque          VARCHAR(100),
+                type_produit    VARCHAR(100),
+                atelier         VARCHAR(100),
+                annee           INTEGER,
+                semaine         INTEGER,
+                stock_brut_t    NUMERIC,
+                besoin_t        NUMERIC,
+                affecte_brut_t  NUMERIC,
+                affecte_net_t   NUMERIC,
+                difference_t    NUMERIC,
+                couverture_sem  NUMERIC,
+                nb_lots         INTEGER,
+                nb_produits     INTEGER,
+                nb_manques      INTEGER,
+                statut          VARCHAR(10),
+                PRIMARY KEY (site, niveau, cle)
+            )
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS previsions_synthese_etat (
+                id          SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+                date_calcul DATE,
+                signature   BIGINT,
+                a_recalculer BOOLEAN NOT NULL DEFAULT FALSE,
+                updated_at  TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cur.execute("""
+            ALTER TABLE previsions_synthese_etat
+                ADD COLUMN IF NOT EXISTS a_recalculer BOOLEAN NOT NULL DEFAULT FALSE
+        """)
+        conn.commit()
+        cur.close()
+        rafraichir_schema()
+        _synthese_prete = True
+    finally:
+        if own:
+            conn.close()
+
+
+_SQL_SIGNATURE = """
+    SELECT COALESCE(SUM(n_tup_ins + n_tup_upd + n_tup_del), 0)::bigint
+    FROM pg_stat_user_tables
+    WHERE relname = ANY(%(tables)s)
+"""
+
+
+def _a_jour(etat, today):
+    return (etat is not None and not etat['a_recalculer'] and etat['date_calcul'] == today
+            and etat['signature'] == etat['signature_courante'])
+
+
+def marquer_synthese_a_recalculer(*tables):
+    """
+    À appeler après le commit d'une écriture sur ces tables : si l'une est une
+    source de la synthèse, la prochaine lecture (tous process) la reconstruit.
+    Un échec est sans gravité (la signature sert de filet) et n'est pas propagé.
+    """
+    if not set(tables) & set(TABLES_SYNTHESE):
+        return
+    try:
+        conn = get_connection()
+        try:
+            init_synthese_previsions(conn)
+            cur = conn.cursor()
+            cur.execute("UPDATE previsions_synthese_etat SET a_recalculer = TRUE WHERE NOT a_recalculer")
+            conn.commit()
+            cur.close()
+        finally:
+            conn.close()
+    except Exception:
+        pass
+
+
+def reconstruire_synthese_previsions(cursor, today=None):
+    """Recalcule toute la synthèse (transaction de l'appelant, verrou consultatif)."""
+    today = today or date.today()
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext('previsions_synthese'))")
+
+    # Un autre process a pu la reconstruire pendant l'attente du verrou
+    cursor.execute(f"""
+        SELECT e.date_calcul, e.signature, e.a_recalculer, ({_SQL_SIGNATURE}) AS signature_courante
+        FROM previsions_synthese_etat e
+    """, {'tables': list(TABLES_SYNTHESE)})
+    etat = cursor.fetchone()
+    if _a_jour(etat, today):
+        return
+
+    # Indicateur baissé AVANT de lire les sources : le verrou de ligne pris ici
+    # fait attendre les écritures qui le relèvent jusqu'au commit du recalcul
+    cursor.execute("UPDATE previsions_synthese_etat SET a_recalculer = FALSE")
+
+    cursor.execute(f"SELECT ({_SQL_SIGNATURE}) AS signature", {'tables': list(TABLES_SYNTHESE)})
+    signature = cursor.fetchone()['signature']
+
+    date_fin = date_fin_campagne(today)
+    annee_iso, semaine_iso, _ = today.isocalendar()
+    params = {
+        'tous': TOUS,
+        'debut': annee_iso * 100 + semaine_iso,
+        'fin': date_fin.year * 100 + 26,
+        'sem_rest': max(1, (date_fin - today).days // 7),
+        'seuil': SEUIL_ALERTE_T,
+        'nb_semaines': NB_SEMAINES_GRAPHE,
+    }
+
+    cursor.execute("DELETE FROM previsions_synthese_sites")
+    cursor.execute("""
+        WITH produits_sites AS (
+            SELECT pc.code_produit, pl.site
+            FROM ref_produits_commerciaux pc
+            JOIN (
+                SELECT DISTINCT site, type_atelier
+                FROM production_lignes
+                WHERE is_active = TRUE AND site IS NOT NULL
+            ) pl ON pl.type_atelier = pc.atelier
+            UNION ALL
+            SELECT code_produit, %(tous)s FROM ref_produits_commerciaux
+        ),
+        besoins AS (
+            SELECT code_produit_commercial, SUM(quantite_prevue_tonnes) AS besoin
+            FROM previsions_ventes
+            WHERE annee * 100 + semaine BETWEEN %(debut)s AND %(fin)s
+            GROUP BY code_produit_commercial
+        ),
+        affectations AS (
+            SELECT code_produit_commercial,
+                   SUM(quantite_affectee_tonnes) AS affecte_brut,
+                   SUM(COALESCE(poids_net_estime_tonnes, quantite_affectee_tonnes * 0.78)) AS affecte_net
+            FROM previsions_affectations
+            WHERE is_active = TRUE
+            GROUP BY code_produit_commercial
+        ),
+        produits_base AS (
+            SELECT ps.site, pc.code_produit, pc.marque, pc.type_produit, pc.atelier,
+                   b.besoin IS NOT NULL AS a_besoin,
+                   COALESCE(b.besoin, 0) AS besoin,
+                   COALESCE(a.affecte_brut, 0) AS affecte_brut,
+                   COALESCE(a.affecte_net, 0) AS affecte_net,
+                   COALESCE(a.affecte_net, 0) - COALESCE(b.besoin, 0) AS difference
+            FROM produits_sites ps
+            JOIN ref_produits_commerciaux pc ON pc.code_produit = ps.code_produit
+            LEFT JOIN besoins b ON b.code_produit_commercial = ps.code_produit
+            LEFT JOIN affectations a ON a.code_produit_commercial = ps.code_produit
+            WHERE b.besoin IS NOT NULL OR a.affecte_brut IS NOT NULL
+        ),
+        produits AS (
+            SELECT *,
+                   CASE
+                       WHEN difference < -%(seuil)s THEN 'MANQUE'
+                       WHEN difference > %(seuil)s THEN 'SURPLUS'
+                       ELSE 'EQUILIBRE'
+                   END AS statut
+            FROM produits_base
+        ),
+        produits_agg AS (
+            SELECT site,
+                   SUM(besoin) AS besoin,
+                   SUM(affecte_brut) AS affecte_brut,
+                   SUM(affecte_net) AS affecte_net,
+                   COUNT(*) FILTER (WHERE a_besoin) AS nb_produits,
+                   COUNT(*) FILTER (WHERE a_besoin AND statut = 'MANQUE') AS nb_manques
+            FROM produits
+            GROUP BY site
+        ),
+        lots_sites AS (
+            SELECT ps.site, COUNT(DISTINCT pa.lot_id) AS nb_lots
+            FROM previsions_affectations pa
+            JOIN produits_sites ps ON ps.code_produit = pa.code_produit_commercial
+            WHERE pa.is_active = TRUE
+            GROUP BY ps.site
+        ),
+        stock_sites AS (
+            SELECT %(tous)s AS site, COALESCE(SUM(poids_total_brut_kg), 0) / 1000 AS stock_brut
+            FROM lots_bruts
+            WHERE is_active = TRUE
+            UNION ALL
+            SELECT site_stockage, SUM(poids_total_kg) / 1000
+            FROM stock_emplacements
+            WHERE is_active = TRUE AND site_stockage IS NOT NULL
+            GROUP BY site_stockage
+        ),
+        semaines AS (
+            SELECT ps.site, pv.annee, pv.semaine, SUM(pv.quantite_prevue_tonnes) AS total,
+                   ROW_NUMBER() OVER (PARTITION BY ps.site ORDER BY pv.annee, pv.semaine) AS rn
+            FROM previsions_ventes pv
+            JOIN produits_sites ps ON ps.code_produit = pv.code_produit_commercial
+            WHERE pv.annee * 100 + pv.semaine >= %(debut)s
+            GROUP BY ps.site, pv.annee, pv.semaine
+        )
+        INSERT INTO previsions_synthese_sites
+            (site, niveau, cle, marque, type_produit, atelier, annee, semaine,
+             stock_brut_t, besoin_t, affecte_brut_t, affecte_net_t, difference_t, couverture_sem,
+             nb_lots, nb_produits, nb_manques, statut)
+        -- Produits ayant un besoin sur la campagne
+        SELECT site, 'PRODUIT', code_produit, marque, type_produit, atelier, NULL, NULL,
+               NULL, besoin, affecte_brut, affecte_net, difference,
+               CASE WHEN besoin > 0 THEN affecte_net * %(sem_rest)s / besoin END,
+               NULL, 1, (statut = 'MANQUE')::int, statut
+        FROM produits
+        WHERE a_besoin
+        UNION ALL
+        -- Marques
+        SELECT site, 'MARQUE', COALESCE(marque, '—'), COALESCE(marque, '—'), NULL, NULL, NULL, NULL,
+               NULL, SUM(besoin), SUM(affecte_brut), SUM(affecte_net), SUM(affecte_net) - SUM(besoin),
+               CASE WHEN SUM(besoin) > 0 THEN SUM(affecte_net) * %(sem_rest)s / SUM(besoin) END,
+               NULL, COUNT(*) FILTER (WHERE a_besoin), COUNT(*) FILTER (WHERE a_besoin AND statut = 'MANQUE'), NULL
+        FROM produits
+        GROUP BY site, COALESCE(marque, '—')
+        UNION ALL
+        -- Sites
+        SELECT s.site, 'SITE', '', NULL, NULL, NULL, NULL, NULL,
+               COALESCE(st.stock_brut, 0), COALESCE(p.besoin, 0), COALESCE(p.affecte_brut, 0),
+               COALESCE(p.affecte_net, 0), COALESCE(p.affecte_net, 0) - COALESCE(p.besoin, 0),
+               CASE WHEN p.besoin > 0 THEN p.affecte_net * %(sem_rest)s / p.besoin END,
+               COALESCE(l.nb_lots, 0), COALESCE(p.nb_produits, 0), COALESCE(p.nb_manques, 0), NULL
+        FROM (SELECT site FROM produits_sites UNION SELECT site FROM stock_sites) s
+        LEFT JOIN stock_sites st ON st.site = s.site
+        LEFT JOIN produits_agg p ON p.site = s.site
+        LEFT JOIN lots_sites l ON l.site = s.site
+        UNION ALL
+        -- Prochaines semaines
+        SELECT site, 'SEMAINE', annee || '-' || LPAD(semaine::text, 2, '0'), NULL, NULL, NULL, annee, semaine,
+               NULL, total, NULL, NULL, NULL, NULL,
+               NULL, NULL, NULL, NULL
+        FROM semaines
+        WHERE rn <= %(nb_semaines)s
+    """, params)
+
+    cursor.execute("""
+        INSERT INTO previsions_synthese_etat (id, date_calcul, signature, updated_at)
+        VALUES (1, %s, %s, CURRENT_TIMESTAMP)
+        ON CONFLICT (id) DO UPDATE SET
+            date_calcul = EXCLUDED.date_calcul,
+            signature = EXCLUDED.signature,
+            updated_at = CURRENT_TIMESTAMP
+    """, (today, signature))
+
+
+def _lire(cursor, site):
+    cursor.execute(f"""
+        SELECT e.date_calcul, e.signature, e.a_recalculer, ({_SQL_SIGNATURE}) AS signature_courante, s.*
+        FROM previsions_synthese_etat e
+        LEFT JOIN previsions_synthese_sites s ON s.site = %(site)s
+    """, {'tables': list(TABLES_SYNTHESE), 'site': site})
+    return cursor.fetchall()
+
+
+def lire_synthese_site(site=None, today=None):
+    """
+    Synthèse d'un site (None = tous), reconstruite d'abord si elle n'est plus à jour.
+
+    Returns:
+        dict
+        - 'kpis': dict stock_brut_tonnes, besoin_total_tonnes, nb_lots_affectes,
+          tonnes_affectees, tonnes_affectees_net, nb_produits, nb_manques
+        - 'produits': DataFrame (code_produit_commercial, marque, type_produit, atelier,
+          besoin_tonnes, stock_affecte, difference, couverture_semaines, statut), différence croissante
+        - 'marques': DataFrame (marque, besoin_tonnes, tonnes_affectees, difference,
+          couverture_semaines, nb_produits, nb_manques), affecté décroissant
+        - 'semaines': DataFrame (annee, semaine, total_tonnes, semaine_label)
+    """
+    today = today or date.today()
+    site = site or TOUS
+    init_synthese_previsions()
+
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        rows = _lire(cursor, site)
+        if not _a_jour(rows[0] if rows else None, today):
+            reconstruire_synthese_previsions(cursor, today)
+            conn.commit()
+            rows = _lire(cursor, site)
+        cursor.close()
+    finally:
+        conn.close()
+
+    df = pd.DataFrame([r for r in rows if r['niveau'] is not None])
+    if df.empty:
+        kpis = {'stock_brut_tonnes': 0.0, 'besoin_total_tonnes': 0.0, 'nb_lots_affectes': 0, 'tonnes_affectees': 0.0,
+                'tonnes_affectees_net': 0.0, 'nb_produits': 0, 'nb_manques': 0}
+        return {'kpis': kpis, 'produits': pd.DataFrame(), 'marques': pd.DataFrame(), 'semaines': pd.DataFrame()}
+    for col in ['stock_brut_t', 'besoin_t', 'affecte_brut_t', 'affecte_net_t', 'difference_t', 'couverture_sem']:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+
+    # La ligne SITE existe dès que le site a des produits ou du stock
+    s = df[df['niveau'] == 'SITE'].iloc[0]
+    kpis = {
+        'stock_brut_tonnes': float(s['stock_brut_t']),
+        'besoin_total_tonnes': float(s['besoin_t']),
+        'nb_lots_affectes': int(s['nb_lots']),
+        'tonnes_affectees': float(s['affecte_brut_t']),
+        'tonnes_affectees_net': float(s['affecte_net_t']),
+        'nb_produits': int(s['nb_produits']),
+        'nb_manques': int(s['nb_manques']),
+    }
+
+    produits = (df[df['niveau'] == 'PRODUIT']
+                .rename(columns={'cle': 'code_produit_commercial', 'besoin_t': 'besoin_tonnes',
+                                 'affecte_net_t': 'stock_affecte', 'difference_t': 'difference',
+                                 'couverture_sem': 'couverture_semaines'})
+                .sort_values('difference')
+                .reset_index(drop=True))
+    produits = produits[['code_produit_commercial', 'marque', 'type_produit', 'atelier', 'besoin_tonnes',
+                         'stock_affecte', 'difference', 'couverture_semaines', 'statut']]
+
+    marques = (df[df['niveau'] == 'MARQUE']
+               .rename(columns={'besoin_t': 'besoin_tonnes', 'affecte_net_t': 'tonnes_affectees',
+                                'difference_t': 'difference', 'couverture_sem': 'couverture_semaines'})
+               .sort_values('tonnes_affectees', ascending=False)
+               .reset_index(drop=True))
+    marques = marques[['marque', 'besoin_tonnes', 'tonnes_affectees', 'difference',
+                       'couverture_semaines', 'nb_produits', 'nb_manques']]
+
+    semaines = (df[df['niveau'] == 'SEMAINE']
+                .rename(columns={'besoin_t': 'total_tonnes'})
+                .sort_values(['annee', 'semaine'])
+                .reset_index(drop=True))
+    semaines = semaines[['annee', 'semaine', 'total_tonnes']].copy()
+    if not semaines.empty:
+        semaines['semaine_label'] = "S" + semaines['semaine'].astype(int).map('{:02d}'.format)
+
+    return {'kpis': kpis, 'produits': produits, 'marques': marques, 'semaines': semaines}